@@ -37,6 +37,9 @@ DAMAGE.
 #ifndef _STIMAGE_GEOMAP_H_
 #define _STIMAGE_GEOMAP_H_
 
+#include <stddef.h>
+#include <stdint.h>
+
 #include "lib/util.h"
 #include "lib/xybbox.h"
 #include "surface/surface.h"
@@ -94,6 +97,14 @@ typedef struct {
 typedef struct {
     geomap_fit_e fit_geometry;
     surface_type_e function;
+    size_t xxorder;
+    size_t xyorder;
+    xterms_e xxterms;
+    size_t yxorder;
+    size_t yyorder;
+    xterms_e yxterms;
+    bbox_t bbox; /* The reference coordinate range the surfaces are
+                    normalized to */
     coord_t rms;
     coord_t mean_ref;
     coord_t mean_input;
@@ -108,8 +119,98 @@ typedef struct {
     double* x2coeff;
     size_t ny2coeff;
     double* y2coeff;
+    size_t ngridx; /* The residual grid, or 0 if there is none.  See */
+    size_t ngridy; /* geomap_grid.h */
+    double* xgrid; /* [ngridy * ngridx] */
+    double* ygrid; /* [ngridy * ngridx] */
 } geomap_result_t;
 
+/*
+The packed form of a geomap_result_t is a single flat buffer, so that
+a solution can be stored or sent to another process in one piece and
+used in place:
+
+    geomap_result_header_t  header
+    double                  bbox[4]        (min.x, min.y, max.x, max.y)
+    double                  rms[2]
+    double                  mean_ref[2]
+    double                  mean_input[2]
+    double                  shift[2]
+    double                  mag[2]
+    double                  rotation[2]
+    double                  xcoeff[nxcoeff]
+    double                  ycoeff[nycoeff]
+    double                  x2coeff[nx2coeff]
+    double                  y2coeff[ny2coeff]
+    double                  xgrid[ngridy * ngridx]
+    double                  ygrid[ngridy * ngridx]
+
+Version 1 buffers, whose header ends before ngridx and which have no
+grids, are still read.
+
+It is written in native byte order; readers reject a buffer whose
+byteorder field does not read back as GEOMAP_RESULT_BYTEORDER.
+*/
+
+#define GEOMAP_RESULT_MAGIC "STIMGGEO"
+#define GEOMAP_RESULT_VERSION 2
+#define GEOMAP_RESULT_BYTEORDER 0x01020304
+
+typedef struct {
+    char     magic[8];
+    uint32_t version;
+    uint32_t byteorder;
+    uint64_t header_size;
+    uint64_t size;
+
+    int32_t  fit_geometry;
+    int32_t  function;
+    int32_t  xxterms;
+    int32_t  yxterms;
+    uint64_t xxorder;
+    uint64_t xyorder;
+    uint64_t yxorder;
+    uint64_t yyorder;
+
+    uint64_t nxcoeff;
+    uint64_t nycoeff;
+    uint64_t nx2coeff;
+    uint64_t ny2coeff;
+
+    /* Since version 2 */
+    uint64_t ngridx;
+    uint64_t ngridy;
+} geomap_result_header_t;
+
+/* The size of a version 1 header */
+#define GEOMAP_RESULT_HEADER_SIZE_V1 \
+    (offsetof(geomap_result_header_t, ngridx))
+
+/**
+A view onto a packed geomap result held in memory.  All of the
+pointers point into the buffer passed to geomap_result_view, which
+must outlive the view.  The grid sizes are read from the view rather
+than the header, which only has them since version 2.
+*/
+typedef struct {
+    const geomap_result_header_t* header;
+    const double*                 bbox;       /* [4] */
+    const double*                 rms;        /* [2] */
+    const double*                 mean_ref;   /* [2] */
+    const double*                 mean_input; /* [2] */
+    const double*                 shift;      /* [2] */
+    const double*                 mag;        /* [2] */
+    const double*                 rotation;   /* [2] */
+    const double*                 xcoeff;     /* [nxcoeff] */
+    const double*                 ycoeff;     /* [nycoeff] */
+    const double*                 x2coeff;    /* [nx2coeff] */
+    const double*                 y2coeff;    /* [ny2coeff] */
+    uint64_t                      ngridx;
+    uint64_t                      ngridy;
+    const double*                 xgrid;      /* [ngridy * ngridx] */
+    const double*                 ygrid;      /* [ngridy * ngridx] */
+} geomap_result_view_t;
+
 /**
 Initialize the geomap_result object.
 */
@@ -265,6 +366,232 @@ geomap(
         geomap_result_t* const result,
         stimage_error_t* const error);
 
+/**
+Choose the polynomial orders and cross terms of a general geomap fit
+from the data.
+
+For each of the *x* and *y* fits, candidate surfaces of order 2 to
+*max_order* (the same order in *x* and *y*) are considered with each
+of the cross term settings, and the one minimizing the Bayesian
+information criterion ``n ln(rss / n) + p ln(n)`` is chosen, where
+*p* is the number of coefficients.  The candidates with the same
+cross terms are nested, so the normal equations of the largest
+surface are accumulated once and the Cholesky factorization is grown
+one order at a time.  The whole selection costs about as much as a
+single fit of order *max_order* with full cross terms.
+
+The selection does not reject any points; the chosen orders are meant
+to be passed to `geomap`, which does.
+
+@param ninput Number of input coordinates.
+
+@param input Array of input coordinates.
+
+@param nref Number of reference coordinates.
+
+@param ref Array of reference coordinates.
+
+@param bbox The range of reference coordinates to use.  See `geomap`.
+
+@param max_order The highest order to consider.  Must be at least 2.
+
+@param xorder The chosen order in both *x* and *y* of the *x* fit,
+       ie. xxorder and xyorder.
+
+@param xxterms The chosen cross terms of the *x* fit.
+
+@param yorder The chosen order in both *x* and *y* of the *y* fit,
+       ie. yxorder and yyorder.
+
+@param yxterms The chosen cross terms of the *y* fit.
+
+@param error
+
+@return Non-zero on error
+*/
+int
+geomap_select_order(
+        const size_t ninput, const coord_t* const input,
+        const size_t nref, const coord_t* const ref,
+        const bbox_t* const bbox,
+        const size_t max_order,
+        /* Output */
+        size_t* const xorder,
+        xterms_e* const xxterms,
+        size_t* const yorder,
+        xterms_e* const yxterms,
+        stimage_error_t* const error);
+
+/**
+Evaluate a geomap solution, transforming reference coordinates to
+input coordinates, including the distortion terms and the residual
+grid if any.
+
+@param result The solution returned by `geomap`
+
+@param ncoord Number of coordinates
+
+@param ref Array of reference coordinates
+
+@param input Output array of input coordinates [ncoord]
+
+@param error
+
+@return Non-zero on error
+*/
+int
+geomap_result_eval(
+        const geomap_result_t* const result,
+        const size_t ncoord,
+        const coord_t* const ref,
+        /* Output */
+        coord_t* const input,
+        stimage_error_t* const error);
+
+/**
+Build the geomap solution of a linear transformation
+
+    input = value + matrix (ref - origin)
+
+as `geomap` would return it for a fit of the given geometry, with no
+distortion terms.  The rms and means of the result are set to zero
+and are left for the caller to fill in.
+
+@param fit_geometry The fit geometry to record.  For
+       geomap_fit_xyscale, the off-diagonal terms of *matrix* must be
+       zero.
+
+@param function The type of surface to express the transformation in
+
+@param bbox The range of reference coordinates the surfaces are
+       normalized to
+
+@param origin The reference coordinate the transformation is
+       expanded about
+
+@param value The input coordinate that *origin* maps to
+
+@param matrix The linear part of the transformation, in row-major
+       order [4]
+
+@param result The result to fill in, which must be freed with
+       geomap_result_free
+
+@param error
+
+@return Non-zero on error
+*/
+int
+geomap_result_from_linear(
+        const geomap_fit_e fit_geometry,
+        const surface_type_e function,
+        const bbox_t* const bbox,
+        const coord_t* const origin,
+        const coord_t* const value,
+        const double* const matrix,
+        /* Output */
+        geomap_result_t* const result,
+        stimage_error_t* const error);
+
+/**
+Invert a geomap solution, transforming input coordinates to reference
+coordinates, including the distortion terms and the residual grid if
+any.
+
+The linear part of the solution is inverted directly.  The distortion
+terms are then removed by iterating ``ref += L^-1 (input - f(ref))``,
+where *L* is the linear part and *f* the full solution, until the
+step is negligible.  This converges wherever the distortion changes
+more slowly than the linear term, which is the case for any sensible
+fit within its bbox.  Points where it does not converge within the
+iteration limit are left at the last finite estimate, and counted in
+*nunconverged*.  Each iteration only evaluates the points that have
+not converged yet.
+
+@param result The solution returned by `geomap`
+
+@param ncoord Number of coordinates
+
+@param input Array of input coordinates
+
+@param ref Output array of reference coordinates [ncoord]
+
+@param nunconverged Output: the number of points that did not converge
+
+@param error
+
+@return Non-zero on error
+*/
+int
+geomap_result_invert(
+        const geomap_result_t* const result,
+        const size_t ncoord,
+        const coord_t* const input,
+        /* Output */
+        coord_t* const ref,
+        size_t* const nunconverged,
+        stimage_error_t* const error);
+
+/**
+The size in bytes of the packed form of a geomap result.
+*/
+size_t
+geomap_result_packed_size(
+        const geomap_result_t* const result);
+
+/**
+Pack a geomap result into a flat buffer.
+
+@param result The result to pack
+
+@param buffer The buffer to write to.  It must be at least
+       geomap_result_packed_size bytes, and aligned to 8 bytes.
+*/
+void
+geomap_result_pack(
+        const geomap_result_t* const result,
+        void* const buffer);
+
+/**
+Validate a packed geomap result held in memory and fill in a view
+onto it.  Nothing is copied.
+
+@param size The size of the buffer in bytes
+
+@param buffer The packed result.  It must be aligned to at least 8
+       bytes.
+
+@param view The view to fill in
+
+@param error
+
+@return Non-zero on error
+*/
+int
+geomap_result_view(
+        const size_t size,
+        const void* const buffer,
+        geomap_result_view_t* const view,
+        stimage_error_t* const error);
+
+/**
+Copy a view of a packed geomap result into a geomap_result_t, which
+must be freed with geomap_result_free.
+
+@param view The view filled in by geomap_result_view
+
+@param result The result to fill in
+
+@param error
+
+@return Non-zero on error
+*/
+int
+geomap_result_unpack(
+        const geomap_result_view_t* const view,
+        geomap_result_t* const result,
+        stimage_error_t* const error);
+
 void
 geomap_result_print(
         const geomap_result_t* const result);
@@ -0,0 +1,137 @@
+/*
+Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+    1. Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+
+    2. Redistributions in binary form must reproduce the above
+      copyright notice, this list of conditions and the following
+      disclaimer in the documentation and/or other materials provided
+      with the distribution.
+
+    3. The name of AURA and its representatives may not be used to
+      endorse or promote products derived from this software without
+      specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+DAMAGE.
+*/
+
+#ifndef _STIMAGE_GEOMAP_GRID_H_
+#define _STIMAGE_GEOMAP_GRID_H_
+
+#include "lib/util.h"
+#include "immatch/geomap.h"
+
+/*
+Residual grids
+
+A residual grid is a secondary correction added to the surfaces of a
+geomap solution, in place of (or on top of) high order distortion
+surfaces.  Each of the x and y corrections is a bicubic B-spline on a
+uniform lattice of ncellx by ncelly cells spanning the bbox of the
+solution, with ngridx = ncellx + 3 by ngridy = ncelly + 3
+coefficients.  Coefficient (i, j), stored at xgrid[j * ngridx + i],
+is centered on
+
+    (bbox.min.x + (i - 1) hx, bbox.min.y + (j - 1) hy)
+
+where hx and hy are the cell sizes.  A point in cell (k, l), at
+fractions (tx, ty) across it, is corrected by
+
+    sum over a, b in 0..3 of B_a(tx) B_b(ty) grid[(l + b) * ngridx + k + a]
+
+with the uniform cubic B-spline weights
+
+    B_0(t) = (1 - t)^3 / 6
+    B_1(t) = (3 t^3 - 6 t^2 + 4) / 6
+    B_2(t) = (-3 t^3 + 3 t^2 + 3 t + 1) / 6
+    B_3(t) = t^3 / 6
+
+so evaluation costs the same 16 multiply-adds per point however fine
+the grid is.  Points outside the bbox are corrected as at the nearest
+point on its edge.
+
+The coefficients are found by least squares on the residuals of the
+surfaces, penalized by the squared second differences of the
+coefficients along each axis, which keeps the correction smooth and
+fills in cells with few or no points.  The normal equations are
+banded, with a bandwidth of 3 ngridx + 4, and are solved by a banded
+Cholesky factorization.
+*/
+
+/**
+Fit a residual grid to the residuals of a geomap solution.
+
+@param ncellx
+@param ncelly The number of grid cells across the bbox in x and y
+
+@param smoothing The weight of the curvature penalty, relative to
+       the data.  0 fits the residuals as closely as the grid allows.
+
+@param noutput The number of output records
+
+@param output The output records returned by `geomap` with *result*.
+       Records whose fit is NaN, which were rejected, are ignored.  On
+       return, the fit and residual of the others include the
+       grid [noutput]
+
+@param result The solution returned by `geomap`.  Any grid it has is
+       replaced, and its rms is updated.
+
+@param error
+
+@return Non-zero on error
+*/
+int
+geomap_grid(
+        const size_t ncellx,
+        const size_t ncelly,
+        const double smoothing,
+        const size_t noutput,
+        /* Input/Output */
+        geomap_output_t* const output,
+        geomap_result_t* const result,
+        stimage_error_t* const error);
+
+/**
+Add the residual grid of a geomap solution to fitted coordinates.
+Does nothing if the solution has no grid.
+
+@param result The solution
+
+@param ncoord Number of coordinates
+
+@param ref Array of reference coordinates
+
+@param xfit
+@param yfit The values of the surfaces at *ref*, to which the
+       correction is added [ncoord]
+
+@param error
+
+@return Non-zero on error
+*/
+int
+geomap_grid_eval(
+        const geomap_result_t* const result,
+        const size_t ncoord,
+        const coord_t* const ref,
+        /* Input/Output */
+        double* const xfit,
+        double* const yfit,
+        stimage_error_t* const error);
+
+#endif /* _STIMAGE_GEOMAP_GRID_H_ */
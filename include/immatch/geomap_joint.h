@@ -0,0 +1,130 @@
+/*
+Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+    1. Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+
+    2. Redistributions in binary form must reproduce the above
+      copyright notice, this list of conditions and the following
+      disclaimer in the documentation and/or other materials provided
+      with the distribution.
+
+    3. The name of AURA and its representatives may not be used to
+      endorse or promote products derived from this software without
+      specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+DAMAGE.
+*/
+
+#ifndef _STIMAGE_GEOMAP_JOINT_H_
+#define _STIMAGE_GEOMAP_JOINT_H_
+
+#include "lib/util.h"
+#include "immatch/geomap.h"
+
+/*
+Joint alignment of many exposures
+
+Each exposure k has a transformation T_k mapping the common (reference)
+frame to its own coordinates, of the form
+
+    T_k(X) = t_k + M_k (X - c)
+
+where M_k is restricted by the fit geometry and c is a fixed point of
+the common frame.  Each matched source s, seen in several exposures,
+has an unknown position X_s in the common frame.  All of the t_k, M_k
+and X_s are found together by minimizing
+
+    sum over observations i of |T_k(i)(X_s(i)) - x_i|^2
+
+with the transformation of the reference exposure held to the
+identity, which fixes the common frame.
+
+The problem is solved by Gauss-Newton iteration.  The source positions
+are eliminated from each step's normal equations (the Schur
+complement), leaving a block-sparse system in the transformation
+parameters alone, with one block per pair of overlapping exposures.
+That system is solved by conjugate gradients, preconditioned by the
+Cholesky factorizations of its diagonal blocks.  When the sources are
+seen in few exposures each, its blocks are stored explicitly;
+otherwise it is never formed, and is applied one source at a time.
+Either way each step costs time and memory linear in the number of
+observations.
+*/
+
+/**
+Fit the transformations of many overlapping exposures at once.
+
+@param nexposure Number of exposures
+
+@param reference The index of the exposure whose coordinates define
+       the common frame.  Its transformation is the identity.
+
+@param nobs Number of observations
+
+@param coord The coordinates of each observation in its exposure
+       [nobs]
+
+@param exposure The exposure of each observation, < nexposure [nobs]
+
+@param group The matched source of each observation, < ngroup
+       [nobs].  A source observed only once does not constrain the
+       fit.
+
+@param ngroup Number of matched sources
+
+@param fit_geometry The fitting geometry, restricting each M_k as in
+       `geomap`.  For geomap_fit_general, only the linear term is fit.
+
+@param function The type of surface the results are expressed in
+
+@param maxiter The maximum number of rejection iterations. 0 means no
+       rejection.
+
+@param reject The rejection limit in units of sigma, computed
+       separately for each exposure and axis.
+
+@param output For each observation, its coordinates, the position of
+       its source in the common frame, and the fit and residual.  The
+       fit and residual are NaN for rejected observations and for
+       sources observed once [nobs]
+
+@param results The transformation of each exposure [nexposure].  Each
+       must be freed with geomap_result_free.
+
+@param error
+
+@return Non-zero on error
+*/
+int
+geomap_joint(
+        const size_t nexposure,
+        const size_t reference,
+        const size_t nobs,
+        const coord_t* const coord,
+        const size_t* const exposure,
+        const size_t* const group,
+        const size_t ngroup,
+        const geomap_fit_e fit_geometry,
+        const surface_type_e function,
+        const size_t maxiter,
+        const double reject,
+        /* Output */
+        geomap_output_t* const output,
+        geomap_result_t* const results,
+        stimage_error_t* const error);
+
+#endif /* _STIMAGE_GEOMAP_JOINT_H_ */
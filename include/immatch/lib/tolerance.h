@@ -38,6 +38,7 @@ DAMAGE.
 #define _STIMAGE_XYINTERSECT_H_
 
 #include "lib/util.h"
+#include "lib/xysoa.h"
 #include "immatch/lib/match_util.h"
 
 /**
@@ -90,4 +91,50 @@ match_tolerance(
         void*                        callback_data,
         stimage_error_t* const       error);
 
+/**
+Like match_tolerance, but takes the coordinates as structure-of-arrays
+lists (see xysoa.h) that have been sorted in xysort order and culled
+with xycoincide_soa.  The indices passed to the callback are taken
+from ref->index and input->index.
+
+The sorted reference list can be split into strips that are matched
+concurrently, one per thread.  The matches from each strip are
+buffered and passed to the callback from the calling thread once all
+of the strips are done, in the same order as a single-threaded run,
+so the callback does not need to be thread-safe and the results do
+not depend on nthreads.
+
+@param nthreads The number of threads to use.  0 or 1 matches in the
+calling thread.  Fewer threads are used for small reference lists.
+
+@return Non-zero in case of error.
+*/
+int
+match_tolerance_soa(
+        const xysoa_t* const         ref,
+        const xysoa_t* const         input,
+        const double                 tolerance,
+        const size_t                 nthreads,
+        coord_match_callback_t*      callback,
+        void*                        callback_data,
+        stimage_error_t* const       error);
+
+/**
+The single-precision counterpart of match_tolerance_soa.  Distances
+are screened in single precision, and the candidates that pass are
+compared in double precision, so the matches are the same as
+match_tolerance_soa would find for the same coordinates.
+
+@return Non-zero in case of error.
+*/
+int
+match_tolerance_soaf(
+        const xysoaf_t* const        ref,
+        const xysoaf_t* const        input,
+        const double                 tolerance,
+        const size_t                 nthreads,
+        coord_match_callback_t*      callback,
+        void*                        callback_data,
+        stimage_error_t* const       error);
+
 #endif /* _STIMAGE_XYINTERSECT_H_ */
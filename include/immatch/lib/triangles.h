@@ -116,6 +116,48 @@ match_triangles(
         void* callback_data,
         stimage_error_t* const error);
 
+/**
+The estimated cost of a call to match_triangles.
+*/
+typedef struct {
+    /** The number of reference triangles that will be allocated */
+    size_t nref_triangles;
+
+    /** The number of input triangles that will be allocated */
+    size_t ninput_triangles;
+
+    /** The peak number of bytes allocated by match_triangles */
+    size_t nbytes;
+
+    /** The amount of work, in arbitrary units proportional to the
+        running time */
+    double work;
+} triangles_cost_t;
+
+/**
+Estimate the peak memory use and running time of match_triangles,
+without allocating anything.  The estimate is an upper bound on the
+memory, since it assumes that no coordinates are culled and that no
+triangles are rejected.
+
+@param nref The number of reference coordinates
+
+@param ninput The number of input coordinates
+
+@param nmatch See match_triangles
+
+@param nreject See match_triangles
+
+@param cost The estimated cost
+*/
+void
+estimate_triangles_cost(
+        const size_t nref,
+        const size_t ninput,
+        const size_t nmatch,
+        const size_t nreject,
+        triangles_cost_t* const cost);
+
 /********************************************************************************
 BELOW IS THE SECONDARY API -- SUBJECT TO CHANGE
 ********************************************************************************/
@@ -292,5 +334,39 @@ vote_triangle_matches(
         const coord_t** const inputcoord_matches,
         stimage_error_t* const error);
 
+/**
+Like match_triangles, but uses a precomputed table of reference
+triangles rather than building it from ref_sorted.  The table must
+have been built with find_triangles from the same ref_sorted list with
+the same nmatch, tolerance and maxratio, and the vertices of the
+triangles must point into ref.  This is used to reuse the reference
+triangles stored in a reference index (see refindex.h).
+
+@param nref_triangles The number of reference triangles
+
+@param ref_triangles The reference triangles, sorted by ratio
+
+See match_triangles for the other parameters.
+*/
+int
+match_triangles_with_ref_triangles(
+        const size_t nref,
+        const size_t nref_unique,
+        const coord_t* const ref,
+        const coord_t* const * const ref_sorted, /*[nref]*/
+        const size_t ninput,
+        const size_t ninput_unique,
+        const coord_t* const input, /*[ninput]*/
+        const coord_t* const * const input_sorted,
+        const size_t nmatch,
+        const double tolerance,
+        const double maxratio,
+        const size_t nreject,
+        const size_t nref_triangles,
+        const triangle_t* const ref_triangles,
+        coord_match_callback_t* callback,
+        void* callback_data,
+        stimage_error_t* const error);
+
 #endif /* _STIMAGE_TRIANGLES_H_ */
 
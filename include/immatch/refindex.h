@@ -0,0 +1,203 @@
+/*
+Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+    1. Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+
+    2. Redistributions in binary form must reproduce the above
+      copyright notice, this list of conditions and the following
+      disclaimer in the documentation and/or other materials provided
+      with the distribution.
+
+    3. The name of AURA and its representatives may not be used to
+      endorse or promote products derived from this software without
+      specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+DAMAGE.
+*/
+
+#ifndef _STIMAGE_REFINDEX_H_
+#define _STIMAGE_REFINDEX_H_
+
+#include <stdint.h>
+
+#include "lib/util.h"
+#include "immatch/lib/triangles.h"
+
+/*
+A reference index is a binary file holding everything xyxymatch
+derives from the reference coordinate list alone: the coordinates
+sorted by xysort, the unique subset left by xycoincide and the
+ratio-sorted triangle table built by find_triangles.  It is laid out
+so that it can be memory-mapped read-only and used in place, letting
+many processes share a single page-cached copy.
+
+All sections start on a REFINDEX_ALIGN byte boundary:
+
+    refindex_header_t    header
+    coord_t              ref[nref]           (original order)
+    uint64_t             sorted[nref]        (indices into ref, xysort order)
+    uint64_t             unique[nunique]     (indices into ref, after xycoincide)
+    refindex_triangle_t  triangles[ntriangles]
+
+The file is written in native byte order; readers reject a file whose
+byteorder field does not read back as REFINDEX_BYTEORDER.
+*/
+
+#define REFINDEX_MAGIC "STIMGREF"
+#define REFINDEX_VERSION 1
+#define REFINDEX_BYTEORDER 0x01020304
+#define REFINDEX_ALIGN 64
+
+typedef struct {
+    char     magic[8];
+    uint32_t version;
+    uint32_t byteorder;
+    uint64_t header_size;
+    uint64_t file_size;
+
+    /* The parameters the index was built with */
+    double   separation;
+    double   tolerance;
+    double   maxratio;
+    uint64_t nmatch;
+
+    uint64_t nref;
+    uint64_t nunique;
+    uint64_t ntriangles;
+
+    /* Byte offsets of each section from the start of the file */
+    uint64_t ref_offset;
+    uint64_t sorted_offset;
+    uint64_t unique_offset;
+    uint64_t triangles_offset;
+} refindex_header_t;
+
+/**
+The on-disk form of a triangle_t.  The vertices are stored as indices
+into the ref section rather than pointers.
+*/
+typedef struct {
+    uint64_t vertices[3];
+    double   log_perimeter;
+    double   ratio;
+    double   cosine_v1;
+    double   ratio_tolerance;
+    double   cosine_tolerance;
+    int64_t  sense;
+} refindex_triangle_t;
+
+/**
+A view onto a reference index held in memory.  All of the pointers
+point into the buffer passed to refindex_view, which must outlive the
+view.
+*/
+typedef struct {
+    const refindex_header_t*   header;
+    const coord_t*             ref;        /* [nref] */
+    const uint64_t*            sorted;     /* [nref] */
+    const uint64_t*            unique;     /* [nunique] */
+    const refindex_triangle_t* triangles;  /* [ntriangles] */
+} refindex_t;
+
+/**
+Build a reference index and write it to a file.
+
+@param nref The number of reference coordinates
+
+@param ref Array of reference coordinates
+
+@param separation The minimum separation passed to xycoincide
+
+@param nmatch The maximum number of coordinates used to build the
+triangle table.  If nmatch is 0, or there are fewer than 3 unique
+coordinates, no triangle table is stored.
+
+@param tolerance The matching tolerance in pixels, used to reject
+triangles with vertices closer than tolerance
+
+@param maxratio The maximum ratio of the longest to shortest side of
+the stored triangles
+
+@param path The path of the file to write.  Any existing file is
+overwritten.
+
+@param error
+
+@return non-zero on failure
+*/
+int
+refindex_build(
+        const size_t nref,
+        const coord_t* const ref /*[nref]*/,
+        const double separation,
+        const size_t nmatch,
+        const double tolerance,
+        const double maxratio,
+        const char* const path,
+        stimage_error_t* const error);
+
+/**
+Validate a reference index held in memory and fill in a view onto it.
+Nothing is copied.
+
+@param size The size of the buffer in bytes
+
+@param buffer The contents of a reference index file.  It must be
+aligned to at least 8 bytes, which is always the case for a
+memory-mapped file.
+
+@param index The view to fill in
+
+@param error
+
+@return non-zero on failure
+*/
+int
+refindex_view(
+        const size_t size,
+        const void* const buffer,
+        refindex_t* const index,
+        stimage_error_t* const error);
+
+/**
+Fill an array of pointers with the unique reference coordinates of an
+index, in sorted order, as xysort and xycoincide would have left them.
+
+@param index The reference index
+
+@param ref_sorted An array of at least nunique pointers to fill in
+*/
+void
+refindex_unique_coords(
+        const refindex_t* const index,
+        const coord_t** const ref_sorted /*[nunique]*/);
+
+/**
+Convert the triangle table of an index into triangle_t structs whose
+vertices point into the ref section of the index.
+
+@param index The reference index
+
+@param triangles An array of at least ntriangles triangle_t structs to
+fill in
+*/
+void
+refindex_triangles(
+        const refindex_t* const index,
+        triangle_t* const triangles /*[ntriangles]*/);
+
+#endif /* _STIMAGE_REFINDEX_H_ */
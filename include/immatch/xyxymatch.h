@@ -33,6 +33,7 @@ DAMAGE.
 #define _STIMAGE_XYXYMATCH_H_
 
 #include "lib/util.h"
+#include "immatch/refindex.h"
 
 typedef struct {
     coord_t coord;
@@ -137,6 +138,12 @@ set higher than 10.0 but may be set as low as 5.0.
 @param nreject The maximum number of rejection iterations for the
 triangles pattern matching algorithm.
 
+@param nthreads The number of threads used by the
+xyxymatch_algo_tolerance algorithm to match strips of the sorted
+reference list concurrently (see match_tolerance_soa).  The results
+are the same for any number of threads.  0 or 1 runs everything in
+the calling thread.  The triangles algorithm ignores this.
+
 @return Non-zero on error
  */
 int
@@ -154,6 +161,137 @@ xyxymatch(
     const size_t nmatch,
     const double maxratio,
     const size_t nreject,
+    const size_t nthreads,
+    stimage_error_t* const error);
+
+/**
+The estimated cost of a call to xyxymatch.
+*/
+typedef struct {
+    /** The nmatch the estimate is for */
+    size_t nmatch;
+
+    /** The peak number of bytes allocated, including an output array
+        of ninput entries */
+    size_t nbytes;
+
+    /** The amount of work, in arbitrary units proportional to the
+        running time */
+    double work;
+} xyxymatch_cost_t;
+
+/**
+Estimate the peak memory use and running time of xyxymatch, without
+allocating anything.
+
+With the triangles algorithm, the memory grows as the cube of nmatch,
+so given a memory_limit, nmatch is reduced to the largest value
+whose estimate fits within it.  The reduced value is returned in
+cost->nmatch, and can be passed on to xyxymatch.
+
+@param ninput The number of input coordinates
+
+@param nref The number of reference coordinates
+
+@param algorithm See xyxymatch
+
+@param nmatch See xyxymatch
+
+@param nreject See xyxymatch
+
+@param memory_limit The maximum number of bytes to use, or 0 for no
+limit.
+
+@param cost The estimated cost
+
+@return Non-zero on error, including when the estimate does not fit
+within memory_limit even with the smallest nmatch.
+*/
+int
+xyxymatch_estimate_cost(
+    const size_t ninput,
+    const size_t nref,
+    const xyxymatch_algo_e algorithm,
+    const size_t nmatch,
+    const size_t nreject,
+    const size_t memory_limit,
+    xyxymatch_cost_t* const cost,
+    stimage_error_t* const error);
+
+/**
+Like xyxymatch, but takes the reference coordinates from a reference
+index (see refindex.h) rather than an array.  The sorted and culled
+reference list is taken directly from the index, and when the
+triangles algorithm is used with the same nmatch, tolerance and
+maxratio as the index was built with, so is the triangle table.
+
+The ref_idx members of the output are indices into the original
+(unsorted) reference coordinates stored in the index.
+
+@param index A view onto the reference index, from refindex_view.
+
+@param separation Must be the same as the separation the index was
+built with, otherwise an error is returned.
+
+See xyxymatch for the other parameters.
+
+@return Non-zero on error
+ */
+int
+xyxymatch_refindex(
+    const size_t ninput, const coord_t* const input /*[ninput]*/,
+    const refindex_t* const index,
+    size_t* noutput, xyxymatch_output_t* const output /*[noutput]*/,
+    const coord_t* const origin,
+    const coord_t* const mag,
+    const coord_t* const rotation,
+    const coord_t* const ref_origin,
+    const xyxymatch_algo_e algorithm,
+    const double tolerance,
+    const double separation,
+    const size_t nmatch,
+    const double maxratio,
+    const size_t nreject,
+    const size_t nthreads,
+    stimage_error_t* const error);
+
+/**
+Like xyxymatch, but takes single-precision input and reference
+coordinates.  With the tolerance algorithm, the coordinates are kept
+in single precision through the transform, sort, coincidence and
+matching steps, roughly halving the memory used for large catalogs.
+The transform is computed in double precision, and distances are
+screened in single precision with any close to the tolerance
+recomputed in double precision, so this gives the same matches as
+xyxymatch would on the same coordinates promoted to double, as long
+as the transformed input coordinates are exactly representable as
+floats (which is the case for the default identity transform).
+
+The triangles algorithm is run in double precision on a promoted copy
+of the coordinates.
+
+The coordinates in the output are promoted to double.
+
+See xyxymatch for the parameters.
+
+@return Non-zero on error
+ */
+int
+xyxymatchf(
+    const size_t ninput, const coordf_t* const input /*[ninput]*/,
+    const size_t nref, const coordf_t* const ref /*[nref]*/,
+    size_t* noutput, xyxymatch_output_t* const output /*[noutput]*/,
+    const coord_t* const origin,
+    const coord_t* const mag,
+    const coord_t* const rotation,
+    const coord_t* const ref_origin,
+    const xyxymatch_algo_e algorithm,
+    const double tolerance,
+    const double separation,
+    const size_t nmatch,
+    const double maxratio,
+    const size_t nreject,
+    const size_t nthreads,
     stimage_error_t* const error);
 
 #endif /* _STIMAGE_XYXYMATCH_H_ */
@@ -0,0 +1,148 @@
+/*
+Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+    1. Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+
+    2. Redistributions in binary form must reproduce the above
+      copyright notice, this list of conditions and the following
+      disclaimer in the documentation and/or other materials provided
+      with the distribution.
+
+    3. The name of AURA and its representatives may not be used to
+      endorse or promote products derived from this software without
+      specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+DAMAGE.
+*/
+
+#ifndef _STIMAGE_COORDFILE_H_
+#define _STIMAGE_COORDFILE_H_
+
+#include "lib/util.h"
+
+/*
+Reading and writing of IRAF-style coordinate list files, such as the
+.coo and .match files used by the IRAF xyxymatch and geomap tasks.
+
+Each line holds whitespace-separated columns.  Blank lines, lines
+whose first non-blank character is '#', and anything after a '#' on a
+data line are ignored.  A column holding INDEF (IRAF's undefined
+value) is read as NaN, and NaN is written as INDEF.
+*/
+
+typedef enum {
+    coordfile_type_double,
+    coordfile_type_uint64,
+    coordfile_type_int64,
+    coordfile_type_LAST
+} coordfile_type_e;
+
+/**
+A column to write: its type and its byte offset within a row.
+*/
+typedef struct {
+    size_t           offset;
+    coordfile_type_e type;
+} coordfile_column_t;
+
+/**
+Return an upper bound on the number of data lines in a buffer, to
+size the values array passed to coordfile_read.
+
+@param size The size of the buffer in bytes
+
+@param buffer The contents of the file
+*/
+size_t
+coordfile_max_rows(
+        const size_t size,
+        const char* const buffer);
+
+/**
+Parse the data lines of a coordinate file held in memory.  The buffer
+need not be NUL-terminated, so a memory-mapped file can be parsed in
+place.
+
+@param size The size of the buffer in bytes
+
+@param buffer The contents of the file
+
+@param ncolumns The number of columns to read
+
+@param columns The 0-based indices of the columns to read, in the
+order they are to be stored
+
+@param nrows On input, the number of rows allocated in values.  On
+output, the number of rows read.
+
+@param values Array of [nrows * ncolumns] to store the values in, row
+by row.
+
+@param error
+
+@return Non-zero on error, including a line with too few columns or a
+column that is not a number.
+*/
+int
+coordfile_read(
+        const size_t size,
+        const char* const buffer,
+        const size_t ncolumns,
+        const size_t* const columns,
+        size_t* const nrows,
+        double* const values,
+        stimage_error_t* const error);
+
+/**
+Write rows of numbers as a coordinate file.
+
+@param path The path of the file to write
+
+@param header A line to write at the top of the file, without the
+leading '#' or trailing newline, or NULL for none
+
+@param nrows The number of rows
+
+@param data The rows, each stride bytes long
+
+@param stride The size of a row in bytes
+
+@param ncolumns The number of columns to write
+
+@param columns The type and offset of each column to write
+
+@param precision The number of significant digits to write for
+floating-point columns.  17 reproduces the values exactly when read
+back.
+
+@param error
+
+@return Non-zero on error
+*/
+int
+coordfile_write(
+        const char* const path,
+        const char* const header,
+        const size_t nrows,
+        const void* const data,
+        const size_t stride,
+        const size_t ncolumns,
+        const coordfile_column_t* const columns,
+        const int precision,
+        stimage_error_t* const error);
+
+#endif
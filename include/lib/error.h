@@ -37,10 +37,23 @@ DAMAGE.
 #ifndef _STIMAGE_ERROR_H_
 #define _STIMAGE_ERROR_H_
 
+#include <stddef.h>
+
 #define STIMAGE_MAX_ERROR_LEN 512
 
+/**
+ A progress callback, polled at coarse intervals by long-running
+ loops.  stage names the loop, of which done units out of total have
+ been completed.  Returning non-zero cancels the call in progress,
+ which then returns an error.
+ */
+typedef int (*stimage_progress_t)(
+    void* data, const char* stage, size_t done, size_t total);
+
 typedef struct {
   char message[STIMAGE_MAX_ERROR_LEN];
+  stimage_progress_t progress;
+  void* progress_data;
 } stimage_error_t;
 
 /*
@@ -79,4 +92,23 @@ stimage_error_is_set(const stimage_error_t* const error);
 void
 stimage_error_unset(stimage_error_t* error);
 
+/**
+ Set the progress callback polled by the calls the error object is
+ passed to, and the data passed to it.  Since the error object is
+ passed down to every function that can fail, it also carries the
+ callback to the loops that poll it.  The default is no callback.
+ */
+void
+stimage_error_set_progress(
+    stimage_error_t* error, stimage_progress_t progress, void* data);
+
+/**
+ Call the progress callback, if any.  Returns non-zero if the call is
+ to be cancelled, in which case the error message is set to
+ "Cancelled", unless the callback set one itself.
+ */
+int
+stimage_error_check_progress(
+    stimage_error_t* error, const char* stage, size_t done, size_t total);
+
 #endif /* _STIMAGE_ERROR_H_ */
@@ -87,4 +87,23 @@ apply_lintransform(
     const coord_t* const input, /* [ncoords] */
     coord_t* output);
 
+/**
+Apply a linear transformation to a list of single-precision
+coordinates.  The arithmetic is done in double precision.
+
+@param coeffs A set of coeffs, for example created by compute_lintransform
+
+@param ncoords The number of coordinates in the list
+
+@param input The input set of coordinates
+
+@param output The output set of coordinates.  May be equal to input.
+*/
+void
+apply_lintransformf(
+    const lintransform_t* const coeffs,
+    size_t ncoords,
+    const coordf_t* const input, /* [ncoords] */
+    coordf_t* output);
+
 #endif /* _STIMAGE_LINTRANSFORM_H_ */
@@ -0,0 +1,176 @@
+/*
+Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+    1. Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+
+    2. Redistributions in binary form must reproduce the above
+      copyright notice, this list of conditions and the following
+      disclaimer in the documentation and/or other materials provided
+      with the distribution.
+
+    3. The name of AURA and its representatives may not be used to
+      endorse or promote products derived from this software without
+      specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+DAMAGE.
+*/
+
+#ifndef _STIMAGE_RADIXSORT_H_
+#define _STIMAGE_RADIXSORT_H_
+
+#include <stdint.h>
+#include <string.h>
+
+#include "lib/util.h"
+
+/**
+Map a double to an unsigned 64-bit key such that the unsigned integer
+ordering of the keys is the same as the numerical ordering of the
+doubles.  Negative numbers have all of their bits flipped, positive
+numbers only have their sign bit set.  The mapping is a bijection, see
+radix_key_to_double.
+*/
+static inline uint64_t
+radix_key_from_double(
+        const double d) {
+
+    uint64_t u;
+
+    memcpy(&u, &d, sizeof(uint64_t));
+    return (u & 0x8000000000000000ULL) ? ~u : (u | 0x8000000000000000ULL);
+}
+
+/**
+The inverse of radix_key_from_double.
+*/
+static inline double
+radix_key_to_double(
+        const uint64_t key) {
+
+    uint64_t u;
+    double   d;
+
+    u = (key & 0x8000000000000000ULL) ? (key & ~0x8000000000000000ULL) : ~key;
+    memcpy(&d, &u, sizeof(double));
+    return d;
+}
+
+/**
+Sort an array of 64-bit keys using a least-significant-digit radix
+sort.  The sort is stable.
+
+@param n The number of keys
+
+@param keys The keys to sort.  Sorted in place.
+
+@param index An array of values that is permuted along with the keys,
+for example to compute an argsort.  May be NULL.
+
+@param error
+
+@return Non-zero on error
+*/
+int
+radix_sort_keys(
+        const size_t n,
+        /* Input/output */
+        uint64_t* const keys, /* [n] */
+        size_t* const index, /* [n] */
+        stimage_error_t* const error);
+
+/**
+Compute the permutation that sorts a strided array of doubles in
+increasing order.  The sort is stable: elements that compare equal
+(including -0.0 and 0.0) retain their original relative order.
+
+@param n The number of elements
+
+@param base A pointer to the first double to be sorted
+
+@param stride The distance in bytes between successive doubles.  This
+makes it possible to sort an array of structs by one of its members
+without copying it out first.
+
+@param perm Output array where perm[i] is the index of the i'th
+smallest element
+
+@param error
+
+@return Non-zero on error
+*/
+int
+radix_argsort(
+        const size_t n,
+        const double* const base,
+        const size_t stride,
+        /* Output */
+        size_t* const perm, /* [n] */
+        stimage_error_t* const error);
+
+/**
+Like radix_argsort, but for a strided array of floats.  Since the
+keys have fewer significant bits, fewer radix passes are needed.
+*/
+int
+radix_argsort_float(
+        const size_t n,
+        const float* const base,
+        const size_t stride,
+        /* Output */
+        size_t* const perm, /* [n] */
+        stimage_error_t* const error);
+
+/**
+Sort an array of doubles in place.
+
+@return Non-zero on error
+*/
+int
+radix_sort_doubles(
+        const size_t n,
+        /* Input/output */
+        double* const a, /* [n] */
+        stimage_error_t* const error);
+
+/**
+Rearrange an array of arbitrary elements in place so that element i
+becomes the element formerly at perm[i].  This follows the cycles of
+the permutation, so it only needs one element of temporary storage.
+perm is reset to the identity permutation on exit.
+
+@param n The number of elements
+
+@param base The array of elements
+
+@param size The size of each element in bytes
+
+@param perm The permutation, for example as computed by radix_argsort
+
+@param error
+
+@return Non-zero on error
+*/
+int
+apply_permutation(
+        const size_t n,
+        /* Input/output */
+        void* const base,
+        const size_t size,
+        size_t* const perm, /* [n] */
+        stimage_error_t* const error);
+
+#endif /* _STIMAGE_RADIXSORT_H_ */
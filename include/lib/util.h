@@ -138,6 +138,13 @@ typedef struct {
     double y;
 } coord_t;
 
+/* Single-precision coordinates, used by the float32 matching path to
+   halve the memory footprint of large catalogs */
+typedef struct {
+    float x;
+    float y;
+} coordf_t;
+
 typedef struct {
     const coord_t* l;
     const coord_t* r;
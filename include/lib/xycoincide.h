@@ -38,6 +38,7 @@ DAMAGE.
 #define _STIMAGE_XYCOINCIDE_H_
 
 #include "lib/util.h"
+#include "lib/xysoa.h"
 
 /**
 Removes coordinates from the list that are too close together, as
@@ -61,4 +62,36 @@ xycoincide(
     const coord_t** const  output, /*[ncoords]*/
     const double tolerance);
 
+/**
+Like xycoincide, but works in place on a structure-of-arrays list of
+coordinates (see xysoa.h) that has already been sorted in xysort
+order.  The coordinates that are removed are compressed out of
+coords->x, coords->y and coords->index, and coords->n is updated.
+
+@param coords The sorted coordinates
+
+@param tolerance The coincidence tolerance.
+
+@param error
+
+@return non-zero on failure, in which case coords is unchanged.
+ */
+int
+xycoincide_soa(
+    xysoa_t* const coords,
+    const double tolerance,
+    stimage_error_t* const error);
+
+/**
+The single-precision counterpart of xycoincide_soa.  Distances are
+screened in single precision, and those close to the tolerance are
+recomputed in double precision, so the result is the same as
+xycoincide_soa would give for the same coordinates.
+ */
+int
+xycoincide_soaf(
+    xysoaf_t* const coords,
+    const double tolerance,
+    stimage_error_t* const error);
+
 #endif /* _STIMAGE_XYCOINCIDE_H_ */
@@ -0,0 +1,195 @@
+/*
+Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+    1. Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+
+    2. Redistributions in binary form must reproduce the above
+      copyright notice, this list of conditions and the following
+      disclaimer in the documentation and/or other materials provided
+      with the distribution.
+
+    3. The name of AURA and its representatives may not be used to
+      endorse or promote products derived from this software without
+      specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+DAMAGE.
+*/
+
+#ifndef _STIMAGE_XYSOA_H_
+#define _STIMAGE_XYSOA_H_
+
+#include "lib/util.h"
+
+/*
+A structure-of-arrays coordinate list.
+
+Most of the library passes coordinates around as arrays of coord_t,
+or as arrays of pointers to coord_t produced by xysort.  The inner
+loops of the coincidence and tolerance matching kernels are much
+faster when the x and y values are each contiguous: every
+access is a direct, sequential load, and the compiler is able to
+vectorize the distance computations.
+
+xysoa_t holds the x and y values of a list of coordinates, usually in
+xysort order, along with the index of each coordinate in the original
+array so that results can be reported in terms of the original
+indices.
+*/
+
+/* The number of points the SoA kernels process at a time.  The
+   distances for a block are computed into a scratch array with a
+   simple loop the compiler can vectorize, and then reduced. */
+#define XYSOA_BLOCK 64
+
+typedef struct {
+    size_t  n;
+    double* x;     /* [n] */
+    double* y;     /* [n] */
+    size_t* index; /* [n] */
+} xysoa_t;
+
+/**
+Mark a xysoa_t as empty.  It is safe to call xysoa_free on it
+afterward.
+*/
+void
+xysoa_new(
+        xysoa_t* const soa);
+
+/**
+Allocate the arrays of a xysoa_t to hold n coordinates.
+
+@return non-zero on failure
+*/
+int
+xysoa_init(
+        xysoa_t* const soa,
+        const size_t n,
+        stimage_error_t* const error);
+
+/**
+Free the arrays of a xysoa_t.
+*/
+void
+xysoa_free(
+        xysoa_t* const soa);
+
+/**
+Fill a xysoa_t from an array of pointers to coordinates, such as
+those produced by xysort.  soa->index is set to the index of each
+coordinate in base.  The xysoa_t must have been initialized to hold
+at least n coordinates.
+
+@param n The number of pointers
+
+@param base The array the pointers point into
+
+@param sorted The pointers to gather coordinates from
+
+@param soa The xysoa_t to fill
+*/
+void
+xysoa_gather(
+        const size_t n,
+        const coord_t* const base,
+        const coord_t* const * const sorted /*[n]*/,
+        xysoa_t* const soa);
+
+/**
+The inverse of xysoa_gather: fill an array of pointers to coordinates
+in base from soa->index.
+*/
+void
+xysoa_pointers(
+        const xysoa_t* const soa,
+        const coord_t* const base,
+        const coord_t** const sorted /*[soa->n]*/);
+
+/*
+The single-precision counterpart of xysoa_t, used by the float32
+matching path (see xyxymatchf).  Coordinates are stored as floats to
+halve the memory traffic.  The kernels screen squared distances in
+single precision and recompute any that fall near the threshold in
+double precision, so the results are the same as running the
+double-precision kernels on the same (float-representable) values.
+*/
+typedef struct {
+    size_t  n;
+    float*  x;     /* [n] */
+    float*  y;     /* [n] */
+    size_t* index; /* [n] */
+} xysoaf_t;
+
+/* A squared distance computed in single precision from float
+   coordinates is within a relative error of a few FLT_EPSILON of the
+   exact value, plus a tiny absolute error when it underflows.
+   Screening thresholds are widened by these margins, so that a
+   single-precision comparison is only trusted when it cannot disagree
+   with the double-precision one. */
+#define XYSOAF_R2_RELATIVE_MARGIN 1e-5
+#define XYSOAF_R2_ABSOLUTE_MARGIN 1e-30
+
+/**
+Mark a xysoaf_t as empty.  It is safe to call xysoaf_free on it
+afterward.
+*/
+void
+xysoaf_new(
+        xysoaf_t* const soa);
+
+/**
+Allocate the arrays of a xysoaf_t to hold n coordinates.
+
+@return non-zero on failure
+*/
+int
+xysoaf_init(
+        xysoaf_t* const soa,
+        const size_t n,
+        stimage_error_t* const error);
+
+/**
+Free the arrays of a xysoaf_t.
+*/
+void
+xysoaf_free(
+        xysoaf_t* const soa);
+
+/**
+Fill a xysoaf_t with the coordinates in coords, sorted in the same
+order as xysort (by y and then by x).  soa->index is set to the index
+of each coordinate in coords.  The xysoaf_t must have been initialized
+to hold at least n coordinates.
+
+@param n The number of coordinates
+
+@param coords The coordinates to sort
+
+@param soa The xysoaf_t to fill
+
+@param error
+
+@return non-zero on failure
+*/
+int
+xysoaf_sort(
+        const size_t n,
+        const coordf_t* const coords /*[n]*/,
+        xysoaf_t* const soa,
+        stimage_error_t* const error);
+
+#endif /* _STIMAGE_XYSOA_H_ */
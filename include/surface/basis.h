@@ -0,0 +1,157 @@
+/*
+Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+    1. Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+
+    2. Redistributions in binary form must reproduce the above
+      copyright notice, this list of conditions and the following
+      disclaimer in the documentation and/or other materials provided
+      with the distribution.
+
+    3. The name of AURA and its representatives may not be used to
+      endorse or promote products derived from this software without
+      specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+DAMAGE.
+*/
+
+#ifndef _STIMAGE_SURFACE_BASIS_H_
+#define _STIMAGE_SURFACE_BASIS_H_
+
+#include "surface/surface.h"
+
+#define SURFACE_BASIS_CACHE_SIZE 4
+
+typedef struct {
+    surface_type_e type;
+    size_t         axis;
+    size_t         order;
+    double         k1;
+    double         k2;
+    double*        basis; /* [order * ncoord] */
+} surface_basis_entry_t;
+
+/**
+A cache of the basis functions of one set of coordinates.
+
+Fitting a surface and evaluating it both start by computing the
+basis functions along each axis at every coordinate.  When the same
+coordinates are fit and evaluated many times, as in the rejection
+loop of geomap, the cache computes them once.  Entries are keyed by
+surface type, axis and normalization, and since the basis functions
+of a given order are a prefix of those of any higher order, a single
+entry serves every order up to the highest one requested.
+*/
+typedef struct {
+    size_t                ncoord;
+    const coord_t*        coord; /* [ncoord] */
+    size_t                next;
+    size_t                last;
+    surface_basis_entry_t entries[SURFACE_BASIS_CACHE_SIZE];
+} surface_basis_cache_t;
+
+/**
+Initialize an empty cache for the given coordinates.  The coordinates
+are not copied, and must outlive the cache.
+*/
+void
+surface_basis_cache_init(
+        surface_basis_cache_t* const cache,
+        const size_t ncoord,
+        const coord_t* const coord);
+
+/**
+Free the memory held by the cache.
+*/
+void
+surface_basis_cache_free(
+        surface_basis_cache_t* const cache);
+
+/**
+Compute the basis functions of a surface type along one axis.
+
+@param type The surface type
+
+@param ncoord Number of coordinates
+
+@param axis The axis number to use (0 = x, 1 = y)
+
+@param coord The coordinates
+
+@param order The number of basis functions
+
+@param k1 Normalizing constant
+
+@param k2 Normalizing constant
+
+@param basis Output array [order * ncoord]
+
+@param error
+
+@return Non-zero on error
+*/
+int
+surface_basis(
+        const surface_type_e type,
+        const size_t ncoord,
+        const size_t axis,
+        const coord_t* const coord,
+        const size_t order,
+        const double k1,
+        const double k2,
+        /* Output */
+        double* const basis,
+        stimage_error_t* const error);
+
+/**
+Get the basis functions of the cached coordinates, computing them
+only if they are not in the cache already.
+
+@param cache The cache
+
+@param type The surface type
+
+@param axis The axis number to use (0 = x, 1 = y)
+
+@param order The number of basis functions needed
+
+@param k1 Normalizing constant
+
+@param k2 Normalizing constant
+
+@param basis Set to an array of at least [order * ncoord], owned by
+       the cache.  It remains valid through the next call, so the
+       bases of both axes may be held at once, but may be freed by
+       any call after that.
+
+@param error
+
+@return Non-zero on error
+*/
+int
+surface_basis_cache_get(
+        surface_basis_cache_t* const cache,
+        const surface_type_e type,
+        const size_t axis,
+        const size_t order,
+        const double k1,
+        const double k2,
+        /* Output */
+        const double** const basis,
+        stimage_error_t* const error);
+
+#endif
@@ -37,6 +37,7 @@ DAMAGE.
 #ifndef _STIMAGE_SURFACE_FIT_H_
 #define _STIMAGE_SURFACE_FIT_H_
 
+#include "surface/basis.h"
 #include "surface/surface.h"
 
 typedef enum {
@@ -94,4 +95,33 @@ surface_fit(
         surface_fit_error_e* const error_type,
         stimage_error_t* const error);
 
+/**
+The same as `surface_fit`, but fits the coordinates of a basis cache,
+reusing the basis functions it already holds.
+
+@param s Surface descriptor
+
+@param cache Basis cache of the data points
+
+@param x data array [cache->ncoord]
+
+@param w weights array [cache->ncoord]
+
+@param weight_type type of weights
+
+@param error_type
+
+@param error
+*/
+int
+surface_fit_cached(
+        surface_t* const s,
+        surface_basis_cache_t* const cache,
+        const double* const z,
+        double* const w,
+        const surface_fit_weight_e weight_type,
+        /* Output */
+        surface_fit_error_e* const error_type,
+        stimage_error_t* const error);
+
 #endif
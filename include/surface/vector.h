@@ -38,6 +38,7 @@ DAMAGE.
 #define _STIMAGE_SURFACE_VECTOR_H_
 
 #include "surface.h"
+#include "surface/basis.h"
 
 /*
   was dgsvector
@@ -53,4 +54,17 @@ surface_vector(
         double* const zfit,
         stimage_error_t* const error);
 
+/*
+Evaluate the fitted surface at the coordinates of a basis cache.  The
+basis functions are taken from the cache, so repeated evaluations at
+the same points are just a sum of products.
+*/
+int
+surface_vector_cached(
+        const surface_t* const s,
+        surface_basis_cache_t* const cache,
+        /* Output */
+        double* const zfit,
+        stimage_error_t* const error);
+
 #endif
@@ -38,6 +38,7 @@ ext_modules = [
         'stsci.stimage._stimage',
         sources=SOURCES,
         include_dirs=INCLUDES,
+        libraries=['pthread'],
     ),
 ]
 
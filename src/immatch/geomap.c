@@ -37,11 +37,16 @@ DAMAGE.
 #include <assert.h>
 
 #define _USE_MATH_DEFINES       /* needed for MS Windows to define M_PI */ 
+#include <float.h>
 #include <math.h>
 #include <stdio.h>
+#include <string.h>
 
 #include "immatch/geomap.h"
+#include "immatch/geomap_grid.h"
+#include "lib/polynomial.h"
 #include "lib/xybbox.h"
+#include "surface/basis.h"
 #include "surface/fit.h"
 #include "surface/vector.h"
 
@@ -79,6 +84,9 @@ typedef struct {
     bbox_t  bbox;
     size_t  n_zero_weighted;
     size_t  ncoord;
+
+    /* Basis functions of the reference coordinates being fit */
+    surface_basis_cache_t basis;
 } geomap_fit_t;
 
 /* was geo_minit */
@@ -129,6 +137,7 @@ geomap_fit_new(
 
     fit->initialized = 0;
     fit->rej = NULL;
+    surface_basis_cache_init(&fit->basis, 0, NULL);
 }
 
 static void
@@ -136,6 +145,7 @@ geomap_fit_free(
         geomap_fit_t* fit) {
 
     free(fit->rej); fit->rej = NULL;
+    surface_basis_cache_free(&fit->basis);
     fit->initialized = 0;
 }
 
@@ -232,7 +242,7 @@ compute_surface_coefficients(
 
  exit:
 
-    return 0;
+    return status;
 }
 
 static int
@@ -242,6 +252,7 @@ compute_residuals(
         const size_t ncoord,
         const coord_t* const input,
         const coord_t* const ref,
+        surface_basis_cache_t* const basis,
         /* Output */
         double* const residual_x,
         double* const residual_y,
@@ -255,11 +266,13 @@ compute_residuals(
     assert(ref);
     assert(residual_x);
     assert(residual_y);
+    assert(basis);
+    assert(basis->coord == ref && basis->ncoord == ncoord);
     assert(error);
 
-    if (surface_vector(sx1, ncoord, ref, residual_x, error)) return 1;
+    if (surface_vector_cached(sx1, basis, residual_x, error)) return 1;
 
-    if (surface_vector(sy1, ncoord, ref, residual_y, error)) return 1;
+    if (surface_vector_cached(sy1, basis, residual_y, error)) return 1;
 
     for (i = 0; i < ncoord; ++i) {
         residual_x[i] = input[i].x - residual_x[i];
@@ -395,7 +408,7 @@ geo_fit_theta(
     for (i = 0; i < ncoord; ++i) {
         syrxi += weights[i] * (ref[i].y - r0.y) * (input[i].x - i0.x);
         sxryi += weights[i] * (ref[i].x - r0.x) * (input[i].y - i0.y);
-        sxryi += weights[i] * (ref[i].x - r0.x) * (input[i].x - i0.x);
+        sxrxi += weights[i] * (ref[i].x - r0.x) * (input[i].x - i0.x);
         syryi += weights[i] * (ref[i].y - r0.y) * (input[i].y - i0.y);
     }
 
@@ -445,8 +458,8 @@ geo_fit_theta(
 
     /* Compute the residuals */
     if (compute_residuals(
-                sx1, sy1, ncoord, input, ref, residual_x, residual_y,
-                error)) goto exit;
+                sx1, sy1, ncoord, input, ref, &fit->basis, residual_x,
+                residual_y, error)) goto exit;
 
     /* Compute the number of zero-weighted points */
     fit->n_zero_weighted = count_zero_weighted(ncoord, weights);
@@ -601,8 +614,8 @@ geo_fit_magnify(
 
     /* Compute the residuals */
     if (compute_residuals(
-                sx1, sy1, ncoord, input, ref, residual_x, residual_y,
-                error)) goto exit;
+                sx1, sy1, ncoord, input, ref, &fit->basis, residual_x,
+                residual_y, error)) goto exit;
 
     /* Compute the number of zero-weighted points */
     fit->n_zero_weighted = count_zero_weighted(ncoord, weights);
@@ -738,7 +751,7 @@ geo_fit_linear(
     cthetac.x = xmag * ctheta;
     sthetac.x = ymag * stheta;
     sthetac.y = xmag * stheta;
-    cthetac.x = ymag * ctheta;
+    cthetac.y = ymag * ctheta;
 
     /* Compute the X and Y fit coefficients */
     if (compute_surface_coefficients(
@@ -747,8 +760,8 @@ geo_fit_linear(
 
     /* Compute the residuals */
     if (compute_residuals(
-                sx1, sy1, ncoord, input, ref, residual_x, residual_y,
-                error)) goto exit;
+                sx1, sy1, ncoord, input, ref, &fit->basis, residual_x,
+                residual_y, error)) goto exit;
 
     /* Compute the number of zero-weighted points */
     fit->n_zero_weighted = count_zero_weighted(ncoord, weights);
@@ -821,7 +834,7 @@ geo_fit_xy(
 
     bbox_t              bbox;
     double*             zfit      = NULL;
-    const double* const z = (double*)input + (xfit ? 0 : 1);
+    double*             z         = NULL;
     surface_t           savefit;
     surface_fit_error_e fit_error = surface_fit_error_ok;
     size_t              i         = 0;
@@ -834,6 +847,7 @@ geo_fit_xy(
     assert(weights);
     assert(residual);
     assert(has_secondary);
+    assert(fit->basis.coord == ref && fit->basis.ncoord == ncoord);
     assert(error);
 
     surface_new(&savefit);
@@ -846,6 +860,14 @@ geo_fit_xy(
     zfit = malloc_with_error(ncoord * sizeof(double), error);
     if (zfit == NULL) goto exit;
 
+    /* The surface fitter wants the ordinates as a contiguous array */
+    z = malloc_with_error(ncoord * sizeof(double), error);
+    if (z == NULL) goto exit;
+
+    for (i = 0; i < ncoord; ++i) {
+        z[i] = xfit ? input[i].x : input[i].y;
+    }
+
     bbox_copy(&fit->bbox, &bbox);
     bbox_make_nonsingular(&bbox);
 
@@ -860,11 +882,11 @@ geo_fit_xy(
                         sf1, fit->function, 1, 1, xterms_none, &bbox,
                         error)) goto exit;
             for (i = 0; i < ncoord; ++i) {
-                zfit[i] = z[i<<1] - ref[i].x;
+                zfit[i] = z[i] - ref[i].x;
             }
 
-            if (surface_fit(
-                        sf1, ncoord, ref, zfit, weights,
+            if (surface_fit_cached(
+                        sf1, &fit->basis, zfit, weights,
                         surface_fit_weight_user, &fit_error, error)) goto exit;
 
             if (fit->function == surface_type_polynomial) {
@@ -885,8 +907,8 @@ geo_fit_xy(
             if (surface_init(
                         sf1, fit->function, 2, 1, xterms_none, &bbox,
                         error)) goto exit;
-            if (surface_fit(
-                        sf1, ncoord, ref, z, weights,
+            if (surface_fit_cached(
+                        sf1, &fit->basis, z, weights,
                         surface_fit_weight_user, &fit_error, error)) goto exit;
             *has_secondary = 0;
             break;
@@ -895,15 +917,15 @@ geo_fit_xy(
             if (surface_init(
                         sf1, fit->function, 2, 2, xterms_none, &bbox,
                         error)) goto exit;
-            if (surface_fit(
-                        sf1, ncoord, ref, z, weights,
+            if (surface_fit_cached(
+                        sf1, &fit->basis, z, weights,
                         surface_fit_weight_user, &fit_error, error)) goto exit;
 
             if (fit->xxorder > 2 || fit->xyorder > 2 ||
                 fit->xxterms == xterms_full) {
                 if (surface_init(
                             sf2, fit->function, fit->xxorder, fit->xyorder,
-                            fit->xxterms, &fit->bbox, error)) {
+                            fit->xxterms, &bbox, error)) {
                     surface_free(sf1);
                     goto exit;
                 }
@@ -923,10 +945,10 @@ geo_fit_xy(
                         sf1, fit->function, 1, 1, xterms_none, &bbox,
                         error)) goto exit;
             for (i = 0; i < ncoord; ++i) {
-                zfit[i] = z[i<<1] - ref[i].y;
+                zfit[i] = z[i] - ref[i].y;
             }
-            if (surface_fit(
-                        sf1, ncoord, ref, zfit, weights,
+            if (surface_fit_cached(
+                        sf1, &fit->basis, zfit, weights,
                         surface_fit_weight_user, &fit_error, error)) goto exit;
             if (fit->function == surface_type_polynomial) {
                 savefit.coeff[0] = sf1->coeff[0];
@@ -947,8 +969,8 @@ geo_fit_xy(
             if (surface_init(
                         sf1, fit->function, 1, 2, xterms_none, &bbox,
                         error)) goto exit;
-            if (surface_fit(
-                        sf1, ncoord, ref, z, weights,
+            if (surface_fit_cached(
+                        sf1, &fit->basis, z, weights,
                         surface_fit_weight_user, &fit_error, error)) goto exit;
             *has_secondary = 0;
             break;
@@ -957,8 +979,8 @@ geo_fit_xy(
             if (surface_init(
                         sf1, fit->function, 2, 2, xterms_none, &bbox,
                         error)) goto exit;
-            if (surface_fit(
-                        sf1, ncoord, ref, z, weights,
+            if (surface_fit_cached(
+                        sf1, &fit->basis, z, weights,
                         surface_fit_weight_user, &fit_error, error)) goto exit;
             if (fit->yxorder > 2 || fit->yyorder > 2 ||
                 fit->yxterms == xterms_full) {
@@ -976,22 +998,22 @@ geo_fit_xy(
     if (_geo_fit_xy_validate_fit_error(
                 fit_error, xfit, fit->projection, error)) goto exit;
 
-    if (surface_vector(sf1, ncoord, ref, residual, error)) goto exit;
+    if (surface_vector_cached(sf1, &fit->basis, residual, error)) goto exit;
     for (i = 0; i < ncoord; ++i) {
-        residual[i] = z[i<<1] - residual[i];
+        residual[i] = z[i] - residual[i];
     }
 
     /* Calculate the higher-order fit */
     if (*has_secondary) {
-        if (surface_fit(
-                    sf2, ncoord, ref, residual, weights,
+        if (surface_fit_cached(
+                    sf2, &fit->basis, residual, weights,
                     surface_fit_weight_user, &fit_error, error)) goto exit;
         if (_geo_fit_xy_validate_fit_error(
                     fit_error, xfit, fit->projection, error)) goto exit;
 
-        if (surface_vector(sf2, ncoord, ref, zfit, error)) goto exit;
+        if (surface_vector_cached(sf2, &fit->basis, zfit, error)) goto exit;
         for (i = 0; i < ncoord; ++i) {
-            residual[i] = zfit[i] - residual[i];
+            residual[i] = residual[i] - zfit[i];
         }
     }
 
@@ -1019,6 +1041,7 @@ geo_fit_xy(
 
     surface_free(&savefit);
     free(zfit);
+    free(z);
 
     return status;
 }
@@ -1079,6 +1102,9 @@ geo_fit_reject(
     }
 
     do { /* while (niter < fit->maxiter) */
+        if (stimage_error_check_progress(
+                    error, "geo_fit_reject", niter, fit->maxiter)) goto exit;
+
         /* Compute the rejection limits */
         if (ncoord - fit->n_zero_weighted > 1) {
             cutx = fit->reject * \
@@ -1093,11 +1119,11 @@ geo_fit_reject(
         /* Reject points from the fit */
         for (i = 0; i < ncoord; ++i) {
             if (tweights[i] > 0.0 &&
-                ((abs(residual_x[i]) > cutx) || abs(residual_y[i]) > cuty)) {
+                ((fabs(residual_x[i]) > cutx) || fabs(residual_y[i]) > cuty)) {
                 tweights[i] = 0.0;
-                ++nreject;
                 assert(nreject < ncoord);
-                fit->rej[nreject] = i;
+                fit->rej[nreject] = (int)i;
+                ++nreject;
             }
         }
 
@@ -1107,7 +1133,7 @@ geo_fit_reject(
         fit->nreject = nreject;
 
         /* Compute the number of deleted points */
-        fit->n_zero_weighted = count_zero_weighted(ncoord, weights);
+        fit->n_zero_weighted = count_zero_weighted(ncoord, tweights);
 
         /* Recompute the X and Y fit */
         switch (fit->fit_geometry) {
@@ -1212,11 +1238,11 @@ geofit(
         break;
     default:
         if (geo_fit_xy(
-                    fit, sx1, sx2, ncoord, 0, input, ref, has_sx2, weights,
+                    fit, sx1, sx2, ncoord, 1, input, ref, has_sx2, weights,
                     residual_x, error)
             ||
             geo_fit_xy(
-                    fit, sy1, sy2, ncoord, 1, input, ref, has_sy2, weights,
+                    fit, sy1, sy2, ncoord, 0, input, ref, has_sy2, weights,
                     residual_y, error)) goto exit;
         break;
     }
@@ -1237,6 +1263,26 @@ geofit(
     return status;
 }
 
+/* Evaluate a surface at the coordinates, through the basis cache when
+   there is one.  One-off evaluations pass no cache, since
+   surface_vector evaluates them a block at a time without building the
+   basis arrays for every coordinate. */
+static int
+geoeval_surface(
+        const surface_t* const s,
+        const size_t ncoord,
+        const coord_t* const ref,
+        surface_basis_cache_t* const basis,
+        double* const zfit,
+        stimage_error_t* const error) {
+
+    if (basis != NULL) {
+        return surface_vector_cached(s, basis, zfit, error);
+    }
+
+    return surface_vector(s, ncoord, ref, zfit, error);
+}
+
 /* DIFF: was geo_evald */
 static int
 geoeval(
@@ -1248,6 +1294,7 @@ geoeval(
         const int has_sy2,
         const size_t ncoord,
         const coord_t* const ref,
+        surface_basis_cache_t* const basis,
         double* const xfit,
         double* const yfit,
         stimage_error_t* const error) {
@@ -1261,6 +1308,8 @@ geoeval(
     assert(sx2);
     assert(sy2);
     assert(ref);
+    assert(basis == NULL ||
+           (basis->coord == ref && basis->ncoord == ncoord));
     assert(xfit);
     assert(yfit);
     assert(error);
@@ -1270,17 +1319,17 @@ geoeval(
         if (tmp == NULL) goto exit;
     }
 
-    if (surface_vector(sx1, ncoord, ref, xfit, error)) goto exit;
+    if (geoeval_surface(sx1, ncoord, ref, basis, xfit, error)) goto exit;
     if (has_sx2) {
-        if (surface_vector(sx2, ncoord, ref, tmp, error)) goto exit;
+        if (geoeval_surface(sx2, ncoord, ref, basis, tmp, error)) goto exit;
         for (i = 0; i < ncoord; ++i) {
             xfit[i] += tmp[i];
         }
     }
 
-    if (surface_vector(sy1, ncoord, ref, yfit, error)) goto exit;
+    if (geoeval_surface(sy1, ncoord, ref, basis, yfit, error)) goto exit;
     if (has_sy2) {
-        if (surface_vector(sy2, ncoord, ref, tmp, error)) goto exit;
+        if (geoeval_surface(sy2, ncoord, ref, basis, tmp, error)) goto exit;
         for (i = 0; i < ncoord; ++i) {
             yfit[i] += tmp[i];
         }
@@ -1308,12 +1357,12 @@ geo_get_coeff(
     size_t nxxcoeff, nxycoeff, nyxcoeff, nyycoeff;
     double xxrange  = 1.0;
     double xyrange  = 1.0;
-    double xxmaxmin = 1.0;
-    double xymaxmin = 1.0;
+    double xxmaxmin = 0.0;
+    double xymaxmin = 0.0;
     double yxrange  = 1.0;
     double yyrange  = 1.0;
-    double yxmaxmin = 1.0;
-    double yymaxmin = 1.0;
+    double yxmaxmin = 0.0;
+    double yymaxmin = 0.0;
     double a, b, c, d;
 
     assert(sx);
@@ -1323,36 +1372,31 @@ geo_get_coeff(
     assert(rot);
     assert(sx->coeff);
     assert(sy->coeff);
-    assert(sx->ncoeff >= 3);
-    assert(sy->ncoeff >= 3);
+    assert(sx->ncoeff >= 2);
+    assert(sy->ncoeff >= 2);
 
-    nxxcoeff = nyxcoeff = sx->nxcoeff;
-    nxycoeff = nyycoeff = sy->nycoeff;
+    nxxcoeff = sx->nxcoeff;
+    nxycoeff = sx->nycoeff;
+    nyxcoeff = sy->nxcoeff;
+    nyycoeff = sy->nycoeff;
 
     /* Get the data range */
     if (sx->type != surface_type_polynomial) {
         xxrange = (sx->bbox.max.x - sx->bbox.min.x) / 2.0;
-        xxmaxmin = -(sx->bbox.max.x - sx->bbox.min.x) / 2.0;
+        xxmaxmin = -(sx->bbox.max.x + sx->bbox.min.x) / 2.0;
         xyrange = (sx->bbox.max.y - sx->bbox.min.y) / 2.0;
-        xymaxmin = (sx->bbox.max.y - sx->bbox.min.y) / 2.0;
+        xymaxmin = -(sx->bbox.max.y + sx->bbox.min.y) / 2.0;
     }
 
     if (sy->type != surface_type_polynomial) {
         yxrange = (sy->bbox.max.x - sy->bbox.min.x) / 2.0;
-        yxmaxmin = (sy->bbox.max.x - sy->bbox.min.x) / 2.0;
+        yxmaxmin = -(sy->bbox.max.x + sy->bbox.min.x) / 2.0;
         yyrange = (sy->bbox.max.y - sy->bbox.min.y) / 2.0;
-        yymaxmin = (sy->bbox.max.y - sy->bbox.min.y) / 2.0;
+        yymaxmin = -(sy->bbox.max.y + sy->bbox.min.y) / 2.0;
     }
 
-    /* Get the shifts */
-    shift->x = sx->coeff[0] + \
-        sx->coeff[1] * xxmaxmin / xxrange + \
-        sx->coeff[2] * xymaxmin / xyrange;
-    shift->y = sy->coeff[0] + \
-        sy->coeff[1] * yxmaxmin / yxrange +
-        sx->coeff[2] * yymaxmin / yyrange;
-
-    /* Get the rotation and scaling parameters */
+    /* Get the rotation and scaling parameters.  The xyscale geometry
+       has no cross-axis terms, so the y term is not always at index 2 */
     if (nxxcoeff > 1) {
         a = sx->coeff[1] / xxrange;
     } else {
@@ -1366,7 +1410,7 @@ geo_get_coeff(
     }
 
     if (nyxcoeff > 1) {
-        c = sx->coeff[1] / yxrange;
+        c = sy->coeff[1] / yxrange;
     } else {
         c = 0.0;
     }
@@ -1377,6 +1421,10 @@ geo_get_coeff(
         d = 0.0;
     }
 
+    /* Get the shifts */
+    shift->x = sx->coeff[0] + a * xxmaxmin + b * xymaxmin;
+    shift->y = sy->coeff[0] + c * yxmaxmin + d * yymaxmin;
+
     scale->x = sqrt(a*a + c*c);
     scale->y = sqrt(b*b + d*d);
 
@@ -1428,6 +1476,23 @@ geo_get_results(
     result->fit_geometry = fit->fit_geometry;
     result->function = fit->function;
 
+    /* Only the general geometry honors the requested orders */
+    if (fit->fit_geometry == geomap_fit_general) {
+        result->xxorder = fit->xxorder;
+        result->xyorder = fit->xyorder;
+        result->xxterms = fit->xxterms;
+        result->yxorder = fit->yxorder;
+        result->yyorder = fit->yyorder;
+        result->yxterms = fit->yxterms;
+    } else {
+        result->xxorder = result->xyorder = 2;
+        result->yxorder = result->yyorder = 2;
+        result->xxterms = result->yxterms = xterms_none;
+    }
+
+    /* All of the surfaces share the same normalization */
+    bbox_copy(&sx1->bbox, &result->bbox);
+
     ngood = MAX(0, fit->ncoord - fit->n_zero_weighted);
 
     if (ngood <= 1) {
@@ -1501,6 +1566,66 @@ geo_get_results(
     return status;
 }
 
+/* Reduce the input and reference coordinates to those in bbox.  If
+   there is nothing to cut, the original arrays are returned and no
+   memory is allocated, so the caller should only free the outputs if
+   they differ from the inputs. */
+static int
+geomap_limit_to_bbox(
+        const size_t ncoord,
+        const coord_t* const input,
+        const coord_t* const ref,
+        const bbox_t* const bbox,
+        /* Output */
+        size_t* const ncoord_in_bbox,
+        coord_t** const input_in_bbox,
+        coord_t** const ref_in_bbox,
+        stimage_error_t* const error) {
+
+    bbox_t tbbox;
+
+    assert(input);
+    assert(ref);
+    assert(ncoord_in_bbox);
+    assert(input_in_bbox);
+    assert(ref_in_bbox);
+    assert(error);
+
+    /* If bbox is NULL, provide a dummy one full of NaNs */
+    if (bbox == NULL) {
+        bbox_init(&tbbox);
+    } else {
+        bbox_copy(bbox, &tbbox);
+    }
+
+    /* If the bbox is all NaNs, we don't need to reduce the data, saving an
+       alloc and copy */
+    if (bbox == NULL ||
+        (!isfinite(tbbox.min.x) && !isfinite(tbbox.min.y) &&
+         !isfinite(tbbox.max.x) && !isfinite(tbbox.max.y))) {
+        *input_in_bbox = (coord_t*)input;
+        *ref_in_bbox = (coord_t*)ref;
+        *ncoord_in_bbox = ncoord;
+        return 0;
+    }
+
+    *input_in_bbox = malloc_with_error(ncoord * sizeof(coord_t), error);
+    if (*input_in_bbox == NULL) return 1;
+
+    *ref_in_bbox = malloc_with_error(ncoord * sizeof(coord_t), error);
+    if (*ref_in_bbox == NULL) {
+        free(*input_in_bbox);
+        *input_in_bbox = NULL;
+        return 1;
+    }
+
+    /* Reduce data to only those in the bbox */
+    *ncoord_in_bbox = limit_to_bbox(
+            ncoord, input, ref, &tbbox, *input_in_bbox, *ref_in_bbox);
+
+    return 0;
+}
+
 int
 geomap(
         const size_t ninput, const coord_t* const input,
@@ -1545,52 +1670,31 @@ geomap(
     assert(ref);
     assert(error);
 
+    geomap_fit_new(&fit);
+    surface_new(&sx1);
+    surface_new(&sy1);
+    surface_new(&sx2);
+    surface_new(&sy2);
+
     if (ninput != nref) {
         stimage_error_set_message(
             error, "Must have the same number of input and reference coordinates.");
         goto exit;
     }
 
-    surface_new(&sx1);
-    surface_new(&sy1);
-    surface_new(&sx2);
-    surface_new(&sy2);
-
     geomap_fit_init(
             &fit, geomap_proj_none, fit_geometry, function,
             xxorder, xyorder, xxterms, yxorder, yyorder, yxterms,
             maxiter, reject);
 
-    /* If bbox is NULL, provide a dummy one full of NaNs */
-    if (bbox == NULL) {
-        bbox_init(&tbbox);
-    } else {
-        bbox_copy(bbox, &tbbox);
-    }
+    if (geomap_limit_to_bbox(
+                ninput, input, ref, bbox, &ninput_in_bbox, &input_in_bbox,
+                &ref_in_bbox, error)) goto exit;
+    nref_in_bbox = ninput_in_bbox;
 
-    /* If the bbox is all NaNs, we don't need to reduce the data, saving an
-       alloc and copy */
-    if (bbox == NULL ||
-        (!isfinite(tbbox.min.x) && !isfinite(tbbox.min.y) &&
-         !isfinite(tbbox.max.x) && !isfinite(tbbox.max.y))) {
-        /* If we have no bbox, we don't need to allocate and copy */
-        input_in_bbox = (coord_t*)input;
-        ref_in_bbox = (coord_t*)ref;
-        ninput_in_bbox = ninput;
-        nref_in_bbox = nref;
-    } else {
-        input_in_bbox = malloc_with_error(
-                ninput * sizeof(coord_t), error);
-        if (input_in_bbox == NULL) goto exit;
-
-        ref_in_bbox = malloc_with_error(
-                nref * sizeof(coord_t), error);
-        if (ref_in_bbox == NULL) goto exit;
-
-        /* Reduce data to only those in the bbox */
-        ninput_in_bbox = nref_in_bbox = limit_to_bbox(
-                ninput, input, ref, &tbbox, input_in_bbox, ref_in_bbox);
-    }
+    /* Every fit and evaluation below is at the reference coordinates,
+       so their basis functions only need to be computed once */
+    surface_basis_cache_init(&fit.basis, nref_in_bbox, ref_in_bbox);
 
     /* Compute the mean of the reference and input coordinates */
     compute_mean_coord(nref_in_bbox, ref_in_bbox, &fit.oref);
@@ -1615,7 +1719,13 @@ geomap(
         weights[i] = 1.0;
     }
 
-    /* Determine the actual max and min of the coordinates */
+    /* Determine the actual max and min of the coordinates, where
+       not given by bbox */
+    if (bbox == NULL) {
+        bbox_init(&tbbox);
+    } else {
+        bbox_copy(bbox, &tbbox);
+    }
     determine_bbox(nref_in_bbox, ref_in_bbox, &tbbox);
     bbox_copy(&tbbox, &fit.bbox);
 
@@ -1627,7 +1737,7 @@ geomap(
     /* Compute the fitted x and y values */
     if (geoeval(
                 &sx1, &sy1, &sx2, &sy2, has_sx2, has_sy2, ninput_in_bbox,
-                ref_in_bbox, xfit, yfit, error)) goto exit;
+                ref_in_bbox, &fit.basis, xfit, yfit, error)) goto exit;
 
     if (geo_get_results(
                 &fit, &sx1, &sy1, &sx2, &sy2, has_sx2, has_sy2, result,
@@ -1689,6 +1799,387 @@ geomap(
     surface_free(&sy1);
     surface_free(&sx2);
     surface_free(&sy2);
+    geomap_fit_free(&fit);
+
+    return status;
+}
+
+/* Order selection
+
+   The candidate surfaces of a given xterms setting are nested: going
+   from order o-1 to order o only appends basis functions.  The normal
+   matrix of the largest candidate is therefore accumulated once, and
+   each chain of candidates is solved by growing a Cholesky factor one
+   column at a time (bordering).  The residual sum of squares of every
+   order falls out of the forward substitution, so each candidate
+   costs only the new columns of the factor.
+
+   The column spaces of the power series, Legendre and Chebyshev bases
+   are the same for these (downward closed) sets of terms, so the
+   selection is always done in the well-conditioned Legendre basis
+   over the normalized bbox, whatever function is fit afterward.
+*/
+
+#define GEOMAP_ORDER_SINGULAR_TOLERANCE 1e-10
+
+/* Index of the basis function x^k y^j in the accumulated normal
+   matrix */
+#define GEOMAP_ORDER_COLUMN(k, j, max_order) ((j) * (max_order) + (k))
+
+/* Append the columns that take the candidate of the given xterms
+   from order - 1 to order.  Returns the new number of columns. */
+static size_t
+geomap_order_block(
+        const xterms_e xterms,
+        const size_t order,
+        const size_t max_order,
+        size_t ncols,
+        size_t* const cols) {
+
+    const size_t o = order - 1;
+    size_t       k = 0;
+
+    switch (xterms) {
+    case xterms_none:
+        cols[ncols++] = GEOMAP_ORDER_COLUMN(o, 0, max_order);
+        if (o > 0) {
+            cols[ncols++] = GEOMAP_ORDER_COLUMN(0, o, max_order);
+        }
+        break;
+
+    case xterms_half:
+        for (k = 0; k <= o; ++k) {
+            cols[ncols++] = GEOMAP_ORDER_COLUMN(o - k, k, max_order);
+        }
+        break;
+
+    default:
+        for (k = 0; k < o; ++k) {
+            cols[ncols++] = GEOMAP_ORDER_COLUMN(o, k, max_order);
+            cols[ncols++] = GEOMAP_ORDER_COLUMN(k, o, max_order);
+        }
+        cols[ncols++] = GEOMAP_ORDER_COLUMN(o, o, max_order);
+        break;
+    }
+
+    return ncols;
+}
+
+/* Pick the order and xterms of one axis of the fit by minimizing the
+   Bayesian information criterion, n ln(RSS / n) + p ln(n). */
+static int
+geomap_select_axis_order(
+        const size_t ncoord,
+        const coord_t* const ref,
+        const double* const z,
+        const bbox_t* const bbox,
+        const size_t max_order,
+        /* Output */
+        size_t* const order,
+        xterms_e* const xterms,
+        stimage_error_t* const error) {
+
+    const size_t ncol     = max_order * max_order;
+    double*      xbasis   = NULL; /* [max_order * ncoord] */
+    double*      ybasis   = NULL; /* [max_order * ncoord] */
+    double*      b        = NULL; /* [ncol] */
+    double*      matrix   = NULL; /* [ncol * ncol], upper triangle */
+    double*      vector   = NULL; /* [ncol] */
+    double*      fact     = NULL; /* [ncol * ncol], lower triangle */
+    double*      y        = NULL; /* [ncol] */
+    size_t*      cols     = NULL; /* [ncol] */
+    double       lmatrix[3 * 3];
+    double       lvector[3];
+    double       lcoeff[3];
+    double       zz       = 0.0;
+    double       rr       = 0.0;
+    double       rss      = 0.0;
+    double       floor    = 0.0;
+    double       r        = 0.0;
+    double       sum      = 0.0;
+    double       bic      = 0.0;
+    double       best_bic = 0.0;
+    double       k1x, k2x, k1y, k2y;
+    xterms_e     chain;
+    size_t       o, p, q, begin, i, j, c, d;
+    int          singular;
+    int          status   = 1;
+
+    assert(ref);
+    assert(z);
+    assert(bbox);
+    assert(order);
+    assert(xterms);
+    assert(error);
+
+    /* The linear fit is the fallback if no higher order is supported
+       by the data */
+    *order = 2;
+    *xterms = xterms_none;
+
+    if (ncoord <= 3) {
+        return 0;
+    }
+
+    xbasis = malloc_with_error(max_order * ncoord * sizeof(double), error);
+    if (xbasis == NULL) goto exit;
+    ybasis = malloc_with_error(max_order * ncoord * sizeof(double), error);
+    if (ybasis == NULL) goto exit;
+    b = malloc_with_error(ncol * sizeof(double), error);
+    if (b == NULL) goto exit;
+    matrix = calloc_with_error(ncol * ncol, sizeof(double), error);
+    if (matrix == NULL) goto exit;
+    vector = calloc_with_error(ncol, sizeof(double), error);
+    if (vector == NULL) goto exit;
+    fact = malloc_with_error(ncol * ncol * sizeof(double), error);
+    if (fact == NULL) goto exit;
+    y = malloc_with_error(ncol * sizeof(double), error);
+    if (y == NULL) goto exit;
+    cols = malloc_with_error(ncol * sizeof(size_t), error);
+    if (cols == NULL) goto exit;
+
+    k1x = -(bbox->max.x + bbox->min.x) / 2.0;
+    k2x = 2.0 / (bbox->max.x - bbox->min.x);
+    k1y = -(bbox->max.y + bbox->min.y) / 2.0;
+    k2y = 2.0 / (bbox->max.y - bbox->min.y);
+    if (basis_legendre(
+                ncoord, 0, ref, (int)max_order, k1x, k2x, xbasis,
+                error)) goto exit;
+    if (basis_legendre(
+                ncoord, 1, ref, (int)max_order, k1y, k2y, ybasis,
+                error)) goto exit;
+
+    /* Take out the linear fit first, so the residual sums of squares
+       below are not differences of nearly equal large numbers */
+    for (i = 0; i < 9; ++i) {
+        lmatrix[i] = 0.0;
+    }
+    for (i = 0; i < 3; ++i) {
+        lvector[i] = 0.0;
+    }
+    for (i = 0; i < ncoord; ++i) {
+        b[0] = 1.0;
+        b[1] = xbasis[ncoord + i];
+        b[2] = ybasis[ncoord + i];
+        for (c = 0; c < 3; ++c) {
+            lvector[c] += b[c] * z[i];
+            for (d = c; d < 3; ++d) {
+                lmatrix[c * 3 + d] += b[c] * b[d];
+            }
+        }
+        zz += z[i] * z[i];
+    }
+
+    for (c = 0; c < 3; ++c) {
+        for (q = 0; q < c; ++q) {
+            sum = lmatrix[q * 3 + c];
+            for (p = 0; p < q; ++p) {
+                sum -= lmatrix[c * 3 + p] * lmatrix[q * 3 + p];
+            }
+            lmatrix[c * 3 + q] = sum / lmatrix[q * 3 + q];
+        }
+        sum = lmatrix[c * 3 + c];
+        for (p = 0; p < c; ++p) {
+            sum -= lmatrix[c * 3 + p] * lmatrix[c * 3 + p];
+        }
+        if (sum <= 0.0) {
+            /* Degenerate reference coordinates: leave it to the fit
+               to report */
+            status = 0;
+            goto exit;
+        }
+        lmatrix[c * 3 + c] = sqrt(sum);
+        sum = lvector[c];
+        for (p = 0; p < c; ++p) {
+            sum -= lmatrix[c * 3 + p] * lcoeff[p];
+        }
+        lcoeff[c] = sum / lmatrix[c * 3 + c];
+    }
+    for (c = 3; c-- > 0; ) {
+        sum = lcoeff[c];
+        for (p = c + 1; p < 3; ++p) {
+            sum -= lmatrix[p * 3 + c] * lcoeff[p];
+        }
+        lcoeff[c] = sum / lmatrix[c * 3 + c];
+    }
+
+    /* Accumulate the normal equations of the largest candidate on the
+       linear residuals */
+    for (i = 0; i < ncoord; ++i) {
+        r = z[i] - (lcoeff[0] +
+                    lcoeff[1] * xbasis[ncoord + i] +
+                    lcoeff[2] * ybasis[ncoord + i]);
+        rr += r * r;
+        for (j = 0; j < max_order; ++j) {
+            for (o = 0; o < max_order; ++o) {
+                b[GEOMAP_ORDER_COLUMN(o, j, max_order)] =
+                    xbasis[o * ncoord + i] * ybasis[j * ncoord + i];
+            }
+        }
+        for (c = 0; c < ncol; ++c) {
+            vector[c] += b[c] * r;
+            for (d = c; d < ncol; ++d) {
+                matrix[c * ncol + d] += b[c] * b[d];
+            }
+        }
+    }
+
+    /* Residuals below the rounding of the input carry no information */
+    floor = DBL_EPSILON * zz;
+
+    best_bic = MAX_DOUBLE;
+    for (chain = xterms_none; chain < xterms_LAST; ++chain) {
+        p = 0;
+        rss = rr;
+        singular = 0;
+        for (o = 1; o <= max_order && !singular; ++o) {
+            begin = p;
+            p = geomap_order_block(chain, o, max_order, p, cols);
+            if (p >= ncoord) {
+                break;
+            }
+
+            /* Border the factor with the new columns */
+            for (q = begin; q < p; ++q) {
+                c = cols[q];
+                for (j = 0; j < q; ++j) {
+                    d = cols[j];
+                    sum = matrix[MIN(c, d) * ncol + MAX(c, d)];
+                    for (i = 0; i < j; ++i) {
+                        sum -= fact[q * ncol + i] * fact[j * ncol + i];
+                    }
+                    fact[q * ncol + j] = sum / fact[j * ncol + j];
+                }
+                sum = matrix[c * ncol + c];
+                for (i = 0; i < q; ++i) {
+                    sum -= fact[q * ncol + i] * fact[q * ncol + i];
+                }
+                if (sum <= GEOMAP_ORDER_SINGULAR_TOLERANCE *
+                    matrix[c * ncol + c]) {
+                    singular = 1;
+                    break;
+                }
+                fact[q * ncol + q] = sqrt(sum);
+
+                sum = vector[c];
+                for (i = 0; i < q; ++i) {
+                    sum -= fact[q * ncol + i] * y[i];
+                }
+                y[q] = sum / fact[q * ncol + q];
+                rss -= y[q] * y[q];
+            }
+
+            /* The linear fit is the smallest candidate */
+            if (singular || o < 2) {
+                continue;
+            }
+
+            bic = (double)ncoord * log(MAX(rss, floor) / (double)ncoord) +
+                (double)p * log((double)ncoord);
+            if (bic < best_bic) {
+                best_bic = bic;
+                *order = o;
+                *xterms = chain;
+            }
+        }
+    }
+
+    status = 0;
+
+ exit:
+
+    free(xbasis);
+    free(ybasis);
+    free(b);
+    free(matrix);
+    free(vector);
+    free(fact);
+    free(y);
+    free(cols);
+
+    return status;
+}
+
+int
+geomap_select_order(
+        const size_t ninput, const coord_t* const input,
+        const size_t nref, const coord_t* const ref,
+        const bbox_t* const bbox,
+        const size_t max_order,
+        /* Output */
+        size_t* const xorder,
+        xterms_e* const xxterms,
+        size_t* const yorder,
+        xterms_e* const yxterms,
+        stimage_error_t* const error) {
+
+    size_t   ncoord_in_bbox = 0;
+    coord_t* input_in_bbox  = NULL;
+    coord_t* ref_in_bbox    = NULL;
+    double*  z              = NULL;
+    bbox_t   tbbox;
+    size_t   i              = 0;
+    int      status         = 1;
+
+    assert(input);
+    assert(ref);
+    assert(xorder);
+    assert(xxterms);
+    assert(yorder);
+    assert(yxterms);
+    assert(error);
+
+    if (ninput != nref) {
+        stimage_error_set_message(
+            error, "Must have the same number of input and reference coordinates.");
+        goto exit;
+    }
+
+    if (max_order < 2) {
+        stimage_error_set_message(error, "max_order must be at least 2");
+        goto exit;
+    }
+
+    if (geomap_limit_to_bbox(
+                ninput, input, ref, bbox, &ncoord_in_bbox, &input_in_bbox,
+                &ref_in_bbox, error)) goto exit;
+
+    if (bbox == NULL) {
+        bbox_init(&tbbox);
+    } else {
+        bbox_copy(bbox, &tbbox);
+    }
+    determine_bbox(ncoord_in_bbox, ref_in_bbox, &tbbox);
+    bbox_make_nonsingular(&tbbox);
+
+    z = malloc_with_error(ncoord_in_bbox * sizeof(double), error);
+    if (z == NULL) goto exit;
+
+    for (i = 0; i < ncoord_in_bbox; ++i) {
+        z[i] = input_in_bbox[i].x;
+    }
+    if (geomap_select_axis_order(
+                ncoord_in_bbox, ref_in_bbox, z, &tbbox, max_order,
+                xorder, xxterms, error)) goto exit;
+
+    for (i = 0; i < ncoord_in_bbox; ++i) {
+        z[i] = input_in_bbox[i].y;
+    }
+    if (geomap_select_axis_order(
+                ncoord_in_bbox, ref_in_bbox, z, &tbbox, max_order,
+                yorder, yxterms, error)) goto exit;
+
+    status = 0;
+
+ exit:
+
+    if (input_in_bbox != input) {
+        free(input_in_bbox);
+    }
+    if (ref_in_bbox != ref) {
+        free(ref_in_bbox);
+    }
+    free(z);
 
     return status;
 }
@@ -1697,10 +2188,15 @@ void
 geomap_result_init(
         geomap_result_t* const r) {
 
+    bbox_init(&r->bbox);
     r->xcoeff = NULL;
     r->ycoeff = NULL;
     r->x2coeff = NULL;
     r->y2coeff = NULL;
+    r->ngridx = 0;
+    r->ngridy = 0;
+    r->xgrid = NULL;
+    r->ygrid = NULL;
 }
 
 void
@@ -1711,6 +2207,736 @@ geomap_result_free(
     free(r->ycoeff); r->ycoeff = NULL;
     free(r->x2coeff); r->x2coeff = NULL;
     free(r->y2coeff); r->y2coeff = NULL;
+    free(r->xgrid); r->xgrid = NULL;
+    free(r->ygrid); r->ygrid = NULL;
+}
+
+/* Rebuild the surfaces of a geomap solution.  The primary surfaces
+   are linear, except for the xyscale geometry where each axis only
+   depends on itself (see geo_fit_xy). */
+static int
+geomap_result_surfaces(
+        const geomap_result_t* const r,
+        /* Output */
+        surface_t* const sx1,
+        surface_t* const sy1,
+        surface_t* const sx2,
+        surface_t* const sy2,
+        int* const has_sx2,
+        int* const has_sy2,
+        stimage_error_t* const error) {
+
+    int xxorder1 = 2;
+    int xyorder1 = 2;
+    int yxorder1 = 2;
+    int yyorder1 = 2;
+
+    assert(r);
+    assert(sx1);
+    assert(sy1);
+    assert(sx2);
+    assert(sy2);
+    assert(has_sx2);
+    assert(has_sy2);
+    assert(error);
+
+    if (r->fit_geometry == geomap_fit_xyscale) {
+        xyorder1 = 1;
+        yxorder1 = 1;
+    }
+
+    if (surface_init(
+                sx1, r->function, xxorder1, xyorder1, xterms_none, &r->bbox,
+                error) ||
+        surface_init(
+                sy1, r->function, yxorder1, yyorder1, xterms_none, &r->bbox,
+                error)) return 1;
+
+    *has_sx2 = r->nx2coeff > 0;
+    *has_sy2 = r->ny2coeff > 0;
+
+    if (*has_sx2 &&
+        surface_init(
+                sx2, r->function, (int)r->xxorder, (int)r->xyorder,
+                r->xxterms, &r->bbox, error)) return 1;
+
+    if (*has_sy2 &&
+        surface_init(
+                sy2, r->function, (int)r->yxorder, (int)r->yyorder,
+                r->yxterms, &r->bbox, error)) return 1;
+
+    if (sx1->ncoeff != r->nxcoeff ||
+        sy1->ncoeff != r->nycoeff ||
+        (*has_sx2 && sx2->ncoeff != r->nx2coeff) ||
+        (*has_sy2 && sy2->ncoeff != r->ny2coeff)) {
+        stimage_error_set_message(
+                error,
+                "The number of coefficients does not match the orders of "
+                "the geomap solution");
+        return 1;
+    }
+
+    memcpy(sx1->coeff, r->xcoeff, r->nxcoeff * sizeof(double));
+    memcpy(sy1->coeff, r->ycoeff, r->nycoeff * sizeof(double));
+    if (*has_sx2) {
+        memcpy(sx2->coeff, r->x2coeff, r->nx2coeff * sizeof(double));
+    }
+    if (*has_sy2) {
+        memcpy(sy2->coeff, r->y2coeff, r->ny2coeff * sizeof(double));
+    }
+
+    return 0;
+}
+
+/* Set the coefficients of a linear surface so that it evaluates to
+   value + dx * (x - origin.x) + dy * (y - origin.y).  The terms the
+   surface does not have must be zero. */
+static void
+geomap_linear_surface(
+        const coord_t* const origin,
+        const double value,
+        const double dx,
+        const double dy,
+        surface_t* const s) {
+
+    coord_t mid  = {0.0, 0.0};
+    coord_t half = {1.0, 1.0};
+
+    assert(origin);
+    assert(s);
+    assert(s->coeff);
+
+    if (s->type != surface_type_polynomial) {
+        mid.x = (s->bbox.max.x + s->bbox.min.x) / 2.0;
+        mid.y = (s->bbox.max.y + s->bbox.min.y) / 2.0;
+        half.x = (s->bbox.max.x - s->bbox.min.x) / 2.0;
+        half.y = (s->bbox.max.y - s->bbox.min.y) / 2.0;
+    }
+
+    s->coeff[0] = value + dx * (mid.x - origin->x) + dy * (mid.y - origin->y);
+    if (s->nxcoeff > 1) {
+        s->coeff[1] = dx * half.x;
+    }
+    if (s->nycoeff > 1) {
+        s->coeff[s->nxcoeff] = dy * half.y;
+    }
+}
+
+int
+geomap_result_from_linear(
+        const geomap_fit_e fit_geometry,
+        const surface_type_e function,
+        const bbox_t* const bbox,
+        const coord_t* const origin,
+        const coord_t* const value,
+        const double* const matrix,
+        /* Output */
+        geomap_result_t* const result,
+        stimage_error_t* const error) {
+
+    surface_t sx1, sy1;
+    int       xyorder1 = 2;
+    int       yxorder1 = 2;
+    int       status   = 1;
+
+    assert(bbox);
+    assert(origin);
+    assert(value);
+    assert(matrix);
+    assert(result);
+    assert(error);
+
+    surface_new(&sx1);
+    surface_new(&sy1);
+    geomap_result_init(result);
+
+    result->fit_geometry = fit_geometry;
+    result->function = function;
+    result->xxorder = result->xyorder = 2;
+    result->yxorder = result->yyorder = 2;
+    result->xxterms = result->yxterms = xterms_none;
+    result->rms.x = result->rms.y = 0.0;
+    result->mean_ref.x = result->mean_ref.y = 0.0;
+    result->mean_input.x = result->mean_input.y = 0.0;
+    result->nxcoeff = result->nycoeff = 0;
+    result->nx2coeff = result->ny2coeff = 0;
+
+    bbox_copy(bbox, &result->bbox);
+    bbox_make_nonsingular(&result->bbox);
+
+    /* The same surfaces as geomap_result_surfaces rebuilds */
+    if (fit_geometry == geomap_fit_xyscale) {
+        if (matrix[1] != 0.0 || matrix[2] != 0.0) {
+            stimage_error_set_message(
+                    error, "The xyscale geometry has no cross-axis terms");
+            goto exit;
+        }
+        xyorder1 = 1;
+        yxorder1 = 1;
+    }
+
+    if (surface_init(
+                &sx1, function, 2, xyorder1, xterms_none, &result->bbox,
+                error) ||
+        surface_init(
+                &sy1, function, yxorder1, 2, xterms_none, &result->bbox,
+                error)) goto exit;
+
+    geomap_linear_surface(origin, value->x, matrix[0], matrix[1], &sx1);
+    geomap_linear_surface(origin, value->y, matrix[2], matrix[3], &sy1);
+
+    if (geo_get_coeff(
+                &sx1, &sy1, &result->shift, &result->mag, &result->rotation,
+                error)) goto exit;
+
+    result->xcoeff = malloc_with_error(sx1.ncoeff * sizeof(double), error);
+    if (result->xcoeff == NULL) goto exit;
+    result->nxcoeff = sx1.ncoeff;
+    memcpy(result->xcoeff, sx1.coeff, sx1.ncoeff * sizeof(double));
+
+    result->ycoeff = malloc_with_error(sy1.ncoeff * sizeof(double), error);
+    if (result->ycoeff == NULL) goto exit;
+    result->nycoeff = sy1.ncoeff;
+    memcpy(result->ycoeff, sy1.coeff, sy1.ncoeff * sizeof(double));
+
+    status = 0;
+
+ exit:
+    if (status != 0) {
+        geomap_result_free(result);
+        result->nxcoeff = result->nycoeff = 0;
+    }
+    surface_free(&sx1);
+    surface_free(&sy1);
+
+    return status;
+}
+
+int
+geomap_result_eval(
+        const geomap_result_t* const result,
+        const size_t ncoord,
+        const coord_t* const ref,
+        /* Output */
+        coord_t* const input,
+        stimage_error_t* const error) {
+
+    surface_t             sx1;
+    surface_t             sy1;
+    surface_t             sx2;
+    surface_t             sy2;
+    int                   has_sx2 = 0;
+    int                   has_sy2 = 0;
+    double*               xfit    = NULL;
+    double*               yfit    = NULL;
+    size_t                i       = 0;
+    int                   status  = 1;
+
+    assert(result);
+    assert(ref);
+    assert(input);
+    assert(error);
+
+    surface_new(&sx1);
+    surface_new(&sy1);
+    surface_new(&sx2);
+    surface_new(&sy2);
+
+    if (geomap_result_surfaces(
+                result, &sx1, &sy1, &sx2, &sy2, &has_sx2, &has_sy2,
+                error)) goto exit;
+
+    xfit = malloc_with_error(MAX(ncoord, 1) * sizeof(double), error);
+    if (xfit == NULL) goto exit;
+    yfit = malloc_with_error(MAX(ncoord, 1) * sizeof(double), error);
+    if (yfit == NULL) goto exit;
+
+    if (geoeval(
+                &sx1, &sy1, &sx2, &sy2, has_sx2, has_sy2, ncoord, ref,
+                NULL, xfit, yfit, error) ||
+        geomap_grid_eval(result, ncoord, ref, xfit, yfit, error)) goto exit;
+
+    for (i = 0; i < ncoord; ++i) {
+        input[i].x = xfit[i];
+        input[i].y = yfit[i];
+    }
+
+    status = 0;
+
+ exit:
+    free(xfit);
+    free(yfit);
+    surface_free(&sx1);
+    surface_free(&sy1);
+    surface_free(&sx2);
+    surface_free(&sy2);
+
+    return status;
+}
+
+#define GEOMAP_INVERT_MAXITER 50
+#define GEOMAP_INVERT_TOLERANCE 1e-10
+
+int
+geomap_result_invert(
+        const geomap_result_t* const result,
+        const size_t ncoord,
+        const coord_t* const input,
+        /* Output */
+        coord_t* const ref,
+        size_t* const nunconverged,
+        stimage_error_t* const error) {
+
+    surface_t             sx1;
+    surface_t             sy1;
+    surface_t             sx2;
+    surface_t             sy2;
+    int                   has_sx2 = 0;
+    int                   has_sy2 = 0;
+    coord_t               center;
+    coord_t               half;
+    coord_t               probe[3];
+    double                fx[3];
+    double                fy[3];
+    double                a, b, c, d, det;
+    double                dx, dy;
+    coord_t               step;
+    double*               xfit    = NULL;
+    double*               yfit    = NULL;
+    size_t*               active  = NULL;
+    coord_t*              aref    = NULL;
+    size_t                nactive = 0;
+    size_t                nkeep   = 0;
+    size_t                nfailed = 0;
+    size_t                iter    = 0;
+    size_t                i       = 0;
+    size_t                j       = 0;
+    int                   status  = 1;
+
+    assert(result);
+    assert(input);
+    assert(ref);
+    assert(nunconverged);
+    assert(error);
+
+    *nunconverged = 0;
+
+    surface_new(&sx1);
+    surface_new(&sy1);
+    surface_new(&sx2);
+    surface_new(&sy2);
+
+    if (geomap_result_surfaces(
+                result, &sx1, &sy1, &sx2, &sy2, &has_sx2, &has_sy2,
+                error)) goto exit;
+
+    /* The primary surfaces are linear, so three points give their
+       matrix exactly */
+    center.x = (result->bbox.max.x + result->bbox.min.x) / 2.0;
+    center.y = (result->bbox.max.y + result->bbox.min.y) / 2.0;
+    half.x = (result->bbox.max.x - result->bbox.min.x) / 2.0;
+    half.y = (result->bbox.max.y - result->bbox.min.y) / 2.0;
+    probe[0] = center;
+    probe[1].x = center.x + half.x;
+    probe[1].y = center.y;
+    probe[2].x = center.x;
+    probe[2].y = center.y + half.y;
+
+    if (surface_vector(&sx1, 3, probe, fx, error) ||
+        surface_vector(&sy1, 3, probe, fy, error)) goto exit;
+
+    a = (fx[1] - fx[0]) / half.x;
+    b = (fx[2] - fx[0]) / half.y;
+    c = (fy[1] - fy[0]) / half.x;
+    d = (fy[2] - fy[0]) / half.y;
+    det = a * d - b * c;
+    if (det == 0.0 || !isfinite(det)) {
+        stimage_error_set_message(
+                error, "The linear part of the geomap solution is singular");
+        goto exit;
+    }
+
+    /* Invert the linear part */
+    for (i = 0; i < ncoord; ++i) {
+        dx = input[i].x - fx[0];
+        dy = input[i].y - fy[0];
+        ref[i].x = center.x + (d * dx - b * dy) / det;
+        ref[i].y = center.y + (a * dy - c * dx) / det;
+    }
+
+    if (!has_sx2 && !has_sy2 && result->ngridx == 0) {
+        status = 0;
+        goto exit;
+    }
+
+    xfit = malloc_with_error(MAX(ncoord, 1) * sizeof(double), error);
+    if (xfit == NULL) goto exit;
+    yfit = malloc_with_error(MAX(ncoord, 1) * sizeof(double), error);
+    if (yfit == NULL) goto exit;
+
+    /* The points that have not converged yet, and their current
+       estimates, packed so that each iteration only evaluates those */
+    active = malloc_with_error(MAX(ncoord, 1) * sizeof(size_t), error);
+    if (active == NULL) goto exit;
+    aref = malloc_with_error(MAX(ncoord, 1) * sizeof(coord_t), error);
+    if (aref == NULL) goto exit;
+
+    for (i = 0; i < ncoord; ++i) {
+        active[i] = i;
+        aref[i] = ref[i];
+    }
+    nactive = ncoord;
+
+    /* Remove the distortion terms */
+    for (iter = 0; iter < GEOMAP_INVERT_MAXITER && nactive > 0; ++iter) {
+        if (geoeval(
+                    &sx1, &sy1, &sx2, &sy2, has_sx2, has_sy2, nactive, aref,
+                    NULL, xfit, yfit, error) ||
+            geomap_grid_eval(
+                    result, nactive, aref, xfit, yfit, error)) goto exit;
+
+        nkeep = 0;
+        for (j = 0; j < nactive; ++j) {
+            i = active[j];
+
+            dx = input[i].x - xfit[j];
+            dy = input[i].y - yfit[j];
+            step.x = (d * dx - b * dy) / det;
+            step.y = (a * dy - c * dx) / det;
+
+            /* Leave the point at its last finite estimate */
+            if (!isfinite(step.x) || !isfinite(step.y)) {
+                ++nfailed;
+                continue;
+            }
+
+            ref[i].x += step.x;
+            ref[i].y += step.y;
+
+            if (fabs(step.x) >
+                    GEOMAP_INVERT_TOLERANCE * (1.0 + fabs(ref[i].x)) ||
+                fabs(step.y) >
+                    GEOMAP_INVERT_TOLERANCE * (1.0 + fabs(ref[i].y))) {
+                active[nkeep] = i;
+                aref[nkeep] = ref[i];
+                ++nkeep;
+            }
+        }
+        nactive = nkeep;
+    }
+
+    *nunconverged = nfailed + nactive;
+
+    status = 0;
+
+ exit:
+    free(xfit);
+    free(yfit);
+    free(active);
+    free(aref);
+    surface_free(&sx1);
+    surface_free(&sy1);
+    surface_free(&sx2);
+    surface_free(&sy2);
+
+    return status;
+}
+
+/* The number of doubles between the header and the coefficients */
+#define GEOMAP_RESULT_NFIXED (4 + 6 * 2)
+
+size_t
+geomap_result_packed_size(
+        const geomap_result_t* const result) {
+
+    assert(result);
+
+    return sizeof(geomap_result_header_t) +
+        (GEOMAP_RESULT_NFIXED + result->nxcoeff + result->nycoeff +
+         result->nx2coeff + result->ny2coeff +
+         2 * result->ngridx * result->ngridy) * sizeof(double);
+}
+
+static double*
+geomap_result_pack_coord(
+        double* const p,
+        const coord_t* const c) {
+
+    p[0] = c->x;
+    p[1] = c->y;
+    return p + 2;
+}
+
+static double*
+geomap_result_pack_coeff(
+        double* const p,
+        const size_t n,
+        const double* const coeff) {
+
+    if (n > 0) {
+        memcpy(p, coeff, n * sizeof(double));
+    }
+    return p + n;
+}
+
+void
+geomap_result_pack(
+        const geomap_result_t* const result,
+        void* const buffer) {
+
+    geomap_result_header_t* header = (geomap_result_header_t*)buffer;
+    double*                 p;
+
+    assert(result);
+    assert(buffer);
+    assert(((size_t)buffer) % 8 == 0);
+
+    memset(header, 0, sizeof(geomap_result_header_t));
+    memcpy(header->magic, GEOMAP_RESULT_MAGIC, sizeof(header->magic));
+    header->version      = GEOMAP_RESULT_VERSION;
+    header->byteorder    = GEOMAP_RESULT_BYTEORDER;
+    header->header_size  = sizeof(geomap_result_header_t);
+    header->size         = geomap_result_packed_size(result);
+    header->fit_geometry = (int32_t)result->fit_geometry;
+    header->function     = (int32_t)result->function;
+    header->xxterms      = (int32_t)result->xxterms;
+    header->yxterms      = (int32_t)result->yxterms;
+    header->xxorder      = result->xxorder;
+    header->xyorder      = result->xyorder;
+    header->yxorder      = result->yxorder;
+    header->yyorder      = result->yyorder;
+    header->nxcoeff      = result->nxcoeff;
+    header->nycoeff      = result->nycoeff;
+    header->nx2coeff     = result->nx2coeff;
+    header->ny2coeff     = result->ny2coeff;
+    header->ngridx       = result->ngridx;
+    header->ngridy       = result->ngridy;
+
+    p = (double*)(header + 1);
+    p = geomap_result_pack_coord(p, &result->bbox.min);
+    p = geomap_result_pack_coord(p, &result->bbox.max);
+    p = geomap_result_pack_coord(p, &result->rms);
+    p = geomap_result_pack_coord(p, &result->mean_ref);
+    p = geomap_result_pack_coord(p, &result->mean_input);
+    p = geomap_result_pack_coord(p, &result->shift);
+    p = geomap_result_pack_coord(p, &result->mag);
+    p = geomap_result_pack_coord(p, &result->rotation);
+    p = geomap_result_pack_coeff(p, result->nxcoeff, result->xcoeff);
+    p = geomap_result_pack_coeff(p, result->nycoeff, result->ycoeff);
+    p = geomap_result_pack_coeff(p, result->nx2coeff, result->x2coeff);
+    p = geomap_result_pack_coeff(p, result->ny2coeff, result->y2coeff);
+    p = geomap_result_pack_coeff(
+            p, result->ngridx * result->ngridy, result->xgrid);
+    geomap_result_pack_coeff(
+            p, result->ngridx * result->ngridy, result->ygrid);
+}
+
+int
+geomap_result_view(
+        const size_t size,
+        const void* const buffer,
+        geomap_result_view_t* const view,
+        stimage_error_t* const error) {
+
+    const geomap_result_header_t* header;
+    const double*                 p;
+    uint64_t                      header_size;
+    uint64_t                      ndouble;
+    uint64_t                      ngrid;
+
+    assert(view);
+    assert(error);
+
+    memset(view, 0, sizeof(geomap_result_view_t));
+
+    if (buffer == NULL || size < GEOMAP_RESULT_HEADER_SIZE_V1) {
+        stimage_error_set_message(
+            error, "Buffer is too small to be a geomap result");
+        return 1;
+    }
+
+    if (((size_t)buffer) % 8 != 0) {
+        stimage_error_set_message(error, "Geomap result buffer is not aligned");
+        return 1;
+    }
+
+    header = (const geomap_result_header_t*)buffer;
+
+    if (memcmp(header->magic, GEOMAP_RESULT_MAGIC,
+               sizeof(header->magic)) != 0) {
+        stimage_error_set_message(error, "Not a geomap result");
+        return 1;
+    }
+
+    if (header->byteorder != GEOMAP_RESULT_BYTEORDER) {
+        stimage_error_set_message(
+            error,
+            "Geomap result was written on a machine with a different byte "
+            "order");
+        return 1;
+    }
+
+    if (header->version == 1) {
+        header_size = GEOMAP_RESULT_HEADER_SIZE_V1;
+    } else if (header->version == GEOMAP_RESULT_VERSION) {
+        header_size = sizeof(geomap_result_header_t);
+    } else {
+        stimage_error_format_message(
+            error, "Unsupported geomap result version %u (expected %d)",
+            (unsigned int)header->version, GEOMAP_RESULT_VERSION);
+        return 1;
+    }
+
+    if (header->header_size != header_size || size < header_size) {
+        stimage_error_set_message(error, "Geomap result is corrupt");
+        return 1;
+    }
+
+    if (header->version >= 2) {
+        view->ngridx = header->ngridx;
+        view->ngridy = header->ngridy;
+    }
+
+    /* Check the counts one at a time, so the sum can't overflow */
+    ndouble = (size - header_size) / sizeof(double);
+    if (header->size > size ||
+        header->fit_geometry < 0 ||
+        header->fit_geometry >= geomap_fit_LAST ||
+        header->function < 0 ||
+        header->function >= surface_type_LAST ||
+        header->xxterms < 0 || header->xxterms >= xterms_LAST ||
+        header->yxterms < 0 || header->yxterms >= xterms_LAST ||
+        ndouble < GEOMAP_RESULT_NFIXED ||
+        header->nxcoeff > ndouble - GEOMAP_RESULT_NFIXED ||
+        header->nycoeff >
+            ndouble - GEOMAP_RESULT_NFIXED - header->nxcoeff ||
+        header->nx2coeff >
+            ndouble - GEOMAP_RESULT_NFIXED - header->nxcoeff -
+            header->nycoeff ||
+        header->ny2coeff >
+            ndouble - GEOMAP_RESULT_NFIXED - header->nxcoeff -
+            header->nycoeff - header->nx2coeff) {
+        stimage_error_set_message(error, "Geomap result is corrupt");
+        return 1;
+    }
+
+    ndouble -= GEOMAP_RESULT_NFIXED + header->nxcoeff + header->nycoeff +
+        header->nx2coeff + header->ny2coeff;
+    if ((view->ngridx == 0) != (view->ngridy == 0) ||
+        (view->ngridx != 0 &&
+         view->ngridy > ndouble / 2 / view->ngridx)) {
+        stimage_error_set_message(error, "Geomap result is corrupt");
+        return 1;
+    }
+    ngrid = view->ngridx * view->ngridy;
+
+    p = (const double*)((const char*)buffer + header_size);
+    view->header     = header;
+    view->bbox       = p; p += 4;
+    view->rms        = p; p += 2;
+    view->mean_ref   = p; p += 2;
+    view->mean_input = p; p += 2;
+    view->shift      = p; p += 2;
+    view->mag        = p; p += 2;
+    view->rotation   = p; p += 2;
+    view->xcoeff     = p; p += header->nxcoeff;
+    view->ycoeff     = p; p += header->nycoeff;
+    view->x2coeff    = p; p += header->nx2coeff;
+    view->y2coeff    = p; p += header->ny2coeff;
+    view->xgrid      = p; p += ngrid;
+    view->ygrid      = p;
+
+    return 0;
+}
+
+static int
+geomap_result_unpack_coeff(
+        const size_t n,
+        const double* const coeff,
+        double** const out,
+        stimage_error_t* const error) {
+
+    *out = NULL;
+    if (n == 0) {
+        return 0;
+    }
+
+    *out = malloc_with_error(n * sizeof(double), error);
+    if (*out == NULL) return 1;
+    memcpy(*out, coeff, n * sizeof(double));
+
+    return 0;
+}
+
+int
+geomap_result_unpack(
+        const geomap_result_view_t* const view,
+        geomap_result_t* const result,
+        stimage_error_t* const error) {
+
+    const geomap_result_header_t* header;
+
+    assert(view);
+    assert(view->header);
+    assert(result);
+    assert(error);
+
+    header = view->header;
+
+    geomap_result_init(result);
+
+    result->fit_geometry = (geomap_fit_e)header->fit_geometry;
+    result->function     = (surface_type_e)header->function;
+    result->xxterms      = (xterms_e)header->xxterms;
+    result->yxterms      = (xterms_e)header->yxterms;
+    result->xxorder      = header->xxorder;
+    result->xyorder      = header->xyorder;
+    result->yxorder      = header->yxorder;
+    result->yyorder      = header->yyorder;
+
+    result->bbox.min.x   = view->bbox[0];
+    result->bbox.min.y   = view->bbox[1];
+    result->bbox.max.x   = view->bbox[2];
+    result->bbox.max.y   = view->bbox[3];
+    result->rms.x        = view->rms[0];
+    result->rms.y        = view->rms[1];
+    result->mean_ref.x   = view->mean_ref[0];
+    result->mean_ref.y   = view->mean_ref[1];
+    result->mean_input.x = view->mean_input[0];
+    result->mean_input.y = view->mean_input[1];
+    result->shift.x      = view->shift[0];
+    result->shift.y      = view->shift[1];
+    result->mag.x        = view->mag[0];
+    result->mag.y        = view->mag[1];
+    result->rotation.x   = view->rotation[0];
+    result->rotation.y   = view->rotation[1];
+
+    result->nxcoeff  = header->nxcoeff;
+    result->nycoeff  = header->nycoeff;
+    result->nx2coeff = header->nx2coeff;
+    result->ny2coeff = header->ny2coeff;
+    result->ngridx   = view->ngridx;
+    result->ngridy   = view->ngridy;
+
+    if (geomap_result_unpack_coeff(
+                result->nxcoeff, view->xcoeff, &result->xcoeff, error) ||
+        geomap_result_unpack_coeff(
+                result->nycoeff, view->ycoeff, &result->ycoeff, error) ||
+        geomap_result_unpack_coeff(
+                result->nx2coeff, view->x2coeff, &result->x2coeff, error) ||
+        geomap_result_unpack_coeff(
+                result->ny2coeff, view->y2coeff, &result->y2coeff, error) ||
+        geomap_result_unpack_coeff(
+                result->ngridx * result->ngridy, view->xgrid, &result->xgrid,
+                error) ||
+        geomap_result_unpack_coeff(
+                result->ngridx * result->ngridy, view->ygrid, &result->ygrid,
+                error)) {
+        geomap_result_free(result);
+        return 1;
+    }
+
+    return 0;
 }
 
 void
@@ -1774,6 +3000,9 @@ geomap_result_print(
     printf("FIT RESULTS:\n");
     printf("  fit_geometry: %s\n", fit_geometry);
     printf("  function:     %s\n", function);
+    printf("  bbox:         ");
+    bbox_print(&r->bbox);
+    printf("\n");
     printf("  rms:          (%f, %f)\n", r->rms.x, r->rms.y);
     printf("  mean_ref:     (%f, %f)\n", r->mean_ref.x, r->mean_ref.y);
     printf("  mean_input:   (%f, %f)\n", r->mean_input.x, r->mean_input.y);
@@ -1809,5 +3038,9 @@ geomap_result_print(
         }
         printf("\n");
     }
+    if (r->ngridx && r->ngridy) {
+        printf("  grid:         %lu x %lu\n",
+               (unsigned long)r->ngridx, (unsigned long)r->ngridy);
+    }
     printf("\n");
 }
@@ -0,0 +1,469 @@
+/*
+Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+    1. Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+
+    2. Redistributions in binary form must reproduce the above
+      copyright notice, this list of conditions and the following
+      disclaimer in the documentation and/or other materials provided
+      with the distribution.
+
+    3. The name of AURA and its representatives may not be used to
+      endorse or promote products derived from this software without
+      specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+DAMAGE.
+*/
+
+#include <assert.h>
+#include <math.h>
+#include <stdint.h>
+#include <string.h>
+
+#include "immatch/geomap_grid.h"
+#include "surface/cholesky.h"
+
+/* The number of coefficients along each axis of the grid, past the
+   number of cells */
+#define GEOMAP_GRID_EXTRA 3
+
+/* Added to the diagonal of the normal equations, relative to their
+   mean, so that coefficients no point or penalty constrains are zero
+   rather than singular */
+#define GEOMAP_GRID_RIDGE 1e-10
+
+#define GEOMAP_GRID_PROGRESS_INTERVAL 4096
+
+typedef struct {
+    size_t  ngridx;
+    size_t  ngridy;
+    size_t  ncellx;
+    size_t  ncelly;
+    coord_t origin;
+    coord_t scale; /* Cells per unit */
+} geomap_grid_lattice_t;
+
+static int
+geomap_grid_lattice(
+        const bbox_t* const bbox,
+        const size_t ngridx,
+        const size_t ngridy,
+        /* Output */
+        geomap_grid_lattice_t* const lattice,
+        stimage_error_t* const error) {
+
+    double width  = bbox->max.x - bbox->min.x;
+    double height = bbox->max.y - bbox->min.y;
+
+    if (ngridx <= GEOMAP_GRID_EXTRA || ngridy <= GEOMAP_GRID_EXTRA) {
+        stimage_error_set_message(
+                error, "The residual grid must be at least 4x4");
+        return 1;
+    }
+
+    if (!(width > 0.0) || !(height > 0.0) ||
+        !isfinite(width) || !isfinite(height)) {
+        stimage_error_set_message(
+                error, "The bbox of a residual grid must have a finite, "
+                "non-zero area");
+        return 1;
+    }
+
+    lattice->ngridx = ngridx;
+    lattice->ngridy = ngridy;
+    lattice->ncellx = ngridx - GEOMAP_GRID_EXTRA;
+    lattice->ncelly = ngridy - GEOMAP_GRID_EXTRA;
+    lattice->origin = bbox->min;
+    lattice->scale.x = (double)lattice->ncellx / width;
+    lattice->scale.y = (double)lattice->ncelly / height;
+
+    return 0;
+}
+
+/* The cell that u, in cells from the lower edge of the grid, falls
+   in, and the weights of the four coefficients that cover it.  Points
+   off the grid are moved onto its edge. */
+static void
+geomap_grid_weights(
+        double u,
+        const size_t ncell,
+        /* Output */
+        size_t* const cell,
+        double* const w) {
+
+    double t, t2, t3, s;
+
+    if (u < 0.0) {
+        u = 0.0;
+    } else if (u > (double)ncell) {
+        u = (double)ncell;
+    }
+
+    *cell = MIN((size_t)u, ncell - 1);
+
+    t  = u - (double)*cell;
+    t2 = t * t;
+    t3 = t2 * t;
+    s  = 1.0 - t;
+
+    w[0] = s * s * s / 6.0;
+    w[1] = (3.0 * t3 - 6.0 * t2 + 4.0) / 6.0;
+    w[2] = (-3.0 * t3 + 3.0 * t2 + 3.0 * t + 1.0) / 6.0;
+    w[3] = t3 / 6.0;
+}
+
+/* The index of the first of the 16 coefficients that cover a point,
+   and their weights, with those of row b at w[4 * b].  Returns
+   non-zero if the point is NaN. */
+static int
+geomap_grid_locate(
+        const geomap_grid_lattice_t* const lattice,
+        const coord_t* const c,
+        /* Output */
+        size_t* const first,
+        double* const w) {
+
+    double wx[4];
+    double wy[4];
+    size_t cellx, celly;
+    size_t a, b;
+
+    if (isnan(c->x) || isnan(c->y)) {
+        return 1;
+    }
+
+    geomap_grid_weights(
+            (c->x - lattice->origin.x) * lattice->scale.x, lattice->ncellx,
+            &cellx, wx);
+    geomap_grid_weights(
+            (c->y - lattice->origin.y) * lattice->scale.y, lattice->ncelly,
+            &celly, wy);
+
+    *first = celly * lattice->ngridx + cellx;
+    for (b = 0; b < 4; ++b) {
+        for (a = 0; a < 4; ++a) {
+            w[4 * b + a] = wy[b] * wx[a];
+        }
+    }
+
+    return 0;
+}
+
+/* The correction of the grid at a point, NaN if it is NaN */
+static void
+geomap_grid_point(
+        const geomap_grid_lattice_t* const lattice,
+        const double* const xgrid,
+        const double* const ygrid,
+        const coord_t* const c,
+        /* Output */
+        coord_t* const value) {
+
+    double        w[16];
+    size_t        first = 0;
+    const double* xrow;
+    const double* yrow;
+    size_t        a, b;
+
+    if (geomap_grid_locate(lattice, c, &first, w)) {
+        value->x = value->y = fmod(1.0, 0.0);
+        return;
+    }
+
+    value->x = value->y = 0.0;
+    for (b = 0; b < 4; ++b) {
+        xrow = xgrid + first + b * lattice->ngridx;
+        yrow = ygrid + first + b * lattice->ngridx;
+        for (a = 0; a < 4; ++a) {
+            value->x += w[4 * b + a] * xrow[a];
+            value->y += w[4 * b + a] * yrow[a];
+        }
+    }
+}
+
+/* Add w (c[i0] - 2 c[i1] + c[i2])^2 to the banded normal equations,
+   for i0 < i1 < i2 */
+static void
+geomap_grid_penalize(
+        const size_t nbands,
+        double* const matrix,
+        const size_t i0,
+        const size_t i1,
+        const size_t i2,
+        const double w) {
+
+    matrix[i0 * nbands]             += w;
+    matrix[i0 * nbands + (i1 - i0)] -= 2.0 * w;
+    matrix[i0 * nbands + (i2 - i0)] += w;
+    matrix[i1 * nbands]             += 4.0 * w;
+    matrix[i1 * nbands + (i2 - i1)] -= 2.0 * w;
+    matrix[i2 * nbands]             += w;
+}
+
+int
+geomap_grid(
+        const size_t ncellx,
+        const size_t ncelly,
+        const double smoothing,
+        const size_t noutput,
+        /* Input/Output */
+        geomap_output_t* const output,
+        geomap_result_t* const result,
+        stimage_error_t* const error) {
+
+    geomap_grid_lattice_t lattice;
+    surface_fit_error_e   error_type = surface_fit_error_ok;
+    size_t                ngridx     = ncellx + GEOMAP_GRID_EXTRA;
+    size_t                ngridy     = ncelly + GEOMAP_GRID_EXTRA;
+    size_t                ncoeff     = 0;
+    size_t                nbands     = 0;
+    double*               matrix     = NULL;
+    double*               matfac     = NULL;
+    double*               xvector    = NULL;
+    double*               yvector    = NULL;
+    double*               xgrid      = NULL;
+    double*               ygrid      = NULL;
+    geomap_output_t*      outi       = NULL;
+    double                w[16];
+    size_t                index[16];
+    size_t                first      = 0;
+    size_t                nused      = 0;
+    double                trace      = 0.0;
+    double                penalty    = 0.0;
+    double                ridge      = 0.0;
+    coord_t               sumsq      = {0.0, 0.0};
+    coord_t               value;
+    size_t                i, j, p, q;
+    int                   status     = 1;
+
+    assert(output || noutput == 0);
+    assert(result);
+    assert(error);
+
+    if (ncellx < 1 || ncelly < 1) {
+        stimage_error_set_message(
+                error,
+                "The residual grid must have at least one cell in each "
+                "direction");
+        goto exit;
+    }
+
+    if (!(smoothing >= 0.0)) {
+        stimage_error_set_message(
+                error, "The residual grid smoothing must not be negative");
+        goto exit;
+    }
+
+    if (geomap_grid_lattice(
+                &result->bbox, ngridx, ngridy, &lattice, error)) goto exit;
+
+    /* The banded normal matrix and its factor are the largest
+       allocations, at nbands doubles for each coefficient */
+    nbands = GEOMAP_GRID_EXTRA * ngridx + GEOMAP_GRID_EXTRA + 1;
+    if (ngridx < ncellx || ngridy < ncelly || nbands < ngridx ||
+        ngridy > SIZE_MAX / sizeof(double) / ngridx / nbands) {
+        stimage_error_format_message(
+                error,
+                "The residual grid of %lu x %lu cells is too large: its "
+                "normal matrix would need %g bytes",
+                (unsigned long)ncellx, (unsigned long)ncelly,
+                (double)ngridx * (double)ngridy * (double)nbands *
+                (double)sizeof(double));
+        goto exit;
+    }
+    ncoeff = ngridx * ngridy;
+
+    matrix = calloc_with_error(ncoeff * nbands, sizeof(double), error);
+    if (matrix == NULL) goto exit;
+    matfac = malloc_with_error(ncoeff * nbands * sizeof(double), error);
+    if (matfac == NULL) goto exit;
+    xvector = calloc_with_error(ncoeff, sizeof(double), error);
+    if (xvector == NULL) goto exit;
+    yvector = calloc_with_error(ncoeff, sizeof(double), error);
+    if (yvector == NULL) goto exit;
+    xgrid = malloc_with_error(ncoeff * sizeof(double), error);
+    if (xgrid == NULL) goto exit;
+    ygrid = malloc_with_error(ncoeff * sizeof(double), error);
+    if (ygrid == NULL) goto exit;
+
+    /* Accumulate the normal equations of the residuals.  The
+       coefficients covering a point are in increasing order, so each
+       pair lands in the upper band. */
+    for (i = 0, outi = output; i < noutput; ++i, ++outi) {
+        if (i % GEOMAP_GRID_PROGRESS_INTERVAL == 0 &&
+            stimage_error_check_progress(
+                    error, "geomap_grid", i, noutput)) goto exit;
+
+        if (!isfinite(outi->fit.x) || !isfinite(outi->fit.y) ||
+            !isfinite(outi->residual.x) || !isfinite(outi->residual.y) ||
+            geomap_grid_locate(&lattice, &outi->ref, &first, w)) {
+            continue;
+        }
+
+        for (p = 0; p < 16; ++p) {
+            index[p] = first + (p / 4) * ngridx + p % 4;
+        }
+
+        for (p = 0; p < 16; ++p) {
+            xvector[index[p]] += w[p] * outi->residual.x;
+            yvector[index[p]] += w[p] * outi->residual.y;
+            for (q = p; q < 16; ++q) {
+                matrix[index[p] * nbands + (index[q] - index[p])] +=
+                    w[p] * w[q];
+            }
+        }
+
+        ++nused;
+    }
+
+    if (nused == 0) {
+        stimage_error_set_message(
+                error, "There are no points to fit the residual grid to");
+        goto exit;
+    }
+
+    /* The penalty is scaled so that smoothing is relative to the
+       data: the trace of the second difference operators is 6 for
+       each difference */
+    for (i = 0; i < ncoeff; ++i) {
+        trace += matrix[i * nbands];
+    }
+    penalty = smoothing * trace / (6.0 * (double)(
+            ngridy * (ngridx - 2) + ngridx * (ngridy - 2)));
+
+    if (penalty > 0.0) {
+        for (j = 0; j < ngridy; ++j) {
+            for (i = 0; i < ngridx; ++i) {
+                p = j * ngridx + i;
+                if (i + 2 < ngridx) {
+                    geomap_grid_penalize(nbands, matrix, p, p + 1, p + 2,
+                                         penalty);
+                }
+                if (j + 2 < ngridy) {
+                    geomap_grid_penalize(nbands, matrix, p, p + ngridx,
+                                         p + 2 * ngridx, penalty);
+                }
+            }
+        }
+    }
+
+    ridge = GEOMAP_GRID_RIDGE * trace / (double)ncoeff;
+    for (i = 0; i < ncoeff; ++i) {
+        matrix[i * nbands] += ridge;
+    }
+
+    if (stimage_error_check_progress(
+                error, "geomap_grid", noutput, noutput)) goto exit;
+
+    if (cholesky_factorization(
+                nbands, ncoeff, matrix, matfac, &error_type, error) ||
+        cholesky_solve(nbands, ncoeff, matfac, xvector, xgrid, error) ||
+        cholesky_solve(nbands, ncoeff, matfac, yvector, ygrid, error)) {
+        goto exit;
+    }
+
+    free(result->xgrid);
+    free(result->ygrid);
+    result->ngridx = ngridx;
+    result->ngridy = ngridy;
+    result->xgrid = xgrid;
+    result->ygrid = ygrid;
+    xgrid = ygrid = NULL;
+
+    /* Apply the grid to the fit, and update the rms to match */
+    for (i = 0, outi = output; i < noutput; ++i, ++outi) {
+        if (!isfinite(outi->fit.x) || !isfinite(outi->fit.y) ||
+            !isfinite(outi->residual.x) || !isfinite(outi->residual.y)) {
+            continue;
+        }
+
+        geomap_grid_point(
+                &lattice, result->xgrid, result->ygrid, &outi->ref, &value);
+        if (isnan(value.x) || isnan(value.y)) {
+            continue;
+        }
+
+        outi->fit.x += value.x;
+        outi->fit.y += value.y;
+        outi->residual.x = outi->input.x - outi->fit.x;
+        outi->residual.y = outi->input.y - outi->fit.y;
+        sumsq.x += outi->residual.x * outi->residual.x;
+        sumsq.y += outi->residual.y * outi->residual.y;
+    }
+
+    if (nused <= 1) {
+        result->rms.x = result->rms.y = 0.0;
+    } else {
+        result->rms.x = sqrt(sumsq.x / (double)(nused - 1));
+        result->rms.y = sqrt(sumsq.y / (double)(nused - 1));
+    }
+
+    status = 0;
+
+ exit:
+    free(matrix);
+    free(matfac);
+    free(xvector);
+    free(yvector);
+    free(xgrid);
+    free(ygrid);
+
+    return status;
+}
+
+int
+geomap_grid_eval(
+        const geomap_result_t* const result,
+        const size_t ncoord,
+        const coord_t* const ref,
+        /* Input/Output */
+        double* const xfit,
+        double* const yfit,
+        stimage_error_t* const error) {
+
+    geomap_grid_lattice_t lattice;
+    coord_t               value;
+    size_t                i;
+
+    assert(result);
+    assert(ref || ncoord == 0);
+    assert(xfit || ncoord == 0);
+    assert(yfit || ncoord == 0);
+    assert(error);
+
+    if (result->ngridx == 0 && result->ngridy == 0) {
+        return 0;
+    }
+
+    if (geomap_grid_lattice(
+                &result->bbox, result->ngridx, result->ngridy, &lattice,
+                error)) return 1;
+
+    if (result->xgrid == NULL || result->ygrid == NULL) {
+        stimage_error_set_message(error, "The residual grid is missing");
+        return 1;
+    }
+
+    for (i = 0; i < ncoord; ++i) {
+        geomap_grid_point(
+                &lattice, result->xgrid, result->ygrid, &ref[i], &value);
+        xfit[i] += value.x;
+        yfit[i] += value.y;
+    }
+
+    return 0;
+}
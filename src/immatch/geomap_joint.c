@@ -0,0 +1,1535 @@
+/*
+Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+    1. Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+
+    2. Redistributions in binary form must reproduce the above
+      copyright notice, this list of conditions and the following
+      disclaimer in the documentation and/or other materials provided
+      with the distribution.
+
+    3. The name of AURA and its representatives may not be used to
+      endorse or promote products derived from this software without
+      specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+DAMAGE.
+*/
+
+#include <assert.h>
+#include <float.h>
+#include <math.h>
+#include <string.h>
+
+#include "immatch/geomap_joint.h"
+#include "lib/xybbox.h"
+
+#define GEOMAP_JOINT_MAX_PARAMS 6
+
+/* Gauss-Newton steps are taken until the cost decreases by less than
+   this fraction */
+#define GEOMAP_JOINT_TOLERANCE 1e-10
+#define GEOMAP_JOINT_MAX_STEPS 100
+#define GEOMAP_JOINT_MAX_HALVINGS 30
+
+/* Each step's conjugate gradient solve stops when the residual has
+   been reduced by this factor.  Any error left is corrected by the
+   following Gauss-Newton steps. */
+#define GEOMAP_JOINT_CG_TOLERANCE 1e-10
+#define GEOMAP_JOINT_CG_MIN_ITER 100
+
+/* The reduced system is formed explicitly when the pairs of
+   observations of the same source number at most this many times the
+   observations.  Forming it costs time proportional to the pairs, but
+   then each conjugate gradient iteration only costs time proportional
+   to the overlapping pairs of exposures.  Deep stacks, where sources
+   are seen in very many exposures, are solved without forming it. */
+#define GEOMAP_JOINT_EXPLICIT_RATIO 64
+
+typedef struct {
+    /* The problem */
+    geomap_fit_e   fit_geometry;
+    size_t         nparam;
+    size_t         nexposure;
+    size_t         reference;
+    size_t         nobs;
+    const coord_t* coord;
+    const size_t*  exposure;
+    const size_t*  group;
+    size_t         ngroup;
+    coord_t        center;
+
+    /* The observations of each group and exposure, in order */
+    size_t*        group_start;    /* [ngroup + 1] */
+    size_t*        group_obs;      /* [nobs] */
+    size_t*        exposure_start; /* [nexposure + 1] */
+    size_t*        exposure_obs;   /* [nobs] */
+
+    /* The current solution.  The parameters of each exposure are the
+       translation t followed by those of M. */
+    double*        param;          /* [nexposure * nparam] */
+    double*        flip;           /* [nexposure] */
+    coord_t*       position;       /* [ngroup] */
+    char*          active;         /* [nobs] */
+    char*          used;           /* [ngroup] */
+
+    /* The transformation matrices and their derivatives */
+    double*        matrix;         /* [nexposure * 4] */
+    double*        dmatrix;        /* [nexposure * (nparam - 2) * 4] */
+
+    /* The normal equations of a step */
+    double*        uinv;           /* [ngroup * 3] */
+    double*        gx;             /* [ngroup * 2] */
+    double*        w;              /* [nobs * 2 * nparam] */
+    double*        v;              /* [nexposure * nparam * nparam] */
+    double*        precond;        /* [nexposure * nparam * nparam] */
+
+    /* The reduced system, if it is formed explicitly.  Block row k
+       holds a block for each exposure sharing a source with k. */
+    int            is_explicit;
+    size_t*        row_start;      /* [nexposure + 1] */
+    size_t*        col;            /* [nblock] */
+    size_t*        pos;            /* [nexposure] */
+    double*        sblock;         /* [nblock * nparam * nparam] */
+
+    /* Conjugate gradient vectors and the step */
+    double*        b;              /* [nexposure * nparam] */
+    double*        x;
+    double*        r;
+    double*        z;
+    double*        p;
+    double*        q;
+    double*        dposition;      /* [ngroup * 2] */
+    double*        old_param;      /* [nexposure * nparam] */
+    coord_t*       old_position;   /* [ngroup] */
+} geomap_joint_t;
+
+static size_t
+joint_nparam(
+        const geomap_fit_e fit_geometry) {
+
+    switch (fit_geometry) {
+    case geomap_fit_shift:
+        return 2;
+    case geomap_fit_rotate:
+        return 3;
+    case geomap_fit_xyscale:
+    case geomap_fit_rscale:
+        return 4;
+    case geomap_fit_rxyscale:
+        return 5;
+    default:
+        return 6;
+    }
+}
+
+/* Compute M (row-major) from the parameters q of the linear part, and
+   if dmatrix is not NULL its derivatives with respect to each of
+   them */
+static void
+joint_matrix(
+        const geomap_fit_e fit_geometry,
+        const double flip,
+        const double* const q,
+        /* Output */
+        double* const m,
+        double* const dmatrix) {
+
+    double c, s;
+    size_t i;
+
+    switch (fit_geometry) {
+    case geomap_fit_shift:
+        m[0] = 1.0; m[1] = 0.0; m[2] = 0.0; m[3] = 1.0;
+        break;
+
+    case geomap_fit_xyscale:
+        m[0] = q[0]; m[1] = 0.0; m[2] = 0.0; m[3] = q[1];
+        if (dmatrix) {
+            memset(dmatrix, 0, 8 * sizeof(double));
+            dmatrix[0] = 1.0;
+            dmatrix[7] = 1.0;
+        }
+        break;
+
+    case geomap_fit_rotate:
+        c = cos(q[0]);
+        s = sin(q[0]);
+        m[0] = flip * c; m[1] = s; m[2] = -flip * s; m[3] = c;
+        if (dmatrix) {
+            dmatrix[0] = -flip * s; dmatrix[1] = c;
+            dmatrix[2] = -flip * c; dmatrix[3] = -s;
+        }
+        break;
+
+    case geomap_fit_rscale:
+        m[0] = flip * q[0]; m[1] = q[1]; m[2] = -flip * q[1]; m[3] = q[0];
+        if (dmatrix) {
+            dmatrix[0] = flip; dmatrix[1] = 0.0;
+            dmatrix[2] = 0.0;  dmatrix[3] = 1.0;
+            dmatrix[4] = 0.0;  dmatrix[5] = 1.0;
+            dmatrix[6] = -flip; dmatrix[7] = 0.0;
+        }
+        break;
+
+    case geomap_fit_rxyscale:
+        c = cos(q[2]);
+        s = sin(q[2]);
+        m[0] = q[0] * c; m[1] = q[1] * s; m[2] = -q[0] * s; m[3] = q[1] * c;
+        if (dmatrix) {
+            dmatrix[0] = c;          dmatrix[1] = 0.0;
+            dmatrix[2] = -s;         dmatrix[3] = 0.0;
+            dmatrix[4] = 0.0;        dmatrix[5] = s;
+            dmatrix[6] = 0.0;        dmatrix[7] = c;
+            dmatrix[8] = -q[0] * s;  dmatrix[9] = q[1] * c;
+            dmatrix[10] = -q[0] * c; dmatrix[11] = -q[1] * s;
+        }
+        break;
+
+    default:
+        for (i = 0; i < 4; ++i) {
+            m[i] = q[i];
+        }
+        if (dmatrix) {
+            memset(dmatrix, 0, 16 * sizeof(double));
+            for (i = 0; i < 4; ++i) {
+                dmatrix[i * 4 + i] = 1.0;
+            }
+        }
+        break;
+    }
+}
+
+/* The parameters of the linear part closest to an arbitrary M, which
+   are exact when M is of the form the geometry allows */
+static void
+joint_project(
+        const geomap_fit_e fit_geometry,
+        const double* const m,
+        /* Output */
+        double* const flip,
+        double* const q) {
+
+    double theta;
+    size_t i;
+
+    *flip = (m[0] * m[3] - m[1] * m[2] < 0.0) ? -1.0 : 1.0;
+
+    switch (fit_geometry) {
+    case geomap_fit_shift:
+        break;
+
+    case geomap_fit_xyscale:
+        q[0] = m[0];
+        q[1] = m[3];
+        break;
+
+    case geomap_fit_rotate:
+        q[0] = atan2(m[1] - *flip * m[2], m[3] + *flip * m[0]);
+        break;
+
+    case geomap_fit_rscale:
+        q[0] = (*flip * m[0] + m[3]) / 2.0;
+        q[1] = (m[1] - *flip * m[2]) / 2.0;
+        break;
+
+    case geomap_fit_rxyscale:
+        theta = atan2(m[1], m[3]);
+        q[0] = m[0] * cos(theta) - m[2] * sin(theta);
+        q[1] = m[1] * sin(theta) + m[3] * cos(theta);
+        q[2] = theta;
+        break;
+
+    default:
+        for (i = 0; i < 4; ++i) {
+            q[i] = m[i];
+        }
+        break;
+    }
+}
+
+static inline void
+joint_apply(
+        const double* const t,
+        const double* const m,
+        const coord_t* const center,
+        const coord_t* const a,
+        /* Output */
+        coord_t* const b) {
+
+    const double dx = a->x - center->x;
+    const double dy = a->y - center->y;
+
+    b->x = t[0] + m[0] * dx + m[1] * dy;
+    b->y = t[1] + m[2] * dx + m[3] * dy;
+}
+
+static void
+joint_invert(
+        const double* const t,
+        const double* const m,
+        const coord_t* const center,
+        const coord_t* const b,
+        /* Output */
+        coord_t* const a) {
+
+    const double det = m[0] * m[3] - m[1] * m[2];
+    const double dx  = b->x - t[0];
+    const double dy  = b->y - t[1];
+
+    a->x = center->x + (m[3] * dx - m[1] * dy) / det;
+    a->y = center->y + (m[0] * dy - m[2] * dx) / det;
+}
+
+static void
+joint_update_matrices(
+        geomap_joint_t* const j) {
+
+    const size_t nd = (j->nparam - 2) * 4;
+    size_t       k;
+
+    for (k = 0; k < j->nexposure; ++k) {
+        joint_matrix(
+                j->fit_geometry, j->flip[k], j->param + k * j->nparam + 2,
+                j->matrix + k * 4, nd ? j->dmatrix + k * nd : NULL);
+    }
+}
+
+/* Lower Cholesky factor of a small dense matrix, in place.  Fails if
+   a pivot is not positive relative to its diagonal entry. */
+static int
+joint_cholesky(
+        const size_t n,
+        double* const a) {
+
+    size_t i, k, l;
+    double sum;
+
+    for (i = 0; i < n; ++i) {
+        for (k = 0; k <= i; ++k) {
+            sum = a[i * n + k];
+            for (l = 0; l < k; ++l) {
+                sum -= a[i * n + l] * a[k * n + l];
+            }
+            if (i == k) {
+                if (!(sum > a[i * n + i] * 1e3 * DBL_EPSILON)) {
+                    return 1;
+                }
+                a[i * n + i] = sqrt(sum);
+            } else {
+                a[i * n + k] = sum / a[k * n + k];
+            }
+        }
+    }
+
+    return 0;
+}
+
+static void
+joint_cholesky_solve(
+        const size_t n,
+        const double* const l,
+        const double* const b,
+        /* Output */
+        double* const x) {
+
+    size_t i, k;
+    double sum;
+
+    for (i = 0; i < n; ++i) {
+        sum = b[i];
+        for (k = 0; k < i; ++k) {
+            sum -= l[i * n + k] * x[k];
+        }
+        x[i] = sum / l[i * n + i];
+    }
+
+    for (i = n; i-- > 0; ) {
+        sum = x[i];
+        for (k = i + 1; k < n; ++k) {
+            sum -= l[k * n + i] * x[k];
+        }
+        x[i] = sum / l[i * n + i];
+    }
+}
+
+/* Counting sort of the observations by key, into CSR form */
+static void
+joint_bucket(
+        const size_t nobs,
+        const size_t* const key,
+        const size_t nkey,
+        /* Output */
+        size_t* const start,
+        size_t* const obs) {
+
+    size_t i;
+
+    memset(start, 0, (nkey + 1) * sizeof(size_t));
+    for (i = 0; i < nobs; ++i) {
+        ++start[key[i] + 1];
+    }
+    for (i = 0; i < nkey; ++i) {
+        start[i + 1] += start[i];
+    }
+    for (i = 0; i < nobs; ++i) {
+        obs[start[key[i]]++] = i;
+    }
+    for (i = nkey; i > 0; --i) {
+        start[i] = start[i - 1];
+    }
+    start[0] = 0;
+}
+
+static void
+joint_new(
+        geomap_joint_t* const j) {
+
+    memset(j, 0, sizeof(geomap_joint_t));
+}
+
+static void
+joint_free(
+        geomap_joint_t* const j) {
+
+    free(j->group_start);
+    free(j->group_obs);
+    free(j->exposure_start);
+    free(j->exposure_obs);
+    free(j->param);
+    free(j->flip);
+    free(j->position);
+    free(j->active);
+    free(j->used);
+    free(j->matrix);
+    free(j->dmatrix);
+    free(j->uinv);
+    free(j->gx);
+    free(j->w);
+    free(j->v);
+    free(j->precond);
+    free(j->row_start);
+    free(j->col);
+    free(j->pos);
+    free(j->sblock);
+    free(j->b);
+    free(j->x);
+    free(j->r);
+    free(j->z);
+    free(j->p);
+    free(j->q);
+    free(j->dposition);
+    free(j->old_param);
+    free(j->old_position);
+    joint_new(j);
+}
+
+static int
+joint_alloc(
+        geomap_joint_t* const j,
+        stimage_error_t* const error) {
+
+    const size_t np = j->nparam;
+    const size_t ne = j->nexposure;
+    const size_t ng = j->ngroup;
+    const size_t no = j->nobs;
+
+    #define ALLOC(member, n) \
+        j->member = calloc_with_error((n), sizeof(*j->member), error); \
+        if (j->member == NULL) return 1;
+
+    ALLOC(group_start, ng + 1);
+    ALLOC(group_obs, no);
+    ALLOC(exposure_start, ne + 1);
+    ALLOC(exposure_obs, no);
+    ALLOC(param, ne * np);
+    ALLOC(flip, ne);
+    ALLOC(position, ng);
+    ALLOC(active, no);
+    ALLOC(used, ng);
+    ALLOC(matrix, ne * 4);
+    ALLOC(dmatrix, ne * (np - 2) * 4 + 1);
+    ALLOC(uinv, ng * 3);
+    ALLOC(gx, ng * 2);
+    ALLOC(w, no * 2 * np);
+    ALLOC(v, ne * np * np);
+    ALLOC(precond, ne * np * np);
+    ALLOC(b, ne * np);
+    ALLOC(x, ne * np);
+    ALLOC(r, ne * np);
+    ALLOC(z, ne * np);
+    ALLOC(p, ne * np);
+    ALLOC(q, ne * np);
+    ALLOC(dposition, ng * 2);
+    ALLOC(old_param, ne * np);
+    ALLOC(old_position, ng);
+
+    #undef ALLOC
+
+    return 0;
+}
+
+/* Mark the groups with at least two active observations, which are
+   the only ones that constrain the fit */
+static void
+joint_mark_used(
+        geomap_joint_t* const j) {
+
+    size_t s, n, i;
+
+    for (s = 0; s < j->ngroup; ++s) {
+        n = 0;
+        for (i = j->group_start[s]; i < j->group_start[s + 1]; ++i) {
+            n += j->active[j->group_obs[i]];
+        }
+        j->used[s] = n >= 2;
+    }
+}
+
+/* Fit the transformation of one exposure to the observations whose
+   groups have a known position, and return the number used */
+static size_t
+joint_fit_exposure(
+        geomap_joint_t* const j,
+        const size_t k,
+        const char* const known) {
+
+    double* const t = j->param + k * j->nparam;
+    size_t  n       = 0;
+    coord_t sx      = {0.0, 0.0};
+    coord_t sr      = {0.0, 0.0};
+    double  xx      = 0.0;
+    double  xy      = 0.0;
+    double  yy      = 0.0;
+    double  ax      = 0.0;
+    double  ay      = 0.0;
+    double  bx      = 0.0;
+    double  by      = 0.0;
+    double  m[4]    = {1.0, 0.0, 0.0, 1.0};
+    double  det, dx, dy, ex, ey;
+    size_t  i, o;
+
+    for (i = j->exposure_start[k]; i < j->exposure_start[k + 1]; ++i) {
+        o = j->exposure_obs[i];
+        if (j->active[o] && known[j->group[o]]) {
+            sr.x += j->position[j->group[o]].x;
+            sr.y += j->position[j->group[o]].y;
+            sx.x += j->coord[o].x;
+            sx.y += j->coord[o].y;
+            ++n;
+        }
+    }
+    if (n == 0) {
+        return 0;
+    }
+    sr.x /= (double)n;
+    sr.y /= (double)n;
+    sx.x /= (double)n;
+    sx.y /= (double)n;
+
+    /* Second moments of the known positions, and their cross moments
+       with the observations */
+    for (i = j->exposure_start[k]; i < j->exposure_start[k + 1]; ++i) {
+        o = j->exposure_obs[i];
+        if (j->active[o] && known[j->group[o]]) {
+            dx = j->position[j->group[o]].x - sr.x;
+            dy = j->position[j->group[o]].y - sr.y;
+            ex = j->coord[o].x - sx.x;
+            ey = j->coord[o].y - sx.y;
+            xx += dx * dx; xy += dx * dy; yy += dy * dy;
+            ax += ex * dx; ay += ex * dy;
+            bx += ey * dx; by += ey * dy;
+        }
+    }
+
+    det = xx * yy - xy * xy;
+    if (j->fit_geometry == geomap_fit_shift) {
+        /* M is the identity */
+    } else if (n >= 3 && det > 1e-12 * (xx + yy) * (xx + yy)) {
+        m[0] = (ax * yy - ay * xy) / det;
+        m[1] = (ay * xx - ax * xy) / det;
+        m[2] = (bx * yy - by * xy) / det;
+        m[3] = (by * xx - bx * xy) / det;
+    } else if (n >= 2 && xx + yy > 0.0) {
+        m[0] = m[3] = (ax + by) / (xx + yy);
+        m[1] = (ay - bx) / (xx + yy);
+        m[2] = -m[1];
+    }
+
+    joint_project(j->fit_geometry, m, &j->flip[k], t + 2);
+    joint_matrix(j->fit_geometry, j->flip[k], t + 2, m, NULL);
+    t[0] = sx.x - (m[0] * (sr.x - j->center.x) + m[1] * (sr.y - j->center.y));
+    t[1] = sx.y - (m[2] * (sr.x - j->center.x) + m[3] * (sr.y - j->center.y));
+
+    return n;
+}
+
+/* Find a starting solution by fitting the exposures one at a time,
+   each time taking the one with the most observations of sources
+   already placed in the common frame */
+static int
+joint_initialize(
+        geomap_joint_t* const j,
+        stimage_error_t* const error) {
+
+    const size_t needed = (j->nparam + 1) / 2;
+    char*        known  = NULL;
+    char*        fitted = NULL;
+    double*      t      = NULL;
+    double       m[4];
+    size_t       n, best, nbest, step, i, k, o, s;
+    int          status = 1;
+
+    known = calloc_with_error(j->ngroup, sizeof(char), error);
+    if (known == NULL) goto exit;
+
+    fitted = calloc_with_error(j->nexposure, sizeof(char), error);
+    if (fitted == NULL) goto exit;
+
+    /* The reference exposure is the identity about its own center */
+    k = j->reference;
+    n = 0;
+    j->center.x = j->center.y = 0.0;
+    for (i = j->exposure_start[k]; i < j->exposure_start[k + 1]; ++i) {
+        o = j->exposure_obs[i];
+        if (j->active[o]) {
+            j->center.x += j->coord[o].x;
+            j->center.y += j->coord[o].y;
+            ++n;
+        }
+    }
+    if (n) {
+        j->center.x /= (double)n;
+        j->center.y /= (double)n;
+    }
+
+    m[0] = 1.0; m[1] = 0.0; m[2] = 0.0; m[3] = 1.0;
+    t = j->param + k * j->nparam;
+    joint_project(j->fit_geometry, m, &j->flip[k], t + 2);
+    t[0] = j->center.x;
+    t[1] = j->center.y;
+    fitted[k] = 1;
+
+    for (i = j->exposure_start[k]; i < j->exposure_start[k + 1]; ++i) {
+        o = j->exposure_obs[i];
+        if (j->active[o] && !known[j->group[o]]) {
+            j->position[j->group[o]] = j->coord[o];
+            known[j->group[o]] = 1;
+        }
+    }
+
+    for (step = 1; step < j->nexposure; ++step) {
+        best = j->nexposure;
+        nbest = 0;
+        for (k = 0; k < j->nexposure; ++k) {
+            if (fitted[k]) continue;
+            n = 0;
+            for (i = j->exposure_start[k]; i < j->exposure_start[k + 1]; ++i) {
+                o = j->exposure_obs[i];
+                n += j->active[o] && known[j->group[o]];
+            }
+            if (best == j->nexposure || n > nbest) {
+                best = k;
+                nbest = n;
+            }
+        }
+
+        if (nbest < needed) {
+            stimage_error_format_message(
+                    error,
+                    "Exposure %lu has too few matches with the others to be "
+                    "fit (%lu, at least %lu are needed)",
+                    (unsigned long)best, (unsigned long)nbest,
+                    (unsigned long)needed);
+            goto exit;
+        }
+
+        k = best;
+        joint_fit_exposure(j, k, known);
+        fitted[k] = 1;
+
+        /* Place the sources first seen in this exposure */
+        t = j->param + k * j->nparam;
+        joint_matrix(j->fit_geometry, j->flip[k], t + 2, m, NULL);
+        for (i = j->exposure_start[k]; i < j->exposure_start[k + 1]; ++i) {
+            o = j->exposure_obs[i];
+            s = j->group[o];
+            if (j->active[o] && !known[s]) {
+                joint_invert(t, m, &j->center, &j->coord[o], &j->position[s]);
+                known[s] = 1;
+            }
+        }
+    }
+
+    status = 0;
+
+ exit:
+    free(known);
+    free(fitted);
+
+    return status;
+}
+
+/* The sum of the squared residuals of the active observations of the
+   used groups */
+static double
+joint_cost(
+        geomap_joint_t* const j) {
+
+    double  cost = 0.0;
+    coord_t fit;
+    size_t  s, i, o, k;
+
+    joint_update_matrices(j);
+
+    for (s = 0; s < j->ngroup; ++s) {
+        if (!j->used[s]) continue;
+        for (i = j->group_start[s]; i < j->group_start[s + 1]; ++i) {
+            o = j->group_obs[i];
+            if (!j->active[o]) continue;
+            k = j->exposure[o];
+            joint_apply(
+                    j->param + k * j->nparam, j->matrix + k * 4, &j->center,
+                    &j->position[s], &fit);
+            cost += (fit.x - j->coord[o].x) * (fit.x - j->coord[o].x) +
+                (fit.y - j->coord[o].y) * (fit.y - j->coord[o].y);
+        }
+    }
+
+    return cost;
+}
+
+/* Accumulate the normal equations of a Gauss-Newton step: for each
+   used group the inverse of its 2x2 block and its gradient, for each
+   observation W = M^T B, and for each exposure its diagonal block V
+   and gradient.  The source positions are then eliminated from the
+   gradient, leaving the right-hand side of the reduced system in b. */
+static int
+joint_normal_equations(
+        geomap_joint_t* const j,
+        stimage_error_t* const error) {
+
+    const size_t np = j->nparam;
+    const size_t nd = np - 2;
+    double       bmat[2 * GEOMAP_JOINT_MAX_PARAMS];
+    double       u[3], g[2], y[2], res[2];
+    double       det, dx, dy;
+    double*      m;
+    double*      dm;
+    double*      w;
+    double*      v;
+    double*      bk;
+    coord_t      fit;
+    size_t       s, i, o, k, a, c;
+
+    joint_update_matrices(j);
+
+    memset(j->v, 0, j->nexposure * np * np * sizeof(double));
+    memset(j->b, 0, j->nexposure * np * sizeof(double));
+
+    for (s = 0; s < j->ngroup; ++s) {
+        if (!j->used[s]) continue;
+
+        u[0] = u[1] = u[2] = 0.0;
+        g[0] = g[1] = 0.0;
+        for (i = j->group_start[s]; i < j->group_start[s + 1]; ++i) {
+            o = j->group_obs[i];
+            if (!j->active[o]) continue;
+            k = j->exposure[o];
+            m = j->matrix + k * 4;
+            joint_apply(
+                    j->param + k * np, m, &j->center, &j->position[s], &fit);
+            res[0] = fit.x - j->coord[o].x;
+            res[1] = fit.y - j->coord[o].y;
+
+            u[0] += m[0] * m[0] + m[2] * m[2];
+            u[1] += m[0] * m[1] + m[2] * m[3];
+            u[2] += m[1] * m[1] + m[3] * m[3];
+            g[0] += m[0] * res[0] + m[2] * res[1];
+            g[1] += m[1] * res[0] + m[3] * res[1];
+
+            if (k == j->reference) continue;
+
+            /* B = d(fit) / d(parameters), 2 x np */
+            dx = j->position[s].x - j->center.x;
+            dy = j->position[s].y - j->center.y;
+            dm = j->dmatrix + k * nd * 4;
+            bmat[0] = 1.0; bmat[1] = 0.0;
+            bmat[np] = 0.0; bmat[np + 1] = 1.0;
+            for (a = 0; a < nd; ++a) {
+                bmat[2 + a] = dm[a * 4] * dx + dm[a * 4 + 1] * dy;
+                bmat[np + 2 + a] = dm[a * 4 + 2] * dx + dm[a * 4 + 3] * dy;
+            }
+
+            w = j->w + o * 2 * np;
+            v = j->v + k * np * np;
+            bk = j->b + k * np;
+            for (a = 0; a < np; ++a) {
+                w[a] = m[0] * bmat[a] + m[2] * bmat[np + a];
+                w[np + a] = m[1] * bmat[a] + m[3] * bmat[np + a];
+                bk[a] += bmat[a] * res[0] + bmat[np + a] * res[1];
+                for (c = 0; c <= a; ++c) {
+                    v[a * np + c] += bmat[a] * bmat[c] +
+                        bmat[np + a] * bmat[np + c];
+                }
+            }
+        }
+
+        det = u[0] * u[2] - u[1] * u[1];
+        if (!(det > 0.0)) {
+            stimage_error_set_message(
+                    error, "The joint fit is singular (a transformation has "
+                    "collapsed)");
+            return 1;
+        }
+        j->uinv[s * 3] = u[2] / det;
+        j->uinv[s * 3 + 1] = -u[1] / det;
+        j->uinv[s * 3 + 2] = u[0] / det;
+        j->gx[s * 2] = g[0];
+        j->gx[s * 2 + 1] = g[1];
+    }
+
+    /* Fill in the upper triangles of V */
+    for (k = 0; k < j->nexposure; ++k) {
+        v = j->v + k * np * np;
+        for (a = 0; a < np; ++a) {
+            for (c = 0; c < a; ++c) {
+                v[c * np + a] = v[a * np + c];
+            }
+        }
+    }
+
+    /* Eliminate the positions: b -= W^T U^-1 g */
+    for (s = 0; s < j->ngroup; ++s) {
+        if (!j->used[s]) continue;
+        y[0] = j->uinv[s * 3] * j->gx[s * 2] +
+            j->uinv[s * 3 + 1] * j->gx[s * 2 + 1];
+        y[1] = j->uinv[s * 3 + 1] * j->gx[s * 2] +
+            j->uinv[s * 3 + 2] * j->gx[s * 2 + 1];
+        for (i = j->group_start[s]; i < j->group_start[s + 1]; ++i) {
+            o = j->group_obs[i];
+            k = j->exposure[o];
+            if (!j->active[o] || k == j->reference) continue;
+            w = j->w + o * 2 * np;
+            bk = j->b + k * np;
+            for (a = 0; a < np; ++a) {
+                bk[a] -= w[a] * y[0] + w[np + a] * y[1];
+            }
+        }
+    }
+
+    /* The right-hand side is the negative gradient */
+    for (i = 0; i < j->nexposure * np; ++i) {
+        j->b[i] = -j->b[i];
+    }
+
+    return 0;
+}
+
+/* Find the blocks of the reduced system, and decide whether to form
+   it explicitly */
+static int
+joint_pattern(
+        geomap_joint_t* const j,
+        stimage_error_t* const error) {
+
+    size_t npairs = 0;
+    size_t nblock = 0;
+    size_t pass, k, i, o, s, l, m;
+
+    for (s = 0; s < j->ngroup; ++s) {
+        m = j->group_start[s + 1] - j->group_start[s];
+        npairs += m * m;
+    }
+
+    j->is_explicit = npairs <= GEOMAP_JOINT_EXPLICIT_RATIO * j->nobs;
+    if (!j->is_explicit) {
+        return 0;
+    }
+
+    j->row_start = calloc_with_error(j->nexposure + 1, sizeof(size_t), error);
+    if (j->row_start == NULL) return 1;
+
+    j->pos = malloc_with_error(j->nexposure * sizeof(size_t), error);
+    if (j->pos == NULL) return 1;
+
+    /* Count the blocks of each row, then fill in their columns, using
+       pos to mark the columns already seen in the row */
+    for (pass = 0; pass < 2; ++pass) {
+        for (k = 0; k < j->nexposure; ++k) {
+            j->pos[k] = j->nexposure;
+        }
+        nblock = 0;
+        for (k = 0; k < j->nexposure; ++k) {
+            j->row_start[k] = nblock;
+            if (k == j->reference) continue;
+            j->pos[k] = k;
+            if (pass) j->col[nblock] = k;
+            ++nblock;
+            for (i = j->exposure_start[k]; i < j->exposure_start[k + 1]; ++i) {
+                s = j->group[j->exposure_obs[i]];
+                for (o = j->group_start[s]; o < j->group_start[s + 1]; ++o) {
+                    l = j->exposure[j->group_obs[o]];
+                    if (l == j->reference || j->pos[l] == k) continue;
+                    j->pos[l] = k;
+                    if (pass) j->col[nblock] = l;
+                    ++nblock;
+                }
+            }
+        }
+        j->row_start[j->nexposure] = nblock;
+
+        if (pass == 0) {
+            j->col = malloc_with_error(nblock * sizeof(size_t) + 1, error);
+            if (j->col == NULL) return 1;
+            j->sblock = malloc_with_error(
+                    nblock * j->nparam * j->nparam * sizeof(double) + 1, error);
+            if (j->sblock == NULL) return 1;
+        }
+    }
+
+    return 0;
+}
+
+/* Build the preconditioner from the diagonal blocks of the reduced
+   system S = V - W^T U^-1 W, forming all of S if it is explicit.
+   Otherwise, the diagonal blocks leave out the cross terms of
+   repeated observations of a source in the same exposure. */
+static int
+joint_reduced_system(
+        geomap_joint_t* const j,
+        stimage_error_t* const error) {
+
+    const size_t np = j->nparam;
+    const double* uinv;
+    const double* w;
+    const double* wj;
+    double        y[2 * GEOMAP_JOINT_MAX_PARAMS];
+    double*       blk;
+    size_t        k, i, o, oj, s, l, a, c, bi;
+
+    if (j->is_explicit) {
+        memset(j->sblock, 0,
+               j->row_start[j->nexposure] * np * np * sizeof(double));
+    } else {
+        memcpy(j->precond, j->v, j->nexposure * np * np * sizeof(double));
+    }
+
+    for (k = 0; k < j->nexposure; ++k) {
+        if (k == j->reference) continue;
+
+        if (j->is_explicit) {
+            for (bi = j->row_start[k]; bi < j->row_start[k + 1]; ++bi) {
+                j->pos[j->col[bi]] = bi;
+            }
+            memcpy(j->sblock + j->pos[k] * np * np, j->v + k * np * np,
+                   np * np * sizeof(double));
+        }
+
+        for (i = j->exposure_start[k]; i < j->exposure_start[k + 1]; ++i) {
+            o = j->exposure_obs[i];
+            s = j->group[o];
+            if (!j->active[o] || !j->used[s]) continue;
+
+            /* y = U^-1 W, 2 x np */
+            uinv = j->uinv + s * 3;
+            w = j->w + o * 2 * np;
+            for (a = 0; a < np; ++a) {
+                y[a] = uinv[0] * w[a] + uinv[1] * w[np + a];
+                y[np + a] = uinv[1] * w[a] + uinv[2] * w[np + a];
+            }
+
+            if (!j->is_explicit) {
+                blk = j->precond + k * np * np;
+                for (a = 0; a < np; ++a) {
+                    for (c = 0; c < np; ++c) {
+                        blk[a * np + c] -= w[a] * y[c] + w[np + a] * y[np + c];
+                    }
+                }
+                continue;
+            }
+
+            for (l = j->group_start[s]; l < j->group_start[s + 1]; ++l) {
+                oj = j->group_obs[l];
+                if (!j->active[oj] || j->exposure[oj] == j->reference) {
+                    continue;
+                }
+                wj = j->w + oj * 2 * np;
+                blk = j->sblock + j->pos[j->exposure[oj]] * np * np;
+                for (a = 0; a < np; ++a) {
+                    for (c = 0; c < np; ++c) {
+                        blk[a * np + c] -= y[a] * wj[c] + y[np + a] * wj[np + c];
+                    }
+                }
+            }
+        }
+
+        if (j->is_explicit) {
+            memcpy(j->precond + k * np * np, j->sblock + j->pos[k] * np * np,
+                   np * np * sizeof(double));
+        }
+    }
+
+    for (k = 0; k < j->nexposure; ++k) {
+        if (k == j->reference) continue;
+        if (joint_cholesky(np, j->precond + k * np * np)) {
+            stimage_error_format_message(
+                    error,
+                    "Exposure %lu has too few matches, or matches in a "
+                    "degenerate configuration, to be fit",
+                    (unsigned long)k);
+            return 1;
+        }
+    }
+
+    return 0;
+}
+
+/* out = S in, where S = V - W^T U^-1 W is the reduced system */
+static void
+joint_reduced_product(
+        geomap_joint_t* const j,
+        const double* const in,
+        /* Output */
+        double* const out) {
+
+    const size_t np = j->nparam;
+    const double* v;
+    const double* w;
+    const double* ik;
+    double*       ok;
+    double        z[2], y[2];
+    size_t        s, i, o, k, a, c, bi;
+
+    if (j->is_explicit) {
+        for (k = 0; k < j->nexposure; ++k) {
+            ok = out + k * np;
+            memset(ok, 0, np * sizeof(double));
+            if (k == j->reference) continue;
+            for (bi = j->row_start[k]; bi < j->row_start[k + 1]; ++bi) {
+                v = j->sblock + bi * np * np;
+                ik = in + j->col[bi] * np;
+                for (a = 0; a < np; ++a) {
+                    for (c = 0; c < np; ++c) {
+                        ok[a] += v[a * np + c] * ik[c];
+                    }
+                }
+            }
+        }
+        return;
+    }
+
+    for (k = 0; k < j->nexposure; ++k) {
+        ok = out + k * np;
+        ik = in + k * np;
+        v = j->v + k * np * np;
+        for (a = 0; a < np; ++a) {
+            ok[a] = 0.0;
+            if (k == j->reference) continue;
+            for (c = 0; c < np; ++c) {
+                ok[a] += v[a * np + c] * ik[c];
+            }
+        }
+    }
+
+    for (s = 0; s < j->ngroup; ++s) {
+        if (!j->used[s]) continue;
+        z[0] = z[1] = 0.0;
+        for (i = j->group_start[s]; i < j->group_start[s + 1]; ++i) {
+            o = j->group_obs[i];
+            k = j->exposure[o];
+            if (!j->active[o] || k == j->reference) continue;
+            w = j->w + o * 2 * np;
+            ik = in + k * np;
+            for (a = 0; a < np; ++a) {
+                z[0] += w[a] * ik[a];
+                z[1] += w[np + a] * ik[a];
+            }
+        }
+        y[0] = j->uinv[s * 3] * z[0] + j->uinv[s * 3 + 1] * z[1];
+        y[1] = j->uinv[s * 3 + 1] * z[0] + j->uinv[s * 3 + 2] * z[1];
+        for (i = j->group_start[s]; i < j->group_start[s + 1]; ++i) {
+            o = j->group_obs[i];
+            k = j->exposure[o];
+            if (!j->active[o] || k == j->reference) continue;
+            w = j->w + o * 2 * np;
+            ok = out + k * np;
+            for (a = 0; a < np; ++a) {
+                ok[a] -= w[a] * y[0] + w[np + a] * y[1];
+            }
+        }
+    }
+}
+
+static void
+joint_precondition(
+        geomap_joint_t* const j,
+        const double* const in,
+        /* Output */
+        double* const out) {
+
+    const size_t np = j->nparam;
+    size_t       k;
+
+    for (k = 0; k < j->nexposure; ++k) {
+        if (k == j->reference) {
+            memset(out + k * np, 0, np * sizeof(double));
+        } else {
+            joint_cholesky_solve(
+                    np, j->precond + k * np * np, in + k * np, out + k * np);
+        }
+    }
+}
+
+static double
+joint_dot(
+        const size_t n,
+        const double* const a,
+        const double* const b) {
+
+    double sum = 0.0;
+    size_t i;
+
+    for (i = 0; i < n; ++i) {
+        sum += a[i] * b[i];
+    }
+
+    return sum;
+}
+
+/* Solve S x = b by preconditioned conjugate gradients */
+static void
+joint_solve_reduced(
+        geomap_joint_t* const j) {
+
+    const size_t n       = j->nexposure * j->nparam;
+    const size_t maxiter = MAX(GEOMAP_JOINT_CG_MIN_ITER, 2 * n);
+    double       bnorm, rz, rz_new, pq, alpha, beta;
+    size_t       i, iter;
+
+    memset(j->x, 0, n * sizeof(double));
+    memcpy(j->r, j->b, n * sizeof(double));
+
+    bnorm = sqrt(joint_dot(n, j->b, j->b));
+    if (bnorm == 0.0) {
+        return;
+    }
+
+    joint_precondition(j, j->r, j->z);
+    memcpy(j->p, j->z, n * sizeof(double));
+    rz = joint_dot(n, j->r, j->z);
+
+    for (iter = 0; iter < maxiter; ++iter) {
+        joint_reduced_product(j, j->p, j->q);
+        pq = joint_dot(n, j->p, j->q);
+        if (!(pq > 0.0)) {
+            break;
+        }
+
+        alpha = rz / pq;
+        for (i = 0; i < n; ++i) {
+            j->x[i] += alpha * j->p[i];
+            j->r[i] -= alpha * j->q[i];
+        }
+
+        if (sqrt(joint_dot(n, j->r, j->r)) <=
+            GEOMAP_JOINT_CG_TOLERANCE * bnorm) {
+            break;
+        }
+
+        joint_precondition(j, j->r, j->z);
+        rz_new = joint_dot(n, j->r, j->z);
+        beta = rz_new / rz;
+        rz = rz_new;
+        for (i = 0; i < n; ++i) {
+            j->p[i] = j->z[i] + beta * j->p[i];
+        }
+    }
+}
+
+/* Back-substitute the parameter step for the position step:
+   dX = -U^-1 (g + W dp) */
+static void
+joint_position_step(
+        geomap_joint_t* const j) {
+
+    const size_t np = j->nparam;
+    const double* w;
+    const double* dp;
+    double        z[2];
+    size_t        s, i, o, k, a;
+
+    for (s = 0; s < j->ngroup; ++s) {
+        if (!j->used[s]) continue;
+        z[0] = j->gx[s * 2];
+        z[1] = j->gx[s * 2 + 1];
+        for (i = j->group_start[s]; i < j->group_start[s + 1]; ++i) {
+            o = j->group_obs[i];
+            k = j->exposure[o];
+            if (!j->active[o] || k == j->reference) continue;
+            w = j->w + o * 2 * np;
+            dp = j->x + k * np;
+            for (a = 0; a < np; ++a) {
+                z[0] += w[a] * dp[a];
+                z[1] += w[np + a] * dp[a];
+            }
+        }
+        j->dposition[s * 2] =
+            -(j->uinv[s * 3] * z[0] + j->uinv[s * 3 + 1] * z[1]);
+        j->dposition[s * 2 + 1] =
+            -(j->uinv[s * 3 + 1] * z[0] + j->uinv[s * 3 + 2] * z[1]);
+    }
+}
+
+/* Gauss-Newton iteration from the current solution, halving any step
+   that does not decrease the cost */
+static int
+joint_solve(
+        geomap_joint_t* const j,
+        stimage_error_t* const error) {
+
+    const size_t nparam = j->nexposure * j->nparam;
+    double       cost, new_cost, alpha;
+    size_t       step, halving, i, s;
+
+    joint_mark_used(j);
+    cost = joint_cost(j);
+
+    for (step = 0; step < GEOMAP_JOINT_MAX_STEPS && cost > 0.0; ++step) {
+        if (stimage_error_check_progress(
+                    error, "geomap_joint", step, GEOMAP_JOINT_MAX_STEPS) ||
+            joint_normal_equations(j, error) ||
+            joint_reduced_system(j, error)) return 1;
+        joint_solve_reduced(j);
+        joint_position_step(j);
+
+        memcpy(j->old_param, j->param, nparam * sizeof(double));
+        memcpy(j->old_position, j->position, j->ngroup * sizeof(coord_t));
+
+        alpha = 1.0;
+        for (halving = 0; halving < GEOMAP_JOINT_MAX_HALVINGS; ++halving) {
+            for (i = 0; i < nparam; ++i) {
+                j->param[i] = j->old_param[i] + alpha * j->x[i];
+            }
+            for (s = 0; s < j->ngroup; ++s) {
+                if (!j->used[s]) continue;
+                j->position[s].x =
+                    j->old_position[s].x + alpha * j->dposition[s * 2];
+                j->position[s].y =
+                    j->old_position[s].y + alpha * j->dposition[s * 2 + 1];
+            }
+            new_cost = joint_cost(j);
+            if (new_cost <= cost) break;
+            alpha /= 2.0;
+        }
+
+        if (!(new_cost <= cost)) {
+            /* No progress can be made from here */
+            memcpy(j->param, j->old_param, nparam * sizeof(double));
+            memcpy(j->position, j->old_position, j->ngroup * sizeof(coord_t));
+            break;
+        }
+
+        if (cost - new_cost <= GEOMAP_JOINT_TOLERANCE * cost) {
+            break;
+        }
+        cost = new_cost;
+    }
+
+    joint_update_matrices(j);
+
+    return 0;
+}
+
+/* Reject the observations whose residuals are more than reject sigma
+   from the fit of their exposure.  Returns the number rejected. */
+static size_t
+joint_reject(
+        geomap_joint_t* const j,
+        const double reject,
+        double* const sums) {
+
+    size_t  nreject = 0;
+    coord_t fit;
+    double  rx, ry;
+    double* sk;
+    size_t  s, i, o, k;
+
+    /* sums holds n, sum(rx^2), sum(ry^2) for each exposure */
+    memset(sums, 0, j->nexposure * 3 * sizeof(double));
+
+    for (s = 0; s < j->ngroup; ++s) {
+        if (!j->used[s]) continue;
+        for (i = j->group_start[s]; i < j->group_start[s + 1]; ++i) {
+            o = j->group_obs[i];
+            if (!j->active[o]) continue;
+            k = j->exposure[o];
+            joint_apply(
+                    j->param + k * j->nparam, j->matrix + k * 4, &j->center,
+                    &j->position[s], &fit);
+            rx = fit.x - j->coord[o].x;
+            ry = fit.y - j->coord[o].y;
+            sk = sums + k * 3;
+            sk[0] += 1.0;
+            sk[1] += rx * rx;
+            sk[2] += ry * ry;
+        }
+    }
+
+    for (k = 0; k < j->nexposure; ++k) {
+        sk = sums + k * 3;
+        if (sk[0] > 0.0) {
+            sk[1] = reject * sqrt(sk[1] / sk[0]);
+            sk[2] = reject * sqrt(sk[2] / sk[0]);
+        }
+    }
+
+    for (s = 0; s < j->ngroup; ++s) {
+        if (!j->used[s]) continue;
+        for (i = j->group_start[s]; i < j->group_start[s + 1]; ++i) {
+            o = j->group_obs[i];
+            if (!j->active[o]) continue;
+            k = j->exposure[o];
+            sk = sums + k * 3;
+            joint_apply(
+                    j->param + k * j->nparam, j->matrix + k * 4, &j->center,
+                    &j->position[s], &fit);
+            if (fabs(fit.x - j->coord[o].x) > sk[1] ||
+                fabs(fit.y - j->coord[o].y) > sk[2]) {
+                j->active[o] = 0;
+                ++nreject;
+            }
+        }
+    }
+
+    return nreject;
+}
+
+/* Fill in the output records and the result of each exposure */
+static int
+joint_results(
+        geomap_joint_t* const j,
+        const surface_type_e function,
+        /* Output */
+        geomap_output_t* const output,
+        geomap_result_t* const results,
+        stimage_error_t* const error) {
+
+    const double my_nan = fmod(1.0, 0.0);
+    double*      sums   = NULL;
+    double*      sk;
+    bbox_t*      bboxes = NULL;
+    bbox_t*      bk;
+    coord_t      fit;
+    coord_t      shift;
+    size_t       s, i, o, k, first;
+    int          status = 1;
+
+    /* n, sum(x), sum(y), sum(X), sum(Y), sum(rx^2), sum(ry^2) */
+    sums = calloc_with_error(j->nexposure * 7, sizeof(double), error);
+    if (sums == NULL) goto exit;
+
+    bboxes = malloc_with_error(j->nexposure * sizeof(bbox_t), error);
+    if (bboxes == NULL) goto exit;
+    for (k = 0; k < j->nexposure; ++k) {
+        bbox_init(&bboxes[k]);
+    }
+
+    for (s = 0; s < j->ngroup; ++s) {
+        /* Sources that do not constrain the fit are placed by their
+           first active observation */
+        if (!j->used[s] && j->group_start[s] < j->group_start[s + 1]) {
+            first = j->group_obs[j->group_start[s]];
+            for (i = j->group_start[s]; i < j->group_start[s + 1]; ++i) {
+                if (j->active[j->group_obs[i]]) {
+                    first = j->group_obs[i];
+                    break;
+                }
+            }
+            k = j->exposure[first];
+            joint_invert(
+                    j->param + k * j->nparam, j->matrix + k * 4, &j->center,
+                    &j->coord[first], &j->position[s]);
+        }
+
+        for (i = j->group_start[s]; i < j->group_start[s + 1]; ++i) {
+            o = j->group_obs[i];
+            k = j->exposure[o];
+            output[o].input = j->coord[o];
+            output[o].ref = j->position[s];
+            if (!j->used[s] || !j->active[o]) {
+                output[o].fit.x = output[o].fit.y = my_nan;
+                output[o].residual.x = output[o].residual.y = my_nan;
+                continue;
+            }
+
+            joint_apply(
+                    j->param + k * j->nparam, j->matrix + k * 4, &j->center,
+                    &j->position[s], &fit);
+            output[o].fit = fit;
+            output[o].residual.x = j->coord[o].x - fit.x;
+            output[o].residual.y = j->coord[o].y - fit.y;
+
+            sk = sums + k * 7;
+            sk[0] += 1.0;
+            sk[1] += j->coord[o].x;
+            sk[2] += j->coord[o].y;
+            sk[3] += j->position[s].x;
+            sk[4] += j->position[s].y;
+            sk[5] += output[o].residual.x * output[o].residual.x;
+            sk[6] += output[o].residual.y * output[o].residual.y;
+
+            bk = &bboxes[k];
+            if (!(bk->min.x <= j->position[s].x)) bk->min.x = j->position[s].x;
+            if (!(bk->min.y <= j->position[s].y)) bk->min.y = j->position[s].y;
+            if (!(bk->max.x >= j->position[s].x)) bk->max.x = j->position[s].x;
+            if (!(bk->max.y >= j->position[s].y)) bk->max.y = j->position[s].y;
+        }
+    }
+
+    for (k = 0; k < j->nexposure; ++k) {
+        if (!bbox_is_valid(&bboxes[k])) {
+            /* Not used by the fit, which can only be the reference */
+            bboxes[k].min = bboxes[k].max = j->center;
+        }
+
+        shift.x = j->param[k * j->nparam];
+        shift.y = j->param[k * j->nparam + 1];
+        if (geomap_result_from_linear(
+                    j->fit_geometry, function, &bboxes[k], &j->center,
+                    &shift, j->matrix + k * 4, &results[k], error)) {
+            for (i = 0; i < k; ++i) {
+                geomap_result_free(&results[i]);
+            }
+            goto exit;
+        }
+
+        sk = sums + k * 7;
+        if (sk[0] > 0.0) {
+            results[k].mean_input.x = sk[1] / sk[0];
+            results[k].mean_input.y = sk[2] / sk[0];
+            results[k].mean_ref.x = sk[3] / sk[0];
+            results[k].mean_ref.y = sk[4] / sk[0];
+        }
+        if (sk[0] > 1.0) {
+            results[k].rms.x = sqrt(sk[5] / (sk[0] - 1.0));
+            results[k].rms.y = sqrt(sk[6] / (sk[0] - 1.0));
+        }
+    }
+
+    status = 0;
+
+ exit:
+    free(sums);
+    free(bboxes);
+
+    return status;
+}
+
+int
+geomap_joint(
+        const size_t nexposure,
+        const size_t reference,
+        const size_t nobs,
+        const coord_t* const coord,
+        const size_t* const exposure,
+        const size_t* const group,
+        const size_t ngroup,
+        const geomap_fit_e fit_geometry,
+        const surface_type_e function,
+        const size_t maxiter,
+        const double reject,
+        /* Output */
+        geomap_output_t* const output,
+        geomap_result_t* const results,
+        stimage_error_t* const error) {
+
+    geomap_joint_t j;
+    double*        sums   = NULL;
+    size_t         i, iter;
+    int            status = 1;
+
+    assert(coord || nobs == 0);
+    assert(exposure || nobs == 0);
+    assert(group || nobs == 0);
+    assert(fit_geometry < geomap_fit_LAST);
+    assert(function < surface_type_LAST);
+    assert(output || nobs == 0);
+    assert(results);
+    assert(error);
+
+    joint_new(&j);
+
+    if (reference >= nexposure) {
+        stimage_error_set_message(
+                error, "The reference exposure is out of range");
+        goto exit;
+    }
+
+    for (i = 0; i < nobs; ++i) {
+        if (exposure[i] >= nexposure || group[i] >= ngroup) {
+            stimage_error_format_message(
+                    error,
+                    "Observation %lu has an exposure or group out of range",
+                    (unsigned long)i);
+            goto exit;
+        }
+    }
+
+    j.fit_geometry = fit_geometry;
+    j.nparam = joint_nparam(fit_geometry);
+    j.nexposure = nexposure;
+    j.reference = reference;
+    j.nobs = nobs;
+    j.coord = coord;
+    j.exposure = exposure;
+    j.group = group;
+    j.ngroup = ngroup;
+
+    if (joint_alloc(&j, error)) goto exit;
+
+    joint_bucket(nobs, group, ngroup, j.group_start, j.group_obs);
+    joint_bucket(nobs, exposure, nexposure, j.exposure_start, j.exposure_obs);
+
+    if (joint_pattern(&j, error)) goto exit;
+
+    for (i = 0; i < nobs; ++i) {
+        j.active[i] = coord_is_finite(&coord[i]);
+    }
+
+    if (joint_initialize(&j, error) ||
+        joint_solve(&j, error)) goto exit;
+
+    if (maxiter > 0 && reject > 0.0 && isfinite(reject)) {
+        sums = malloc_with_error(nexposure * 3 * sizeof(double), error);
+        if (sums == NULL) goto exit;
+
+        for (iter = 0; iter < maxiter; ++iter) {
+            if (joint_reject(&j, reject, sums) == 0) break;
+            if (joint_solve(&j, error)) goto exit;
+        }
+    }
+
+    if (joint_results(&j, function, output, results, error)) goto exit;
+
+    status = 0;
+
+ exit:
+    free(sums);
+    joint_free(&j);
+
+    return status;
+}
@@ -35,43 +35,139 @@ DAMAGE.
 */
 
 #include <assert.h>
+#include <float.h>
+#include <pthread.h>
+#include <stdlib.h>
 
 #include "immatch/lib/tolerance.h"
 
-int
-match_tolerance(
-        const size_t nref,
-        const coord_t* const ref,
-        const coord_t* const * const ref_sorted,
+/* The smallest number of reference objects given to each thread by
+   match_tolerance_soa */
+#define MATCH_TOLERANCE_MIN_STRIP 1024
+
+/* Find the first input object at or after start that is beyond the
+   tolerance limit in y.  The test is monotonic in a sorted list, so
+   this can gallop ahead and then bisect, rather than stepping through
+   every object in the search range. */
+static size_t
+match_tolerance_window_end(
         const size_t ninput,
-        const coord_t* const input,
-        const coord_t* const * const input_sorted,
+        const double* const iy,
+        size_t start,
+        const double ry,
+        const double tolerance) {
+
+    size_t lo   = start;
+    size_t hi   = start;
+    size_t mid  = 0;
+    size_t step = 1;
+
+    #define BEYOND(i) (ry - iy[i] < -tolerance)
+
+    while (hi < ninput && !BEYOND(hi)) {
+        lo = hi + 1;
+        hi += step;
+        step <<= 1;
+    }
+    if (hi > ninput) {
+        hi = ninput;
+    }
+
+    while (lo < hi) {
+        mid = lo + (hi - lo) / 2;
+        if (BEYOND(mid)) {
+            hi = mid;
+        } else {
+            lo = mid + 1;
+        }
+    }
+
+    #undef BEYOND
+
+    return lo;
+}
+
+/* Find the first input object that is not below the tolerance limit
+   in y of a reference object at ry.  This is where the sequential
+   sweep's search range would start for that reference object. */
+static size_t
+match_tolerance_window_start(
+        const size_t ninput,
+        const double* const iy,
+        const double ry,
+        const double tolerance) {
+
+    size_t lo  = 0;
+    size_t hi  = ninput;
+    size_t mid = 0;
+
+    while (lo < hi) {
+        mid = lo + (hi - lo) / 2;
+        if (ry - iy[mid] < tolerance) {
+            hi = mid;
+        } else {
+            lo = mid + 1;
+        }
+    }
+
+    return lo;
+}
+
+/* Match the reference objects [rbegin, rend) of ref.  Each reference
+   object's match depends only on its own position, so a strip of the
+   sorted reference list can be matched independently of the others,
+   starting from the input object found by
+   match_tolerance_window_start. */
+static int
+match_tolerance_strip(
+        const void* const ref_,
+        const void* const input_,
+        const size_t rbegin,
+        const size_t rend,
         const double tolerance,
         coord_match_callback_t* callback,
         void* callback_data,
         stimage_error_t* const error) {
 
-    const double   tolerance2  = tolerance*tolerance;
-    size_t         rp          = 0;
-    size_t         blp         = 0;
-    size_t         lp          = 0;
-    size_t         input_index = 0;
-    size_t         ref_index   = 0;
-    double         dx, dy, rmax2, r2;
-    const coord_t* rmatch;
-    const coord_t* lmatch;
+    const xysoa_t* ref        = (const xysoa_t*)ref_;
+    const xysoa_t* input      = (const xysoa_t*)input_;
+    const double   tolerance2 = tolerance*tolerance;
+    const double*  ix;
+    const double*  iy;
+    size_t         ninput;
+    size_t         rp         = 0;
+    size_t         blp        = 0;
+    size_t         lp         = 0;
+    size_t         end        = 0;
+    size_t         nblock     = 0;
+    size_t         j          = 0;
+    size_t         lmatch     = 0;
+    double         ncandidates = 0.0;
+    int            found      = 0;
+    double         rx, ry, dx, dy, rmax2;
+    double         r2[XYSOA_BLOCK];
 
     assert(ref);
-    assert(ref_sorted);
     assert(input);
-    assert(input_sorted);
     assert(callback);
     assert(error);
 
-    for (rp = 0; rp < nref; ++rp) {
+    ninput = input->n;
+    ix = input->x;
+    iy = input->y;
+
+    if (rbegin > 0 && rbegin < rend) {
+        blp = match_tolerance_window_start(
+                ninput, iy, ref->y[rbegin], tolerance);
+    }
+
+    for (rp = rbegin; rp < rend; ++rp) {
+        rx = ref->x[rp];
+        ry = ref->y[rp];
+
         /* Compute the start of the search range */
         for (; blp < ninput; ++blp) {
-            dy = ref_sorted[rp]->y - input_sorted[blp]->y;
+            dy = ry - iy[blp];
             if (dy < tolerance) {
                 break;
             }
@@ -88,33 +184,233 @@ match_tolerance(
             continue;
         }
 
-        /* Find the closest match to the reference object */
+        /* Compute the end of the search range */
+        end = match_tolerance_window_end(ninput, iy, blp + 1, ry, tolerance);
+
+        /* Find the closest match to the reference object, computing
+           the distances a block at a time.  Later points win ties,
+           as in match_tolerance. */
         rmax2 = tolerance2;
-        rmatch = NULL;
-        lmatch = NULL;
-        for (lp = blp; lp < ninput; ++lp) {
-            /* Compute the distance between the two points */
-            dy = ref_sorted[rp]->y - input_sorted[lp]->y;
-            if (dy < -tolerance) {
-                break;
+        found = 0;
+        for (lp = blp; lp < end; lp += XYSOA_BLOCK) {
+            nblock = MIN(XYSOA_BLOCK, end - lp);
+
+            /* (ncandidates is a double so that the whole loop,
+               including the count, vectorizes) */
+            ncandidates = 0.0;
+            for (j = 0; j < nblock; ++j) {
+                dy = ry - iy[lp + j];
+                dx = rx - ix[lp + j];
+                r2[j] = dx*dx + dy*dy;
+                ncandidates += (r2[j] <= rmax2) ? 1.0 : 0.0;
             }
-            dx = ref_sorted[rp]->x - input_sorted[lp]->x;
-            r2 = dx*dx + dy*dy;
-
-            /* A match has been found */
-            if (r2 <= rmax2) {
-                rmax2 = r2;
-                rmatch = ref_sorted[rp];
-                lmatch = input_sorted[lp];
+
+            /* Most blocks contain nothing within the tolerance */
+            if (ncandidates == 0.0) {
+                continue;
+            }
+
+            for (j = 0; j < nblock; ++j) {
+                if (r2[j] <= rmax2) {
+                    rmax2 = r2[j];
+                    lmatch = lp + j;
+                    found = 1;
+                }
             }
         }
 
         /* A match was found, so write the results to the output array */
-        if (rmatch != NULL && lmatch != NULL) {
-            ref_index = rmatch - ref;
-            input_index = lmatch - input;
+        if (found) {
+            if (callback(callback_data, ref->index[rp], input->index[lmatch],
+                         error)) {
+                return 1;
+            }
+        }
+    }
+
+    return 0;
+}
+
+/* The single-precision counterpart of match_tolerance_window_end */
+static size_t
+match_tolerance_window_endf(
+        const size_t ninput,
+        const float* const iy,
+        size_t start,
+        const double ry,
+        const double tolerance) {
+
+    size_t lo   = start;
+    size_t hi   = start;
+    size_t mid  = 0;
+    size_t step = 1;
+
+    #define BEYOND(i) (ry - (double)iy[i] < -tolerance)
+
+    while (hi < ninput && !BEYOND(hi)) {
+        lo = hi + 1;
+        hi += step;
+        step <<= 1;
+    }
+    if (hi > ninput) {
+        hi = ninput;
+    }
+
+    while (lo < hi) {
+        mid = lo + (hi - lo) / 2;
+        if (BEYOND(mid)) {
+            hi = mid;
+        } else {
+            lo = mid + 1;
+        }
+    }
+
+    #undef BEYOND
+
+    return lo;
+}
+
+/* The single-precision counterpart of match_tolerance_window_start */
+static size_t
+match_tolerance_window_startf(
+        const size_t ninput,
+        const float* const iy,
+        const double ry,
+        const double tolerance) {
+
+    size_t lo  = 0;
+    size_t hi  = ninput;
+    size_t mid = 0;
+
+    while (lo < hi) {
+        mid = lo + (hi - lo) / 2;
+        if (ry - (double)iy[mid] < tolerance) {
+            hi = mid;
+        } else {
+            lo = mid + 1;
+        }
+    }
+
+    return lo;
+}
+
+/* The single-precision counterpart of match_tolerance_strip */
+static int
+match_tolerance_stripf(
+        const void* const ref_,
+        const void* const input_,
+        const size_t rbegin,
+        const size_t rend,
+        const double tolerance,
+        coord_match_callback_t* callback,
+        void* callback_data,
+        stimage_error_t* const error) {
+
+    const xysoaf_t* ref       = (const xysoaf_t*)ref_;
+    const xysoaf_t* input     = (const xysoaf_t*)input_;
+    const double   tolerance2 = tolerance*tolerance;
+    const float*   ix;
+    const float*   iy;
+    size_t         ninput;
+    size_t         rp         = 0;
+    size_t         blp        = 0;
+    size_t         lp         = 0;
+    size_t         end        = 0;
+    size_t         nblock     = 0;
+    size_t         j          = 0;
+    size_t         lmatch     = 0;
+    float          ncandidates = 0.0f;
+    int            found      = 0;
+    double         rx, ry, dx, dy, r2, rmax2;
+    float          rxf, ryf, dxf, dyf, screen2;
+    float          r2f[XYSOA_BLOCK];
+
+    assert(ref);
+    assert(input);
+    assert(callback);
+    assert(error);
+
+    ninput = input->n;
+    ix = input->x;
+    iy = input->y;
+
+    if (rbegin > 0 && rbegin < rend) {
+        blp = match_tolerance_window_startf(
+                ninput, iy, ref->y[rbegin], tolerance);
+    }
+
+    for (rp = rbegin; rp < rend; ++rp) {
+        rx = ref->x[rp];
+        ry = ref->y[rp];
 
-            if (callback(callback_data, ref_index, input_index, error)) {
+        /* Compute the start of the search range */
+        for (; blp < ninput; ++blp) {
+            dy = ry - (double)iy[blp];
+            if (dy < tolerance) {
+                break;
+            }
+        }
+
+        /* Break if the end of the input list is reached */
+        if (blp >= ninput) {
+            break;
+        }
+
+        /* If one is outside the tolerance limits, skip to next
+           reference object. */
+        if (dy < -tolerance) {
+            continue;
+        }
+
+        /* Compute the end of the search range */
+        end = match_tolerance_window_endf(ninput, iy, blp + 1, ry, tolerance);
+
+        /* Find the closest match to the reference object, as in
+           match_tolerance_soa */
+        rmax2 = tolerance2;
+        found = 0;
+        rxf = ref->x[rp];
+        ryf = ref->y[rp];
+        for (lp = blp; lp < end; lp += XYSOA_BLOCK) {
+            nblock = MIN(XYSOA_BLOCK, end - lp);
+
+            /* Screen the block in single precision, with the
+               threshold widened so that no point that is within rmax2
+               in double precision can be missed (see xysoa.h) */
+            screen2 = (float)MIN(
+                    rmax2 * (1.0 + XYSOAF_R2_RELATIVE_MARGIN) +
+                    XYSOAF_R2_ABSOLUTE_MARGIN, FLT_MAX);
+            ncandidates = 0.0f;
+            for (j = 0; j < nblock; ++j) {
+                dyf = ryf - iy[lp + j];
+                dxf = rxf - ix[lp + j];
+                r2f[j] = dxf*dxf + dyf*dyf;
+                ncandidates += (r2f[j] <= screen2) ? 1.0f : 0.0f;
+            }
+
+            if (ncandidates == 0.0f) {
+                continue;
+            }
+
+            /* Pick the closest candidate in double precision */
+            for (j = 0; j < nblock; ++j) {
+                if (r2f[j] <= screen2) {
+                    dy = ry - (double)iy[lp + j];
+                    dx = rx - (double)ix[lp + j];
+                    r2 = dx*dx + dy*dy;
+                    if (r2 <= rmax2) {
+                        rmax2 = r2;
+                        lmatch = lp + j;
+                        found = 1;
+                    }
+                }
+            }
+        }
+
+        /* A match was found, so write the results to the output array */
+        if (found) {
+            if (callback(callback_data, ref->index[rp], input->index[lmatch],
+                         error)) {
                 return 1;
             }
         }
@@ -122,3 +418,259 @@ match_tolerance(
 
     return 0;
 }
+
+/* The signature shared by match_tolerance_strip and
+   match_tolerance_stripf */
+typedef int (match_tolerance_strip_t)(
+        const void* const ref,
+        const void* const input,
+        const size_t rbegin,
+        const size_t rend,
+        const double tolerance,
+        coord_match_callback_t* callback,
+        void* callback_data,
+        stimage_error_t* const error);
+
+/* One strip of a threaded match.  The matches are buffered as (ref
+   index, input index) pairs, and handed to the real callback once all
+   of the strips are done. */
+typedef struct {
+    match_tolerance_strip_t* strip;
+    const void*              ref;
+    const void*              input;
+    size_t                   rbegin;
+    size_t                   rend;
+    double                   tolerance;
+    size_t                   nmatches;
+    size_t                   capacity;
+    size_t*                  matches; /* [capacity * 2] */
+    int                      status;
+    stimage_error_t          error;
+} match_tolerance_task_t;
+
+static int
+match_tolerance_buffer_callback(
+        void* data,
+        size_t ref_index,
+        size_t input_index,
+        stimage_error_t* error) {
+
+    match_tolerance_task_t* task = (match_tolerance_task_t*)data;
+    size_t*                 matches;
+    size_t                  capacity;
+
+    if (task->nmatches >= task->capacity) {
+        capacity = task->capacity ? task->capacity * 2 : 1024;
+        matches = realloc(task->matches, capacity * 2 * sizeof(size_t));
+        if (matches == NULL) {
+            stimage_error_set_message(error, "Out of memory");
+            return 1;
+        }
+        task->matches = matches;
+        task->capacity = capacity;
+    }
+
+    task->matches[task->nmatches * 2] = ref_index;
+    task->matches[task->nmatches * 2 + 1] = input_index;
+    ++(task->nmatches);
+
+    return 0;
+}
+
+static void*
+match_tolerance_thread(
+        void* data) {
+
+    match_tolerance_task_t* task = (match_tolerance_task_t*)data;
+
+    task->status = task->strip(
+            task->ref, task->input, task->rbegin, task->rend, task->tolerance,
+            &match_tolerance_buffer_callback, task, &task->error);
+
+    return NULL;
+}
+
+/* Split the sorted reference list into nthreads strips of (nearly)
+   equal size, match each of them in its own thread, and then pass
+   the matches to the callback strip by strip.  Since the strips are
+   contiguous ranges of the sorted list, this calls the callback with
+   exactly the same matches, in exactly the same order, as a single
+   sequential sweep. */
+static int
+match_tolerance_threaded(
+        match_tolerance_strip_t* strip,
+        const void* const ref,
+        const size_t nref,
+        const void* const input,
+        const double tolerance,
+        size_t nthreads,
+        coord_match_callback_t* callback,
+        void* callback_data,
+        stimage_error_t* const error) {
+
+    match_tolerance_task_t* tasks    = NULL;
+    pthread_t*              threads  = NULL;
+    int*                    started  = NULL;
+    size_t                  i        = 0;
+    size_t                  j        = 0;
+    int                     status   = 1;
+
+    /* Strips much smaller than this aren't worth a thread */
+    nthreads = MIN(nthreads, nref / MATCH_TOLERANCE_MIN_STRIP);
+    if (nthreads <= 1) {
+        return strip(ref, input, 0, nref, tolerance,
+                     callback, callback_data, error);
+    }
+
+    tasks = calloc_with_error(nthreads, sizeof(match_tolerance_task_t), error);
+    if (tasks == NULL) goto exit;
+    threads = malloc_with_error(nthreads * sizeof(pthread_t), error);
+    if (threads == NULL) goto exit;
+    started = calloc_with_error(nthreads, sizeof(int), error);
+    if (started == NULL) goto exit;
+
+    for (i = 0; i < nthreads; ++i) {
+        tasks[i].strip = strip;
+        tasks[i].ref = ref;
+        tasks[i].input = input;
+        tasks[i].rbegin = nref * i / nthreads;
+        tasks[i].rend = nref * (i + 1) / nthreads;
+        tasks[i].tolerance = tolerance;
+        stimage_error_init(&tasks[i].error);
+    }
+
+    /* If a thread can't be started, its strip is run here instead */
+    for (i = 0; i < nthreads; ++i) {
+        started[i] = pthread_create(
+                &threads[i], NULL, &match_tolerance_thread, &tasks[i]) == 0;
+        if (!started[i]) {
+            match_tolerance_thread(&tasks[i]);
+        }
+    }
+
+    for (i = 0; i < nthreads; ++i) {
+        if (started[i]) {
+            pthread_join(threads[i], NULL);
+        }
+    }
+
+    for (i = 0; i < nthreads; ++i) {
+        if (tasks[i].status) {
+            stimage_error_set_message(
+                    error, stimage_error_get_message(&tasks[i].error));
+            goto exit;
+        }
+    }
+
+    for (i = 0; i < nthreads; ++i) {
+        for (j = 0; j < tasks[i].nmatches; ++j) {
+            if (callback(callback_data,
+                         tasks[i].matches[j * 2],
+                         tasks[i].matches[j * 2 + 1],
+                         error)) {
+                goto exit;
+            }
+        }
+    }
+
+    status = 0;
+
+ exit:
+
+    if (tasks != NULL) {
+        for (i = 0; i < nthreads; ++i) {
+            free(tasks[i].matches);
+        }
+    }
+    free(tasks);
+    free(threads);
+    free(started);
+
+    return status;
+}
+
+int
+match_tolerance_soa(
+        const xysoa_t* const ref,
+        const xysoa_t* const input,
+        const double tolerance,
+        const size_t nthreads,
+        coord_match_callback_t* callback,
+        void* callback_data,
+        stimage_error_t* const error) {
+
+    assert(ref);
+    assert(input);
+    assert(callback);
+    assert(error);
+
+    return match_tolerance_threaded(
+            &match_tolerance_strip, ref, ref->n, input, tolerance, nthreads,
+            callback, callback_data, error);
+}
+
+int
+match_tolerance_soaf(
+        const xysoaf_t* const ref,
+        const xysoaf_t* const input,
+        const double tolerance,
+        const size_t nthreads,
+        coord_match_callback_t* callback,
+        void* callback_data,
+        stimage_error_t* const error) {
+
+    assert(ref);
+    assert(input);
+    assert(callback);
+    assert(error);
+
+    return match_tolerance_threaded(
+            &match_tolerance_stripf, ref, ref->n, input, tolerance, nthreads,
+            callback, callback_data, error);
+}
+
+int
+match_tolerance(
+        const size_t nref,
+        const coord_t* const ref,
+        const coord_t* const * const ref_sorted,
+        const size_t ninput,
+        const coord_t* const input,
+        const coord_t* const * const input_sorted,
+        const double tolerance,
+        coord_match_callback_t* callback,
+        void* callback_data,
+        stimage_error_t* const error) {
+
+    xysoa_t ref_soa;
+    xysoa_t input_soa;
+    int     status = 1;
+
+    assert(ref);
+    assert(ref_sorted);
+    assert(input);
+    assert(input_sorted);
+    assert(callback);
+    assert(error);
+
+    xysoa_new(&ref_soa);
+    xysoa_new(&input_soa);
+
+    if (xysoa_init(&ref_soa, nref, error) ||
+        xysoa_init(&input_soa, ninput, error)) {
+        goto exit;
+    }
+
+    xysoa_gather(nref, ref, ref_sorted, &ref_soa);
+    xysoa_gather(ninput, input, input_sorted, &input_soa);
+
+    status = match_tolerance_soa(
+            &ref_soa, &input_soa, tolerance, 1, callback, callback_data, error);
+
+ exit:
+
+    xysoa_free(&ref_soa);
+    xysoa_free(&input_soa);
+
+    return status;
+}
@@ -38,6 +38,19 @@ DAMAGE.
 #include <math.h>
 
 #include "immatch/lib/triangles.h"
+#include "lib/radixsort.h"
+
+/* The number of triangle comparisons merge_triangles makes between
+   polls of the progress callback.  This counts the comparisons rather
+   than the reference triangles, since the ratio window searched for
+   each reference triangle grows with the size of the lists. */
+#define TRIANGLES_PROGRESS_COMPARISONS (1 << 20)
+
+/* The fraction of the input triangles that falls within the ratio
+   window of each reference triangle in merge_triangles.  It depends on
+   the tolerance and the spacing of the points, and is between a third
+   and a half for the default tolerance of a pixel. */
+#define TRIANGLES_WINDOW_FRACTION 0.4
 
 int
 max_num_triangles(
@@ -59,6 +72,83 @@ max_num_triangles(
     return 0;
 }
 
+/* The number of triangles from n points, without the range check of
+   max_num_triangles */
+static size_t
+count_triangles(
+        const size_t n) {
+
+    if (n < 3) {
+        return 0;
+    }
+
+    return n * (n - 1) / 2 * (n - 2) / 3;
+}
+
+void
+estimate_triangles_cost(
+        const size_t nref,
+        const size_t ninput,
+        const size_t nmatch,
+        const size_t nreject,
+        triangles_cost_t* const cost) {
+
+    /* The sort scratch space for each triangle: the permutation, the
+       keys and the radix sort's temporary keys and indices */
+    const size_t sort_bytes  = 2 * sizeof(size_t) + 2 * sizeof(uint64_t);
+    const size_t nref_used   = MIN(nref, nmatch);
+    const size_t ninput_used = MIN(ninput, nmatch);
+    size_t       nref_bytes;
+    size_t       ninput_bytes;
+    size_t       nmatches;
+    size_t       nbytes;
+    size_t       peak;
+
+    assert(cost);
+
+    cost->nref_triangles   = count_triangles(nref_used);
+    cost->ninput_triangles = count_triangles(ninput_used);
+    nmatches = MAX(cost->nref_triangles, cost->ninput_triangles);
+
+    nref_bytes = cost->nref_triangles * sizeof(triangle_t);
+    ninput_bytes = cost->ninput_triangles * sizeof(triangle_t);
+
+    /* Building and sorting the reference triangles */
+    peak = nref_bytes + cost->nref_triangles * sort_bytes;
+
+    /* Building and sorting the input triangles */
+    nbytes = nref_bytes + ninput_bytes + cost->ninput_triangles * sort_bytes;
+    peak = MAX(peak, nbytes);
+
+    /* Merging and rejecting the triangle matches */
+    nbytes = nref_bytes + ninput_bytes +
+        nmatches * (sizeof(triangle_match_t) + sizeof(double));
+    peak = MAX(peak, nbytes);
+
+    /* Voting on the coordinate matches */
+    nbytes = nref_bytes + ninput_bytes +
+        nmatches * sizeof(triangle_match_t) +
+        (nref + ninput) * sizeof(size_t) +
+        (nref_used + ninput_used) * sizeof(coord_t*) +
+        nref_used * ninput_used * sizeof(size_t);
+    peak = MAX(peak, nbytes);
+
+    /* The coordinate matches */
+    cost->nbytes = peak + 2 * nmatch * sizeof(coord_t*);
+
+    /* merge_triangles compares each reference triangle with every
+       input triangle in a window around its ratio, and so dominates
+       everything else once there are more than a handful of points */
+    cost->work =
+        (double)cost->nref_triangles +
+        (double)cost->ninput_triangles +
+        (double)cost->nref_triangles * (double)cost->ninput_triangles *
+            TRIANGLES_WINDOW_FRACTION +
+        (double)nmatches * (double)(1 + nreject) +
+        (double)nref_used * (double)ninput_used +
+        (double)(nref + ninput);
+}
+
 static const size_t
 sides_def [3][2] = {
     { 2, 1 },
@@ -66,22 +156,40 @@ sides_def [3][2] = {
     { 2, 0 }
 };
 
-/* Uses as a qsort functor */
+/* Sort the triangles in increasing order of ratio.  The permutation
+   is computed with a radix sort on the ratios, and then applied to the
+   triangles in place, so no second copy of the (potentially very
+   large) triangle table is required. */
 static int
-triangle_ratio_compare(
-        const void* ap,
-        const void* bp) {
+sort_triangles(
+        const size_t ntriangles,
+        triangle_t* const triangles,
+        stimage_error_t* const error) {
 
-    const triangle_t* a = (const triangle_t*)ap;
-    const triangle_t* b = (const triangle_t*)bp;
+    size_t* perm   = NULL;
+    int     status = 1;
 
-    if (a->ratio < b->ratio) {
-        return -1;
-    } else if (a->ratio > b->ratio) {
-        return 1;
-    } else {
+    if (ntriangles == 0) {
         return 0;
     }
+
+    perm = malloc_with_error(ntriangles * sizeof(size_t), error);
+    if (perm == NULL) goto exit;
+
+    if (radix_argsort(
+                ntriangles, &triangles[0].ratio, sizeof(triangle_t), perm,
+                error) ||
+        apply_permutation(
+                ntriangles, triangles, sizeof(triangle_t), perm,
+                error)) goto exit;
+
+    status = 0;
+
+ exit:
+
+    free(perm);
+
+    return status;
 }
 
 int
@@ -119,6 +227,11 @@ find_triangles(
     }
 
     for (i = 0; i < npoints - (2 * nsample); i += nsample) {
+        if (stimage_error_check_progress(
+                    error, "find_triangles", i, npoints)) {
+            return 1;
+        }
+
         for (j = i + nsample; j < npoints - nsample; j += nsample) {
             dist_ij = euclid_distance2(coords[i], coords[j]);
             if (dist_ij <= tol2) {
@@ -232,9 +345,26 @@ find_triangles(
     *ntriangles = ntri;
 
     /* Sort the triangles in increasing order of ratio */
-    qsort(triangles, ntri, sizeof(triangle_t), &triangle_ratio_compare);
+    return sort_triangles(ntri, triangles, error);
+}
 
-    return 0;
+/* Count one comparison made by merge_triangles, and poll the progress
+   callback once every TRIANGLES_PROGRESS_COMPARISONS of them */
+static int
+merge_triangles_poll(
+        size_t* const ncompare,
+        const size_t rp,
+        const size_t nr_triangles,
+        stimage_error_t* const error) {
+
+    if (++*ncompare < TRIANGLES_PROGRESS_COMPARISONS) {
+        return 0;
+    }
+
+    *ncompare = 0;
+
+    return stimage_error_check_progress(
+            error, "merge_triangles", rp, nr_triangles);
 }
 
 int
@@ -251,6 +381,8 @@ merge_triangles(
     size_t match_iter = 0;
     double rmaxtol, lmaxtol, maxtol;
     size_t blp = 0, rp = 0, lp = 0;
+    /* Poll on the first reference triangle */
+    size_t ncompare = TRIANGLES_PROGRESS_COMPARISONS - 1;
     double dratio, dratio2, dcosine, dcosine2, dtratio, dtcosine;
     const triangle_t* max_tri = NULL;
     const triangle_t* l_tri = NULL;
@@ -279,6 +411,10 @@ merge_triangles(
 
     /* Loop over all the triangles in R */
     for (rp = 0; rp < nr_triangles; ++rp) {
+        if (merge_triangles_poll(&ncompare, rp, nr_triangles, error)) {
+            return 1;
+        }
+
         r_tri = r_triangles + rp;
 
         /* Move to the first triangle in L that satisfies the ratio
@@ -312,6 +448,10 @@ merge_triangles(
         max_dcosine2 = 0.5 * MAX_DOUBLE;
 
         for (lp = blp; lp < nl_triangles; ++lp) {
+            if (merge_triangles_poll(&ncompare, rp, nr_triangles, error)) {
+                return 1;
+            }
+
             l_tri = l_triangles + lp;
 
             /* Quit the loop if the next triangle is out of match range. */
@@ -466,6 +606,11 @@ reject_triangles(
 
     /* Begin the rejection loop */
     for (niter = 0; niter < nreject; ++niter) {
+        if (stimage_error_check_progress(
+                    error, "reject_triangles", niter, nreject)) {
+            goto exit;
+        }
+
         ncount = 0;
         locut = mode - factor * sigma;
         hicut = mode + factor * sigma;
@@ -559,13 +704,18 @@ reject_triangles(
     return status;
 }
 
+/* nref and ninput are the lengths of ref_sorted and input_sorted,
+   which may be shorter than the ref and input arrays they point into
+   (nref_all and ninput_all long) */
 static int
 _match_triangles(
+        const size_t nref_all,
         const size_t nref,
         const coord_t* const ref,
         const coord_t* const * const ref_sorted, /*[nref]*/
+        const size_t ninput_all,
         const size_t ninput,
-        const coord_t* const input, /*[ninput]*/
+        const coord_t* const input, /*[ninput_all]*/
         const coord_t* const * const input_sorted,
         size_t* ncoord_matches,
         const coord_t** refcoord_matches_,
@@ -574,6 +724,8 @@ _match_triangles(
         const double tolerance,
         const double maxratio,
         const size_t nreject,
+        const size_t nref_triangles_in,
+        const triangle_t* const ref_triangles_in,
         size_t* nkeep,
         size_t* nmerge,
         stimage_error_t* const error) {
@@ -586,6 +738,7 @@ _match_triangles(
     const coord_t*    right              = NULL;
     size_t            nref_triangles     = 0;
     triangle_t*       ref_triangles      = NULL;
+    const triangle_t* ref_triangles_used = NULL;
     size_t            ninput_triangles   = 0;
     triangle_t*       input_triangles    = NULL;
     size_t            ntriangle_matches  = 0;
@@ -617,15 +770,22 @@ _match_triangles(
         goto exit;
     }
 
-    /* Find all the reference triangles */
-    if (max_num_triangles(nref, nmatch, &nref_triangles, error)) goto exit;
+    /* Find all the reference triangles, unless they were provided by
+       the caller (for example, from a reference index) */
+    if (ref_triangles_in != NULL) {
+        nref_triangles = nref_triangles_in;
+        ref_triangles_used = ref_triangles_in;
+    } else {
+        if (max_num_triangles(nref, nmatch, &nref_triangles, error)) goto exit;
 
-    ref_triangles = malloc_with_error(
-            nref_triangles * sizeof(triangle_t), error);
-    if (ref_triangles == NULL) goto exit;
+        ref_triangles = malloc_with_error(
+                nref_triangles * sizeof(triangle_t), error);
+        if (ref_triangles == NULL) goto exit;
 
-    if (find_triangles(nref, ref_sorted, &nref_triangles, ref_triangles,
-                       nmatch, tolerance, maxratio, error)) goto exit;
+        if (find_triangles(nref, ref_sorted, &nref_triangles, ref_triangles,
+                           nmatch, tolerance, maxratio, error)) goto exit;
+        ref_triangles_used = ref_triangles;
+    }
 
     if (nref_triangles == 0) {
         stimage_error_set_message(
@@ -662,25 +822,25 @@ _match_triangles(
     if (nref_triangles <= ninput_triangles) {
         refcoord_matches = inputcoord_matches_;
         inputcoord_matches = refcoord_matches_;
-        nleft = ninput;
+        nleft = ninput_all;
         left = input;
-        nright = nref;
+        nright = nref_all;
         right = ref;
         if (merge_triangles(
-                nref_triangles, ref_triangles,
+                nref_triangles, ref_triangles_used,
                 ninput_triangles, input_triangles,
                 &ntriangle_matches, triangle_matches,
                 error)) goto exit;
     } else {
         refcoord_matches = refcoord_matches_;
         inputcoord_matches = inputcoord_matches_;
-        nleft = nref;
+        nleft = nref_all;
         left = ref;
-        nright = ninput;
+        nright = ninput_all;
         right = input;
         if (merge_triangles(
                 ninput_triangles, input_triangles,
-                nref_triangles, ref_triangles,
+                nref_triangles, ref_triangles_used,
                 &ntriangle_matches, triangle_matches,
                 error)) goto exit;
     }
@@ -726,8 +886,8 @@ _match_triangles(
     return status;
 }
 
-int
-match_triangles(
+static int
+_match_triangles_with_ref_triangles(
         const size_t nref,
         const size_t nref_unique,
         const coord_t* const ref,
@@ -740,6 +900,8 @@ match_triangles(
         const double tolerance,
         const double maxratio,
         const size_t nreject,
+        const size_t nref_triangles,
+        const triangle_t* const ref_triangles,
         coord_match_callback_t* callback,
         void* callback_data,
         stimage_error_t* const error) {
@@ -764,10 +926,11 @@ match_triangles(
     if (inputcoord_matches == NULL) goto exit;
 
     if (_match_triangles(
-        nref_unique, ref, ref_sorted,
-        ninput_unique, input, input_sorted,
+        nref, nref_unique, ref, ref_sorted,
+        ninput, ninput_unique, input, input_sorted,
         &ncoord_matches, refcoord_matches, inputcoord_matches,
         nmatch, tolerance, maxratio, nreject,
+        nref_triangles, ref_triangles,
         &nkeep, &nmerge,
         error)) goto exit;
 
@@ -783,10 +946,11 @@ match_triangles(
     if (ncoord_matches < nmatch && ncoord_matches > 2) {
         ncheck = ncoord_matches;
         if (_match_triangles(
-                ncoord_matches, ref, refcoord_matches,
-                ncoord_matches, input, inputcoord_matches,
+                nref, ncoord_matches, ref, refcoord_matches,
+                ninput, ncoord_matches, input, inputcoord_matches,
                 &ncoord_matches, refcoord_matches, inputcoord_matches,
                 nmatch, tolerance, maxratio, nreject,
+                0, NULL,
                 &nkeep, &nmerge, error)) goto exit;
 
         if (ncoord_matches < ncheck) {
@@ -819,3 +983,66 @@ match_triangles(
 
     return status;
 }
+
+int
+match_triangles(
+        const size_t nref,
+        const size_t nref_unique,
+        const coord_t* const ref,
+        const coord_t* const * const ref_sorted, /*[nref]*/
+        const size_t ninput,
+        const size_t ninput_unique,
+        const coord_t* const input, /*[ninput]*/
+        const coord_t* const * const input_sorted,
+        const size_t nmatch,
+        const double tolerance,
+        const double maxratio,
+        const size_t nreject,
+        coord_match_callback_t* callback,
+        void* callback_data,
+        stimage_error_t* const error) {
+
+    return _match_triangles_with_ref_triangles(
+            nref, nref_unique, ref, ref_sorted,
+            ninput, ninput_unique, input, input_sorted,
+            nmatch, tolerance, maxratio, nreject,
+            0, NULL,
+            callback, callback_data, error);
+}
+
+int
+match_triangles_with_ref_triangles(
+        const size_t nref,
+        const size_t nref_unique,
+        const coord_t* const ref,
+        const coord_t* const * const ref_sorted, /*[nref]*/
+        const size_t ninput,
+        const size_t ninput_unique,
+        const coord_t* const input, /*[ninput]*/
+        const coord_t* const * const input_sorted,
+        const size_t nmatch,
+        const double tolerance,
+        const double maxratio,
+        const size_t nreject,
+        const size_t nref_triangles,
+        const triangle_t* const ref_triangles,
+        coord_match_callback_t* callback,
+        void* callback_data,
+        stimage_error_t* const error) {
+
+    assert(ref_triangles);
+
+    if (nref_triangles == 0) {
+        stimage_error_set_message(
+            error,
+            "No valid reference triangles found.");
+        return 1;
+    }
+
+    return _match_triangles_with_ref_triangles(
+            nref, nref_unique, ref, ref_sorted,
+            ninput, ninput_unique, input, input_sorted,
+            nmatch, tolerance, maxratio, nreject,
+            nref_triangles, ref_triangles,
+            callback, callback_data, error);
+}
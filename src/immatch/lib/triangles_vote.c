@@ -55,6 +55,12 @@ vote_triangle_matches(
     typedef size_t vote_t;
 
     vote_t*           votes        = NULL;
+    size_t*           lmap         = NULL;
+    size_t*           rmap         = NULL;
+    const coord_t**   lused        = NULL;
+    const coord_t**   rused        = NULL;
+    size_t            nlused       = 0;
+    size_t            nrused       = 0;
     vote_t            maxvote      = 0;
     vote_t            half_maxvote = 0;
     vote_t            row_maxvote  = 0;
@@ -78,33 +84,77 @@ vote_triangle_matches(
     assert(inputcoord_matches);
     assert(error);
 
-    /* Since the vote tallies are rather sparse, this uses a nested
-       map from reference coordinates to a map from input coordinates
-       to vote counts. */
+    /* Only the coordinates at the vertices of the triangles can get
+       votes, and there are at most nmatch of those on each side, so
+       the vote table is built over just those coordinates rather than
+       over all nleft * nright pairs.  They are numbered in the order
+       they appear in left and right, so the result is the same as for
+       the full table. */
 
-    #define VOTE(li, ri) votes[(ri) * nleft + (li)]
+    #define VOTE(li, ri) votes[(ri) * nlused + (li)]
 
-    votes = malloc(nleft * nright * sizeof(size_t));
-    if (votes == NULL) {
-        goto exit;
+    lmap = malloc_with_error(nleft * sizeof(size_t), error);
+    if (lmap == NULL) goto exit;
+    rmap = malloc_with_error(nright * sizeof(size_t), error);
+    if (rmap == NULL) goto exit;
+
+    for (li = 0; li < nleft; ++li) {
+        lmap[li] = 0;
+    }
+    for (ri = 0; ri < nright; ++ri) {
+        rmap[ri] = 0;
+    }
+
+    for (i = 0; i < ntriangle_matches; ++i) {
+        for (j = 0; j < 3; ++j) {
+            li = triangle_matches[i].l->vertices[j] - left;
+            assert(li < nleft);
+            lmap[li] = 1;
+            ri = triangle_matches[i].r->vertices[j] - right;
+            assert(ri < nright);
+            rmap[ri] = 1;
+        }
+    }
+
+    for (li = 0; li < nleft; ++li) {
+        nlused += lmap[li];
+    }
+    for (ri = 0; ri < nright; ++ri) {
+        nrused += rmap[ri];
     }
 
-    for (i = 0; i < nleft * nright; ++i) {
-        votes[i] = 0;
+    lused = malloc_with_error(MAX(nlused, 1) * sizeof(coord_t*), error);
+    if (lused == NULL) goto exit;
+    rused = malloc_with_error(MAX(nrused, 1) * sizeof(coord_t*), error);
+    if (rused == NULL) goto exit;
+
+    nlused = 0;
+    for (li = 0; li < nleft; ++li) {
+        if (lmap[li]) {
+            lused[nlused] = left + li;
+            lmap[li] = nlused++;
+        }
+    }
+    nrused = 0;
+    for (ri = 0; ri < nright; ++ri) {
+        if (rmap[ri]) {
+            rused[nrused] = right + ri;
+            rmap[ri] = nrused++;
+        }
     }
 
+    votes = calloc_with_error(
+            MAX(nlused * nrused, 1), sizeof(vote_t), error);
+    if (votes == NULL) goto exit;
+
     /* Accumulate the votes */
     for (i = 0; i < ntriangle_matches; ++i) {
         r_tri = triangle_matches[i].r;
         l_tri = triangle_matches[i].l;
 
         for (j = 0; j < 3; ++j) {
-            l_coord = l_tri->vertices[j];
-            r_coord = r_tri->vertices[j];
-            li = l_coord - left;
-            assert(li >= 0 && li < nleft);
-            ri = r_coord - right;
-            assert(ri >= 0 && ri < nright);
+            li = lmap[l_tri->vertices[j] - left];
+            ri = rmap[r_tri->vertices[j] - right];
             vote = ++VOTE(li, ri);
             if (maxvote < vote) {
                 maxvote = vote;
@@ -120,18 +170,18 @@ vote_triangle_matches(
 
     half_maxvote = maxvote >> 1;
     ncount = 0;
-    for (ri = 0; ri < nright; ++ri) {
-        r_coord = right + ri;
+    for (ri = 0; ri < nrused; ++ri) {
+        r_coord = rused[ri];
 
         row_maxvote = 0;
         row_2maxvote = 0;
         l_coord = NULL;
-        for (li = 0; li < nleft; ++li) {
+        for (li = 0; li < nlused; ++li) {
             vote = VOTE(li, ri);
             if (vote > row_maxvote) {
                 row_2maxvote = row_maxvote;
                 row_maxvote = vote;
-                l_coord = left + li;
+                l_coord = lused[li];
             }
         }
 
@@ -153,8 +203,8 @@ vote_triangle_matches(
 
         /* Remove all future matches involving the input coord, so it
            won't be matched twice. */
-        for (ri2 = ri; ri2 < nright; ++ri2) {
-            li = l_coord - left;
+        for (ri2 = ri; ri2 < nrused; ++ri2) {
+            li = lmap[l_coord - left];
             VOTE(li, ri) = 0;
         }
 
@@ -179,6 +229,10 @@ vote_triangle_matches(
  exit:
 
     free(votes);
+    free(lmap);
+    free(rmap);
+    free(lused);
+    free(rused);
 
     return status;
 }
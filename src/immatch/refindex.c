@@ -0,0 +1,402 @@
+/*
+Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+    1. Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+
+    2. Redistributions in binary form must reproduce the above
+      copyright notice, this list of conditions and the following
+      disclaimer in the documentation and/or other materials provided
+      with the distribution.
+
+    3. The name of AURA and its representatives may not be used to
+      endorse or promote products derived from this software without
+      specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+DAMAGE.
+*/
+
+#include <assert.h>
+#include <errno.h>
+#include <stdio.h>
+#include <string.h>
+
+#include "immatch/refindex.h"
+#include "lib/xycoincide.h"
+#include "lib/xysort.h"
+
+static uint64_t
+refindex_align(
+        const uint64_t offset) {
+
+    return (offset + (REFINDEX_ALIGN - 1)) & ~((uint64_t)REFINDEX_ALIGN - 1);
+}
+
+static int
+refindex_write(
+        FILE* fd,
+        const uint64_t offset,
+        const void* const data,
+        const size_t size,
+        const char* const path,
+        stimage_error_t* const error) {
+
+    static const char padding[REFINDEX_ALIGN] = {0};
+    long              position;
+
+    /* Pad up to the start of the section */
+    position = ftell(fd);
+    if (position < 0 || (uint64_t)position > offset) {
+        goto fail;
+    }
+    while ((uint64_t)position < offset) {
+        size_t npad = MIN((size_t)(offset - position), sizeof(padding));
+        if (fwrite(padding, 1, npad, fd) != npad) goto fail;
+        position += (long)npad;
+    }
+
+    if (size && fwrite(data, 1, size, fd) != size) goto fail;
+
+    return 0;
+
+ fail:
+    stimage_error_format_message(
+        error, "Error writing reference index '%s': %s", path, strerror(errno));
+    return 1;
+}
+
+int
+refindex_build(
+        const size_t nref,
+        const coord_t* const ref /*[nref]*/,
+        const double separation,
+        const size_t nmatch,
+        const double tolerance,
+        const double maxratio,
+        const char* const path,
+        stimage_error_t* const error) {
+
+    const coord_t**      ref_sorted     = NULL;
+    uint64_t*            sorted         = NULL;
+    uint64_t*            unique         = NULL;
+    size_t               nunique        = 0;
+    size_t               ntriangles     = 0;
+    triangle_t*          triangles      = NULL;
+    refindex_triangle_t* triangle_table = NULL;
+    refindex_header_t    header;
+    FILE*                fd             = NULL;
+    size_t               i, j;
+    int                  status         = 1;
+
+    assert(ref);
+    assert(path);
+    assert(error);
+
+    if (nref == 0) {
+        stimage_error_set_message(error, "The reference coordinate list is empty");
+        goto exit;
+    }
+
+    /****************************************
+     SORT AND CULL
+    */
+    ref_sorted = malloc_with_error(nref * sizeof(coord_t*), error);
+    if (ref_sorted == NULL) goto exit;
+    sorted = malloc_with_error(nref * sizeof(uint64_t), error);
+    if (sorted == NULL) goto exit;
+    unique = malloc_with_error(nref * sizeof(uint64_t), error);
+    if (unique == NULL) goto exit;
+
+    xysort(nref, ref, ref_sorted);
+    for (i = 0; i < nref; ++i) {
+        sorted[i] = (uint64_t)(ref_sorted[i] - ref);
+    }
+
+    nunique = xycoincide(nref, ref_sorted, ref_sorted, separation);
+    for (i = 0; i < nunique; ++i) {
+        unique[i] = (uint64_t)(ref_sorted[i] - ref);
+    }
+
+    /****************************************
+     BUILD THE TRIANGLE TABLE
+    */
+    if (nmatch > 0 && nunique >= 3) {
+        if (max_num_triangles(nunique, nmatch, &ntriangles, error)) goto exit;
+
+        triangles = malloc_with_error(ntriangles * sizeof(triangle_t), error);
+        if (triangles == NULL) goto exit;
+
+        if (find_triangles(nunique, ref_sorted, &ntriangles, triangles,
+                           nmatch, tolerance, maxratio, error)) goto exit;
+
+        triangle_table = malloc_with_error(
+                MAX(ntriangles, 1) * sizeof(refindex_triangle_t), error);
+        if (triangle_table == NULL) goto exit;
+
+        for (i = 0; i < ntriangles; ++i) {
+            for (j = 0; j < 3; ++j) {
+                triangle_table[i].vertices[j] =
+                    (uint64_t)(triangles[i].vertices[j] - ref);
+            }
+            triangle_table[i].log_perimeter    = triangles[i].log_perimeter;
+            triangle_table[i].ratio            = triangles[i].ratio;
+            triangle_table[i].cosine_v1        = triangles[i].cosine_v1;
+            triangle_table[i].ratio_tolerance  = triangles[i].ratio_tolerance;
+            triangle_table[i].cosine_tolerance = triangles[i].cosine_tolerance;
+            triangle_table[i].sense            = triangles[i].sense;
+        }
+    }
+
+    /****************************************
+     LAY OUT THE HEADER
+    */
+    memset(&header, 0, sizeof(refindex_header_t));
+    memcpy(header.magic, REFINDEX_MAGIC, sizeof(header.magic));
+    header.version          = REFINDEX_VERSION;
+    header.byteorder        = REFINDEX_BYTEORDER;
+    header.header_size      = sizeof(refindex_header_t);
+    header.separation       = separation;
+    header.tolerance        = tolerance;
+    header.maxratio         = maxratio;
+    header.nmatch           = nmatch;
+    header.nref             = nref;
+    header.nunique          = nunique;
+    header.ntriangles       = ntriangles;
+    header.ref_offset       = refindex_align(sizeof(refindex_header_t));
+    header.sorted_offset    = refindex_align(
+            header.ref_offset + nref * sizeof(coord_t));
+    header.unique_offset    = refindex_align(
+            header.sorted_offset + nref * sizeof(uint64_t));
+    header.triangles_offset = refindex_align(
+            header.unique_offset + nunique * sizeof(uint64_t));
+    header.file_size        =
+        header.triangles_offset + ntriangles * sizeof(refindex_triangle_t);
+
+    /****************************************
+     WRITE IT OUT
+    */
+    fd = fopen(path, "wb");
+    if (fd == NULL) {
+        stimage_error_format_message(
+            error, "Could not open '%s' for writing: %s", path, strerror(errno));
+        goto exit;
+    }
+
+    if (refindex_write(fd, 0, &header, sizeof(refindex_header_t),
+                       path, error) ||
+        refindex_write(fd, header.ref_offset, ref, nref * sizeof(coord_t),
+                       path, error) ||
+        refindex_write(fd, header.sorted_offset, sorted,
+                       nref * sizeof(uint64_t), path, error) ||
+        refindex_write(fd, header.unique_offset, unique,
+                       nunique * sizeof(uint64_t), path, error) ||
+        refindex_write(fd, header.triangles_offset, triangle_table,
+                       ntriangles * sizeof(refindex_triangle_t),
+                       path, error)) {
+        goto exit;
+    }
+
+    if (fclose(fd)) {
+        fd = NULL;
+        stimage_error_format_message(
+            error, "Error writing reference index '%s': %s", path, strerror(errno));
+        goto exit;
+    }
+    fd = NULL;
+
+    status = 0;
+
+ exit:
+
+    if (fd != NULL) {
+        fclose(fd);
+    }
+    free(ref_sorted);
+    free(sorted);
+    free(unique);
+    free(triangles);
+    free(triangle_table);
+
+    return status;
+}
+
+static int
+refindex_check_section(
+        const refindex_header_t* const header,
+        const uint64_t offset,
+        const uint64_t count,
+        const uint64_t itemsize,
+        const char* const name,
+        stimage_error_t* const error) {
+
+    if (offset % 8 != 0 ||
+        offset < header->header_size ||
+        offset > header->file_size ||
+        (itemsize && count > (header->file_size - offset) / itemsize)) {
+        stimage_error_format_message(
+            error, "Reference index is corrupt: invalid %s section", name);
+        return 1;
+    }
+
+    return 0;
+}
+
+int
+refindex_view(
+        const size_t size,
+        const void* const buffer,
+        refindex_t* const index,
+        stimage_error_t* const error) {
+
+    const refindex_header_t* header;
+    const char*              base = (const char*)buffer;
+    size_t                   i, j;
+
+    assert(index);
+    assert(error);
+
+    memset(index, 0, sizeof(refindex_t));
+
+    if (buffer == NULL || size < sizeof(refindex_header_t)) {
+        stimage_error_set_message(
+            error, "Buffer is too small to be a reference index");
+        return 1;
+    }
+
+    if (((size_t)buffer) % 8 != 0) {
+        stimage_error_set_message(
+            error, "Reference index buffer is not aligned");
+        return 1;
+    }
+
+    header = (const refindex_header_t*)buffer;
+
+    if (memcmp(header->magic, REFINDEX_MAGIC, sizeof(header->magic)) != 0) {
+        stimage_error_set_message(error, "Not a reference index");
+        return 1;
+    }
+
+    if (header->byteorder != REFINDEX_BYTEORDER) {
+        stimage_error_set_message(
+            error,
+            "Reference index was written on a machine with a different byte "
+            "order");
+        return 1;
+    }
+
+    if (header->version != REFINDEX_VERSION) {
+        stimage_error_format_message(
+            error, "Unsupported reference index version %u (expected %d)",
+            (unsigned int)header->version, REFINDEX_VERSION);
+        return 1;
+    }
+
+    if (header->header_size < sizeof(refindex_header_t) ||
+        header->file_size > size ||
+        header->nunique > header->nref ||
+        header->nref == 0) {
+        stimage_error_set_message(error, "Reference index is corrupt");
+        return 1;
+    }
+
+    if (refindex_check_section(
+                header, header->ref_offset, header->nref,
+                sizeof(coord_t), "ref", error) ||
+        refindex_check_section(
+                header, header->sorted_offset, header->nref,
+                sizeof(uint64_t), "sorted", error) ||
+        refindex_check_section(
+                header, header->unique_offset, header->nunique,
+                sizeof(uint64_t), "unique", error) ||
+        refindex_check_section(
+                header, header->triangles_offset, header->ntriangles,
+                sizeof(refindex_triangle_t), "triangles", error)) {
+        return 1;
+    }
+
+    index->header    = header;
+    index->ref       = (const coord_t*)(base + header->ref_offset);
+    index->sorted    = (const uint64_t*)(base + header->sorted_offset);
+    index->unique    = (const uint64_t*)(base + header->unique_offset);
+    index->triangles =
+        (const refindex_triangle_t*)(base + header->triangles_offset);
+
+    /* The indices are dereferenced later, so make sure they are all
+       in range now */
+    for (i = 0; i < header->nref; ++i) {
+        if (index->sorted[i] >= header->nref) goto corrupt;
+    }
+
+    for (i = 0; i < header->nunique; ++i) {
+        if (index->unique[i] >= header->nref) goto corrupt;
+    }
+
+    for (i = 0; i < header->ntriangles; ++i) {
+        for (j = 0; j < 3; ++j) {
+            if (index->triangles[i].vertices[j] >= header->nref) goto corrupt;
+        }
+    }
+
+    return 0;
+
+ corrupt:
+    memset(index, 0, sizeof(refindex_t));
+    stimage_error_set_message(
+        error, "Reference index is corrupt: index out of range");
+    return 1;
+}
+
+void
+refindex_unique_coords(
+        const refindex_t* const index,
+        const coord_t** const ref_sorted /*[nunique]*/) {
+
+    size_t i;
+
+    assert(index);
+    assert(index->header);
+    assert(ref_sorted);
+
+    for (i = 0; i < index->header->nunique; ++i) {
+        ref_sorted[i] = &index->ref[index->unique[i]];
+    }
+}
+
+void
+refindex_triangles(
+        const refindex_t* const index,
+        triangle_t* const triangles /*[ntriangles]*/) {
+
+    const refindex_triangle_t* src;
+    size_t                     i, j;
+
+    assert(index);
+    assert(index->header);
+    assert(triangles);
+
+    for (i = 0; i < index->header->ntriangles; ++i) {
+        src = &index->triangles[i];
+        for (j = 0; j < 3; ++j) {
+            triangles[i].vertices[j] = &index->ref[src->vertices[j]];
+        }
+        triangles[i].log_perimeter    = src->log_perimeter;
+        triangles[i].ratio            = src->ratio;
+        triangles[i].cosine_v1        = src->cosine_v1;
+        triangles[i].ratio_tolerance  = src->ratio_tolerance;
+        triangles[i].cosine_tolerance = src->cosine_tolerance;
+        triangles[i].sense            = (int)src->sense;
+    }
+}
@@ -35,10 +35,13 @@ DAMAGE.
 */
 
 #include <assert.h>
+#include <stdint.h>
 
 #include "immatch/xyxymatch.h"
+#include "immatch/refindex.h"
 #include "lib/lintransform.h"
 #include "lib/xycoincide.h"
+#include "lib/xysoa.h"
 #include "lib/xysort.h"
 #include "immatch/lib/triangles.h"
 #include "immatch/lib/tolerance.h"
@@ -81,6 +84,174 @@ xyxymatch_callback(
     return 0;
 }
 
+typedef struct {
+    const coordf_t*     ref;
+    const coordf_t*     input;
+    size_t              noutput;
+    size_t              outputp;
+    xyxymatch_output_t* output;
+} xyxymatchf_callback_data_t;
+
+static int
+xyxymatchf_callback(
+        void* data,
+        size_t ref_index,
+        size_t input_index,
+        stimage_error_t* error) {
+
+    xyxymatchf_callback_data_t* state = (xyxymatchf_callback_data_t*)data;
+    xyxymatch_output_t* entry;
+
+    if (state->outputp >= state->noutput) {
+        stimage_error_format_message(
+            error,
+            "Number of output coordinates exceeded allocation (%d)",
+            state->noutput);
+        return 1;
+    }
+
+    entry = &(state->output[state->outputp]);
+
+    entry->coord.x   = state->input[input_index].x;
+    entry->coord.y   = state->input[input_index].y;
+    entry->ref.x     = state->ref[ref_index].x;
+    entry->ref.y     = state->ref[ref_index].y;
+    entry->coord_idx = input_index;
+    entry->ref_idx   = ref_index;
+
+    ++(state->outputp);
+
+    return 0;
+}
+
+static int
+_xyxymatch(
+        const size_t ninput, const coord_t* const input /*[ninput]*/,
+        const size_t nref, const coord_t* const ref /*[nref]*/,
+        const xysoa_t* const ref_unique,
+        const coord_t* const * const ref_sorted /*[ref_unique->n]*/,
+        const size_t nref_triangles,
+        const triangle_t* const ref_triangles /*[nref_triangles]*/,
+        size_t* noutput, xyxymatch_output_t* const output /*[noutput]*/,
+        const coord_t* origin,
+        const coord_t* mag,
+        const coord_t* rotation,
+        const coord_t* ref_origin,
+        const xyxymatch_algo_e algorithm,
+        const double tolerance,
+        const double separation,
+        const size_t nmatch,
+        const double maxratio,
+        const size_t nreject,
+        const size_t nthreads,
+        stimage_error_t* const error) {
+
+    static const coord_t      DEFAULT_ORIGIN     = {0.0, 0.0};
+    static const coord_t      DEFAULT_MAG        = {1.0, 1.0};
+    static const coord_t      DEFAULT_ROTATION   = {0.0, 0.0};
+    static const coord_t      DEFAULT_REF_ORIGIN = {0.0, 0.0};
+    coord_t*                  input_trans        = NULL;
+    const coord_t**           input_trans_sorted = NULL;
+    size_t                    ninput_unique      = ninput;
+    xysoa_t                   input_unique;
+    lintransform_t            lintransform;
+    xyxymatch_callback_data_t state;
+    int                       status             = 1;
+
+    xysoa_new(&input_unique);
+
+    if (origin == NULL) {
+        origin = &DEFAULT_ORIGIN;
+    }
+
+    if (mag == NULL) {
+        mag = &DEFAULT_MAG;
+    }
+
+    if (rotation == NULL) {
+        rotation = &DEFAULT_ROTATION;
+    }
+
+    if (ref_origin == NULL) {
+        ref_origin = &DEFAULT_REF_ORIGIN;
+    }
+
+    /****************************************
+     DETERMINE INITIAL TRANSFORM
+    */
+    compute_lintransform(*origin, *mag, *rotation, *ref_origin, &lintransform);
+
+    /****************************************
+     PREPARE INPUT COORDINATES
+    */
+    input_trans = malloc_with_error(ninput * sizeof(coord_t), error);
+    if (input_trans == NULL) goto exit;
+
+    input_trans_sorted = malloc_with_error(ninput * sizeof(coord_t*), error);
+    if (input_trans_sorted == NULL) goto exit;
+
+    if (xysoa_init(&input_unique, ninput, error)) goto exit;
+
+    apply_lintransform(&lintransform, ninput, input, input_trans);
+    xysort(ninput, input_trans, input_trans_sorted);
+    xysoa_gather(ninput, input_trans, input_trans_sorted, &input_unique);
+    if (xycoincide_soa(&input_unique, separation, error)) goto exit;
+    ninput_unique = input_unique.n;
+    xysoa_pointers(&input_unique, input_trans, input_trans_sorted);
+
+    /****************************************
+     RUN THE DESIRED ALGORITHM
+    */
+    state.ref = ref;
+    state.input = input;
+    state.noutput = *noutput;
+    state.outputp = 0;
+    state.output = output;
+
+    switch (algorithm) {
+    case xyxymatch_algo_tolerance:
+        if (match_tolerance_soa(
+                ref_unique, &input_unique,
+                tolerance, nthreads,
+                xyxymatch_callback, &state,
+                error)) goto exit;
+        *noutput = state.outputp;
+        break;
+    case xyxymatch_algo_triangles:
+        if (ref_triangles != NULL) {
+            if (match_triangles_with_ref_triangles(
+                    nref, ref_unique->n, ref, ref_sorted,
+                    ninput, ninput_unique, input_trans, input_trans_sorted,
+                    nmatch, tolerance, maxratio, nreject,
+                    nref_triangles, ref_triangles,
+                    &xyxymatch_callback, &state,
+                    error)) goto exit;
+        } else {
+            if (match_triangles(
+                    nref, ref_unique->n, ref, ref_sorted,
+                    ninput, ninput_unique, input_trans, input_trans_sorted,
+                    nmatch, tolerance, maxratio, nreject,
+                    &xyxymatch_callback, &state,
+                    error)) goto exit;
+        }
+        *noutput = state.outputp;
+        break;
+    case xyxymatch_algo_LAST:
+    default:
+        stimage_error_set_message(error, "Invalid algorithm");
+        goto exit;
+    }
+
+    status = 0;
+
+exit:
+
+    free(input_trans_sorted);
+    free(input_trans);
+    xysoa_free(&input_unique);
+    return status;
+}
+
 /** DIFF
 
 The original takes lists of input, reference and output files.  This
@@ -112,21 +283,15 @@ xyxymatch(
         const size_t nmatch,
         const double maxratio,
         const size_t nreject,
+        const size_t nthreads,
         stimage_error_t* const error) {
 
-    static const coord_t      DEFAULT_ORIGIN     = {0.0, 0.0};
-    static const coord_t      DEFAULT_MAG        = {1.0, 1.0};
-    static const coord_t      DEFAULT_ROTATION   = {0.0, 0.0};
-    static const coord_t      DEFAULT_REF_ORIGIN = {0.0, 0.0};
-    coord_t*                  input_trans        = NULL;
-    const coord_t**           input_trans_sorted = NULL;
-    size_t                    ninput_unique      = ninput;
     const coord_t**           ref_sorted         = NULL;
-    size_t                    nref_unique        = nref;
-    lintransform_t            lintransform;
-    xyxymatch_callback_data_t state;
+    xysoa_t                   ref_unique;
     int                       status             = 1;
 
+    xysoa_new(&ref_unique);
+
     /****************************************
      CHECK ARGUMENTS
     */
@@ -151,6 +316,329 @@ xyxymatch(
         goto exit;
     }
 
+    /****************************************
+     PREPARE REFERENCE COORDINATES
+    */
+    ref_sorted = malloc_with_error(nref * sizeof(coord_t*), error);
+    if (ref_sorted == NULL) goto exit;
+
+    if (xysoa_init(&ref_unique, nref, error)) goto exit;
+
+    xysort(nref, ref, ref_sorted);
+    xysoa_gather(nref, ref, ref_sorted, &ref_unique);
+    if (xycoincide_soa(&ref_unique, separation, error)) goto exit;
+    xysoa_pointers(&ref_unique, ref, ref_sorted);
+
+    status = _xyxymatch(
+            ninput, input, nref, ref, &ref_unique, ref_sorted, 0, NULL,
+            noutput, output, origin, mag, rotation, ref_origin,
+            algorithm, tolerance, separation, nmatch, maxratio, nreject,
+            nthreads,
+            error);
+
+exit:
+
+    free(ref_sorted);
+    xysoa_free(&ref_unique);
+    return status;
+}
+
+/* The estimated cost of xyxymatch with a given nmatch */
+static void
+xyxymatch_cost(
+        const size_t ninput,
+        const size_t nref,
+        const xyxymatch_algo_e algorithm,
+        const size_t nmatch,
+        const size_t nreject,
+        xyxymatch_cost_t* const cost) {
+
+    /* The sort scratch space for each coordinate: the coordinate,
+       the permutation, the keys and the radix sort's temporary keys
+       and indices, and the coincidence flags */
+    const size_t     sort_bytes =
+        sizeof(double) + 2 * sizeof(size_t) + 2 * sizeof(uint64_t) + 1;
+    const size_t     n          = MAX(ninput, nref);
+    triangles_cost_t triangles;
+
+    cost->nmatch = nmatch;
+
+    /* The sorted and unique reference list, the transformed, sorted
+       and unique input list, and the output */
+    cost->nbytes =
+        nref * (sizeof(coord_t*) + 2 * sizeof(double)) +
+        ninput * (sizeof(coord_t) + sizeof(coord_t*) + 2 * sizeof(double) +
+                  sizeof(xyxymatch_output_t));
+    cost->work = (double)(ninput + nref) * 8.0;
+
+    switch (algorithm) {
+    case xyxymatch_algo_triangles:
+        estimate_triangles_cost(nref, ninput, nmatch, nreject, &triangles);
+        cost->nbytes += MAX(n * sort_bytes, triangles.nbytes);
+        cost->work += triangles.work;
+        break;
+    default:
+        cost->nbytes += n * sort_bytes;
+        cost->work += (double)(ninput + nref);
+        break;
+    }
+}
+
+int
+xyxymatch_estimate_cost(
+        const size_t ninput,
+        const size_t nref,
+        const xyxymatch_algo_e algorithm,
+        const size_t nmatch,
+        const size_t nreject,
+        const size_t memory_limit,
+        xyxymatch_cost_t* const cost,
+        stimage_error_t* const error) {
+
+    size_t           lo;
+    size_t           hi;
+    size_t           mid;
+    xyxymatch_cost_t trial;
+
+    assert(cost);
+    assert(error);
+
+    if (algorithm >= xyxymatch_algo_LAST || algorithm < 0) {
+        stimage_error_set_message(error, "Invalid algorithm specified");
+        return 1;
+    }
+
+    xyxymatch_cost(ninput, nref, algorithm, nmatch, nreject, cost);
+
+    if (memory_limit == 0 || cost->nbytes <= memory_limit) {
+        return 0;
+    }
+
+    /* The cost only grows with nmatch, so search for the largest
+       nmatch that fits.  Triangle matching needs at least 3. */
+    if (algorithm == xyxymatch_algo_triangles && nmatch > 3) {
+        xyxymatch_cost(ninput, nref, algorithm, 3, nreject, &trial);
+        if (trial.nbytes <= memory_limit) {
+            lo = 3;
+            hi = nmatch;
+            while (hi - lo > 1) {
+                mid = lo + (hi - lo) / 2;
+                xyxymatch_cost(ninput, nref, algorithm, mid, nreject, &trial);
+                if (trial.nbytes <= memory_limit) {
+                    lo = mid;
+                } else {
+                    hi = mid;
+                }
+            }
+            xyxymatch_cost(ninput, nref, algorithm, lo, nreject, cost);
+            return 0;
+        }
+        *cost = trial;
+    }
+
+    stimage_error_format_message(
+        error,
+        "memory_limit (%lu bytes) is too small; at least %lu bytes are "
+        "needed", (unsigned long)memory_limit, (unsigned long)cost->nbytes);
+    return 1;
+}
+
+int
+xyxymatch_refindex(
+        const size_t ninput, const coord_t* const input /*[ninput]*/,
+        const refindex_t* const index,
+        size_t* noutput, xyxymatch_output_t* const output /*[noutput]*/,
+        const coord_t* origin,
+        const coord_t* mag,
+        const coord_t* rotation,
+        const coord_t* ref_origin,
+        const xyxymatch_algo_e algorithm,
+        const double tolerance,
+        const double separation,
+        const size_t nmatch,
+        const double maxratio,
+        const size_t nreject,
+        const size_t nthreads,
+        stimage_error_t* const error) {
+
+    const refindex_header_t* header;
+    const coord_t**          ref_sorted     = NULL;
+    xysoa_t                  ref_unique;
+    size_t                   nref_triangles = 0;
+    triangle_t*              ref_triangles  = NULL;
+    int                      status         = 1;
+
+    assert(input);
+    assert(index);
+    assert(index->header);
+    assert(output);
+    assert(error);
+    assert(*noutput > 0);
+
+    header = index->header;
+
+    xysoa_new(&ref_unique);
+
+    if (ninput == 0) {
+        stimage_error_set_message(error, "The input coordinate list is empty");
+        goto exit;
+    }
+
+    if (algorithm >= xyxymatch_algo_LAST || algorithm < 0) {
+        stimage_error_set_message(error, "Invalid algorithm specified");
+        goto exit;
+    }
+
+    /* The unique list depends on the separation, so it can't be
+       reused with a different one */
+    if (separation != header->separation) {
+        stimage_error_format_message(
+            error,
+            "separation (%f) does not match the separation the reference "
+            "index was built with (%f)", separation, header->separation);
+        goto exit;
+    }
+
+    /****************************************
+     PREPARE REFERENCE COORDINATES
+    */
+    ref_sorted = malloc_with_error(
+            MAX(header->nunique, 1) * sizeof(coord_t*), error);
+    if (ref_sorted == NULL) goto exit;
+
+    refindex_unique_coords(index, ref_sorted);
+
+    if (xysoa_init(&ref_unique, header->nunique, error)) goto exit;
+    xysoa_gather(header->nunique, index->ref, ref_sorted, &ref_unique);
+
+    /* The stored triangle table can only be used when it was built
+       with the same parameters.  Otherwise, it is rebuilt from the
+       unique list as usual. */
+    if (algorithm == xyxymatch_algo_triangles &&
+        header->ntriangles > 0 &&
+        nmatch == header->nmatch &&
+        tolerance == header->tolerance &&
+        maxratio == header->maxratio) {
+        nref_triangles = header->ntriangles;
+        ref_triangles = malloc_with_error(
+                nref_triangles * sizeof(triangle_t), error);
+        if (ref_triangles == NULL) goto exit;
+
+        refindex_triangles(index, ref_triangles);
+    }
+
+    status = _xyxymatch(
+            ninput, input, header->nref, index->ref,
+            &ref_unique, ref_sorted, nref_triangles, ref_triangles,
+            noutput, output, origin, mag, rotation, ref_origin,
+            algorithm, tolerance, separation, nmatch, maxratio, nreject,
+            nthreads,
+            error);
+
+exit:
+
+    free(ref_sorted);
+    free(ref_triangles);
+    xysoa_free(&ref_unique);
+    return status;
+}
+
+static int
+_xyxymatchf_promote(
+        const size_t n,
+        const coordf_t* const in,
+        coord_t** out,
+        stimage_error_t* const error) {
+
+    size_t i;
+
+    *out = malloc_with_error(n * sizeof(coord_t), error);
+    if (*out == NULL) return 1;
+
+    for (i = 0; i < n; ++i) {
+        (*out)[i].x = in[i].x;
+        (*out)[i].y = in[i].y;
+    }
+
+    return 0;
+}
+
+int
+xyxymatchf(
+        const size_t ninput, const coordf_t* const input /*[ninput]*/,
+        const size_t nref, const coordf_t* const ref /*[nref]*/,
+        size_t* noutput, xyxymatch_output_t* const output /*[noutput]*/,
+        const coord_t* origin,
+        const coord_t* mag,
+        const coord_t* rotation,
+        const coord_t* ref_origin,
+        const xyxymatch_algo_e algorithm,
+        const double tolerance,
+        const double separation,
+        const size_t nmatch,
+        const double maxratio,
+        const size_t nreject,
+        const size_t nthreads,
+        stimage_error_t* const error) {
+
+    static const coord_t       DEFAULT_ORIGIN     = {0.0, 0.0};
+    static const coord_t       DEFAULT_MAG        = {1.0, 1.0};
+    static const coord_t       DEFAULT_ROTATION   = {0.0, 0.0};
+    static const coord_t       DEFAULT_REF_ORIGIN = {0.0, 0.0};
+    coord_t*                   input_double       = NULL;
+    coord_t*                   ref_double         = NULL;
+    coordf_t*                  input_trans        = NULL;
+    xysoaf_t                   ref_unique;
+    xysoaf_t                   input_unique;
+    lintransform_t             lintransform;
+    xyxymatchf_callback_data_t state;
+    int                        status             = 1;
+
+    /****************************************
+     CHECK ARGUMENTS
+    */
+    assert(input);
+    assert(ref);
+    assert(output);
+    assert(error);
+    assert(*noutput > 0);
+
+    xysoaf_new(&ref_unique);
+    xysoaf_new(&input_unique);
+
+    if (ninput == 0) {
+        stimage_error_set_message(error, "The input coordinate list is empty");
+        goto exit;
+    }
+
+    if (nref == 0) {
+        stimage_error_set_message(error, "The reference coordinate list is empty");
+        goto exit;
+    }
+
+    if (algorithm >= xyxymatch_algo_LAST || algorithm < 0) {
+        stimage_error_set_message(error, "Invalid algorithm specified");
+        goto exit;
+    }
+
+    /* The triangle matching code only works in double precision.
+       Since it only ever looks at nmatch points at a time, there is
+       little to gain from a single-precision version, so the
+       coordinates are simply promoted. */
+    if (algorithm == xyxymatch_algo_triangles) {
+        if (_xyxymatchf_promote(ninput, input, &input_double, error) ||
+            _xyxymatchf_promote(nref, ref, &ref_double, error)) {
+            goto exit;
+        }
+
+        status = xyxymatch(
+                ninput, input_double, nref, ref_double, noutput, output,
+                origin, mag, rotation, ref_origin, algorithm,
+                tolerance, separation, nmatch, maxratio, nreject, nthreads,
+                error);
+        goto exit;
+    }
+
     if (origin == NULL) {
         origin = &DEFAULT_ORIGIN;
     }
@@ -170,11 +658,11 @@ xyxymatch(
     /****************************************
      PREPARE REFERENCE COORDINATES
     */
-    ref_sorted = malloc_with_error(nref * sizeof(coord_t*), error);
-    if (ref_sorted == NULL) goto exit;
-
-    xysort(nref, ref, ref_sorted);
-    nref_unique = xycoincide(nref, ref_sorted, ref_sorted, separation);
+    if (xysoaf_init(&ref_unique, nref, error) ||
+        xysoaf_sort(nref, ref, &ref_unique, error) ||
+        xycoincide_soaf(&ref_unique, separation, error)) {
+        goto exit;
+    }
 
     /****************************************
      DETERMINE INITIAL TRANSFORM
@@ -184,18 +672,23 @@ xyxymatch(
     /****************************************
      PREPARE INPUT COORDINATES
     */
-    input_trans = malloc_with_error(ninput * sizeof(coord_t), error);
+    input_trans = malloc_with_error(ninput * sizeof(coordf_t), error);
     if (input_trans == NULL) goto exit;
 
-    input_trans_sorted = malloc_with_error(ninput * sizeof(coord_t*), error);
-    if (input_trans_sorted == NULL) goto exit;
+    apply_lintransformf(&lintransform, ninput, input, input_trans);
 
-    apply_lintransform(&lintransform, ninput, input, input_trans);
-    xysort(ninput, input_trans, input_trans_sorted);
-    ninput_unique = xycoincide(ninput, input_trans_sorted, input_trans_sorted, separation);
+    if (xysoaf_init(&input_unique, ninput, error) ||
+        xysoaf_sort(ninput, input_trans, &input_unique, error) ||
+        xycoincide_soaf(&input_unique, separation, error)) {
+        goto exit;
+    }
+
+    /* Only the sorted copy is needed from here on */
+    free(input_trans);
+    input_trans = NULL;
 
     /****************************************
-     RUN THE DESIRED ALGORITHM
+     RUN THE MATCHING
     */
     state.ref = ref;
     state.input = input;
@@ -203,40 +696,21 @@ xyxymatch(
     state.outputp = 0;
     state.output = output;
 
-    switch (algorithm) {
-    case xyxymatch_algo_tolerance:
-        if (match_tolerance(
-                nref_unique, ref, ref_sorted,
-                ninput_unique, input_trans, input_trans_sorted,
-                tolerance,
-                xyxymatch_callback, &state,
-                error)) goto exit;
-        *noutput = state.outputp;
-        break;
-    case xyxymatch_algo_triangles:
-        if (match_triangles(
-                nref, nref_unique, ref, ref_sorted,
-                ninput, ninput_unique, input_trans, input_trans_sorted,
-                nmatch, tolerance, maxratio, nreject,
-                &xyxymatch_callback, &state,
-                error)) goto exit;
-        *noutput = state.outputp;
-        break;
-    case xyxymatch_algo_LAST:
-    default:
-        stimage_error_set_message(error, "Invalid algorithm");
-        goto exit;
-    }
+    if (match_tolerance_soaf(
+            &ref_unique, &input_unique,
+            tolerance, nthreads,
+            xyxymatchf_callback, &state,
+            error)) goto exit;
+    *noutput = state.outputp;
 
     status = 0;
 
 exit:
 
-    free(ref_sorted);
-    free(input_trans_sorted);
+    free(input_double);
+    free(ref_double);
     free(input_trans);
+    xysoaf_free(&ref_unique);
+    xysoaf_free(&input_unique);
     return status;
 }
-
-
-
@@ -0,0 +1,477 @@
+/*
+Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+    1. Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+
+    2. Redistributions in binary form must reproduce the above
+      copyright notice, this list of conditions and the following
+      disclaimer in the documentation and/or other materials provided
+      with the distribution.
+
+    3. The name of AURA and its representatives may not be used to
+      endorse or promote products derived from this software without
+      specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+DAMAGE.
+*/
+
+#include <assert.h>
+#include <errno.h>
+#include <math.h>
+#include <stdint.h>
+#include <stdio.h>
+#include <string.h>
+
+#include "lib/coordfile.h"
+
+/* The size of the output buffer, and the most a single column can
+   take up in it */
+#define COORDFILE_BUFFER_SIZE (1 << 16)
+#define COORDFILE_MAX_FIELD 64
+#define COORDFILE_MAX_PRECISION 30
+
+static int
+coordfile_is_blank(
+        const char c) {
+
+    return c == ' ' || c == '\t' || c == '\r' || c == '\v' || c == '\f';
+}
+
+static int
+coordfile_is_end(
+        const char* const p,
+        const char* const end) {
+
+    return p == end || coordfile_is_blank(*p) || *p == '#';
+}
+
+size_t
+coordfile_max_rows(
+        const size_t size,
+        const char* const buffer) {
+
+    const char* p     = buffer;
+    const char* end   = buffer + size;
+    size_t      nrows = 0;
+
+    while (p < end && (p = memchr(p, '\n', end - p)) != NULL) {
+        ++nrows;
+        ++p;
+    }
+
+    if (size > 0 && buffer[size - 1] != '\n') {
+        ++nrows;
+    }
+
+    return nrows;
+}
+
+/* Parse a decimal number, setting *stop past it.  Numbers whose
+   digits fit exactly in a double, with a small enough power of ten,
+   are converted with a single multiplication or division, which is
+   correctly rounded and so gives exactly what strtod does.  Anything
+   else (more digits, large exponents, nan, inf, hex) goes to strtod. */
+static double
+coordfile_parse_double(
+        const char* const p,
+        char** const stop) {
+
+    static const double powers[] = {
+        1e0, 1e1, 1e2, 1e3, 1e4, 1e5, 1e6, 1e7, 1e8, 1e9, 1e10, 1e11,
+        1e12, 1e13, 1e14, 1e15, 1e16, 1e17, 1e18, 1e19, 1e20, 1e21, 1e22
+    };
+
+    const char* q        = p;
+    const char* start    = NULL;
+    const char* fraction = NULL;
+    uint64_t    mantissa = 0;
+    int         ndigits  = 0;
+    int         exponent = 0;
+    int         expsign  = 1;
+    int         expvalue = 0;
+    int         negative = 0;
+    double      value;
+
+    if (*q == '-' || *q == '+') {
+        negative = (*q == '-');
+        ++q;
+    }
+
+    /* Leading zeros count towards the 15 digits, which only sends
+       the rare number with very many of them to strtod */
+    start = q;
+    for (; *q >= '0' && *q <= '9'; ++q) {
+        mantissa = mantissa * 10 + (uint64_t)(*q - '0');
+    }
+    ndigits = (int)(q - start);
+
+    if (*q == '.') {
+        fraction = ++q;
+        for (; *q >= '0' && *q <= '9'; ++q) {
+            mantissa = mantissa * 10 + (uint64_t)(*q - '0');
+        }
+        exponent = -(int)(q - fraction);
+        ndigits += (int)(q - fraction);
+    }
+
+    if (ndigits == 0 || ndigits > 15) goto slow;
+
+    if (*q == 'e' || *q == 'E') {
+        ++q;
+        if (*q == '-' || *q == '+') {
+            expsign = (*q == '-') ? -1 : 1;
+            ++q;
+        }
+        if (!(*q >= '0' && *q <= '9')) goto slow;
+        for (; *q >= '0' && *q <= '9'; ++q) {
+            expvalue = expvalue * 10 + (*q - '0');
+            if (expvalue > 1000) goto slow;
+        }
+        exponent += expsign * expvalue;
+    }
+
+    /* Leave anything unusual following the digits, like the x of a
+       hex number, to strtod */
+    if ((*q >= 'a' && *q <= 'z') || (*q >= 'A' && *q <= 'Z') || *q == '.') {
+        goto slow;
+    }
+
+    if (exponent < -22 || exponent > 22) goto slow;
+
+    value = (double)mantissa;
+    if (exponent < 0) {
+        value /= powers[-exponent];
+    } else {
+        value *= powers[exponent];
+    }
+
+    *stop = (char*)q;
+    return negative ? -value : value;
+
+ slow:
+    return strtod(p, stop);
+}
+
+/* Parse the needed columns of a single line, which ends at end.  end
+   must point to a character that stops strtod, either the newline or
+   a NUL terminator.  *ncolumns is set to the number of columns found,
+   up to nfields, so 0 is a blank or comment line. */
+static int
+coordfile_read_line(
+        const char* p,
+        const char* const end,
+        const size_t lineno,
+        const size_t nfields,
+        const char* const needed,
+        double* const fields,
+        size_t* const ncolumns,
+        stimage_error_t* const error) {
+
+    char*  stop = NULL;
+    size_t f    = 0;
+
+    for (f = 0; f < nfields; ++f) {
+        while (p < end && coordfile_is_blank(*p)) {
+            ++p;
+        }
+
+        if (p == end || *p == '#') {
+            break;
+        }
+
+        if (!needed[f]) {
+            while (!coordfile_is_end(p, end)) {
+                ++p;
+            }
+        } else if (*p == 'I' && end - p >= 5 && strncmp(p, "INDEF", 5) == 0 &&
+                   coordfile_is_end(p + 5, end)) {
+            fields[f] = NAN;
+            p += 5;
+        } else {
+            fields[f] = coordfile_parse_double(p, &stop);
+            if (stop == p || !coordfile_is_end(stop, end)) {
+                stimage_error_format_message(
+                    error, "Line %lu: column %lu is not a number",
+                    (unsigned long)lineno, (unsigned long)f);
+                return 1;
+            }
+            p = stop;
+        }
+    }
+
+    if (f > 0 && f < nfields) {
+        stimage_error_format_message(
+            error, "Line %lu: expected at least %lu columns, found %lu",
+            (unsigned long)lineno, (unsigned long)nfields, (unsigned long)f);
+        return 1;
+    }
+
+    *ncolumns = f;
+
+    return 0;
+}
+
+int
+coordfile_read(
+        const size_t size,
+        const char* const buffer,
+        const size_t ncolumns,
+        const size_t* const columns,
+        size_t* const nrows,
+        double* const values,
+        stimage_error_t* const error) {
+
+    const char* p       = buffer;
+    const char* bufend  = buffer + size;
+    const char* line    = NULL;
+    const char* end     = NULL;
+    const char* next    = NULL;
+    char*       last    = NULL;
+    char*       needed  = NULL;
+    double*     fields  = NULL;
+    size_t      nfields = 0;
+    size_t      nfound  = 0;
+    size_t      lineno  = 0;
+    size_t      row     = 0;
+    size_t      i       = 0;
+    int         status  = 1;
+
+    assert(buffer || size == 0);
+    assert(columns);
+    assert(nrows);
+    assert(values || *nrows == 0);
+    assert(error);
+
+    if (ncolumns == 0) {
+        stimage_error_set_message(error, "No columns to read");
+        goto exit;
+    }
+
+    for (i = 0; i < ncolumns; ++i) {
+        nfields = MAX(nfields, columns[i] + 1);
+    }
+
+    needed = calloc_with_error(nfields, sizeof(char), error);
+    if (needed == NULL) goto exit;
+    fields = malloc_with_error(nfields * sizeof(double), error);
+    if (fields == NULL) goto exit;
+
+    for (i = 0; i < ncolumns; ++i) {
+        needed[columns[i]] = 1;
+    }
+
+    while (p < bufend) {
+        ++lineno;
+
+        end = memchr(p, '\n', bufend - p);
+        if (end != NULL) {
+            line = p;
+            next = end + 1;
+        } else {
+            /* The last line has no newline, so it is copied to give
+               strtod a terminator that is within bounds */
+            last = malloc_with_error(bufend - p + 1, error);
+            if (last == NULL) goto exit;
+            memcpy(last, p, bufend - p);
+            last[bufend - p] = '\0';
+            line = last;
+            end = last + (bufend - p);
+            next = bufend;
+        }
+
+        if (coordfile_read_line(
+                    line, end, lineno, nfields, needed, fields, &nfound,
+                    error)) goto exit;
+
+        if (nfound > 0) {
+            if (row >= *nrows) {
+                stimage_error_set_message(
+                    error, "Found more rows than were allocated for");
+                goto exit;
+            }
+
+            for (i = 0; i < ncolumns; ++i) {
+                values[row * ncolumns + i] = fields[columns[i]];
+            }
+            ++row;
+        }
+
+        p = next;
+    }
+
+    *nrows = row;
+
+    status = 0;
+
+ exit:
+
+    free(last);
+    free(needed);
+    free(fields);
+
+    return status;
+}
+
+static int
+coordfile_flush(
+        FILE* const fd,
+        const char* const buffer,
+        size_t* const pos,
+        const char* const path,
+        stimage_error_t* const error) {
+
+    if (*pos && fwrite(buffer, 1, *pos, fd) != *pos) {
+        stimage_error_format_message(
+            error, "Error writing '%s': %s", path, strerror(errno));
+        return 1;
+    }
+
+    *pos = 0;
+
+    return 0;
+}
+
+int
+coordfile_write(
+        const char* const path,
+        const char* const header,
+        const size_t nrows,
+        const void* const data,
+        const size_t stride,
+        const size_t ncolumns,
+        const coordfile_column_t* const columns,
+        const int precision,
+        stimage_error_t* const error) {
+
+    FILE*       fd     = NULL;
+    char*       buffer = NULL;
+    const char* row    = NULL;
+    const char* field  = NULL;
+    size_t      pos    = 0;
+    size_t      i      = 0;
+    size_t      j      = 0;
+    double      d;
+    uint64_t    u;
+    int64_t     s;
+    int         status = 1;
+
+    assert(path);
+    assert(data || nrows == 0);
+    assert(columns || ncolumns == 0);
+    assert(error);
+
+    if (precision < 1 || precision > COORDFILE_MAX_PRECISION) {
+        stimage_error_format_message(
+            error, "precision must be in the range 1 - %d",
+            COORDFILE_MAX_PRECISION);
+        goto exit;
+    }
+
+    for (j = 0; j < ncolumns; ++j) {
+        if (columns[j].type >= coordfile_type_LAST || columns[j].type < 0) {
+            stimage_error_set_message(error, "Invalid column type");
+            goto exit;
+        }
+    }
+
+    buffer = malloc_with_error(COORDFILE_BUFFER_SIZE, error);
+    if (buffer == NULL) goto exit;
+
+    fd = fopen(path, "w");
+    if (fd == NULL) {
+        stimage_error_format_message(
+            error, "Could not open '%s' for writing: %s", path, strerror(errno));
+        goto exit;
+    }
+
+    if (header != NULL) {
+        if (fprintf(fd, "# %s\n", header) < 0) {
+            stimage_error_format_message(
+                error, "Error writing '%s': %s", path, strerror(errno));
+            goto exit;
+        }
+    }
+
+    /* Each row is formatted into the buffer, which is written out
+       whenever it might not hold the next column */
+    for (i = 0, row = data; i < nrows; ++i, row += stride) {
+        for (j = 0; j < ncolumns; ++j) {
+            if (pos + COORDFILE_MAX_FIELD > COORDFILE_BUFFER_SIZE) {
+                if (coordfile_flush(fd, buffer, &pos, path, error)) goto exit;
+            }
+
+            if (j > 0) {
+                buffer[pos++] = ' ';
+            }
+
+            field = row + columns[j].offset;
+            switch (columns[j].type) {
+            case coordfile_type_double:
+                memcpy(&d, field, sizeof(double));
+                if (isnan(d)) {
+                    memcpy(buffer + pos, "INDEF", 5);
+                    pos += 5;
+                } else {
+                    pos += snprintf(
+                            buffer + pos, COORDFILE_MAX_FIELD - 1, "%.*g",
+                            precision, d);
+                }
+                break;
+            case coordfile_type_uint64:
+                memcpy(&u, field, sizeof(uint64_t));
+                pos += snprintf(
+                        buffer + pos, COORDFILE_MAX_FIELD - 1, "%llu",
+                        (unsigned long long)u);
+                break;
+            case coordfile_type_int64:
+                memcpy(&s, field, sizeof(int64_t));
+                pos += snprintf(
+                        buffer + pos, COORDFILE_MAX_FIELD - 1, "%lld",
+                        (long long)s);
+                break;
+            default:
+                break;
+            }
+        }
+
+        if (pos + 1 > COORDFILE_BUFFER_SIZE) {
+            if (coordfile_flush(fd, buffer, &pos, path, error)) goto exit;
+        }
+        buffer[pos++] = '\n';
+    }
+
+    if (coordfile_flush(fd, buffer, &pos, path, error)) goto exit;
+
+    if (fclose(fd)) {
+        fd = NULL;
+        stimage_error_format_message(
+            error, "Error writing '%s': %s", path, strerror(errno));
+        goto exit;
+    }
+    fd = NULL;
+
+    status = 0;
+
+ exit:
+
+    if (fd != NULL) {
+        fclose(fd);
+    }
+    free(buffer);
+
+    return status;
+}
@@ -50,6 +50,8 @@ stimage_error_init(
     for (i = 0; i < STIMAGE_MAX_ERROR_LEN; ++i) {
         error->message[i] = '\0';
     }
+    error->progress = NULL;
+    error->progress_data = NULL;
 }
 
 void
@@ -113,3 +115,37 @@ stimage_error_unset(
 
   error->message[0] = 0;
 }
+
+void
+stimage_error_set_progress(
+    stimage_error_t* error,
+    stimage_progress_t progress,
+    void* data) {
+
+  assert(error);
+
+  error->progress = progress;
+  error->progress_data = data;
+}
+
+int
+stimage_error_check_progress(
+    stimage_error_t* error,
+    const char* stage,
+    size_t done,
+    size_t total) {
+
+  assert(error);
+  assert(stage);
+
+  if (error->progress == NULL ||
+      !error->progress(error->progress_data, stage, done, total)) {
+    return 0;
+  }
+
+  if (!stimage_error_is_set(error)) {
+    stimage_error_set_message(error, "Cancelled");
+  }
+
+  return 1;
+}
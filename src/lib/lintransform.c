@@ -72,19 +72,69 @@ apply_lintransform(
     coord_t* output) {
 
     size_t i;
+    double a, b, c, d, e, f;
     double x, y;
 
     assert(coeffs);
     assert(input);
     assert(output);
 
+    /* The coefficients are copied to locals, since otherwise the
+       compiler must assume that writing to output may change them,
+       and reload them on every iteration rather than vectorizing the
+       loop. */
+    a = coeffs->a;
+    b = coeffs->b;
+    c = coeffs->c;
+    d = coeffs->d;
+    e = coeffs->e;
+    f = coeffs->f;
+
+#ifndef NDEBUG
     for (i = 0; i < ncoords; ++i) {
         assert(coord_is_finite(input + i));
+    }
+#endif
+
+    for (i = 0; i < ncoords; ++i) {
+        x = input[i].x;
+        y = input[i].y;
 
+        output[i].x = a * x + b * y + c;
+        output[i].y = d * x + e * y + f;
+    }
+}
+
+void
+apply_lintransformf(
+    const lintransform_t* const coeffs,
+    size_t ncoords,
+    const coordf_t* const input, /* [ncoords] */
+    coordf_t* output) {
+
+    size_t i;
+    double a, b, c, d, e, f;
+    double x, y;
+
+    assert(coeffs);
+    assert(input);
+    assert(output);
+
+    a = coeffs->a;
+    b = coeffs->b;
+    c = coeffs->c;
+    d = coeffs->d;
+    e = coeffs->e;
+    f = coeffs->f;
+
+    /* Computed in double precision and rounded once on output, so
+       the result is the nearest float to what apply_lintransform
+       gives */
+    for (i = 0; i < ncoords; ++i) {
         x = input[i].x;
         y = input[i].y;
 
-        output[i].x = coeffs->a * x + coeffs->b * y + coeffs->c;
-        output[i].y = coeffs->d * x + coeffs->e * y + coeffs->f;
+        output[i].x = (float)(a * x + b * y + c);
+        output[i].y = (float)(d * x + e * y + f);
     }
 }
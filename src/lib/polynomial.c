@@ -34,74 +34,182 @@ DAMAGE.
 
 #include "lib/polynomial.h"
 
-typedef int (*basis_function_t)(
+/* The number of points evaluated together.  The working arrays of a
+   block all fit in the L1 cache. */
+#define POLY_BLOCK 128
+
+/* Each basis satisfies B_0(x) = 1, B_1(x) = x and, for k >= 2, the
+   recurrence B_k(x) = a_k x B_{k-1}(x) + b_k B_{k-2}(x).  A
+   recurrence_t returns a_k and b_k. */
+typedef void (*recurrence_t)(
         const size_t,
-        const size_t,
-        const coord_t* const,
-        const int,
-        const double,
-        const double,
         double* const,
-        stimage_error_t* const);
+        double* const);
 
-int
-eval_1dpoly(
-        const int order,
-        const double* const coeff,
-        const size_t ncoord,
-        const size_t axis,
-        const coord_t* const ref,
-        double* const zfit,
-        stimage_error_t* const error) {
+static void
+recurrence_poly(
+        const size_t k,
+        double* const a,
+        double* const b) {
+
+    *a = 1.0;
+    *b = 0.0;
+}
 
-    size_t        i      = 0;
-    size_t        j      = 0;
-    const double* x      = (double *)ref + axis;
-    double*       tmp    = NULL;
-    int           status = 1;
+static void
+recurrence_chebyshev(
+        const size_t k,
+        double* const a,
+        double* const b) {
 
-    assert(coeff);
-    assert(ref);
-    assert(zfit);
-    assert(error);
+    *a = 2.0;
+    *b = -1.0;
+}
+
+static void
+recurrence_legendre(
+        const size_t k,
+        double* const a,
+        double* const b) {
+
+    *a = (2.0 * (double)k - 1.0) / (double)k;
+    *b = -((double)k - 1.0) / (double)k;
+}
+
+/* Add sum(c[k] * B_k(x[i]), first <= k < n) to z[i] for each of m
+   points, where first is 0 or 1.  This is Clenshaw's recurrence, which
+   for the power series reduces to Horner's rule.  b1 and b2 are
+   scratch space for m values each. */
+static void
+eval_series_block(
+        const size_t m,
+        const double* const x,
+        const size_t n,
+        const double* const c,
+        const size_t first,
+        recurrence_t recurrence,
+        double* const b1,
+        double* const b2,
+        /* Output */
+        double* const z) {
 
-    for (i = 0; i < ncoord; ++i) {
-        zfit[i] = coeff[0];
+    size_t i, k;
+    double a, b, t;
+
+    if (n <= first) {
+        return;
     }
 
-    if (order == 1) {
-        return 0;
+    if (n == 1) {
+        for (i = 0; i < m; ++i) {
+            z[i] += c[0];
+        }
+        return;
     }
 
-    for (i = 0; i < ncoord; ++i) {
-        zfit[i] += (x[i<<1] * coeff[1]);
+    for (i = 0; i < m; ++i) {
+        b1[i] = c[n - 1];
+        b2[i] = 0.0;
     }
 
-    if (order == 2) {
-        return 0;
+    for (k = n - 2; k >= 1; --k) {
+        recurrence(k + 1, &a, &t);
+        recurrence(k + 2, &t, &b);
+        for (i = 0; i < m; ++i) {
+            t = c[k] + a * x[i] * b1[i] + b * b2[i];
+            b2[i] = b1[i];
+            b1[i] = t;
+        }
     }
 
-    tmp = malloc_with_error(ncoord * sizeof(double), error);
-    if (tmp == NULL) goto exit;
+    recurrence(2, &a, &b);
+    for (i = 0; i < m; ++i) {
+        z[i] += x[i] * b1[i] + b * b2[i];
+    }
+    if (first == 0) {
+        for (i = 0; i < m; ++i) {
+            z[i] += c[0];
+        }
+    }
+}
 
-    for (i = 0; i < ncoord; ++i) {
-        tmp[i] = x[i<<1];
+/* Copy m coordinates along axis to x, normalized to (x + k1) * k2 unless
+   the basis is the plain power series */
+static void
+normalize_block(
+        const size_t m,
+        const coord_t* const ref,
+        const size_t axis,
+        const double k1,
+        const double k2,
+        recurrence_t recurrence,
+        /* Output */
+        double* const x) {
+
+    const double* const r = (const double*)ref + axis;
+    size_t              i;
+
+    if (recurrence == &recurrence_poly) {
+        for (i = 0; i < m; ++i) {
+            x[i] = r[i<<1];
+        }
+    } else {
+        for (i = 0; i < m; ++i) {
+            x[i] = (r[i<<1] + k1) * k2;
+        }
     }
+}
 
-    for (j = 2; j < order; ++j) {
-        for (i = 0; i < ncoord; ++i) {
-            tmp[i] *= x[i<<1];
-            zfit[i] += tmp[i] * coeff[j];
+static int
+eval_1d_generic(
+        const int order,
+        const double* const coeff,
+        const size_t ncoord,
+        const size_t axis,
+        const coord_t* const ref,
+        const double k1,
+        const double k2,
+        recurrence_t recurrence,
+        /* Output */
+        double* const zfit) {
+
+    double x[POLY_BLOCK];
+    double b1[POLY_BLOCK];
+    double b2[POLY_BLOCK];
+    size_t start, m, i;
+
+    for (start = 0; start < ncoord; start += POLY_BLOCK) {
+        m = MIN(POLY_BLOCK, ncoord - start);
+        normalize_block(m, ref + start, axis, k1, k2, recurrence, x);
+        for (i = 0; i < m; ++i) {
+            zfit[start + i] = 0.0;
         }
+        eval_series_block(
+                m, x, (size_t)order, coeff, 0, recurrence, b1, b2,
+                zfit + start);
     }
 
-    status = 0;
+    return 0;
+}
 
- exit:
+int
+eval_1dpoly(
+        const int order,
+        const double* const coeff,
+        const size_t ncoord,
+        const size_t axis,
+        const coord_t* const ref,
+        double* const zfit,
+        stimage_error_t* const error) {
 
-    free(tmp);
+    assert(coeff);
+    assert(ref);
+    assert(zfit);
+    assert(error);
 
-    return 0;
+    return eval_1d_generic(
+            order, coeff, ncoord, axis, ref, 0.0, 1.0, &recurrence_poly,
+            zfit);
 }
 
 int
@@ -116,86 +224,14 @@ eval_1dchebyshev(
         double* const zfit,
         stimage_error_t* const error) {
 
-    size_t        i      = 0;
-    size_t        j      = 0;
-    const double* x      = (double *)ref + axis;
-    double        c1     = 0.0;
-    double        c2     = 0.0;
-    double*       sx     = NULL;
-    double*       pn     = NULL;
-    double*       pnm1   = NULL;
-    double*       pnm2   = NULL;
-    int           status = 1;
-
     assert(coeff);
     assert(ref);
     assert(zfit);
     assert(error);
 
-    for (i = 0; i < ncoord; ++i) {
-        zfit[i] = coeff[0];
-    }
-
-    if (order == 1) {
-        return 0;
-    }
-
-    c1 = k2 * coeff[1];
-    c2 = c1 * k1 + coeff[0];
-    for (i = 0; i < ncoord; ++i) {
-        zfit[i] = x[i<<1] * c1 + c2;
-    }
-
-    if (order == 2) {
-        return 0;
-    }
-
-    sx = malloc_with_error(ncoord * sizeof(double), error);
-    if (sx == NULL) goto exit;
-
-    pn = malloc_with_error(ncoord * sizeof(double), error);
-    if (pn == NULL) goto exit;
-
-    pnm1 = malloc_with_error(ncoord * sizeof(double), error);
-    if (pnm1 == NULL) goto exit;
-
-    pnm2 = malloc_with_error(ncoord * sizeof(double), error);
-    if (pnm2 == NULL) goto exit;
-
-    for (i = 0; i < ncoord; ++i) {
-        pnm2[i] = 1.0;
-        pnm1[i] = sx[i] = (x[i<<1] + k1) * k2;
-        sx[i] *= 2;
-    }
-
-    for (j = 2; j < order; ++j) {
-        for (i = 0; i < ncoord; ++i) {
-            pn[i] = (sx[i] * pnm1[i]) - pnm2[i];
-        }
-
-        if (j < order - 1) {
-            for (i = 0; i < ncoord; ++i) {
-                pnm2[i] = pnm1[i];
-                pnm1[i] = pn[i];
-            }
-        }
-
-        for (i = 0; i < ncoord; ++i) {
-            pn[i] *= coeff[j];
-            zfit[i] += pn[i];
-        }
-    }
-
-    status = 0;
-
- exit:
-
-    free(sx);
-    free(pn);
-    free(pnm1);
-    free(pnm2);
-
-    return 0;
+    return eval_1d_generic(
+            order, coeff, ncoord, axis, ref, k1, k2, &recurrence_chebyshev,
+            zfit);
 }
 
 int
@@ -210,91 +246,14 @@ eval_1dlegendre(
         double* const zfit,
         stimage_error_t* const error) {
 
-    size_t        i      = 0;
-    size_t        j      = 0;
-    const double* x      = (double *)ref + axis;
-    double        ri     = 0.0;
-    double        ri1    = 0.0;
-    double        ri2    = 0.0;
-    double*       sx     = NULL;
-    double*       pn     = NULL;
-    double*       pnm1   = NULL;
-    double*       pnm2   = NULL;
-    int           status = 1;
-
     assert(coeff);
     assert(ref);
     assert(zfit);
     assert(error);
 
-    for (i = 0; i < ncoord; ++i) {
-        zfit[i] = coeff[0];
-    }
-
-    if (order == 1) {
-        return 0;
-    }
-
-    ri1 = k2 * coeff[1];
-    ri2 = ri1 * k1 + coeff[0];
-    for (i = 0; i < ncoord; ++i) {
-        zfit[i] = (x[i<<1] * ri1) + ri2;
-    }
-
-    if (order == 2) {
-        return 0;
-    }
-
-    sx = malloc_with_error(ncoord * sizeof(double), error);
-    if (sx == NULL) goto exit;
-
-    pn = malloc_with_error(ncoord * sizeof(double), error);
-    if (pn == NULL) goto exit;
-
-    pnm1 = malloc_with_error(ncoord * sizeof(double), error);
-    if (pnm1 == NULL) goto exit;
-
-    pnm2 = malloc_with_error(ncoord * sizeof(double), error);
-    if (pnm2 == NULL) goto exit;
-
-    for (i = 0; i < ncoord; ++i) {
-        pnm2[i] = 1.0;
-        pnm1[i] = sx[i] = (x[i<<1] + k1) * k2;
-    }
-
-    for (j = 2; j < order; ++j) {
-        ri = (double)j + 1.0;
-        ri1 = (2.0 * ri - 3.0) / (ri - 1.0);
-        ri2 = -(ri - 2.0) / (ri - 1.0);
-
-        for (i = 0; i < ncoord; ++i) {
-            pn[i] = sx[i] * pnm1[i];
-            pn[i] = pn[i] * ri1 + pnm2[i] * ri2;
-        }
-
-        if (j < order - 1) {
-            for (i = 0; i < ncoord; ++i) {
-                pnm2[i] = pnm1[i];
-                pnm1[i] = pn[i];
-            }
-        }
-
-        for (i = 0; i < ncoord; ++i) {
-            pn[i] *= coeff[j];
-            zfit[i] += pn[i];
-        }
-    }
-
-    status = 0;
-
- exit:
-
-    free(sx);
-    free(pn);
-    free(pnm1);
-    free(pnm2);
-
-    return status;
+    return eval_1d_generic(
+            order, coeff, ncoord, axis, ref, k1, k2, &recurrence_legendre,
+            zfit);
 }
 
 int
@@ -442,6 +401,11 @@ basis_legendre(
     return 0;
 }
 
+/* Evaluate the surface a block of points at a time, with O(order)
+   arithmetic per term and no allocation.  With cross terms, row j of
+   the coefficients multiplies B_j(y), and is itself a series in x, so
+   the sum over the rows is another Clenshaw recurrence in y, whose
+   coefficients are computed as they are needed. */
 static int
 eval_poly_generic(
         const int xorder,
@@ -454,23 +418,25 @@ eval_poly_generic(
         const double k2x,
         const double k1y,
         const double k2y,
-        basis_function_t basis_function,
+        recurrence_t recurrence,
         /* Output */
         double* const zfit,
         stimage_error_t* const error) {
 
-    size_t       i        = 0;
-    size_t       j        = 0;
-    size_t       k        = 0;
-    double*      xb       = NULL;
-    double*      yb       = NULL;
-    double*      accum    = NULL;
-    size_t       cp       = 0;
     const size_t maxorder = MAX(xorder + 1, yorder + 1);
-    size_t       xincr    = 0;
-    double*      xbp      = xb;
-    double*      ybp      = yb;
-    int          status   = 1;
+    double       x[POLY_BLOCK];
+    double       y[POLY_BLOCK];
+    double       b1[POLY_BLOCK];
+    double       b2[POLY_BLOCK];
+    double       row[POLY_BLOCK];
+    double       yb1[POLY_BLOCK];
+    double       yb2[POLY_BLOCK];
+    double*      z;
+    size_t       ncoeff   = 0;
+    size_t       nrow     = 0;
+    size_t       cp       = 0;
+    size_t       start, m, i, j;
+    double       a, b, t;
 
     assert(coeff);
     assert(ref);
@@ -486,103 +452,97 @@ eval_poly_generic(
         return 0;
     }
 
-    /* Fit first order in x and y */
-    if (xorder == 2 && yorder == 1) {
-        for (i = 0; i < ncoord; ++i) {
-            zfit[i] += ref[i].x * coeff[1];
-        }
-
-        return 0;
-    }
+    /* Fit first order in x and y.  The shortcuts only apply to the
+       plain power series, since the other bases are normalized. */
+    if (recurrence == &recurrence_poly) {
+        if (xorder == 2 && yorder == 1) {
+            for (i = 0; i < ncoord; ++i) {
+                zfit[i] = coeff[0] + ref[i].x * coeff[1];
+            }
 
-    if (yorder == 2 && xorder == 1) {
-        for (i = 0; i < ncoord; ++i) {
-            zfit[i] += ref[i].y * coeff[1];
+            return 0;
         }
 
-        return 0;
-    }
+        if (yorder == 2 && xorder == 1) {
+            for (i = 0; i < ncoord; ++i) {
+                zfit[i] = coeff[0] + ref[i].y * coeff[1];
+            }
 
-    if (yorder == 2 && xorder == 2 && xterms == xterms_none) {
-        for (i = 0; i < ncoord; ++i) {
-            zfit[i] += ref[i].x * coeff[1] + ref[i].y * coeff[2];
+            return 0;
         }
 
-        return 0;
-    }
-
-    xb = malloc_with_error(xorder * ncoord * sizeof(double), error);
-    if (xb == NULL) goto exit;
-    yb = malloc_with_error(yorder * ncoord * sizeof(double), error);
-    if (yb == NULL) goto exit;
-    accum = malloc_with_error(ncoord * sizeof(double), error);
-    if (accum == NULL) goto exit;
-
-    /* Calculate basis functions */
-    if (basis_function(ncoord, 0, ref, xorder, k1x, k2x, xb, error)) goto exit;
-    if (basis_function(ncoord, 1, ref, yorder, k1y, k2y, yb, error)) goto exit;
+        if (yorder == 2 && xorder == 2 && xterms == xterms_none) {
+            for (i = 0; i < ncoord; ++i) {
+                zfit[i] = coeff[0] + ref[i].x * coeff[1] + ref[i].y * coeff[2];
+            }
 
-    /* Accumulate the output vector */
-    for (i = 0; i < ncoord; ++i) {
-        zfit[i] = 0.0;
+            return 0;
+        }
     }
 
+    /* The number of coefficients, to find the rows from the end */
     if (xterms != xterms_none) {
-        xincr = xorder;
-        ybp = yb;
-        for (j = 0; j < yorder; ++j) {
-            for (i = 0; i < ncoord; ++i) {
-                accum[i] = 0.0;
-            }
-            xbp = xb;
-            for (k = 0; k < xincr; ++k) {
-                for (i = 0; i < ncoord; ++i) {
-                    accum[i] += xbp[i] * coeff[cp+k];
-                }
-            }
-            xbp += ncoord;
+        for (j = 0; j < (size_t)yorder; ++j) {
+            ncoeff += (xterms == xterms_full) ?
+                (size_t)xorder : MIN((size_t)xorder, maxorder - 1 - j);
         }
+    }
 
-        for (i = 0; i < ncoord; ++i) {
-            zfit[i] += accum[i] * ybp[i];
-        }
+    for (start = 0; start < ncoord; start += POLY_BLOCK) {
+        m = MIN(POLY_BLOCK, ncoord - start);
+        z = zfit + start;
+        normalize_block(m, ref + start, 0, k1x, k2x, recurrence, x);
+        normalize_block(m, ref + start, 1, k1y, k2y, recurrence, y);
 
-        cp += xincr;
-        ybp += ncoord;
+        for (i = 0; i < m; ++i) {
+            z[i] = 0.0;
+        }
 
-        if (xterms == xterms_half) {
-            if ((j + xorder + 1) > maxorder) {
-                xincr -= 1;
-            }
+        if (xterms == xterms_none) {
+            eval_series_block(
+                    m, x, (size_t)xorder, coeff, 0, recurrence, b1, b2, z);
+            /* The y terms follow the x terms, without the constant */
+            eval_series_block(
+                    m, y, (size_t)yorder, coeff + xorder - 1, 1, recurrence,
+                    b1, b2, z);
+            continue;
         }
-    } else { /* xterms == surface_xterms_none */
-        xbp = xb;
-        for (k = 0; k < xorder; ++k) {
-            for (i = 0; i < ncoord; ++i) {
-                zfit[i] += xbp[i] * coeff[k];
-            }
 
-            xbp += ncoord;
+        for (i = 0; i < m; ++i) {
+            yb1[i] = 0.0;
+            yb2[i] = 0.0;
         }
 
-        ybp = yb + ncoord;
-        for (k = 0; k < yorder - 1; ++k) {
-            for (i = 0; i < ncoord; ++i) {
-                zfit[i] += ybp[i] * coeff[xorder+k];
+        cp = ncoeff;
+        for (j = (size_t)yorder; j-- > 0; ) {
+            /* The x series of row j */
+            nrow = (xterms == xterms_full) ?
+                (size_t)xorder : MIN((size_t)xorder, maxorder - 1 - j);
+            cp -= nrow;
+            for (i = 0; i < m; ++i) {
+                row[i] = 0.0;
             }
+            eval_series_block(
+                    m, x, nrow, coeff + cp, 0, recurrence, b1, b2, row);
 
-            ybp += ncoord;
+            if (j == 0) {
+                recurrence(2, &a, &b);
+                for (i = 0; i < m; ++i) {
+                    z[i] = row[i] + y[i] * yb1[i] + b * yb2[i];
+                }
+            } else {
+                recurrence(j + 1, &a, &t);
+                recurrence(j + 2, &t, &b);
+                for (i = 0; i < m; ++i) {
+                    t = row[i] + a * y[i] * yb1[i] + b * yb2[i];
+                    yb2[i] = yb1[i];
+                    yb1[i] = t;
+                }
+            }
         }
     }
 
-    status = 0;
-
- exit:
-    free(xb);
-    free(yb);
-    free(accum);
-
-    return status;
+    return 0;
 }
 
 int
@@ -603,7 +563,7 @@ eval_poly(
 
     return eval_poly_generic(
             xorder, yorder, coeff, ncoord, ref, xterms, k1x, k2x, k1y, k2y,
-            &basis_poly, zfit, error);
+            &recurrence_poly, zfit, error);
 }
 
 int
@@ -624,7 +584,7 @@ eval_chebyshev(
 
     return eval_poly_generic(
             xorder, yorder, coeff, ncoord, ref, xterms, k1x, k2x, k1y, k2y,
-            &basis_chebyshev, zfit, error);
+            &recurrence_chebyshev, zfit, error);
 }
 
 int
@@ -645,5 +605,5 @@ eval_legendre(
 
     return eval_poly_generic(
             xorder, yorder, coeff, ncoord, ref, xterms, k1x, k2x, k1y, k2y,
-            &basis_legendre, zfit, error);
+            &recurrence_legendre, zfit, error);
 }
@@ -0,0 +1,350 @@
+/*
+Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+    1. Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+
+    2. Redistributions in binary form must reproduce the above
+      copyright notice, this list of conditions and the following
+      disclaimer in the documentation and/or other materials provided
+      with the distribution.
+
+    3. The name of AURA and its representatives may not be used to
+      endorse or promote products derived from this software without
+      specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+DAMAGE.
+*/
+
+#include <assert.h>
+#include <stdlib.h>
+#include <string.h>
+
+#include "lib/radixsort.h"
+
+/* The keys are sorted 11 bits at a time, which takes 6 passes for a
+   64-bit key.  This keeps the histograms (6 x 2048 counts) small
+   enough to stay in the L2 cache, while needing fewer passes than
+   sorting byte-by-byte.  Passes where all of the keys have the same
+   digit (typically the sign and exponent bits of coordinates in a
+   limited range) are skipped entirely. */
+#define RADIX_BITS   11
+#define RADIX_SIZE   (1 << RADIX_BITS)
+#define RADIX_MASK   (RADIX_SIZE - 1)
+#define RADIX_PASSES ((64 + RADIX_BITS - 1) / RADIX_BITS)
+
+/* Below this size, the setup cost of the histograms dominates, so a
+   simple insertion sort is used instead. */
+#define RADIX_MIN_SIZE 64
+
+static void
+insertion_sort_keys(
+        const size_t n,
+        uint64_t* const keys,
+        size_t* const index) {
+
+    size_t   i, j;
+    uint64_t key;
+    size_t   idx = 0;
+
+    for (i = 1; i < n; ++i) {
+        key = keys[i];
+        if (index) {
+            idx = index[i];
+        }
+        for (j = i; j > 0 && keys[j-1] > key; --j) {
+            keys[j] = keys[j-1];
+            if (index) {
+                index[j] = index[j-1];
+            }
+        }
+        keys[j] = key;
+        if (index) {
+            index[j] = idx;
+        }
+    }
+}
+
+int
+radix_sort_keys(
+        const size_t n,
+        uint64_t* const keys,
+        size_t* const index,
+        stimage_error_t* const error) {
+
+    size_t*   counts    = NULL;
+    size_t*   count     = NULL;
+    uint64_t* tmp_keys  = NULL;
+    size_t*   tmp_index = NULL;
+    uint64_t* src_keys  = keys;
+    uint64_t* dst_keys  = NULL;
+    size_t*   src_index = index;
+    size_t*   dst_index = NULL;
+    void*     swap      = NULL;
+    size_t    i         = 0;
+    size_t    pass      = 0;
+    size_t    shift     = 0;
+    size_t    sum       = 0;
+    size_t    c         = 0;
+    size_t    digit     = 0;
+    int       status    = 1;
+
+    assert(keys);
+    assert(error);
+
+    if (n < RADIX_MIN_SIZE) {
+        insertion_sort_keys(n, keys, index);
+        return 0;
+    }
+
+    counts = calloc_with_error(
+            RADIX_PASSES * RADIX_SIZE, sizeof(size_t), error);
+    if (counts == NULL) goto exit;
+
+    tmp_keys = malloc_with_error(n * sizeof(uint64_t), error);
+    if (tmp_keys == NULL) goto exit;
+
+    if (index) {
+        tmp_index = malloc_with_error(n * sizeof(size_t), error);
+        if (tmp_index == NULL) goto exit;
+    }
+
+    /* Compute the histograms for all of the passes at once */
+    for (i = 0; i < n; ++i) {
+        for (pass = 0; pass < RADIX_PASSES; ++pass) {
+            digit = (size_t)(keys[i] >> (pass * RADIX_BITS)) & RADIX_MASK;
+            ++counts[pass * RADIX_SIZE + digit];
+        }
+    }
+
+    dst_keys = tmp_keys;
+    dst_index = tmp_index;
+
+    for (pass = 0; pass < RADIX_PASSES; ++pass) {
+        shift = pass * RADIX_BITS;
+        count = counts + pass * RADIX_SIZE;
+
+        /* If every key has the same digit, this pass would not change
+           anything */
+        digit = (size_t)(src_keys[0] >> shift) & RADIX_MASK;
+        if (count[digit] == n) {
+            continue;
+        }
+
+        /* Convert the histogram to starting offsets */
+        sum = 0;
+        for (i = 0; i < RADIX_SIZE; ++i) {
+            c = count[i];
+            count[i] = sum;
+            sum += c;
+        }
+
+        /* Scatter the keys into the other buffer */
+        for (i = 0; i < n; ++i) {
+            digit = (size_t)(src_keys[i] >> shift) & RADIX_MASK;
+            c = count[digit]++;
+            dst_keys[c] = src_keys[i];
+            if (index) {
+                dst_index[c] = src_index[i];
+            }
+        }
+
+        swap = src_keys; src_keys = dst_keys; dst_keys = swap;
+        swap = src_index; src_index = dst_index; dst_index = swap;
+    }
+
+    /* Make sure the result ends up in the caller's buffers */
+    if (src_keys != keys) {
+        memcpy(keys, src_keys, n * sizeof(uint64_t));
+        if (index) {
+            memcpy(index, src_index, n * sizeof(size_t));
+        }
+    }
+
+    status = 0;
+
+ exit:
+
+    free(counts);
+    free(tmp_keys);
+    free(tmp_index);
+
+    return status;
+}
+
+int
+radix_argsort(
+        const size_t n,
+        const double* const base,
+        const size_t stride,
+        size_t* const perm,
+        stimage_error_t* const error) {
+
+    uint64_t*   keys   = NULL;
+    const char* p      = (const char*)base;
+    size_t      i      = 0;
+    int         status = 1;
+
+    assert(base);
+    assert(perm);
+    assert(error);
+
+    keys = malloc_with_error(n * sizeof(uint64_t), error);
+    if (keys == NULL) goto exit;
+
+    for (i = 0; i < n; ++i, p += stride) {
+        /* Adding 0.0 turns -0.0 into 0.0, so that the two compare
+           equal and the sort remains stable between them, as it would
+           with a comparison function. */
+        keys[i] = radix_key_from_double(*(const double*)p + 0.0);
+        perm[i] = i;
+    }
+
+    if (radix_sort_keys(n, keys, perm, error)) goto exit;
+
+    status = 0;
+
+ exit:
+
+    free(keys);
+
+    return status;
+}
+
+int
+radix_argsort_float(
+        const size_t n,
+        const float* const base,
+        const size_t stride,
+        size_t* const perm,
+        stimage_error_t* const error) {
+
+    uint64_t*   keys   = NULL;
+    const char* p      = (const char*)base;
+    size_t      i      = 0;
+    int         status = 1;
+
+    assert(base);
+    assert(perm);
+    assert(error);
+
+    keys = malloc_with_error(n * sizeof(uint64_t), error);
+    if (keys == NULL) goto exit;
+
+    /* Converting to double is exact, and leaves the low 29 bits of
+       every key zero, so radix_sort_keys skips those passes */
+    for (i = 0; i < n; ++i, p += stride) {
+        keys[i] = radix_key_from_double((double)*(const float*)p + 0.0);
+        perm[i] = i;
+    }
+
+    if (radix_sort_keys(n, keys, perm, error)) goto exit;
+
+    status = 0;
+
+ exit:
+
+    free(keys);
+
+    return status;
+}
+
+int
+radix_sort_doubles(
+        const size_t n,
+        double* const a,
+        stimage_error_t* const error) {
+
+    uint64_t* keys   = NULL;
+    size_t    i      = 0;
+    int       status = 1;
+
+    assert(a);
+    assert(error);
+
+    keys = malloc_with_error(n * sizeof(uint64_t), error);
+    if (keys == NULL) goto exit;
+
+    for (i = 0; i < n; ++i) {
+        keys[i] = radix_key_from_double(a[i]);
+    }
+
+    if (radix_sort_keys(n, keys, NULL, error)) goto exit;
+
+    for (i = 0; i < n; ++i) {
+        a[i] = radix_key_to_double(keys[i]);
+    }
+
+    status = 0;
+
+ exit:
+
+    free(keys);
+
+    return status;
+}
+
+int
+apply_permutation(
+        const size_t n,
+        void* const base,
+        const size_t size,
+        size_t* const perm,
+        stimage_error_t* const error) {
+
+    char*  a      = (char*)base;
+    char*  tmp    = NULL;
+    size_t i      = 0;
+    size_t j      = 0;
+    size_t k      = 0;
+    int    status = 1;
+
+    assert(base);
+    assert(perm);
+    assert(error);
+
+    tmp = malloc_with_error(size, error);
+    if (tmp == NULL) goto exit;
+
+    for (i = 0; i < n; ++i) {
+        if (perm[i] == i) {
+            continue;
+        }
+
+        /* Follow the cycle starting at i, marking each element as
+           done by resetting its perm entry */
+        memcpy(tmp, a + i * size, size);
+        j = i;
+        for (;;) {
+            k = perm[j];
+            perm[j] = j;
+            if (k == i) {
+                memcpy(a + j * size, tmp, size);
+                break;
+            }
+            memcpy(a + j * size, a + k * size, size);
+            j = k;
+        }
+    }
+
+    status = 0;
+
+ exit:
+
+    free(tmp);
+
+    return status;
+}
@@ -35,8 +35,10 @@ DAMAGE.
 */
 
 #include <assert.h>
+#include <stdint.h>
 #include <stdlib.h>
 
+#include "lib/radixsort.h"
 #include "lib/util.h"
 
 void *
@@ -50,7 +52,8 @@ malloc_with_error(
 
     result = malloc(size);
     if (result == NULL) {
-        stimage_error_format_message(error, "Error allocating %u bytes", size);
+        stimage_error_format_message(
+                error, "Error allocating %lu bytes", (unsigned long)size);
     }
     return result;
 }
@@ -67,7 +70,15 @@ calloc_with_error(
 
     result = calloc(nmemb, size);
     if (result == NULL) {
-        stimage_error_format_message(error, "Error allocating %u bytes", size);
+        if (size != 0 && nmemb > SIZE_MAX / size) {
+            stimage_error_format_message(
+                    error, "Error allocating %lu x %lu bytes",
+                    (unsigned long)nmemb, (unsigned long)size);
+        } else {
+            stimage_error_format_message(
+                    error, "Error allocating %lu bytes",
+                    (unsigned long)(nmemb * size));
+        }
     }
     return result;
 }
@@ -104,7 +115,7 @@ combinatorial(
     size_t gfac;
     size_t i;
 
-    assert(n > ngroup);
+    assert(n >= ngroup);
     assert(ngroup > 0);
     assert(n < 2346);
 
@@ -147,9 +158,17 @@ sort_doubles(
         const size_t n,
         double* const a) {
 
+    stimage_error_t error;
+
     assert(a);
 
-    qsort(a, n, sizeof(double), &double_compare);
+    stimage_error_init(&error);
+
+    /* Fall back to qsort if the radix sort can not allocate its
+       scratch space */
+    if (radix_sort_doubles(n, a, &error)) {
+        qsort(a, n, sizeof(double), &double_compare);
+    }
 }
 
 void
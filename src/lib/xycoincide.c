@@ -35,14 +35,283 @@ DAMAGE.
 */
 
 #include <assert.h>
+#include <float.h>
+#include <stdlib.h>
 #include <string.h>
 
 #include "lib/xycoincide.h"
 
-size_t
-xycoincide(
+/* Find the first object after iprev that is outside the tolerance
+   limit in y.  The test is monotonic in a sorted list, so this can
+   gallop ahead and then bisect, rather than stepping through every
+   object in the window. */
+static size_t
+xycoincide_window_end(
+    const size_t n,
+    const double* const y,
+    const size_t iprev,
+    const double tolerance2) {
+
+    size_t lo   = iprev + 1;
+    size_t hi   = 0;
+    size_t mid  = 0;
+    size_t step = 1;
+    double dy;
+
+    #define OUTSIDE(i) (dy = y[i] - y[iprev], dy * dy > tolerance2)
+
+    /* Gallop: find hi such that hi is outside (or n) and lo is the
+       first candidate */
+    hi = lo;
+    while (hi < n && !OUTSIDE(hi)) {
+        lo = hi + 1;
+        hi += step;
+        step <<= 1;
+    }
+    if (hi > n) {
+        hi = n;
+    }
+
+    /* Bisect in [lo, hi) */
+    while (lo < hi) {
+        mid = lo + (hi - lo) / 2;
+        if (OUTSIDE(mid)) {
+            hi = mid;
+        } else {
+            lo = mid + 1;
+        }
+    }
+
+    #undef OUTSIDE
+
+    return lo;
+}
+
+int
+xycoincide_soa(
+    xysoa_t* const coords,
+    const double tolerance,
+    stimage_error_t* const error) {
+
+    const double   tolerance2 = tolerance * tolerance;
+    const double*  x;
+    const double*  y;
+    unsigned char* deleted    = NULL;
+    double         r2[XYSOA_BLOCK];
+    double         dx, dy;
+    size_t         n;
+    size_t         nunique;
+    size_t         nwindow;
+    size_t         iprev, i, j, end;
+
+    assert(coords);
+    assert(error);
+
+    n = coords->n;
+    x = coords->x;
+    y = coords->y;
+
+    if (n < 2) {
+        return 0;
+    }
+
+    deleted = calloc_with_error(n, sizeof(unsigned char), error);
+    if (deleted == NULL) {
+        return 1;
+    }
+
+    for (iprev = 0; iprev < n; ++iprev) {
+        /* Jump to the next object if this one has been deleted,
+           since all comparisons are invalid */
+        if (deleted[iprev]) {
+            continue;
+        }
+
+        /* Since the list is sorted in y, everything within the
+           tolerance limit in y follows directly.  (Deleted objects
+           don't need to be skipped here, since anything beyond the
+           first object outside the limit is also outside it.) */
+        end = xycoincide_window_end(n, y, iprev, tolerance2);
+
+        /* Delete everything in that window that is too close, one
+           block at a time */
+        for (i = iprev + 1; i < end; i += XYSOA_BLOCK) {
+            nwindow = MIN(XYSOA_BLOCK, end - i);
+
+            for (j = 0; j < nwindow; ++j) {
+                dy = y[i + j] - y[iprev];
+                dx = x[i + j] - x[iprev];
+                r2[j] = dy * dy + dx * dx;
+            }
+
+            for (j = 0; j < nwindow; ++j) {
+                deleted[i + j] |= (r2[j] <= tolerance2);
+            }
+        }
+    }
+
+    /* Compress the arrays */
+    nunique = 0;
+    for (i = 0; i < n; ++i) {
+        if (!deleted[i]) {
+            coords->x[nunique] = coords->x[i];
+            coords->y[nunique] = coords->y[i];
+            coords->index[nunique] = coords->index[i];
+            ++nunique;
+        }
+    }
+    coords->n = nunique;
+
+    free(deleted);
+
+    return 0;
+}
+
+/* The single-precision counterpart of xycoincide_window_end.  The
+   differences are computed in double precision. */
+static size_t
+xycoincide_window_endf(
+    const size_t n,
+    const float* const y,
+    const size_t iprev,
+    const double tolerance2) {
+
+    size_t lo   = iprev + 1;
+    size_t hi   = 0;
+    size_t mid  = 0;
+    size_t step = 1;
+    double dy;
+
+    #define OUTSIDE(i) (dy = (double)y[i] - (double)y[iprev], \
+                        dy * dy > tolerance2)
+
+    hi = lo;
+    while (hi < n && !OUTSIDE(hi)) {
+        lo = hi + 1;
+        hi += step;
+        step <<= 1;
+    }
+    if (hi > n) {
+        hi = n;
+    }
+
+    while (lo < hi) {
+        mid = lo + (hi - lo) / 2;
+        if (OUTSIDE(mid)) {
+            hi = mid;
+        } else {
+            lo = mid + 1;
+        }
+    }
+
+    #undef OUTSIDE
+
+    return lo;
+}
+
+int
+xycoincide_soaf(
+    xysoaf_t* const coords,
+    const double tolerance,
+    stimage_error_t* const error) {
+
+    const double   tolerance2 = tolerance * tolerance;
+    const float*   x;
+    const float*   y;
+    unsigned char* deleted    = NULL;
+    float          r2[XYSOA_BLOCK];
+    float          dxf, dyf, x0, y0, inside2, outside2, nborder;
+    double         dx, dy;
+    size_t         n;
+    size_t         nunique;
+    size_t         nwindow;
+    size_t         iprev, i, j, end;
+
+    assert(coords);
+    assert(error);
+
+    n = coords->n;
+    x = coords->x;
+    y = coords->y;
+
+    if (n < 2) {
+        return 0;
+    }
+
+    deleted = calloc_with_error(n, sizeof(unsigned char), error);
+    if (deleted == NULL) {
+        return 1;
+    }
+
+    /* Squared distances computed in single precision at or below
+       inside2 are certainly within the tolerance, and those above
+       outside2 are certainly outside it.  Anything in between is
+       recomputed in double precision. */
+    inside2 = (float)MIN(
+            tolerance2 * (1.0 - XYSOAF_R2_RELATIVE_MARGIN) -
+            XYSOAF_R2_ABSOLUTE_MARGIN, FLT_MAX);
+    outside2 = (float)MIN(
+            tolerance2 * (1.0 + XYSOAF_R2_RELATIVE_MARGIN) +
+            XYSOAF_R2_ABSOLUTE_MARGIN, FLT_MAX);
+
+    for (iprev = 0; iprev < n; ++iprev) {
+        if (deleted[iprev]) {
+            continue;
+        }
+
+        end = xycoincide_window_endf(n, y, iprev, tolerance2);
+
+        x0 = x[iprev];
+        y0 = y[iprev];
+        for (i = iprev + 1; i < end; i += XYSOA_BLOCK) {
+            nwindow = MIN(XYSOA_BLOCK, end - i);
+
+            nborder = 0.0f;
+            for (j = 0; j < nwindow; ++j) {
+                dyf = y[i + j] - y0;
+                dxf = x[i + j] - x0;
+                r2[j] = dyf * dyf + dxf * dxf;
+                nborder += ((r2[j] > inside2) & (r2[j] <= outside2)) ?
+                    1.0f : 0.0f;
+            }
+
+            for (j = 0; j < nwindow; ++j) {
+                deleted[i + j] |= (r2[j] <= inside2);
+            }
+
+            if (nborder == 0.0f) {
+                continue;
+            }
+
+            for (j = 0; j < nwindow; ++j) {
+                if (r2[j] > inside2 && r2[j] <= outside2) {
+                    dy = (double)y[i + j] - (double)y0;
+                    dx = (double)x[i + j] - (double)x0;
+                    deleted[i + j] |= (dy * dy + dx * dx <= tolerance2);
+                }
+            }
+        }
+    }
+
+    nunique = 0;
+    for (i = 0; i < n; ++i) {
+        if (!deleted[i]) {
+            coords->x[nunique] = coords->x[i];
+            coords->y[nunique] = coords->y[i];
+            coords->index[nunique] = coords->index[i];
+            ++nunique;
+        }
+    }
+    coords->n = nunique;
+
+    free(deleted);
+
+    return 0;
+}
+
+static size_t
+xycoincide_scalar(
     const size_t ncoords,
-    const coord_t* const * const input /*[ncoords]*/,
     const coord_t** const output /*[ncoords]*/,
     const double tolerance) {
 
@@ -53,13 +322,6 @@ xycoincide(
     size_t iprev = 0;
     size_t i = 0;
 
-    assert(input);
-    assert(output);
-
-    if ((coord_t **)input != (coord_t **)output) {
-        memcpy(output, input, sizeof(coord_t *) * ncoords);
-    }
-
     for (iprev = 0; iprev < ncoords; ++iprev) {
         /* Jump to the next object if this one has been deleted,
            since all comparisons are invalid */
@@ -105,3 +367,59 @@ xycoincide(
 
     return nunique;
 }
+
+size_t
+xycoincide(
+    const size_t ncoords,
+    const coord_t* const * const input /*[ncoords]*/,
+    const coord_t** const output /*[ncoords]*/,
+    const double tolerance) {
+
+    xysoa_t         soa;
+    size_t          nunique = 0;
+    size_t          i       = 0;
+    stimage_error_t error;
+
+    assert(input);
+    assert(output);
+
+    stimage_error_init(&error);
+
+    if ((coord_t **)input != (coord_t **)output) {
+        memcpy(output, input, sizeof(coord_t *) * ncoords);
+    }
+
+    if (ncoords < 2) {
+        return ncoords;
+    }
+
+    /* The work is done on a contiguous copy of the coordinates.  The
+       indices in the copy are positions in the pointer array, rather
+       than in the coordinate array the pointers point into.  If the
+       copy can't be allocated, fall back to working on the pointers
+       directly. */
+    if (xysoa_init(&soa, ncoords, &error)) {
+        return xycoincide_scalar(ncoords, output, tolerance);
+    }
+
+    for (i = 0; i < ncoords; ++i) {
+        soa.x[i] = output[i]->x;
+        soa.y[i] = output[i]->y;
+        soa.index[i] = i;
+    }
+
+    if (xycoincide_soa(&soa, tolerance, &error)) {
+        xysoa_free(&soa);
+        return xycoincide_scalar(ncoords, output, tolerance);
+    }
+    nunique = soa.n;
+
+    /* soa.index is increasing, so this can be done in place */
+    for (i = 0; i < nunique; ++i) {
+        output[i] = output[soa.index[i]];
+    }
+
+    xysoa_free(&soa);
+
+    return nunique;
+}
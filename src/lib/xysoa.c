@@ -0,0 +1,293 @@
+/*
+Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+    1. Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+
+    2. Redistributions in binary form must reproduce the above
+      copyright notice, this list of conditions and the following
+      disclaimer in the documentation and/or other materials provided
+      with the distribution.
+
+    3. The name of AURA and its representatives may not be used to
+      endorse or promote products derived from this software without
+      specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+DAMAGE.
+*/
+
+#include <assert.h>
+#include <string.h>
+
+#include "lib/radixsort.h"
+#include "lib/xysoa.h"
+
+void
+xysoa_new(
+        xysoa_t* const soa) {
+
+    assert(soa);
+
+    memset(soa, 0, sizeof(xysoa_t));
+}
+
+int
+xysoa_init(
+        xysoa_t* const soa,
+        const size_t n,
+        stimage_error_t* const error) {
+
+    size_t nalloc = MAX(n, 1);
+
+    assert(soa);
+    assert(error);
+
+    xysoa_new(soa);
+
+    soa->x = malloc_with_error(nalloc * sizeof(double), error);
+    if (soa->x == NULL) goto fail;
+    soa->y = malloc_with_error(nalloc * sizeof(double), error);
+    if (soa->y == NULL) goto fail;
+    soa->index = malloc_with_error(nalloc * sizeof(size_t), error);
+    if (soa->index == NULL) goto fail;
+
+    soa->n = n;
+
+    return 0;
+
+ fail:
+    xysoa_free(soa);
+
+    return 1;
+}
+
+void
+xysoa_free(
+        xysoa_t* const soa) {
+
+    assert(soa);
+
+    free(soa->x); soa->x = NULL;
+    free(soa->y); soa->y = NULL;
+    free(soa->index); soa->index = NULL;
+    soa->n = 0;
+}
+
+void
+xysoa_gather(
+        const size_t n,
+        const coord_t* const base,
+        const coord_t* const * const sorted /*[n]*/,
+        xysoa_t* const soa) {
+
+    size_t i;
+
+    assert(base);
+    assert(sorted);
+    assert(soa);
+
+    for (i = 0; i < n; ++i) {
+        soa->x[i] = sorted[i]->x;
+        soa->y[i] = sorted[i]->y;
+        soa->index[i] = sorted[i] - base;
+    }
+    soa->n = n;
+}
+
+void
+xysoa_pointers(
+        const xysoa_t* const soa,
+        const coord_t* const base,
+        const coord_t** const sorted /*[soa->n]*/) {
+
+    size_t i;
+
+    assert(soa);
+    assert(base);
+    assert(sorted);
+
+    for (i = 0; i < soa->n; ++i) {
+        sorted[i] = base + soa->index[i];
+    }
+}
+
+void
+xysoaf_new(
+        xysoaf_t* const soa) {
+
+    assert(soa);
+
+    memset(soa, 0, sizeof(xysoaf_t));
+}
+
+int
+xysoaf_init(
+        xysoaf_t* const soa,
+        const size_t n,
+        stimage_error_t* const error) {
+
+    size_t nalloc = MAX(n, 1);
+
+    assert(soa);
+    assert(error);
+
+    xysoaf_new(soa);
+
+    soa->x = malloc_with_error(nalloc * sizeof(float), error);
+    if (soa->x == NULL) goto fail;
+    soa->y = malloc_with_error(nalloc * sizeof(float), error);
+    if (soa->y == NULL) goto fail;
+    soa->index = malloc_with_error(nalloc * sizeof(size_t), error);
+    if (soa->index == NULL) goto fail;
+
+    soa->n = n;
+
+    return 0;
+
+ fail:
+    xysoaf_free(soa);
+
+    return 1;
+}
+
+void
+xysoaf_free(
+        xysoaf_t* const soa) {
+
+    assert(soa);
+
+    free(soa->x); soa->x = NULL;
+    free(soa->y); soa->y = NULL;
+    free(soa->index); soa->index = NULL;
+    soa->n = 0;
+}
+
+/* Runs of equal y values longer than this are sorted by x with a
+   radix sort rather than an insertion sort, as in xysort */
+#define XYSOAF_MAX_INSERTION_RUN 32
+
+static int
+xysoaf_sort_run_by_x(
+        const size_t nrun,
+        float* const x,
+        size_t* const index,
+        stimage_error_t* const error) {
+
+    size_t* perm   = NULL;
+    float*  xtmp   = NULL;
+    size_t* itmp   = NULL;
+    float   tmpx   = 0.0f;
+    size_t  tmpi   = 0;
+    size_t  i      = 0;
+    size_t  j      = 0;
+    int     status = 1;
+
+    /* y is the same throughout the run, so only x and index need to
+       be moved */
+    if (nrun <= XYSOAF_MAX_INSERTION_RUN) {
+        for (i = 1; i < nrun; ++i) {
+            tmpx = x[i];
+            tmpi = index[i];
+            for (j = i; j > 0 && x[j-1] > tmpx; --j) {
+                x[j] = x[j-1];
+                index[j] = index[j-1];
+            }
+            x[j] = tmpx;
+            index[j] = tmpi;
+        }
+        return 0;
+    }
+
+    perm = malloc_with_error(nrun * sizeof(size_t), error);
+    if (perm == NULL) goto exit;
+    xtmp = malloc_with_error(nrun * sizeof(float), error);
+    if (xtmp == NULL) goto exit;
+    itmp = malloc_with_error(nrun * sizeof(size_t), error);
+    if (itmp == NULL) goto exit;
+
+    if (radix_argsort_float(nrun, x, sizeof(float), perm, error)) goto exit;
+
+    for (i = 0; i < nrun; ++i) {
+        xtmp[i] = x[perm[i]];
+        itmp[i] = index[perm[i]];
+    }
+    memcpy(x, xtmp, nrun * sizeof(float));
+    memcpy(index, itmp, nrun * sizeof(size_t));
+
+    status = 0;
+
+ exit:
+
+    free(perm);
+    free(xtmp);
+    free(itmp);
+
+    return status;
+}
+
+int
+xysoaf_sort(
+        const size_t n,
+        const coordf_t* const coords /*[n]*/,
+        xysoaf_t* const soa,
+        stimage_error_t* const error) {
+
+    size_t* perm   = NULL;
+    size_t  i      = 0;
+    size_t  j      = 0;
+    int     status = 1;
+
+    assert(coords);
+    assert(soa);
+    assert(error);
+
+    soa->n = n;
+    if (n == 0) {
+        return 0;
+    }
+
+    perm = malloc_with_error(n * sizeof(size_t), error);
+    if (perm == NULL) goto exit;
+
+    if (radix_argsort_float(n, &coords[0].y, sizeof(coordf_t), perm, error)) {
+        goto exit;
+    }
+
+    for (i = 0; i < n; ++i) {
+        soa->x[i] = coords[perm[i]].x;
+        soa->y[i] = coords[perm[i]].y;
+        soa->index[i] = perm[i];
+    }
+
+    /* Sort each run of equal y by x */
+    for (i = 0; i < n; i = j) {
+        for (j = i + 1; j < n && soa->y[j] == soa->y[i]; ++j) {
+            /* empty */
+        }
+        if (j - i > 1) {
+            if (xysoaf_sort_run_by_x(
+                        j - i, soa->x + i, soa->index + i, error)) goto exit;
+        }
+    }
+
+    status = 0;
+
+ exit:
+
+    free(perm);
+
+    return status;
+}
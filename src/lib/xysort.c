@@ -37,6 +37,7 @@ DAMAGE.
 #include <assert.h>
 #include <stdlib.h>
 
+#include "lib/radixsort.h"
 #include "lib/xysort.h"
 
 /* DIFF: The documentation of the original function (part of rg_sort)
@@ -49,8 +50,14 @@ DAMAGE.
    Whereas the original function sorts the data as well as a set of
    indices, we treat the data as constant and sort pointers to the
    data (which can later be used as indices using pointer
-   subtraction).  This allows us to use the C stdlib qsort as-is
-   rather than writing our own quicksort algorithm.
+   subtraction).
+
+   The primary sort on y is a radix sort (see radixsort.h), which
+   avoids the overhead of calling a comparison function through a
+   pointer for every comparison.  Exactly equal y values are rare, so
+   the secondary sort on x is done afterward only within each run of
+   equal y values.  If the scratch memory for the radix sort can not
+   be allocated, we fall back to the C stdlib qsort.
 */
 
 static int
@@ -73,17 +80,107 @@ xysort_compare(const void* ap, const void* bp) {
     }
 }
 
+/* Runs of equal y values longer than this are sorted by x with a
+   radix sort rather than an insertion sort */
+#define XYSORT_MAX_INSERTION_RUN 32
+
+static int
+xysort_run_by_x(
+        const size_t nrun,
+        const coord_t** const run,
+        stimage_error_t* const error) {
+
+    double*         x      = NULL;
+    size_t*         perm   = NULL;
+    const coord_t*  tmp    = NULL;
+    size_t          i      = 0;
+    size_t          j      = 0;
+    int             status = 1;
+
+    if (nrun <= XYSORT_MAX_INSERTION_RUN) {
+        for (i = 1; i < nrun; ++i) {
+            tmp = run[i];
+            for (j = i; j > 0 && run[j-1]->x > tmp->x; --j) {
+                run[j] = run[j-1];
+            }
+            run[j] = tmp;
+        }
+        return 0;
+    }
+
+    x = malloc_with_error(nrun * sizeof(double), error);
+    if (x == NULL) goto exit;
+
+    perm = malloc_with_error(nrun * sizeof(size_t), error);
+    if (perm == NULL) goto exit;
+
+    for (i = 0; i < nrun; ++i) {
+        x[i] = run[i]->x;
+    }
+
+    if (radix_argsort(nrun, x, sizeof(double), perm, error) ||
+        apply_permutation(nrun, (void*)run, sizeof(coord_t*), perm, error)) {
+        goto exit;
+    }
+
+    status = 0;
+
+ exit:
+
+    free(x);
+    free(perm);
+
+    return status;
+}
+
 void
 xysort(
     const size_t ncoords,
     const coord_t* const coords /* [ncoords] */,
     const coord_t** const coords_ptr /* [ncoords] */) {
 
-    size_t i;
+    size_t*         perm   = NULL;
+    size_t          i      = 0;
+    size_t          j      = 0;
+    stimage_error_t error;
 
     assert(coords);
     assert(coords_ptr);
 
+    stimage_error_init(&error);
+
+    if (ncoords == 0) {
+        return;
+    }
+
+    perm = malloc_with_error(ncoords * sizeof(size_t), &error);
+    if (perm == NULL ||
+        radix_argsort(ncoords, &coords[0].y, sizeof(coord_t), perm, &error)) {
+        goto fallback;
+    }
+
+    /* Fill the pointer array in y order */
+    for (i = 0; i < ncoords; ++i) {
+        coords_ptr[i] = coords + perm[i];
+    }
+
+    /* Sort each run of equal y by x */
+    for (i = 0; i < ncoords; i = j) {
+        for (j = i + 1; j < ncoords && coords_ptr[j]->y == coords_ptr[i]->y; ++j) {
+            /* empty */
+        }
+        if (j - i > 1) {
+            if (xysort_run_by_x(j - i, coords_ptr + i, &error)) goto fallback;
+        }
+    }
+
+    free(perm);
+    return;
+
+ fallback:
+
+    free(perm);
+
     /* Fill the pointer array */
     for (i = 0; i < ncoords; ++i) {
         coords_ptr[i] = (coord_t*)coords + i;
@@ -0,0 +1,176 @@
+/*
+Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+    1. Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+
+    2. Redistributions in binary form must reproduce the above
+      copyright notice, this list of conditions and the following
+      disclaimer in the documentation and/or other materials provided
+      with the distribution.
+
+    3. The name of AURA and its representatives may not be used to
+      endorse or promote products derived from this software without
+      specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+DAMAGE.
+*/
+
+#include <assert.h>
+#include <string.h>
+
+#include "surface/basis.h"
+#include "lib/polynomial.h"
+
+void
+surface_basis_cache_init(
+        surface_basis_cache_t* const cache,
+        const size_t ncoord,
+        const coord_t* const coord) {
+
+    assert(cache);
+
+    memset(cache, 0, sizeof(surface_basis_cache_t));
+    cache->ncoord = ncoord;
+    cache->coord = coord;
+    cache->last = SURFACE_BASIS_CACHE_SIZE;
+}
+
+void
+surface_basis_cache_free(
+        surface_basis_cache_t* const cache) {
+
+    size_t i;
+
+    assert(cache);
+
+    for (i = 0; i < SURFACE_BASIS_CACHE_SIZE; ++i) {
+        free(cache->entries[i].basis);
+        cache->entries[i].basis = NULL;
+        cache->entries[i].order = 0;
+    }
+    cache->next = 0;
+    cache->last = SURFACE_BASIS_CACHE_SIZE;
+}
+
+int
+surface_basis(
+        const surface_type_e type,
+        const size_t ncoord,
+        const size_t axis,
+        const coord_t* const coord,
+        const size_t order,
+        const double k1,
+        const double k2,
+        /* Output */
+        double* const basis,
+        stimage_error_t* const error) {
+
+    assert(coord);
+    assert(basis);
+    assert(error);
+
+    switch (type) {
+    case surface_type_polynomial:
+        return basis_poly(
+                ncoord, axis, coord, (int)order, k1, k2, basis, error);
+    case surface_type_chebyshev:
+        return basis_chebyshev(
+                ncoord, axis, coord, (int)order, k1, k2, basis, error);
+    case surface_type_legendre:
+        return basis_legendre(
+                ncoord, axis, coord, (int)order, k1, k2, basis, error);
+    default:
+        stimage_error_set_message(error, "Illegal curve type");
+        return 1;
+    }
+}
+
+int
+surface_basis_cache_get(
+        surface_basis_cache_t* const cache,
+        const surface_type_e type,
+        const size_t axis,
+        const size_t order,
+        const double k1,
+        const double k2,
+        /* Output */
+        const double** const basis,
+        stimage_error_t* const error) {
+
+    surface_basis_entry_t* entry = NULL;
+    double*                tmp   = NULL;
+    size_t                 i;
+
+    assert(cache);
+    assert(cache->coord || cache->ncoord == 0);
+    assert(basis);
+    assert(error);
+
+    for (i = 0; i < SURFACE_BASIS_CACHE_SIZE; ++i) {
+        if (cache->entries[i].basis != NULL &&
+            cache->entries[i].type == type &&
+            cache->entries[i].axis == axis &&
+            cache->entries[i].k1 == k1 &&
+            cache->entries[i].k2 == k2) {
+            entry = &cache->entries[i];
+            break;
+        }
+    }
+
+    if (entry != NULL && entry->order >= order) {
+        cache->last = (size_t)(entry - cache->entries);
+        *basis = entry->basis;
+        return 0;
+    }
+
+    /* Evict the oldest entry if nothing matches, but never the one
+       handed out by the previous call, so that the x and y bases of a
+       surface can be held at the same time */
+    if (entry == NULL) {
+        if (cache->next == cache->last) {
+            cache->next = (cache->next + 1) % SURFACE_BASIS_CACHE_SIZE;
+        }
+        entry = &cache->entries[cache->next];
+        cache->next = (cache->next + 1) % SURFACE_BASIS_CACHE_SIZE;
+        free(entry->basis);
+        entry->basis = NULL;
+        entry->order = 0;
+    }
+
+    tmp = malloc_with_error(
+            MAX(order, 1) * MAX(cache->ncoord, 1) * sizeof(double), error);
+    if (tmp == NULL) return 1;
+
+    if (surface_basis(
+                type, cache->ncoord, axis, cache->coord, order, k1, k2, tmp,
+                error)) {
+        free(tmp);
+        return 1;
+    }
+
+    free(entry->basis);
+    entry->basis = tmp;
+    entry->type  = type;
+    entry->axis  = axis;
+    entry->order = order;
+    entry->k1    = k1;
+    entry->k2    = k2;
+
+    cache->last = (size_t)(entry - cache->entries);
+    *basis = entry->basis;
+    return 0;
+}
@@ -65,7 +65,6 @@ cholesky_factorization(
     /* Copy matrix into matfac */
     for (n = 0; n < nrows; ++n) {
         for (j = 0; j < nbands; ++j) {
-            assert(n < nbands && j < nrows);
             MATFAC(j, n) = MATRIX(j, n);
         }
     }
@@ -75,7 +74,6 @@ cholesky_factorization(
         if (((MATFAC(0, n) + MATRIX(0, n)) - MATRIX(0, n)) <=
             1000.0 / MAX_DOUBLE) {
             for (j = 0; j < nbands; ++j) {
-                assert(n < nbands && j < nrows);
                 MATFAC(j, n) = 0.0;
             }
             *error_type = surface_fit_error_singular;
@@ -84,22 +82,20 @@ cholesky_factorization(
 
         assert(MATFAC(0, n) != 0.0);
         MATFAC(0, n) = 1.0 / MATFAC(0, n);
-        imax = MIN(nbands - 1, nrows - n);
-        if (imax < 0) {
+        imax = (int)MIN(nbands - 1, nrows - n - 1);
+        if (imax < 1) {
             continue;
         }
 
         jmax = imax;
-        for (i = 0; i < (size_t)imax; ++i) {
-            assert(n < nbands && i+1 < nrows);
-            ratio = MATFAC(i+1, n) * MATFAC(0, n);
+        for (i = 1; i <= (size_t)imax; ++i) {
+            ratio = MATFAC(i, n) * MATFAC(0, n);
             for (j = 0; j < (size_t)jmax; ++j) {
-                assert(n+i < nbands && j < nrows && j+i < nrows);
+                assert(n+i < nrows && j+i < nbands);
                 MATFAC(j, n+i) = MATFAC(j, n+i) - MATFAC(j+i, n) * ratio;
             }
             --jmax;
-            assert(n < nbands && i+1 < nrows);
-            MATFAC(i+1, n) = ratio;
+            MATFAC(i, n) = ratio;
         }
     }
 
@@ -123,6 +119,7 @@ cholesky_solve(
 
     size_t i, j, jmax, nbands_m1;
     int n;
+    double sum;
 
     assert(matfac);
     assert(vector);
@@ -144,23 +141,21 @@ cholesky_solve(
     /* Forward substitution */
     nbands_m1 = nbands - 1;
     for (n = 0; n < (int)nrows; ++n) {
-        jmax = MIN(nbands_m1, nrows - n);
-        if (jmax >= 1) {
-            for (j = 0; j < jmax; ++j) {
-                coeff[j+n] -= MATFAC(j+1, n) * coeff[n];
-            }
+        jmax = MIN(nbands_m1, nrows - (size_t)n - 1);
+        for (j = 1; j <= jmax; ++j) {
+            coeff[j+n] -= MATFAC(j, n) * coeff[n];
         }
     }
 
     /* Back substitution */
     for (n = (int)nrows - 1; n >= 0; --n) {
         coeff[n] *= MATFAC(0, n);
-        jmax = MIN(nbands_m1, nrows - n);
-        if (jmax >= 1) {
-            for (j = 0; j < jmax; ++j) {
-                coeff[n] -= MATFAC(j+1, n) * coeff[j+n];
-            }
+        jmax = MIN(nbands_m1, nrows - (size_t)n - 1);
+        sum = 0.0;
+        for (j = 1; j <= jmax; ++j) {
+            sum += MATFAC(j, n) * coeff[j+n];
         }
+        coeff[n] -= sum;
     }
 
     return 0;
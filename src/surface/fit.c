@@ -32,9 +32,9 @@ DAMAGE.
 #include <assert.h>
 #include <stdio.h>
 
+#include "surface/basis.h"
 #include "surface/cholesky.h"
 #include "surface/fit.h"
-#include "lib/polynomial.h"
 
 static double
 vector_dot_product(
@@ -52,10 +52,14 @@ vector_dot_product(
     return sum;
 }
 
-/* was dgsacpts */
+/* was dgsacpts
+
+   If cache is not NULL, the basis functions are taken from it, and
+   coord must be the coordinates of the cache. */
 static int
 surface_fit_add_points(
         surface_t* const s,
+        surface_basis_cache_t* const cache,
         const size_t ncoord,
         const coord_t* const coord,
         const double* const z,
@@ -68,14 +72,16 @@ surface_fit_add_points(
     double* bw = NULL;
     double* xbasis = NULL;
     double* ybasis = NULL;
+    const double* xb;
+    const double* yb;
+    const double* bxp;
+    const double* byp;
+    const double* bbyp;
+    const double* bbxp;
     double* vzp;
     double* mzp;
-    double* bxp;
-    double* byp;
     double* vindex;
     double* mindex;
-    double* bbyp;
-    double* bbxp;
     int xorder;
     int xxorder;
     int maxorder;
@@ -122,40 +128,29 @@ surface_fit_add_points(
         break;
     }
 
-    xbasis = malloc_with_error(ncoord * s->xorder * sizeof(double), error);
-    if (xbasis == NULL) goto exit;
-    ybasis = malloc_with_error(ncoord * s->yorder * sizeof(double), error);
-    if (ybasis == NULL) goto exit;
-
     /* Calculate the non-zero basis functions */
-    switch (s->type) {
-    case surface_type_polynomial:
-        if (basis_poly(
-                    ncoord, 0, coord, s->xorder, s->xmaxmin, s->xrange,
-                    xbasis, error)) goto exit;
-        if (basis_poly(
-                    ncoord, 1, coord, s->yorder, s->ymaxmin, s->yrange,
-                    ybasis, error)) goto exit;
-        break;
-    case surface_type_chebyshev:
-        if (basis_chebyshev(
-                    ncoord, 0, coord, s->xorder, s->xmaxmin, s->xrange,
-                    xbasis, error)) goto exit;
-        if (basis_chebyshev(
-                    ncoord, 1, coord, s->yorder, s->ymaxmin, s->yrange,
-                    ybasis, error)) goto exit;
-        break;
-    case surface_type_legendre:
-        if (basis_legendre(
-                    ncoord, 0, coord, s->xorder, s->xmaxmin, s->xrange,
-                    xbasis, error)) goto exit;
-        if (basis_legendre(
-                    ncoord, 1, coord, s->yorder, s->ymaxmin, s->yrange,
-                    ybasis, error)) goto exit;
-        break;
-    default:
-        stimage_error_set_message(error, "Illegal curve type");
-        goto exit;
+    if (cache != NULL) {
+        assert(cache->coord == coord && cache->ncoord == ncoord);
+        if (surface_basis_cache_get(
+                    cache, s->type, 0, s->xorder, s->xmaxmin, s->xrange,
+                    &xb, error)) goto exit;
+        if (surface_basis_cache_get(
+                    cache, s->type, 1, s->yorder, s->ymaxmin, s->yrange,
+                    &yb, error)) goto exit;
+    } else {
+        xbasis = malloc_with_error(ncoord * s->xorder * sizeof(double), error);
+        if (xbasis == NULL) goto exit;
+        ybasis = malloc_with_error(ncoord * s->yorder * sizeof(double), error);
+        if (ybasis == NULL) goto exit;
+
+        if (surface_basis(
+                    s->type, ncoord, 0, coord, s->xorder, s->xmaxmin,
+                    s->xrange, xbasis, error)) goto exit;
+        if (surface_basis(
+                    s->type, ncoord, 1, coord, s->yorder, s->ymaxmin,
+                    s->yrange, ybasis, error)) goto exit;
+        xb = xbasis;
+        yb = ybasis;
     }
 
     /* Allocate temporary space for matrix accumulation */
@@ -166,8 +161,8 @@ surface_fit_add_points(
 
     vzp = s->vector - 1;
     mzp = s->matrix;
-    bxp = xbasis;
-    byp = ybasis;
+    bxp = xb;
+    byp = yb;
 
     maxorder = MAX(s->xorder + 1, s->yorder + 1);
     xorder = s->xorder;
@@ -177,9 +172,9 @@ surface_fit_add_points(
             byw[i] = w[i] * byp[i];
         }
 
-        bxp = xbasis;
+        bxp = xb;
 
-        for (k = 1; k <= s->xorder; ++k) {
+        for (k = 1; k <= (size_t)xorder; ++k) {
             for (i = 0; i < ncoord; ++i) {
                 bw[i] = byw[i] * bxp[i];
             }
@@ -196,15 +191,15 @@ surface_fit_add_points(
             for (j = k + ntimes; j <= s->ncoeff; ++j) {
                 mindex = mzp + ii;
                 assert(mindex - s->matrix < s->ncoeff * s->ncoeff);
-                assert((bbxp - xbasis) + ncoord - 1 < ncoord * s->xorder);
-                assert((bbyp - ybasis) + ncoord - 1 < ncoord * s->yorder);
+                assert((bbxp - xb) + ncoord - 1 < ncoord * s->xorder);
+                assert((bbyp - yb) + ncoord - 1 < ncoord * s->yorder);
                 for (i = 0; i < ncoord; ++i) {
                     *mindex += bw[i] * bbxp[i] * bbyp[i];
                 }
                 if (jj % xxorder == 0) {
                     jj = 1;
                     ++ll;
-                    bbxp = xbasis;
+                    bbxp = xb;
                     bbyp += ncoord;
                     switch (s->xterms) {
                     case xterms_none:
@@ -248,8 +243,6 @@ surface_fit_add_points(
 
     status = 0;
 
-    surface_print(s);
-
  exit:
 
     free(byw);
@@ -302,8 +295,6 @@ surface_fit_solve(
         return 1;
     }
 
-    surface_print(s);
-
     return 0;
 }
 
@@ -326,7 +317,36 @@ surface_fit(
     assert(error);
 
     if (surface_zero(s, error) ||
-        surface_fit_add_points(s, ncoord, coord, z, w, weight_type, error) ||
+        surface_fit_add_points(
+                s, NULL, ncoord, coord, z, w, weight_type, error) ||
+        surface_fit_solve(s, error_type, error)) {
+        return 1;
+    }
+
+    return 0;
+}
+
+int
+surface_fit_cached(
+        surface_t* const s,
+        surface_basis_cache_t* const cache,
+        const double* const z,
+        double* const w,
+        const surface_fit_weight_e weight_type,
+        /* Output */
+        surface_fit_error_e* const error_type,
+        stimage_error_t* const error) {
+
+    assert(s);
+    assert(cache);
+    assert(z);
+    assert(w);
+    assert(error);
+
+    if (surface_zero(s, error) ||
+        surface_fit_add_points(
+                s, cache, cache->ncoord, cache->coord, z, w, weight_type,
+                error) ||
         surface_fit_solve(s, error_type, error)) {
         return 1;
     }
@@ -88,9 +88,9 @@ surface_init(
             goto fail;
         }
         s->xrange = 2.0 / (bbox->max.x - bbox->min.x);
-        s->xmaxmin = -(bbox->max.x - bbox->min.x) / 2.0;
+        s->xmaxmin = -(bbox->max.x + bbox->min.x) / 2.0;
         s->yrange = 2.0 / (bbox->max.y - bbox->min.y);
-        s->ymaxmin = -(bbox->max.y - bbox->min.y) / 2.0;
+        s->ymaxmin = -(bbox->max.y + bbox->min.y) / 2.0;
         break;
 
     case surface_type_polynomial:
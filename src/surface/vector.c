@@ -113,3 +113,94 @@ surface_vector(
 
     return status;
 }
+
+/* Accumulate sum(coeff * xbasis * ybasis) over the terms of the
+   surface, in the same coefficient order as the fit */
+static void
+surface_vector_basis(
+        const surface_t* const s,
+        const size_t ncoord,
+        const double* const xbasis,
+        const double* const ybasis,
+        /* Output */
+        double* const zfit) {
+
+    const size_t  maxorder = MAX(s->xorder + 1, s->yorder + 1);
+    const double* xbp;
+    const double* ybp;
+    const double* cp       = s->coeff;
+    double        c;
+    size_t        xincr;
+    size_t        i, j, k;
+
+    for (i = 0; i < ncoord; ++i) {
+        zfit[i] = 0.0;
+    }
+
+    if (s->xterms == xterms_none) {
+        xbp = xbasis;
+        for (k = 0; k < s->xorder; ++k, xbp += ncoord) {
+            c = *cp++;
+            for (i = 0; i < ncoord; ++i) {
+                zfit[i] += xbp[i] * c;
+            }
+        }
+
+        ybp = ybasis + ncoord;
+        for (k = 1; k < s->yorder; ++k, ybp += ncoord) {
+            c = *cp++;
+            for (i = 0; i < ncoord; ++i) {
+                zfit[i] += ybp[i] * c;
+            }
+        }
+
+        return;
+    }
+
+    xincr = s->xorder;
+    ybp = ybasis;
+    for (j = 0; j < s->yorder; ++j, ybp += ncoord) {
+        xbp = xbasis;
+        for (k = 0; k < xincr; ++k, xbp += ncoord) {
+            c = *cp++;
+            for (i = 0; i < ncoord; ++i) {
+                zfit[i] += xbp[i] * ybp[i] * c;
+            }
+        }
+
+        if (s->xterms == xterms_half && (j + 1 + s->xorder + 1) > maxorder) {
+            --xincr;
+        }
+    }
+}
+
+int
+surface_vector_cached(
+        const surface_t* const s,
+        surface_basis_cache_t* const cache,
+        /* Output */
+        double* const zfit,
+        stimage_error_t* const error) {
+
+    const double* xbasis = NULL;
+    const double* ybasis = NULL;
+
+    assert(s);
+    assert(s->coeff);
+    assert(cache);
+    assert(zfit);
+    assert(error);
+
+    if (surface_basis_cache_get(
+                cache, s->type, 0, s->xorder, s->xmaxmin, s->xrange,
+                &xbasis, error) ||
+        surface_basis_cache_get(
+                cache, s->type, 1, s->yorder, s->ymaxmin, s->yrange,
+                &ybasis, error)) {
+        return 1;
+    }
+
+    surface_vector_basis(s, cache->ncoord, xbasis, ybasis, zfit);
+
+    return 0;
+}
@@ -41,11 +41,20 @@ DAMAGE.
 
 #include "wrap_util.h"
 #include "immatch/geomap.h"
+#include "immatch/geomap_grid.h"
+#include "immatch/geomap_joint.h"
 
 typedef struct {
     PyObject_HEAD
     PyObject *fit_geometry;
     PyObject *function;
+    PyObject *xxorder;
+    PyObject *xyorder;
+    PyObject *xxterms;
+    PyObject *yxorder;
+    PyObject *yyorder;
+    PyObject *yxterms;
+    PyObject *bbox;
     PyObject *rms;
     PyObject *mean_ref;
     PyObject *mean_input;
@@ -56,6 +65,8 @@ typedef struct {
     PyObject *ycoeff;
     PyObject *x2coeff;
     PyObject *y2coeff;
+    PyObject *xgrid;
+    PyObject *ygrid;
 } geomap_object;
 
 static PyObject *
@@ -68,59 +79,83 @@ geomap_new(PyTypeObject *type, PyObject *args, PyObject *kwds)
 }
 
 static PyObject *
-geomap_array_init() {
-    PyObject *o = NULL;
-    npy_intp dims = 1;
-    
-    o = PyArray_SimpleNew(1, &dims, NPY_DOUBLE);
-    if (o != NULL) {
-        *((double*)PyArray_GETPTR1(o, 0)) = 0.0;
-    }
+geomap_array_init(npy_intp n) {
+    return PyArray_ZEROS(1, &n, NPY_DOUBLE, 0);
+}
+
+static PyObject *
+geomap_grid_init() {
+    npy_intp dims[2] = {0, 0};
 
-    return o;
+    return PyArray_ZEROS(2, dims, NPY_DOUBLE, 0);
 }
 
 static int
 geomap_init(geomap_object *self, PyObject *args, PyObject *kwds)
 {
-#if PY_MAJOR_VERSION >= 3
-    self->fit_geometry = PyUnicode_FromString("");
-    self->function = PyUnicode_FromString("");
-#else
-    self->fit_geometry = PyString_FromString("");
-    self->function = PyString_FromString("");
-#endif
+    /* The defaults describe an all-zero linear general fit, so that
+       they can be packed and pickled like any other result */
+    if (from_geomap_fit_e(geomap_fit_general, &self->fit_geometry)) return -1;
+
+    if (from_surface_type_e(surface_type_polynomial, &self->function)) {
+        return -1;
+    }
+
+    self->xxorder = PyLong_FromLong(2);
+    if (self->xxorder == NULL) return -1;
+
+    self->xyorder = PyLong_FromLong(2);
+    if (self->xyorder == NULL) return -1;
+
+    if (from_xterms_e(xterms_none, &self->xxterms)) return -1;
+
+    self->yxorder = PyLong_FromLong(2);
+    if (self->yxorder == NULL) return -1;
+
+    self->yyorder = PyLong_FromLong(2);
+    if (self->yyorder == NULL) return -1;
+
+    if (from_xterms_e(xterms_none, &self->yxterms)) return -1;
+
+    self->bbox = geomap_array_init(4);
+    if (self->bbox == NULL) return -1;
     
-    self->rms = geomap_array_init();
+    self->rms = geomap_array_init(2);
     if (self->rms == NULL) return -1;
     
-    self->mean_ref = geomap_array_init();
+    self->mean_ref = geomap_array_init(2);
     if (self->mean_ref == NULL) return -1;
     
-    self->mean_input = geomap_array_init();
+    self->mean_input = geomap_array_init(2);
     if (self->mean_input == NULL) return -1;
     
-    self->shift = geomap_array_init();
+    self->shift = geomap_array_init(2);
     if (self->shift == NULL) return -1;
     
-    self->mag = geomap_array_init();
+    self->mag = geomap_array_init(2);
     if (self->mag == NULL) return -1;
     
-    self->rotation = geomap_array_init();
+    self->rotation = geomap_array_init(2);
     if (self->rotation == NULL) return -1;
     
-    self->xcoeff = geomap_array_init();
+    self->xcoeff = geomap_array_init(3);
     if (self->xcoeff == NULL) return -1;
  
-    self->ycoeff = geomap_array_init();
+    self->ycoeff = geomap_array_init(3);
     if (self->ycoeff == NULL) return -1;
 
-    self->x2coeff = geomap_array_init();
+    self->x2coeff = geomap_array_init(0);
     if (self->x2coeff == NULL) return -1;
  
-    self->y2coeff = geomap_array_init();
+    self->y2coeff = geomap_array_init(0);
     if (self->y2coeff == NULL) return -1;
 
+    self->xgrid = geomap_grid_init();
+    if (self->xgrid == NULL) return -1;
+
+    self->ygrid = geomap_grid_init();
+    if (self->ygrid == NULL) return -1;
+
     return 0;
 }
 
@@ -129,6 +164,13 @@ geomap_dealloc(geomap_object *self)
 {    
     Py_XDECREF(self->fit_geometry);
     Py_XDECREF(self->function);
+    Py_XDECREF(self->xxorder);
+    Py_XDECREF(self->xyorder);
+    Py_XDECREF(self->xxterms);
+    Py_XDECREF(self->yxorder);
+    Py_XDECREF(self->yyorder);
+    Py_XDECREF(self->yxterms);
+    Py_XDECREF(self->bbox);
     Py_XDECREF(self->rms);
     Py_XDECREF(self->mean_ref);
     Py_XDECREF(self->mean_input);
@@ -139,16 +181,338 @@ geomap_dealloc(geomap_object *self)
     Py_XDECREF(self->ycoeff);
     Py_XDECREF(self->x2coeff);
     Py_XDECREF(self->y2coeff);
+    Py_XDECREF(self->xgrid);
+    Py_XDECREF(self->ygrid);
     Py_TYPE(self)->tp_free((PyObject*)self);
 }
 
+static PyTypeObject geomap_class;
+
+/* Pack a result into a new bytes, or bytearray if as_bytearray */
+static PyObject*
+geomap_pack(
+        const geomap_result_t* const r,
+        const int as_bytearray) {
+
+    size_t    size   = geomap_result_packed_size(r);
+    double*   buffer = NULL;
+    PyObject* result = NULL;
+
+    /* Packed through a double array so that it is aligned */
+    buffer = malloc(size);
+    if (buffer == NULL) {
+        return PyErr_NoMemory();
+    }
+    geomap_result_pack(r, buffer);
+
+    if (as_bytearray) {
+        result = PyByteArray_FromStringAndSize((char*)buffer, size);
+    } else {
+        result = PyBytes_FromStringAndSize((char*)buffer, size);
+    }
+
+    free(buffer);
+
+    return result;
+}
+
+static PyObject*
+geomap_array_view_nd(
+        PyObject* base,
+        const double* const data,
+        const int nd,
+        npy_intp* const dims,
+        const int writable) {
+
+    PyObject* array = NULL;
+
+    array = PyArray_New(
+            &PyArray_Type, nd, dims, NPY_DOUBLE, NULL, (void*)data, 0,
+            writable ? NPY_ARRAY_CARRAY : NPY_ARRAY_CARRAY_RO, NULL);
+    if (array == NULL) {
+        return NULL;
+    }
+
+    Py_INCREF(base);
+    if (PyArray_SetBaseObject((PyArrayObject*)array, base)) {
+        Py_DECREF(array);
+        return NULL;
+    }
+
+    return array;
+}
+
+static PyObject*
+geomap_array_view(
+        PyObject* base,
+        const double* const data,
+        const size_t n,
+        const int writable) {
+
+    npy_intp dims = (npy_intp)n;
+
+    return geomap_array_view_nd(base, data, 1, &dims, writable);
+}
+
+/* Build a GeomapResults whose arrays are views onto a packed result,
+   without copying it unless it is misaligned */
+static PyObject*
+geomap_from_buffer(
+        PyTypeObject* type,
+        PyObject* buffer_obj) {
+
+    PyObject*            base = NULL;
+    PyObject*            copy = NULL;
+    Py_buffer*           buffer;
+    geomap_result_view_t view;
+    geomap_object*       self = NULL;
+    npy_intp             grid_dims[2];
+    int                  writable;
+    stimage_error_t      error;
+
+    stimage_error_init(&error);
+
+    /* The memoryview holds the exported buffer for as long as any of
+       the arrays refer to it */
+    base = PyMemoryView_FromObject(buffer_obj);
+    if (base == NULL) {
+        return NULL;
+    }
+    buffer = PyMemoryView_GET_BUFFER(base);
+
+    if (!PyBuffer_IsContiguous(buffer, 'C')) {
+        PyErr_SetString(PyExc_ValueError, "buffer must be contiguous");
+        goto fail;
+    }
+
+    if (((size_t)buffer->buf) % 8 != 0) {
+        copy = PyByteArray_FromStringAndSize(buffer->buf, buffer->len);
+        if (copy == NULL) {
+            goto fail;
+        }
+        Py_DECREF(base);
+        base = PyMemoryView_FromObject(copy);
+        Py_DECREF(copy);
+        if (base == NULL) {
+            return NULL;
+        }
+        buffer = PyMemoryView_GET_BUFFER(base);
+    }
+
+    if (geomap_result_view(buffer->len, buffer->buf, &view, &error)) {
+        PyErr_SetString(PyExc_ValueError, stimage_error_get_message(&error));
+        goto fail;
+    }
+
+    writable = !buffer->readonly;
+
+    self = (geomap_object*)type->tp_alloc(type, 0);
+    if (self == NULL) {
+        goto fail;
+    }
+
+    if (from_geomap_fit_e(
+                (geomap_fit_e)view.header->fit_geometry,
+                &self->fit_geometry) ||
+        from_surface_type_e(
+                (surface_type_e)view.header->function, &self->function) ||
+        from_xterms_e((xterms_e)view.header->xxterms, &self->xxterms) ||
+        from_xterms_e((xterms_e)view.header->yxterms, &self->yxterms)) {
+        goto fail;
+    }
+
+    #define SET_SIZE(member) \
+        self->member = PyLong_FromSize_t((size_t)view.header->member); \
+        if (self->member == NULL) goto fail;
+
+    #define SET_VIEW(member, n) \
+        self->member = geomap_array_view(base, view.member, (n), writable); \
+        if (self->member == NULL) goto fail;
+
+    SET_SIZE(xxorder);
+    SET_SIZE(xyorder);
+    SET_SIZE(yxorder);
+    SET_SIZE(yyorder);
+    SET_VIEW(bbox, 4);
+    SET_VIEW(rms, 2);
+    SET_VIEW(mean_ref, 2);
+    SET_VIEW(mean_input, 2);
+    SET_VIEW(shift, 2);
+    SET_VIEW(mag, 2);
+    SET_VIEW(rotation, 2);
+    SET_VIEW(xcoeff, view.header->nxcoeff);
+    SET_VIEW(ycoeff, view.header->nycoeff);
+    SET_VIEW(x2coeff, view.header->nx2coeff);
+    SET_VIEW(y2coeff, view.header->ny2coeff);
+
+    #undef SET_SIZE
+    #undef SET_VIEW
+
+    grid_dims[0] = (npy_intp)view.ngridy;
+    grid_dims[1] = (npy_intp)view.ngridx;
+    self->xgrid = geomap_array_view_nd(
+            base, view.xgrid, 2, grid_dims, writable);
+    if (self->xgrid == NULL) goto fail;
+    self->ygrid = geomap_array_view_nd(
+            base, view.ygrid, 2, grid_dims, writable);
+    if (self->ygrid == NULL) goto fail;
+
+    Py_DECREF(base);
+
+    return (PyObject*)self;
+
+ fail:
+    Py_XDECREF(base);
+    Py_XDECREF(self);
+
+    return NULL;
+}
+
+static PyObject*
+geomap_frombuffer(PyObject* cls, PyObject* buffer_obj)
+{
+    return geomap_from_buffer((PyTypeObject*)cls, buffer_obj);
+}
+
+static PyObject*
+geomap_tobytes(PyObject* self, PyObject* unused)
+{
+    geomap_result_t r;
+    PyObject*       result;
+
+    if (to_geomap_result_t("self", self, &r)) {
+        return NULL;
+    }
+
+    result = geomap_pack(&r, 0);
+    geomap_result_free(&r);
+
+    return result;
+}
+
+static PyObject*
+geomap_reduce_ex(PyObject* self, PyObject* protocol_obj)
+{
+    geomap_result_t r;
+    long            protocol;
+    PyObject*       data       = NULL;
+    PyObject*       frombuffer = NULL;
+
+    protocol = PyLong_AsLong(protocol_obj);
+    if (protocol == -1 && PyErr_Occurred()) {
+        return NULL;
+    }
+
+    if (to_geomap_result_t("self", self, &r)) {
+        return NULL;
+    }
+
+    /* A bytearray, so that the unpickled arrays are writable */
+    data = geomap_pack(&r, 1);
+    geomap_result_free(&r);
+    if (data == NULL) {
+        return NULL;
+    }
+
+#if PY_VERSION_HEX >= 0x03080000
+    /* Lets protocol 5 send the packed result out-of-band */
+    if (protocol >= 5) {
+        PyObject* pickle_buffer = PyPickleBuffer_FromObject(data);
+        Py_DECREF(data);
+        if (pickle_buffer == NULL) {
+            return NULL;
+        }
+        data = pickle_buffer;
+    }
+#endif
+
+    frombuffer = PyObject_GetAttrString((PyObject*)Py_TYPE(self), "frombuffer");
+    if (frombuffer == NULL) {
+        Py_DECREF(data);
+        return NULL;
+    }
+
+    return Py_BuildValue("N(N)", frombuffer, data);
+}
+
+static PyObject*
+geomap_evaluate(PyObject* self, PyObject* ref_obj)
+{
+    geomap_result_t r;
+    PyObject*       ref_array   = NULL;
+    PyObject*       input_array = NULL;
+    npy_intp        dims[2];
+    int             status      = 0;
+    stimage_error_t error;
+
+    stimage_error_init(&error);
+
+    ref_array = (PyObject*)PyArray_ContiguousFromAny(
+            ref_obj, NPY_DOUBLE, 2, 2);
+    if (ref_array == NULL) {
+        return NULL;
+    }
+    if (PyArray_DIM(ref_array, 1) != 2) {
+        PyErr_SetString(PyExc_TypeError, "ref array must be an Nx2 array");
+        Py_DECREF(ref_array);
+        return NULL;
+    }
+
+    dims[0] = PyArray_DIM(ref_array, 0);
+    dims[1] = 2;
+    input_array = PyArray_SimpleNew(2, dims, NPY_DOUBLE);
+    if (input_array == NULL) {
+        Py_DECREF(ref_array);
+        return NULL;
+    }
+
+    if (to_geomap_result_t("self", self, &r)) {
+        Py_DECREF(ref_array);
+        Py_DECREF(input_array);
+        return NULL;
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+    status = geomap_result_eval(
+            &r, (size_t)dims[0], (coord_t*)PyArray_DATA(ref_array),
+            (coord_t*)PyArray_DATA(input_array), &error);
+    Py_END_ALLOW_THREADS
+
+    geomap_result_free(&r);
+    Py_DECREF(ref_array);
+    if (status) {
+        Py_DECREF(input_array);
+        wrap_set_runtime_error(&error);
+        return NULL;
+    }
+
+    return input_array;
+}
+
 static PyMethodDef geomap_methods[] = {
+    {"frombuffer", (PyCFunction)geomap_frombuffer, METH_O | METH_CLASS,
+     "Build a GeomapResults from the packed form returned by tobytes.  "
+     "The arrays are views onto the buffer, which is not copied."},
+    {"tobytes", (PyCFunction)geomap_tobytes, METH_NOARGS,
+     "Pack the result into a single flat, versioned buffer."},
+    {"evaluate", (PyCFunction)geomap_evaluate, METH_O,
+     "Transform an Nx2 array of reference coordinates to input "
+     "coordinates, including the distortion terms and the residual "
+     "grid."},
+    {"__reduce_ex__", (PyCFunction)geomap_reduce_ex, METH_O, NULL},
     {NULL}  /* Sentinel */
 };
 
 static PyMemberDef geomap_members[] = {
     {"fit_geometry", T_OBJECT_EX, offsetof(geomap_object, fit_geometry), 0, "fit_geometry"},
     {"function", T_OBJECT_EX, offsetof(geomap_object, function), 0, "function"},
+    {"xxorder", T_OBJECT_EX, offsetof(geomap_object, xxorder), 0, "xxorder"},
+    {"xyorder", T_OBJECT_EX, offsetof(geomap_object, xyorder), 0, "xyorder"},
+    {"xxterms", T_OBJECT_EX, offsetof(geomap_object, xxterms), 0, "xxterms"},
+    {"yxorder", T_OBJECT_EX, offsetof(geomap_object, yxorder), 0, "yxorder"},
+    {"yyorder", T_OBJECT_EX, offsetof(geomap_object, yyorder), 0, "yyorder"},
+    {"yxterms", T_OBJECT_EX, offsetof(geomap_object, yxterms), 0, "yxterms"},
+    {"bbox", T_OBJECT_EX, offsetof(geomap_object, bbox), 0, "bbox"},
     {"rms", T_OBJECT_EX, offsetof(geomap_object, rms), 0, "rms"},
     {"mean_ref", T_OBJECT_EX, offsetof(geomap_object, mean_ref), 0, "mean_ref"},
     {"mean_input", T_OBJECT_EX, offsetof(geomap_object, mean_input), 0, "mean_input"},
@@ -159,12 +523,14 @@ static PyMemberDef geomap_members[] = {
     {"ycoeff", T_OBJECT_EX, offsetof(geomap_object, ycoeff), 0, "ycoeff"},
     {"x2coeff", T_OBJECT_EX, offsetof(geomap_object, x2coeff), 0, "x2coeff"},
     {"y2coeff", T_OBJECT_EX, offsetof(geomap_object, y2coeff), 0, "y2coeff"},
+    {"xgrid", T_OBJECT_EX, offsetof(geomap_object, xgrid), 0, "xgrid"},
+    {"ygrid", T_OBJECT_EX, offsetof(geomap_object, ygrid), 0, "ygrid"},
     {NULL}  /* Sentinel */
 };
 
 static PyTypeObject geomap_class = {
     PyVarObject_HEAD_INIT(NULL, 0)
-    "py_geomap.GeomapResults", /* tp_name */
+    "stsci.stimage._stimage.GeomapResults", /* tp_name */
     sizeof(geomap_object),     /* tp_basicsize */
     0,                         /* tp_itemsize */
     (destructor)geomap_dealloc,/* tp_dealloc */
@@ -203,6 +569,60 @@ static PyTypeObject geomap_class = {
     geomap_new,                /* tp_new */
 };
 
+/* Wrap an array of output records, which the array then owns, in a
+   structured array */
+static PyObject*
+geomap_output_array(
+        const size_t noutput,
+        geomap_output_t* const output) {
+
+    PyObject*      dtype_list = NULL;
+    PyArray_Descr* dtype      = NULL;
+    npy_intp       dims       = (npy_intp)noutput;
+
+    dtype_list = Py_BuildValue(
+            "[(ss)(ss)(ss)(ss)(ss)(ss)(ss)(ss)]",
+            "input_x", "f8",
+            "input_y", "f8",
+            "ref_x", "f8",
+            "ref_y", "f8",
+            "fit_x", "f8",
+            "fit_y", "f8",
+            "resid_x", "f8",
+            "resid_y", "f8");
+    if (dtype_list == NULL) {
+        return NULL;
+    }
+    if (!PyArray_DescrConverter(dtype_list, &dtype)) {
+        Py_DECREF(dtype_list);
+        return NULL;
+    }
+    Py_DECREF(dtype_list);
+
+    return PyArray_NewFromDescr(
+            &PyArray_Type, dtype, 1, &dims, NULL, output,
+            NPY_OWNDATA, NULL);
+}
+
+/* A new GeomapResults, whose arrays are all views onto a single
+   packed buffer */
+static PyObject*
+geomap_result_object(
+        const geomap_result_t* const r) {
+
+    PyObject* packed = NULL;
+    PyObject* result = NULL;
+
+    packed = geomap_pack(r, 1);
+    if (packed == NULL) {
+        return NULL;
+    }
+    result = geomap_from_buffer(&geomap_class, packed);
+    Py_DECREF(packed);
+
+    return result;
+}
+
 PyObject*
 py_geomap(PyObject* self, PyObject* args, PyObject* kwds) {
     PyObject* input_obj        = NULL;
@@ -219,6 +639,11 @@ py_geomap(PyObject* self, PyObject* args, PyObject* kwds) {
     char*     yxterms_str      = NULL;
     size_t    maxiter          = 0;
     double    reject           = 0.0;
+    size_t    max_order        = 0;
+    PyObject* progress_obj     = NULL;
+    size_t    grid_x           = 0;
+    size_t    grid_y           = 0;
+    double    grid_smoothing   = 0.0;
 
     size_t         ninput       = 0;
     PyObject*      input_array  = NULL;
@@ -231,21 +656,19 @@ py_geomap(PyObject* self, PyObject* args, PyObject* kwds) {
     xterms_e       yxterms      = xterms_half;
 
     geomap_result_t  fit;
-    PyObject*        tmp          = NULL;
-    npy_intp         dims         = 0;
-    size_t           i            = 0;
     size_t           noutput      = 0;
     geomap_output_t* output       = NULL;
-    PyObject*        dtype_list   = NULL;
-    PyArray_Descr*   dtype        = NULL;
     PyObject*        result       = NULL;
     PyObject*        output_array = NULL;
+    int              status       = 0;
+    wrap_progress_t  progress;
     stimage_error_t  error;
 
     const char*    keywords[]    = {
         "input", "ref", "bbox", "fit_geometry", "function",
         "xxorder", "xyorder", "yxorder", "yyorder", "xxterms",
-        "yxterms", "maxiter", "reject", NULL
+        "yxterms", "maxiter", "reject", "max_order", "progress",
+        "grid_x", "grid_y", "grid_smoothing", NULL
     };
 
     bbox_init(&bbox);
@@ -253,11 +676,16 @@ py_geomap(PyObject* self, PyObject* args, PyObject* kwds) {
     stimage_error_init(&error);
 
     if (!PyArg_ParseTupleAndKeywords(
-                args, kwds, "OO|Ossnnnnssnd:geomap",
+                args, kwds, "OO|OssnnnnssndnOnnd:geomap",
                 (char **)keywords,
                 &input_obj, &ref_obj, &bbox_obj, &fit_geometry_str,
                 &surface_type_str, &xxorder, &xyorder, &yxorder, &yyorder,
-                &xxterms_str, &yxterms_str, &maxiter, &reject)) {
+                &xxterms_str, &yxterms_str, &maxiter, &reject, &max_order,
+                &progress_obj, &grid_x, &grid_y, &grid_smoothing)) {
+        return NULL;
+    }
+
+    if (wrap_progress_init("progress", progress_obj, &progress, &error)) {
         return NULL;
     }
 
@@ -298,73 +726,64 @@ py_geomap(PyObject* self, PyObject* args, PyObject* kwds) {
         goto exit;
     }
 
-    if (geomap(
+    /* max_order != 0 picks the orders and cross terms from the data */
+    if (max_order != 0) {
+        if (fit_geometry != geomap_fit_general) {
+            PyErr_SetString(
+                    PyExc_ValueError,
+                    "Automatic order selection requires the 'general' fit_geometry");
+            goto exit;
+        }
+
+        Py_BEGIN_ALLOW_THREADS
+        status = geomap_select_order(
                 ninput, (coord_t*)PyArray_DATA(input_array),
                 nref, (coord_t*)PyArray_DATA(ref_array),
-                &bbox, fit_geometry, surface_type,
-                xxorder, xyorder, yxorder, yyorder,
-                xxterms, yxterms,
-                maxiter, reject,
-                &noutput, output, &fit,
-                &error)) {
-        PyErr_SetString(PyExc_RuntimeError, stimage_error_get_message(&error));
-        goto exit;
+                &bbox, max_order,
+                &xxorder, &xxterms, &yxorder, &yxterms,
+                &error);
+        Py_END_ALLOW_THREADS
+        if (status) {
+            wrap_set_runtime_error(&error);
+            goto exit;
+        }
+        xyorder = xxorder;
+        yyorder = yxorder;
     }
 
-    dtype_list = Py_BuildValue(
-            "[(ss)(ss)(ss)(ss)(ss)(ss)(ss)(ss)]",
-            "input_x", "f8",
-            "input_y", "f8",
-            "ref_x", "f8",
-            "ref_y", "f8",
-            "fit_x", "f8",
-            "fit_y", "f8",
-            "resid_x", "f8",
-            "resid_y", "f8");
-    if (dtype_list == NULL) {
-        goto exit;
+    Py_BEGIN_ALLOW_THREADS
+    status = geomap(
+            ninput, (coord_t*)PyArray_DATA(input_array),
+            nref, (coord_t*)PyArray_DATA(ref_array),
+            &bbox, fit_geometry, surface_type,
+            xxorder, xyorder, yxorder, yyorder,
+            xxterms, yxterms,
+            maxiter, reject,
+            &noutput, output, &fit,
+            &error);
+    /* grid_x != 0 adds a residual grid on top of the surfaces */
+    if (status == 0 && (grid_x != 0 || grid_y != 0)) {
+        status = geomap_grid(
+                grid_x, grid_y, grid_smoothing, noutput, output, &fit,
+                &error);
     }
-    if (!PyArray_DescrConverter(dtype_list, &dtype)) {
+    Py_END_ALLOW_THREADS
+    if (status) {
+        wrap_set_runtime_error(&error);
         goto exit;
     }
-    Py_DECREF(dtype_list);
-    dims = (npy_intp)noutput;
-    output_array = PyArray_NewFromDescr(
-            &PyArray_Type, dtype, 1, &dims, NULL, output,
-            NPY_OWNDATA, NULL);
+
+    output_array = geomap_output_array(noutput, output);
     if (output_array == NULL) {
         goto exit;
     }
 
-    fit_obj = geomap_new(&geomap_class, NULL, NULL);
-    
-    #define ADD_ATTR(func, member, name) \
-        if ((func)((member), &tmp)) goto exit;      \
-        PyObject_SetAttrString(fit_obj, (name), tmp);       \
-        Py_DECREF(tmp);
-
-    #define ADD_ARRAY(size, member, name) \
-        dims = (size); \
-        tmp = PyArray_SimpleNew(1, &dims, NPY_DOUBLE); \
-        if (tmp == NULL) goto exit; \
-        for (i = 0; i < (size); ++i) ((double*)PyArray_DATA(tmp))[i] = (member)[i]; \
-        PyObject_SetAttrString(fit_obj, (name), tmp); \
-        Py_DECREF(tmp);
-
-    ADD_ATTR(from_geomap_fit_e, fit.fit_geometry, "fit_geometry");
-    ADD_ATTR(from_surface_type_e, fit.function, "function");
-    ADD_ATTR(from_coord_t, &fit.rms, "rms");
-    ADD_ATTR(from_coord_t, &fit.mean_ref, "mean_ref");
-    ADD_ATTR(from_coord_t, &fit.mean_input, "mean_input");
-    ADD_ATTR(from_coord_t, &fit.shift, "shift");
-    ADD_ATTR(from_coord_t, &fit.mag, "mag");
-    ADD_ATTR(from_coord_t, &fit.rotation, "rotation");
-    ADD_ARRAY(fit.nxcoeff, fit.xcoeff, "xcoeff");
-    ADD_ARRAY(fit.nycoeff, fit.ycoeff, "ycoeff");
-    ADD_ARRAY(fit.nx2coeff, fit.x2coeff, "x2coeff");
-    ADD_ARRAY(fit.ny2coeff, fit.y2coeff, "y2coeff");
-
-    result = Py_BuildValue("OO", fit_obj, output_array);
+    fit_obj = geomap_result_object(&fit);
+    if (fit_obj == NULL) {
+        goto exit;
+    }
+
+    result = Py_BuildValue("NN", fit_obj, output_array);
 
  exit:
 
@@ -380,47 +799,320 @@ py_geomap(PyObject* self, PyObject* args, PyObject* kwds) {
     return result;
 }
 
-#if PY_MAJOR_VERSION >= 3
+static int
+to_geomap_result_string(
+        PyObject* o,
+        const char** s) {
 
-static PyModuleDef geomap_module = {
-    PyModuleDef_HEAD_INIT,
-    "geomap_results",
-    "Python object to hold the results of geomap",
-    -1,
-    NULL, NULL, NULL, NULL, NULL
-};
+    *s = PyUnicode_AsUTF8(o);
+    return *s == NULL ? -1 : 0;
+}
 
-PyMODINIT_FUNC
-PyInit_geomap_results(void) 
-{
-    PyObject* m;
+/* A 2-D residual grid, which may be empty */
+static int
+to_geomap_result_grid(
+        PyObject* o,
+        size_t* const nx,
+        size_t* const ny,
+        double** const grid) {
+
+    PyObject* array = NULL;
+    size_t    n;
+
+    array = PyArray_ContiguousFromAny(o, NPY_DOUBLE, 2, 2);
+    if (array == NULL) {
+        return -1;
+    }
+
+    *ny = (size_t)PyArray_DIM(array, 0);
+    *nx = (size_t)PyArray_DIM(array, 1);
+    n = *nx * *ny;
+    if (n == 0) {
+        *nx = *ny = 0;
+    }
+    *grid = malloc(MAX(n, 1) * sizeof(double));
+    if (*grid == NULL) {
+        Py_DECREF(array);
+        PyErr_NoMemory();
+        return -1;
+    }
+    memcpy(*grid, PyArray_DATA(array), n * sizeof(double));
+
+    Py_DECREF(array);
+
+    return 0;
+}
+
+static int
+to_geomap_result_coeff(
+        PyObject* o,
+        size_t* const n,
+        double** const coeff) {
+
+    PyObject* array = NULL;
+
+    array = PyArray_ContiguousFromAny(o, NPY_DOUBLE, 1, 1);
+    if (array == NULL) {
+        return -1;
+    }
 
+    *n = (size_t)PyArray_DIM(array, 0);
+    *coeff = malloc(MAX(*n, 1) * sizeof(double));
+    if (*coeff == NULL) {
+        Py_DECREF(array);
+        PyErr_NoMemory();
+        return -1;
+    }
+    memcpy(*coeff, PyArray_DATA(array), *n * sizeof(double));
+
+    Py_DECREF(array);
+
+    return 0;
+}
+
+int
+to_geomap_result_t(
+        const char* const name,
+        PyObject* o,
+        geomap_result_t* const r) {
+
+    geomap_object* self = (geomap_object*)o;
+    const char*    fit_geometry;
+    const char*    function;
+    const char*    xxterms;
+    const char*    yxterms;
+    size_t         ngridx;
+    size_t         ngridy;
+
+    if (!PyObject_TypeCheck(o, &geomap_class)) {
+        PyErr_Format(
+                PyExc_TypeError,
+                "%s must be a GeomapResults object",
+                name);
+        return -1;
+    }
+
+    geomap_result_init(r);
+
+    if (to_geomap_result_string(self->fit_geometry, &fit_geometry) ||
+        to_geomap_result_string(self->function, &function) ||
+        to_geomap_result_string(self->xxterms, &xxterms) ||
+        to_geomap_result_string(self->yxterms, &yxterms) ||
+        to_geomap_fit_e("fit_geometry", fit_geometry, &r->fit_geometry) ||
+        to_surface_type_e("function", function, &r->function) ||
+        to_xterms_e("xxterms", xxterms, &r->xxterms) ||
+        to_xterms_e("yxterms", yxterms, &r->yxterms) ||
+        to_bbox_t("bbox", self->bbox, &r->bbox)) {
+        goto fail;
+    }
+
+    r->xxorder = PyLong_AsSize_t(self->xxorder);
+    r->xyorder = PyLong_AsSize_t(self->xyorder);
+    r->yxorder = PyLong_AsSize_t(self->yxorder);
+    r->yyorder = PyLong_AsSize_t(self->yyorder);
+    if (PyErr_Occurred()) {
+        goto fail;
+    }
+
+    if (to_coord_t("rms", self->rms, &r->rms) ||
+        to_coord_t("mean_ref", self->mean_ref, &r->mean_ref) ||
+        to_coord_t("mean_input", self->mean_input, &r->mean_input) ||
+        to_coord_t("shift", self->shift, &r->shift) ||
+        to_coord_t("mag", self->mag, &r->mag) ||
+        to_coord_t("rotation", self->rotation, &r->rotation) ||
+        to_geomap_result_coeff(self->xcoeff, &r->nxcoeff, &r->xcoeff) ||
+        to_geomap_result_coeff(self->ycoeff, &r->nycoeff, &r->ycoeff) ||
+        to_geomap_result_coeff(self->x2coeff, &r->nx2coeff, &r->x2coeff) ||
+        to_geomap_result_coeff(self->y2coeff, &r->ny2coeff, &r->y2coeff) ||
+        to_geomap_result_grid(
+                self->xgrid, &r->ngridx, &r->ngridy, &r->xgrid) ||
+        to_geomap_result_grid(
+                self->ygrid, &ngridx, &ngridy, &r->ygrid)) {
+        goto fail;
+    }
+
+    if (ngridx != r->ngridx || ngridy != r->ngridy) {
+        PyErr_SetString(
+                PyExc_ValueError, "xgrid and ygrid must have the same shape");
+        goto fail;
+    }
+
+    return 0;
+
+ fail:
+    geomap_result_free(r);
+
+    return -1;
+}
+
+int
+init_geomap_results(PyObject* m) {
     geomap_class.tp_new = PyType_GenericNew;
-    if (PyType_Ready(&geomap_class) < 0)
+    if (PyType_Ready(&geomap_class) < 0) {
+        return -1;
+    }
+
+    Py_INCREF(&geomap_class);
+    if (PyModule_AddObject(m, "GeomapResults", (PyObject *)&geomap_class)) {
+        Py_DECREF(&geomap_class);
+        return -1;
+    }
+
+    return 0;
+}
+
+PyObject*
+py_geomap_joint(PyObject* self, PyObject* args, PyObject* kwds) {
+    PyObject* coord_obj        = NULL;
+    PyObject* exposure_obj     = NULL;
+    PyObject* group_obj        = NULL;
+    size_t    nexposure        = 0;
+    size_t    ngroup           = 0;
+    size_t    reference        = 0;
+    char*     fit_geometry_str = NULL;
+    char*     surface_type_str = NULL;
+    size_t    maxiter          = 0;
+    double    reject           = 0.0;
+    PyObject* progress_obj     = NULL;
+
+    PyObject*        coord_array    = NULL;
+    PyObject*        exposure_array = NULL;
+    PyObject*        group_array    = NULL;
+    size_t           nobs           = 0;
+    geomap_fit_e     fit_geometry   = geomap_fit_general;
+    surface_type_e   surface_type   = surface_type_polynomial;
+    geomap_output_t* output         = NULL;
+    geomap_result_t* fits           = NULL;
+    PyObject*        fit_list       = NULL;
+    PyObject*        fit_obj        = NULL;
+    PyObject*        output_array   = NULL;
+    PyObject*        result         = NULL;
+    size_t           i              = 0;
+    int              status         = 0;
+    wrap_progress_t  progress;
+    stimage_error_t  error;
+
+    const char*    keywords[]    = {
+        "coord", "exposure", "group", "nexposure", "ngroup", "reference",
+        "fit_geometry", "function", "maxiter", "reject", "progress", NULL
+    };
+
+    stimage_error_init(&error);
+
+    if (!PyArg_ParseTupleAndKeywords(
+                args, kwds, "OOOnn|nssndO:geomap_joint",
+                (char **)keywords,
+                &coord_obj, &exposure_obj, &group_obj, &nexposure, &ngroup,
+                &reference, &fit_geometry_str, &surface_type_str, &maxiter,
+                &reject, &progress_obj)) {
         return NULL;
+    }
 
-    m = PyModule_Create(&geomap_module);
-    if (m == NULL)
+    if (wrap_progress_init("progress", progress_obj, &progress, &error)) {
         return NULL;
+    }
 
-    Py_INCREF(&geomap_class);
-    PyModule_AddObject(m, "GeomapResults", (PyObject *)&geomap_class);
-    return m;
-}
+    coord_array = (PyObject*)PyArray_ContiguousFromAny(
+            coord_obj, NPY_DOUBLE, 2, 2);
+    if (coord_array == NULL) {
+        goto exit;
+    }
+    if (PyArray_DIM(coord_array, 1) != 2) {
+        PyErr_SetString(PyExc_TypeError, "coord array must be an Nx2 array");
+        goto exit;
+    }
+    nobs = (size_t)PyArray_DIM(coord_array, 0);
 
-#else
-PyMODINIT_FUNC
-initgeomap_results(void) 
-{
-    PyObject* m;
+    exposure_array = (PyObject*)PyArray_ContiguousFromAny(
+            exposure_obj, NPY_UINTP, 1, 1);
+    if (exposure_array == NULL) {
+        goto exit;
+    }
 
-    geomap_class.tp_new = PyType_GenericNew;
-    if (PyType_Ready(&geomap_class) < 0)
-        return;
+    group_array = (PyObject*)PyArray_ContiguousFromAny(
+            group_obj, NPY_UINTP, 1, 1);
+    if (group_array == NULL) {
+        goto exit;
+    }
 
-    m = Py_InitModule("GeomapResults", geomap_methods);
+    if ((size_t)PyArray_DIM(exposure_array, 0) != nobs ||
+        (size_t)PyArray_DIM(group_array, 0) != nobs) {
+        PyErr_SetString(
+                PyExc_ValueError,
+                "coord, exposure and group must have the same length");
+        goto exit;
+    }
 
-    Py_INCREF(&geomap_class);
-    PyModule_AddObject(m, "GeomapResults", (PyObject *)&geomap_class);
+    if (nexposure == 0) {
+        PyErr_SetString(PyExc_ValueError, "There must be at least one exposure");
+        goto exit;
+    }
+
+    if (to_geomap_fit_e("fit_geometry", fit_geometry_str, &fit_geometry) ||
+        to_surface_type_e("surface_type", surface_type_str, &surface_type)) {
+        goto exit;
+    }
+
+    output = malloc(MAX(nobs, 1) * sizeof(geomap_output_t));
+    fits = malloc(nexposure * sizeof(geomap_result_t));
+    if (output == NULL || fits == NULL) {
+        PyErr_NoMemory();
+        goto exit;
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+    status = geomap_joint(
+            nexposure, reference, nobs,
+            (coord_t*)PyArray_DATA(coord_array),
+            (size_t*)PyArray_DATA(exposure_array),
+            (size_t*)PyArray_DATA(group_array),
+            ngroup, fit_geometry, surface_type, maxiter, reject,
+            output, fits, &error);
+    Py_END_ALLOW_THREADS
+
+    if (status) {
+        free(fits);
+        fits = NULL;
+        wrap_set_runtime_error(&error);
+        goto exit;
+    }
+
+    fit_list = PyList_New((Py_ssize_t)nexposure);
+    if (fit_list == NULL) {
+        goto exit;
+    }
+    for (i = 0; i < nexposure; ++i) {
+        fit_obj = geomap_result_object(&fits[i]);
+        if (fit_obj == NULL) {
+            goto exit;
+        }
+        PyList_SET_ITEM(fit_list, (Py_ssize_t)i, fit_obj);
+    }
+
+    output_array = geomap_output_array(nobs, output);
+    if (output_array == NULL) {
+        goto exit;
+    }
+    output = NULL;
+
+    result = Py_BuildValue("NN", fit_list, output_array);
+    fit_list = NULL;
+    output_array = NULL;
+
+ exit:
+
+    Py_XDECREF(coord_array);
+    Py_XDECREF(exposure_array);
+    Py_XDECREF(group_array);
+    if (fits != NULL) {
+        for (i = 0; i < nexposure; ++i) {
+            geomap_result_free(&fits[i]);
+        }
+        free(fits);
+    }
+    free(output);
+    Py_XDECREF(fit_list);
+    Py_XDECREF(output_array);
+
+    return result;
 }
-#endif
@@ -0,0 +1,142 @@
+/*
+Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+    1. Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+
+    2. Redistributions in binary form must reproduce the above
+      copyright notice, this list of conditions and the following
+      disclaimer in the documentation and/or other materials provided
+      with the distribution.
+
+    3. The name of AURA and its representatives may not be used to
+      endorse or promote products derived from this software without
+      specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+DAMAGE.
+*/
+
+#define NO_IMPORT_ARRAY
+
+#include <Python.h>
+#include "wrap_util.h"
+
+#include "immatch/refindex.h"
+
+PyObject*
+py_build_reference_index(PyObject* self, PyObject* args, PyObject* kwds) {
+    PyObject* ref_obj    = NULL;
+    PyObject* path_obj   = NULL;
+    double    separation = 9.0;
+    size_t    nmatch     = 30;
+    double    tolerance  = 1.0;
+    double    maxratio   = 10.0;
+
+    PyObject*       ref_array = NULL;
+    PyObject*       result    = NULL;
+    stimage_error_t error;
+
+    const char*    keywords[]    = {
+        "ref", "path", "separation", "nmatch", "tolerance", "maxratio", NULL
+    };
+
+    stimage_error_init(&error);
+
+    if (!PyArg_ParseTupleAndKeywords(
+                args, kwds, "OO&|dndd:build_reference_index",
+                (char **)keywords,
+                &ref_obj, PyUnicode_FSConverter, &path_obj, &separation,
+                &nmatch, &tolerance, &maxratio)) {
+        return NULL;
+    }
+
+    ref_array = (PyObject*)PyArray_ContiguousFromAny(
+            ref_obj, NPY_DOUBLE, 2, 2);
+    if (ref_array == NULL) {
+        goto exit;
+    }
+    if (PyArray_DIM(ref_array, 1) != 2) {
+        PyErr_SetString(PyExc_TypeError, "ref array must be an Nx2 array");
+        goto exit;
+    }
+
+    if (refindex_build(
+                PyArray_DIM(ref_array, 0), (coord_t*)PyArray_DATA(ref_array),
+                separation, nmatch, tolerance, maxratio,
+                PyBytes_AsString(path_obj), &error)) {
+        PyErr_SetString(PyExc_RuntimeError, stimage_error_get_message(&error));
+        goto exit;
+    }
+
+    Py_INCREF(Py_None);
+    result = Py_None;
+
+ exit:
+
+    Py_XDECREF(ref_array);
+    Py_XDECREF(path_obj);
+
+    return result;
+}
+
+PyObject*
+py_reference_index_info(PyObject* self, PyObject* args, PyObject* kwds) {
+    PyObject*         buffer_obj = NULL;
+    Py_buffer         buffer;
+    refindex_t        index;
+    PyObject*         result     = NULL;
+    stimage_error_t   error;
+
+    const char*    keywords[]    = {
+        "buffer", NULL
+    };
+
+    stimage_error_init(&error);
+
+    if (!PyArg_ParseTupleAndKeywords(
+                args, kwds, "O:reference_index_info",
+                (char **)keywords, &buffer_obj)) {
+        return NULL;
+    }
+
+    if (PyObject_GetBuffer(buffer_obj, &buffer, PyBUF_SIMPLE)) {
+        return NULL;
+    }
+
+    if (refindex_view(buffer.len, buffer.buf, &index, &error)) {
+        PyErr_SetString(PyExc_ValueError, stimage_error_get_message(&error));
+        goto exit;
+    }
+
+    result = Py_BuildValue(
+            "{sIsdsdsdsnsnsnsnsKsK}",
+            "version", (unsigned int)index.header->version,
+            "separation", index.header->separation,
+            "tolerance", index.header->tolerance,
+            "maxratio", index.header->maxratio,
+            "nmatch", (Py_ssize_t)index.header->nmatch,
+            "nref", (Py_ssize_t)index.header->nref,
+            "nunique", (Py_ssize_t)index.header->nunique,
+            "ntriangles", (Py_ssize_t)index.header->ntriangles,
+            "ref_offset", (unsigned long long)index.header->ref_offset,
+            "file_size", (unsigned long long)index.header->file_size);
+
+ exit:
+
+    PyBuffer_Release(&buffer);
+
+    return result;
+}
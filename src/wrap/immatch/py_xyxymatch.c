@@ -41,6 +41,69 @@ DAMAGE.
 
 #include "immatch/xyxymatch.h"
 
+/* Map the input coordinates to the reference frame with the inverse of
+   a geomap solution.  The result has the same type as input_array. */
+static PyObject*
+xyxymatch_transform_input(
+        PyObject* input_array,
+        const geomap_result_t* const transform,
+        const int typenum) {
+
+    PyObject*       dinput_array = NULL;
+    PyObject*       dtrans_array = NULL;
+    PyObject*       trans_array  = NULL;
+    npy_intp        dims[2];
+    size_t          nunconverged = 0;
+    stimage_error_t error;
+
+    stimage_error_init(&error);
+
+    dinput_array = (PyObject*)PyArray_FROMANY(
+            input_array, NPY_DOUBLE, 2, 2, NPY_ARRAY_CARRAY);
+    if (dinput_array == NULL) {
+        goto exit;
+    }
+
+    dims[0] = PyArray_DIM(dinput_array, 0);
+    dims[1] = 2;
+    dtrans_array = PyArray_SimpleNew(2, dims, NPY_DOUBLE);
+    if (dtrans_array == NULL) {
+        goto exit;
+    }
+
+    if (geomap_result_invert(
+                transform, (size_t)dims[0],
+                (coord_t*)PyArray_DATA(dinput_array),
+                (coord_t*)PyArray_DATA(dtrans_array), &nunconverged,
+                &error)) {
+        PyErr_SetString(PyExc_RuntimeError, stimage_error_get_message(&error));
+        goto exit;
+    }
+
+    if (nunconverged != 0 &&
+        PyErr_WarnFormat(
+                PyExc_RuntimeWarning, 1,
+                "The inverse of transform did not converge for %zu of "
+                "%zd input coordinates", nunconverged, dims[0])) {
+        goto exit;
+    }
+
+    if (typenum == NPY_DOUBLE) {
+        trans_array = dtrans_array;
+        dtrans_array = NULL;
+    } else {
+        trans_array = (PyObject*)PyArray_FROMANY(
+                dtrans_array, typenum, 2, 2,
+                NPY_ARRAY_CARRAY | NPY_ARRAY_FORCECAST);
+    }
+
+ exit:
+    Py_XDECREF(dinput_array);
+    Py_XDECREF(dtrans_array);
+
+    return trans_array;
+}
+
 PyObject*
 py_xyxymatch(PyObject* self, PyObject* args, PyObject* kwds) {
     PyObject* input_obj      = NULL;
@@ -55,14 +118,31 @@ py_xyxymatch(PyObject* self, PyObject* args, PyObject* kwds) {
     size_t    nmatch         = 30;
     double    maxratio       = 10.0;
     size_t    nreject        = 10;
+    PyObject* ref_index_obj  = NULL;
+    PyObject* dtype_obj      = NULL;
+    Py_ssize_t nthreads      = 1;
+    PyObject* transform_obj  = NULL;
 
     PyObject*        input_array = NULL;
     PyObject*        ref_array   = NULL;
+    PyObject*        trans_array = NULL;
     coord_t          origin      = {0.0, 0.0};
     coord_t          mag         = {1.0, 1.0};
     coord_t          rotation    = {0.0, 0.0};
     coord_t          ref_origin  = {0.0, 0.0};
     xyxymatch_algo_e algorithm   = xyxymatch_algo_tolerance;
+    int              typenum     = NPY_DOUBLE;
+    PyArray_Descr*   typedescr   = NULL;
+    Py_buffer        ref_index_buffer;
+    int              has_ref_index = 0;
+    refindex_t       ref_index;
+    geomap_result_t  transform;
+    int              has_transform = 0;
+    const void*      match_input = NULL;
+    const coord_t*   dinput      = NULL;
+    const coordf_t*  finput      = NULL;
+    PyObject*        progress_obj = NULL;
+    wrap_progress_t  progress;
 
     PyObject*           result     = NULL;
     size_t              noutput    = 0;
@@ -70,26 +150,55 @@ py_xyxymatch(PyObject* self, PyObject* args, PyObject* kwds) {
     PyObject*           dtype_list = NULL;
     PyArray_Descr*      dtype      = NULL;
     npy_intp            dims;
+    size_t              i;
+    int                 status;
     stimage_error_t     error;
 
     const char*    keywords[]    = {
         "input", "ref", "origin", "mag", "rotation", "ref_origin", "algorithm",
-        "tolerance", "separation", "nmatch", "maxratio", "nreject", NULL
+        "tolerance", "separation", "nmatch", "maxratio", "nreject", "ref_index",
+        "dtype", "nthreads", "transform", "progress", NULL
     };
 
     stimage_error_init(&error);
+    geomap_result_init(&transform);
 
     if (!PyArg_ParseTupleAndKeywords(
-                args, kwds, "OO|OOOOsddndn:xyxymatch",
+                args, kwds, "OO|OOOOsddndnOOnOO:xyxymatch",
                 (char **)keywords,
                 &input_obj, &ref_obj, &origin_obj, &mag_obj, &rotation_obj,
                 &ref_origin_obj, &algorithm_str, &tolerance, &separation,
-                &nmatch, &maxratio, &nreject)) {
+                &nmatch, &maxratio, &nreject, &ref_index_obj, &dtype_obj,
+                &nthreads, &transform_obj, &progress_obj)) {
+        return NULL;
+    }
+
+    if (wrap_progress_init("progress", progress_obj, &progress, &error)) {
         return NULL;
     }
 
-    input_array = (PyObject*)PyArray_ContiguousFromAny(
-            input_obj, NPY_DOUBLE, 2, 2);
+    if (nthreads < 1) {
+        PyErr_SetString(PyExc_ValueError, "nthreads must be at least 1");
+        return NULL;
+    }
+
+    if (dtype_obj != NULL && dtype_obj != Py_None) {
+        if (!PyArray_DescrConverter(dtype_obj, &typedescr)) {
+            return NULL;
+        }
+        typenum = typedescr->type_num;
+        Py_DECREF(typedescr);
+        if (typenum != NPY_DOUBLE && typenum != NPY_FLOAT) {
+            PyErr_SetString(
+                PyExc_ValueError, "dtype must be float32 or float64");
+            return NULL;
+        }
+    }
+
+    /* Coordinates are cast to the requested precision, even if that
+       loses precision */
+    input_array = (PyObject*)PyArray_FROMANY(
+            input_obj, typenum, 2, 2, NPY_ARRAY_CARRAY | NPY_ARRAY_FORCECAST);
     if (input_array == NULL) {
         goto exit;
     }
@@ -98,14 +207,39 @@ py_xyxymatch(PyObject* self, PyObject* args, PyObject* kwds) {
         goto exit;
     }
 
-    ref_array = (PyObject*)PyArray_ContiguousFromAny(
-            ref_obj, NPY_DOUBLE, 2, 2);
-    if (ref_array == NULL) {
-        goto exit;
-    }
-    if (PyArray_DIM(ref_array, 1) != 2) {
-        PyErr_SetString(PyExc_TypeError, "ref array must be an Nx2 array");
-        goto exit;
+    if (ref_index_obj != NULL && ref_index_obj != Py_None) {
+        if (ref_obj != Py_None) {
+            PyErr_SetString(
+                PyExc_TypeError, "ref must be None when ref_index is given");
+            goto exit;
+        }
+        if (typenum != NPY_DOUBLE) {
+            PyErr_SetString(
+                PyExc_ValueError,
+                "A reference index can only be used with dtype float64");
+            goto exit;
+        }
+        if (PyObject_GetBuffer(ref_index_obj, &ref_index_buffer, PyBUF_SIMPLE)) {
+            goto exit;
+        }
+        has_ref_index = 1;
+        if (refindex_view(ref_index_buffer.len, ref_index_buffer.buf,
+                          &ref_index, &error)) {
+            PyErr_SetString(
+                PyExc_ValueError, stimage_error_get_message(&error));
+            goto exit;
+        }
+    } else {
+        ref_array = (PyObject*)PyArray_FROMANY(
+                ref_obj, typenum, 2, 2,
+                NPY_ARRAY_CARRAY | NPY_ARRAY_FORCECAST);
+        if (ref_array == NULL) {
+            goto exit;
+        }
+        if (PyArray_DIM(ref_array, 1) != 2) {
+            PyErr_SetString(PyExc_TypeError, "ref array must be an Nx2 array");
+            goto exit;
+        }
     }
 
     if (to_coord_t("origin", origin_obj, &origin) ||
@@ -116,23 +250,84 @@ py_xyxymatch(PyObject* self, PyObject* args, PyObject* kwds) {
         goto exit;
     }
 
+    /* A geomap solution replaces the linear transformation entirely,
+       so the matching itself runs with the identity */
+    match_input = PyArray_DATA(input_array);
+    if (transform_obj != NULL && transform_obj != Py_None) {
+        if (origin.x != 0.0 || origin.y != 0.0 ||
+            mag.x != 1.0 || mag.y != 1.0 ||
+            rotation.x != 0.0 || rotation.y != 0.0 ||
+            ref_origin.x != 0.0 || ref_origin.y != 0.0) {
+            PyErr_SetString(
+                PyExc_ValueError,
+                "origin, mag, rotation and ref_origin can not be used with "
+                "transform");
+            goto exit;
+        }
+        if (to_geomap_result_t("transform", transform_obj, &transform)) {
+            goto exit;
+        }
+        has_transform = 1;
+        trans_array = xyxymatch_transform_input(
+                input_array, &transform, typenum);
+        if (trans_array == NULL) {
+            goto exit;
+        }
+        match_input = PyArray_DATA(trans_array);
+    }
+
     noutput = PyArray_DIM(input_array, 0);
     output = malloc(noutput * sizeof(xyxymatch_output_t));
     if (output == NULL) {
         result = PyErr_NoMemory();
         goto exit;
     }
-    if (xyxymatch(
-                PyArray_DIM(input_array, 0), (coord_t*)PyArray_DATA(input_array),
+    Py_BEGIN_ALLOW_THREADS
+    if (has_ref_index) {
+        status = xyxymatch_refindex(
+                PyArray_DIM(input_array, 0), (const coord_t*)match_input,
+                &ref_index,
+                &noutput, output,
+                &origin, &mag, &rotation, &ref_origin,
+                algorithm, tolerance, separation, nmatch, maxratio, nreject,
+                (size_t)nthreads, &error);
+    } else if (typenum == NPY_FLOAT) {
+        status = xyxymatchf(
+                PyArray_DIM(input_array, 0), (const coordf_t*)match_input,
+                PyArray_DIM(ref_array, 0), (coordf_t*)PyArray_DATA(ref_array),
+                &noutput, output,
+                &origin, &mag, &rotation, &ref_origin,
+                algorithm, tolerance, separation, nmatch, maxratio, nreject,
+                (size_t)nthreads, &error);
+    } else {
+        status = xyxymatch(
+                PyArray_DIM(input_array, 0), (const coord_t*)match_input,
                 PyArray_DIM(ref_array, 0), (coord_t*)PyArray_DATA(ref_array),
                 &noutput, output,
                 &origin, &mag, &rotation, &ref_origin,
                 algorithm, tolerance, separation, nmatch, maxratio, nreject,
-                &error)) {
-        PyErr_SetString(PyExc_RuntimeError, stimage_error_get_message(&error));
+                (size_t)nthreads, &error);
+    }
+    Py_END_ALLOW_THREADS
+    if (status) {
+        wrap_set_runtime_error(&error);
         goto exit;
     }
 
+    /* Report the input coordinates as given, not as transformed */
+    if (has_transform && typenum == NPY_FLOAT) {
+        finput = (const coordf_t*)PyArray_DATA(input_array);
+        for (i = 0; i < noutput; ++i) {
+            output[i].coord.x = finput[output[i].coord_idx].x;
+            output[i].coord.y = finput[output[i].coord_idx].y;
+        }
+    } else if (has_transform) {
+        dinput = (const coord_t*)PyArray_DATA(input_array);
+        for (i = 0; i < noutput; ++i) {
+            output[i].coord = dinput[output[i].coord_idx];
+        }
+    }
+
     dtype_list = Py_BuildValue(
             "[(ss)(ss)(ss)(ss)(ss)(ss)]",
             "input_x", "f8",
@@ -154,11 +349,61 @@ py_xyxymatch(PyObject* self, PyObject* args, PyObject* kwds) {
 
  exit:
 
-    Py_DECREF(input_array);
-    Py_DECREF(ref_array);
+    Py_XDECREF(input_array);
+    Py_XDECREF(ref_array);
+    Py_XDECREF(trans_array);
+    geomap_result_free(&transform);
+    if (has_ref_index) {
+        PyBuffer_Release(&ref_index_buffer);
+    }
     if (result == NULL) {
         free(output);
     }
 
     return result;
 }
+
+PyObject*
+py_estimate_xyxymatch_cost(PyObject* self, PyObject* args, PyObject* kwds) {
+    size_t           ninput        = 0;
+    size_t           nref          = 0;
+    char*            algorithm_str = NULL;
+    size_t           nmatch        = 30;
+    size_t           nreject       = 10;
+    size_t           memory_limit  = 0;
+    xyxymatch_algo_e algorithm     = xyxymatch_algo_tolerance;
+    xyxymatch_cost_t cost;
+    stimage_error_t  error;
+
+    const char*    keywords[]    = {
+        "ninput", "nref", "algorithm", "nmatch", "nreject", "memory_limit",
+        NULL
+    };
+
+    stimage_error_init(&error);
+
+    if (!PyArg_ParseTupleAndKeywords(
+                args, kwds, "nn|snnn:estimate_xyxymatch_cost",
+                (char **)keywords,
+                &ninput, &nref, &algorithm_str, &nmatch, &nreject,
+                &memory_limit)) {
+        return NULL;
+    }
+
+    if (to_xyxymatch_algo_e("algorithm", algorithm_str, &algorithm)) {
+        return NULL;
+    }
+
+    if (xyxymatch_estimate_cost(
+                ninput, nref, algorithm, nmatch, nreject, memory_limit,
+                &cost, &error)) {
+        PyErr_SetString(PyExc_MemoryError, stimage_error_get_message(&error));
+        return NULL;
+    }
+
+    return Py_BuildValue(
+            "{snsnsd}",
+            "nmatch", (Py_ssize_t)cost.nmatch,
+            "peak_memory", (Py_ssize_t)cost.nbytes,
+            "work", cost.work);
+}
@@ -0,0 +1,273 @@
+/*
+Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+    1. Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+
+    2. Redistributions in binary form must reproduce the above
+      copyright notice, this list of conditions and the following
+      disclaimer in the documentation and/or other materials provided
+      with the distribution.
+
+    3. The name of AURA and its representatives may not be used to
+      endorse or promote products derived from this software without
+      specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+DAMAGE.
+*/
+
+#define NO_IMPORT_ARRAY
+
+#include <Python.h>
+#include "wrap_util.h"
+
+#include "lib/coordfile.h"
+
+static int
+to_coordfile_columns(
+        PyObject* columns_obj,
+        size_t* const ncolumns,
+        size_t** const columns) {
+
+    PyObject*  seq  = NULL;
+    Py_ssize_t n    = 0;
+    Py_ssize_t i    = 0;
+    Py_ssize_t value;
+
+    seq = PySequence_Fast(columns_obj, "columns must be a sequence of integers");
+    if (seq == NULL) {
+        return -1;
+    }
+
+    n = PySequence_Fast_GET_SIZE(seq);
+    *columns = malloc(MAX(n, 1) * sizeof(size_t));
+    if (*columns == NULL) {
+        Py_DECREF(seq);
+        PyErr_NoMemory();
+        return -1;
+    }
+
+    for (i = 0; i < n; ++i) {
+        value = PyNumber_AsSsize_t(
+                PySequence_Fast_GET_ITEM(seq, i), PyExc_OverflowError);
+        if (value == -1 && PyErr_Occurred()) {
+            goto fail;
+        }
+        if (value < 0) {
+            PyErr_SetString(PyExc_ValueError, "columns must not be negative");
+            goto fail;
+        }
+        (*columns)[i] = (size_t)value;
+    }
+
+    *ncolumns = (size_t)n;
+    Py_DECREF(seq);
+    return 0;
+
+ fail:
+    Py_DECREF(seq);
+    free(*columns);
+    *columns = NULL;
+    return -1;
+}
+
+PyObject*
+py_read_coords(PyObject* self, PyObject* args, PyObject* kwds) {
+    PyObject*       buffer_obj  = NULL;
+    PyObject*       columns_obj = NULL;
+    Py_buffer       buffer;
+    size_t          ncolumns    = 0;
+    size_t*         columns     = NULL;
+    size_t          nrows       = 0;
+    double*         values      = NULL;
+    double*         shrunk      = NULL;
+    npy_intp        dims[2];
+    PyObject*       result      = NULL;
+    int             status      = 0;
+    stimage_error_t error;
+
+    const char*    keywords[]    = {
+        "buffer", "columns", NULL
+    };
+
+    stimage_error_init(&error);
+
+    if (!PyArg_ParseTupleAndKeywords(
+                args, kwds, "OO:read_coords",
+                (char **)keywords, &buffer_obj, &columns_obj)) {
+        return NULL;
+    }
+
+    if (to_coordfile_columns(columns_obj, &ncolumns, &columns)) {
+        return NULL;
+    }
+
+    if (PyObject_GetBuffer(buffer_obj, &buffer, PyBUF_SIMPLE)) {
+        free(columns);
+        return NULL;
+    }
+
+    nrows = coordfile_max_rows(buffer.len, buffer.buf);
+    values = malloc(MAX(nrows * ncolumns, 1) * sizeof(double));
+    if (values == NULL) {
+        PyErr_NoMemory();
+        goto exit;
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+    status = coordfile_read(
+            buffer.len, buffer.buf, ncolumns, columns, &nrows, values, &error);
+    Py_END_ALLOW_THREADS
+
+    if (status) {
+        PyErr_SetString(PyExc_ValueError, stimage_error_get_message(&error));
+        goto exit;
+    }
+
+    /* Give back the space for the comment lines */
+    shrunk = realloc(values, MAX(nrows * ncolumns, 1) * sizeof(double));
+    if (shrunk != NULL) {
+        values = shrunk;
+    }
+
+    dims[0] = (npy_intp)nrows;
+    dims[1] = (npy_intp)ncolumns;
+    result = PyArray_New(
+            &PyArray_Type, 2, dims, NPY_DOUBLE, NULL, values, 0,
+            NPY_ARRAY_CARRAY | NPY_ARRAY_OWNDATA, NULL);
+
+ exit:
+
+    PyBuffer_Release(&buffer);
+    free(columns);
+    if (result == NULL) {
+        free(values);
+    }
+
+    return result;
+}
+
+PyObject*
+py_write_coords(PyObject* self, PyObject* args, PyObject* kwds) {
+    PyObject*           path_obj    = NULL;
+    PyObject*           data_obj    = NULL;
+    size_t              nrows       = 0;
+    size_t              stride      = 0;
+    PyObject*           columns_obj = NULL;
+    int                 precision   = 17;
+    const char*         header      = NULL;
+    Py_buffer           buffer;
+    PyObject*           seq         = NULL;
+    coordfile_column_t* columns     = NULL;
+    size_t              ncolumns    = 0;
+    size_t              i           = 0;
+    Py_ssize_t          offset;
+    int                 type;
+    PyObject*           result      = NULL;
+    int                 status      = 0;
+    stimage_error_t     error;
+
+    const char*    keywords[]    = {
+        "path", "data", "nrows", "stride", "columns", "precision", "header",
+        NULL
+    };
+
+    stimage_error_init(&error);
+
+    if (!PyArg_ParseTupleAndKeywords(
+                args, kwds, "O&OnnO|iz:write_coords",
+                (char **)keywords,
+                PyUnicode_FSConverter, &path_obj, &data_obj, &nrows, &stride,
+                &columns_obj, &precision, &header)) {
+        return NULL;
+    }
+
+    if (PyObject_GetBuffer(data_obj, &buffer, PyBUF_SIMPLE)) {
+        Py_DECREF(path_obj);
+        return NULL;
+    }
+
+    seq = PySequence_Fast(
+            columns_obj, "columns must be a sequence of (offset, type) pairs");
+    if (seq == NULL) {
+        goto exit;
+    }
+
+    ncolumns = (size_t)PySequence_Fast_GET_SIZE(seq);
+    columns = malloc(MAX(ncolumns, 1) * sizeof(coordfile_column_t));
+    if (columns == NULL) {
+        PyErr_NoMemory();
+        goto exit;
+    }
+
+    for (i = 0; i < ncolumns; ++i) {
+        if (!PyArg_ParseTuple(
+                    PySequence_Fast_GET_ITEM(seq, i), "nC:write_coords",
+                    &offset, &type)) {
+            goto exit;
+        }
+
+        switch (type) {
+        case 'f':
+            columns[i].type = coordfile_type_double;
+            break;
+        case 'u':
+            columns[i].type = coordfile_type_uint64;
+            break;
+        case 'i':
+            columns[i].type = coordfile_type_int64;
+            break;
+        default:
+            PyErr_Format(PyExc_ValueError, "Unknown column type '%c'", type);
+            goto exit;
+        }
+
+        /* All of the column types are 8 bytes */
+        if (offset < 0 || (size_t)offset + 8 > stride) {
+            PyErr_SetString(PyExc_ValueError, "Column offset out of range");
+            goto exit;
+        }
+        columns[i].offset = (size_t)offset;
+    }
+
+    if (nrows > 0 && (size_t)buffer.len < nrows * stride) {
+        PyErr_SetString(PyExc_ValueError, "data is too small");
+        goto exit;
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+    status = coordfile_write(
+            PyBytes_AsString(path_obj), header, nrows, buffer.buf, stride,
+            ncolumns, columns, precision, &error);
+    Py_END_ALLOW_THREADS
+
+    if (status) {
+        PyErr_SetString(PyExc_RuntimeError, stimage_error_get_message(&error));
+        goto exit;
+    }
+
+    Py_INCREF(Py_None);
+    result = Py_None;
+
+ exit:
+
+    PyBuffer_Release(&buffer);
+    Py_XDECREF(seq);
+    Py_DECREF(path_obj);
+    free(columns);
+
+    return result;
+}
@@ -38,10 +38,23 @@ DAMAGE.
 
 PyObject* py_xyxymatch(PyObject*, PyObject*, PyObject*);
 PyObject* py_geomap(PyObject*, PyObject*, PyObject*);
+PyObject* py_geomap_joint(PyObject*, PyObject*, PyObject*);
+PyObject* py_build_reference_index(PyObject*, PyObject*, PyObject*);
+PyObject* py_reference_index_info(PyObject*, PyObject*, PyObject*);
+PyObject* py_estimate_xyxymatch_cost(PyObject*, PyObject*, PyObject*);
+PyObject* py_read_coords(PyObject*, PyObject*, PyObject*);
+PyObject* py_write_coords(PyObject*, PyObject*, PyObject*);
+int init_geomap_results(PyObject*);
 
 static PyMethodDef module_methods[] = {
     {"xyxymatch", (PyCFunction)py_xyxymatch, METH_VARARGS | METH_KEYWORDS, NULL},
     {"geomap", (PyCFunction)py_geomap, METH_VARARGS | METH_KEYWORDS, NULL},
+    {"geomap_joint", (PyCFunction)py_geomap_joint, METH_VARARGS | METH_KEYWORDS, NULL},
+    {"build_reference_index", (PyCFunction)py_build_reference_index, METH_VARARGS | METH_KEYWORDS, NULL},
+    {"reference_index_info", (PyCFunction)py_reference_index_info, METH_VARARGS | METH_KEYWORDS, NULL},
+    {"estimate_xyxymatch_cost", (PyCFunction)py_estimate_xyxymatch_cost, METH_VARARGS | METH_KEYWORDS, NULL},
+    {"read_coords", (PyCFunction)py_read_coords, METH_VARARGS | METH_KEYWORDS, NULL},
+    {"write_coords", (PyCFunction)py_write_coords, METH_VARARGS | METH_KEYWORDS, NULL},
     {NULL}  /* Sentinel */
 };
 
@@ -74,6 +87,15 @@ init_stimage(void)
 
 #if PY_MAJOR_VERSION >= 3
     m = PyModule_Create(&moduledef);
+    if (m == NULL) {
+        return NULL;
+    }
+
+    if (init_geomap_results(m)) {
+        Py_DECREF(m);
+        return NULL;
+    }
+
 	return m;
 #else
     m = Py_InitModule3("_stimage", module_methods,
@@ -133,6 +133,28 @@ to_bbox_t(
     return 0;
 }
 
+int
+from_bbox_t(
+        const bbox_t* const b,
+        PyObject** o) {
+
+    npy_intp dims = 4;
+    double*  data;
+
+    *o = PyArray_SimpleNew(1, &dims, NPY_DOUBLE);
+    if (*o == NULL) {
+        return -1;
+    }
+
+    data = (double*)PyArray_DATA(*o);
+    data[0] = b->min.x;
+    data[1] = b->min.y;
+    data[2] = b->max.x;
+    data[3] = b->max.y;
+
+    return 0;
+}
+
 int
 to_xyxymatch_algo_e(
         const char* const name,
@@ -369,3 +391,74 @@ from_xterms_e(
 
     return 0;
 }
+
+static int
+wrap_progress(
+        void* data,
+        const char* stage,
+        size_t done,
+        size_t total) {
+
+    wrap_progress_t* progress = (wrap_progress_t*)data;
+    PyGILState_STATE gil;
+    PyObject*        result   = NULL;
+    clock_t          now      = clock();
+    int              cancel   = 0;
+
+    if (progress->polled &&
+        (double)(now - progress->last) <
+        WRAP_PROGRESS_INTERVAL * CLOCKS_PER_SEC) {
+        return 0;
+    }
+    progress->polled = 1;
+    progress->last = now;
+
+    gil = PyGILState_Ensure();
+    if (PyErr_Occurred() || PyErr_CheckSignals()) {
+        cancel = 1;
+    } else if (progress->callback != NULL) {
+        result = PyObject_CallFunction(
+                progress->callback, "snn", stage,
+                (Py_ssize_t)done, (Py_ssize_t)total);
+        if (result == NULL) {
+            cancel = 1;
+        }
+        Py_XDECREF(result);
+    }
+    PyGILState_Release(gil);
+
+    return cancel;
+}
+
+int
+wrap_progress_init(
+        const char* const name,
+        PyObject* callback,
+        wrap_progress_t* const progress,
+        stimage_error_t* const error) {
+
+    progress->callback = NULL;
+    progress->polled = 0;
+    progress->last = 0;
+
+    if (callback != NULL && callback != Py_None) {
+        if (!PyCallable_Check(callback)) {
+            PyErr_Format(PyExc_TypeError, "%s must be callable", name);
+            return -1;
+        }
+        progress->callback = callback;
+    }
+
+    stimage_error_set_progress(error, &wrap_progress, progress);
+
+    return 0;
+}
+
+void
+wrap_set_runtime_error(
+        stimage_error_t* const error) {
+
+    if (!PyErr_Occurred()) {
+        PyErr_SetString(PyExc_RuntimeError, stimage_error_get_message(error));
+    }
+}
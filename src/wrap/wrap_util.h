@@ -41,6 +41,7 @@ DAMAGE.
 
 #include <Python.h>
 #include <numpy/arrayobject.h>
+#include <time.h>
 
 #include "immatch/xyxymatch.h"
 #include "immatch/geomap.h"
@@ -49,6 +50,8 @@ DAMAGE.
 
 extern char* SIZE_T_D;
 
+#define WRAP_PROGRESS_INTERVAL 0.05
+
 int
 to_coord_t(
         const char* const name,
@@ -66,6 +69,11 @@ to_bbox_t(
         PyObject* o,
         bbox_t* const b);
 
+int
+from_bbox_t(
+        const bbox_t* const b,
+        PyObject** o);
+
 int
 to_xyxymatch_algo_e(
         const char* const name,
@@ -105,4 +113,40 @@ from_xterms_e(
         const xterms_e e,
         PyObject** o);
 
+/* The state of the progress callback installed by wrap_progress_init */
+typedef struct {
+    PyObject* callback;
+    int       polled;
+    clock_t   last;
+} wrap_progress_t;
+
+/* Install a progress callback on error that, on the first poll and
+   then at most every WRAP_PROGRESS_INTERVAL seconds of CPU time,
+   checks for signals, so
+   that Ctrl-C raises KeyboardInterrupt, and calls callback(stage, done,
+   total) if callback is not None.  An exception from either cancels the
+   call, and is left set for the wrapper to return.  The callback takes
+   the GIL, so the call may be made with the GIL released. */
+int
+wrap_progress_init(
+        const char* const name,
+        PyObject* callback,
+        wrap_progress_t* const progress,
+        stimage_error_t* const error);
+
+/* Set a RuntimeError from error, unless the call failed because the
+   progress callback raised an exception */
+void
+wrap_set_runtime_error(
+        stimage_error_t* const error);
+
+/* Defined in py_geomap.c, next to the GeomapResults type.  The
+   coefficient arrays of r are allocated, and must be freed with
+   geomap_result_free. */
+int
+to_geomap_result_t(
+        const char* const name,
+        PyObject* o,
+        geomap_result_t* const r);
+
 #endif
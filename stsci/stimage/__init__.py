@@ -28,8 +28,19 @@
 # DAMAGE.
 
 from __future__ import absolute_import
+
+import operator
+
+import numpy as np
+
 from ._version import version as __version__
 from . import _stimage
+from ._stimage import GeomapResults
+from .refindex import (build_reference_index, open_reference_index,
+                       ReferenceIndex)
+from .cache import ResultCache
+from .coordfile import read_coords, write_coords
+from .aio import xyxymatch_async, geomap_async
 
 
 def xyxymatch(input,
@@ -43,7 +54,13 @@ def xyxymatch(input,
               separation = 9.0,
               nmatch = 30,
               maxratio = 10.0,
-              nreject = 10):
+              nreject = 10,
+              dtype = None,
+              nthreads = 1,
+              transform = None,
+              cache = None,
+              memory_limit = None,
+              progress = None):
     """
     Match pixels coordinate lists using various methods.
 
@@ -152,6 +169,12 @@ def xyxymatch(input,
     - *input*: Array of input coordinates. (Must be an Nx2 array).
 
     - *ref*: Array of reference coordinates. (Must be an Nx2 array).
+      May also be a `ReferenceIndex` opened with
+      `open_reference_index`, in which case the sorted reference
+      coordinates (and, for the ``'triangles'`` algorithm, the
+      reference triangles) are read from the index rather than
+      recomputed.  *separation* must match the value the index was
+      built with.
 
     - *origin*: The origin of the input coordinate system.  Default:
       (0.0, 0.0)
@@ -223,6 +246,61 @@ def xyxymatch(input,
     - *nreject*: The maximum number of rejection iterations for the
       ``'triangles'`` pattern matching algorithm.  Default: 10
 
+    - *dtype*: The precision to match in, either `numpy.float64` or
+      `numpy.float32`.  With `numpy.float32`, the coordinates are
+      kept in single precision through the transform, sort,
+      coincidence and ``'tolerance'`` matching steps, which roughly
+      halves the memory (and memory bandwidth) used for large
+      catalogs.  Any distance close to the tolerance is recomputed
+      in double precision, so the matches are the same as in double
+      precision for coordinates that are exactly representable as
+      float32, as long as the initial transformation does not need
+      rounding (the default identity transformation never does).
+      The ``'triangles'`` algorithm always runs in double precision.
+      The output columns are float64 in either case.  Default:
+      `numpy.float64`
+
+    - *nthreads*: The number of threads used by the ``'tolerance'``
+      algorithm.  The sorted reference list is split into strips in
+      *y* that are matched concurrently, and the results are merged
+      back in order, so the output is the same for any number of
+      threads.  Small reference lists use fewer threads.  The
+      ``'triangles'`` algorithm ignores this.  Default: 1
+
+    - *transform*: A `GeomapResults` from a previous `geomap` of
+      matched input and reference coordinates, used as the initial
+      transformation instead of *origin*, *mag*, *rotation* and
+      *ref_origin*, which must then be left at their defaults.  Since
+      `geomap` maps reference coordinates to input coordinates, the
+      input coordinates are transformed with its inverse, including
+      the distortion terms (*x2coeff* and *y2coeff*).  For detectors
+      with significant known distortion, this lets the first pass use
+      a tolerance close to the centroiding error.  A `RuntimeWarning`
+      is issued if the inverse does not converge for some input
+      coordinates, such as those far outside the fitted region.  The
+      returned *input_x* and *input_y* are the coordinates as given.
+      Default: `None`
+
+    - *cache*: A `ResultCache` to look the result up in, and to store
+      it in when it is not found.  Default: `None`, always compute
+
+    - *memory_limit*: The maximum number of bytes to use.  The memory
+      used by the ``'triangles'`` algorithm grows as the cube of
+      *nmatch*, so it is reduced as needed to fit (see
+      `estimate_xyxymatch_cost`).  If even the smallest *nmatch* does
+      not fit, `MemoryError` is raised before anything is allocated.
+      Default: `None`, no limit
+
+    - *progress*: A callable polled from the ``'triangles'``
+      algorithm's loops as ``progress(stage, done, total)``, where
+      *stage* names the loop and *done* of *total* units of it are
+      complete.  Raising an exception from it cancels the match, and
+      the exception is raised from `xyxymatch`.  Whether or not it is
+      given, the loops check for Ctrl-C, which raises
+      `KeyboardInterrupt`.  Polls are at most every 50 ms of CPU time.
+      The GIL is released while matching, so `xyxymatch` can run in
+      other threads (see `xyxymatch_async`).  Default: `None`
+
     **Returns**: A structured array containing the output
     information.  It has the following columns:
 
@@ -233,6 +311,23 @@ def xyxymatch(input,
     - *ref_y*
     - *ref_idx*
     """
+    if memory_limit is not None:
+        nmatch = estimate_xyxymatch_cost(
+            len(input), len(ref), algorithm=algorithm, nmatch=nmatch,
+            nreject=nreject, memory_limit=memory_limit)['nmatch']
+
+    if cache is not None:
+        return cache.call(
+            xyxymatch, input=input, ref=ref, origin=origin, mag=mag,
+            rotation=rotation, ref_origin=ref_origin, algorithm=algorithm,
+            tolerance=tolerance, separation=separation, nmatch=nmatch,
+            maxratio=maxratio, nreject=nreject, dtype=dtype,
+            nthreads=nthreads, transform=transform, progress=progress)
+
+    ref_index = None
+    if isinstance(ref, ReferenceIndex):
+        ref, ref_index = None, ref.buffer
+
     return _stimage.xyxymatch(
         input,
         ref,
@@ -245,7 +340,74 @@ def xyxymatch(input,
         separation,
         nmatch,
         maxratio,
-        nreject)
+        nreject,
+        ref_index,
+        dtype,
+        nthreads,
+        transform,
+        progress)
+
+
+def _count(n):
+    """
+    The number of coordinates *n* stands for: either *n* itself, when
+    it is an integer of any type, or its length.
+    """
+    try:
+        return operator.index(n)
+    except TypeError:
+        return len(n)
+
+
+def estimate_xyxymatch_cost(ninput,
+                            nref,
+                            algorithm='tolerance',
+                            nmatch=30,
+                            nreject=10,
+                            memory_limit=None):
+    """
+    Estimate the peak memory use and running time of `xyxymatch`,
+    without running it.
+
+    The ``'triangles'`` algorithm builds every triangle of up to
+    *nmatch* coordinates from each list, so its memory grows as the
+    cube of *nmatch*: the triangles for the default of 30 need well
+    under a megabyte, while those for 200 need a few hundred
+    megabytes.  Its running time grows faster still, as roughly the
+    sixth power of *nmatch*, since each triangle is compared with
+    every triangle of a similar shape in the other list.  Otherwise,
+    the memory only grows linearly with the lengths of the lists.
+
+    **Parameters:**
+
+    - *ninput*, *nref*: The number of input and reference
+      coordinates, or the coordinate lists themselves.
+
+    - *algorithm*, *nmatch*, *nreject*: As passed to `xyxymatch`.
+
+    - *memory_limit*: The maximum number of bytes to use.  With the
+      ``'triangles'`` algorithm, *nmatch* is reduced to the largest
+      value whose estimate fits.  `MemoryError` is raised if even the
+      smallest *nmatch* does not fit.  Default: `None`, no limit
+
+    **Returns:** A dictionary with the following keys:
+
+    - *nmatch*: The *nmatch* the estimate is for.
+
+    - *peak_memory*: The estimated peak memory use in bytes,
+      including the output.  It is an upper bound, since it assumes
+      that no coordinates are culled and no triangles are rejected.
+
+    - *work*: The amount of work, in arbitrary units proportional to
+      the running time.  Only the relative values are meaningful.
+    """
+    return _stimage.estimate_xyxymatch_cost(
+        _count(ninput),
+        _count(nref),
+        algorithm,
+        nmatch,
+        nreject,
+        int(memory_limit or 0))
 
 
 def geomap(input,
@@ -260,7 +422,13 @@ def geomap(input,
            xxterms="half",
            yxterms="half",
            maxiter=0,
-           reject=0.0):
+           reject=0.0,
+           order=None,
+           max_order=5,
+           grid=None,
+           grid_smoothing=0.01,
+           cache=None,
+           progress=None):
     """
     `geomap` computes the transformation required to map the reference
     coordinate system to the input coordinate system.
@@ -526,6 +694,43 @@ def geomap(input,
 
     - *reject* = 3.0: The rejection limit in units of sigma.
 
+    - *order*: When ``'auto'``, the orders and cross terms of the *x*
+      and *y* fits are chosen from the data, and *xxorder*,
+      *xyorder*, *yxorder*, *yyorder*, *xxterms* and *yxterms* are
+      ignored.  Each fit gets the same order in *x* and *y*, between
+      2 and *max_order*, and the cross terms, that minimize the
+      Bayesian information criterion ``n ln(rss / n) + p ln(n)``,
+      where *p* is the number of coefficients.  All the candidates
+      are solved from one set of normal equations by growing the
+      Cholesky factorization an order at a time, so the search costs
+      about as much as the largest fit.  The chosen values are
+      available on the returned `GeomapResults`.  Only valid with the
+      "general" *fit_geometry*.  Default: `None`, use the given orders
+
+    - *max_order*: The highest order considered when *order* is
+      ``'auto'``.  Default: 5
+
+    - *grid*: The number of cells ``(nx, ny)``, or a single number for
+      both, of a residual grid to fit on top of the surfaces.  The
+      grid is a bicubic B-spline over *bbox*, fit to the residuals of
+      the surfaces, so a low order fit with a grid can follow a
+      detector distortion that would otherwise need a high order
+      polynomial.  It costs the same to evaluate at any resolution.
+      The rejection, if any, is done by the surfaces alone.  Default:
+      `None`, no grid
+
+    - *grid_smoothing*: The weight of the penalty on the curvature of
+      the residual grid, relative to the data.  Larger values give a
+      smoother correction, and fill in cells with few points from
+      their neighbors.  Default: 0.01
+
+    - *cache*: A `ResultCache` to look the result up in, and to store
+      it in when it is not found.  Default: `None`, always compute
+
+    - *progress*: A callable polled before each rejection iteration,
+      as for `xyxymatch`.  The GIL is released while fitting (see
+      `geomap_async`).  Default: `None`
+
     **Returns:** A 2-tuple with the following parts:
 
     - `GeomapResults` object, with the following attributes:
@@ -535,6 +740,14 @@ def geomap(input,
 
       - *function* str: The same value as *function* passed to `geomap`.
 
+      - *xxorder*, *xyorder*, *yxorder*, *yyorder* int: The orders of
+        the fit.
+
+      - *xxterms*, *yxterms* str: The cross terms of the fit.
+
+      - *bbox* double array: The range of reference coordinates
+        ``[xmin, ymin, xmax, ymax]`` the surfaces are normalized to.
+
       - *rms* (x, y) tuple: The root-mean-square of the residuals.
 
       - *mean_ref* (x, y) tuple: The mean value of the reference
@@ -561,6 +774,22 @@ def geomap(input,
       - *y2coeff* double array: The second-order *y* coefficients of
         the fit.
 
+      - *xgrid*, *ygrid* double arrays: The coefficients of the
+        residual grid of the *x* and *y* fits, of shape ``(ny + 3, nx
+        + 3)``, or empty if there is none.  Coefficient ``[j, i]`` is
+        centered on ``(xmin + (i - 1) * hx, ymin + (j - 1) * hy)``,
+        where *hx* and *hy* are the cell sizes.
+
+      ``fit.evaluate(ref)`` transforms an Nx2 array of reference
+      coordinates to input coordinates, including the distortion
+      terms and the residual grid.
+
+      The arrays of a `GeomapResults` are all views onto one flat,
+      versioned buffer.  ``fit.tobytes()`` returns that buffer and
+      ``GeomapResults.frombuffer(buffer)`` rebuilds a result from it
+      without copying.  Results pickle through the same buffer, which
+      pickle protocol 5 can send out-of-band.
+
     - A Numpy structured array with the following columns:
 
       - *input_x*
@@ -572,6 +801,36 @@ def geomap(input,
       - *resid_x*
       - *resid_y*
     """
+    if cache is not None:
+        return cache.call(
+            geomap, input=input, ref=ref, bbox=bbox,
+            fit_geometry=fit_geometry, function=function, xxorder=xxorder,
+            xyorder=xyorder, yxorder=yxorder, yyorder=yyorder,
+            xxterms=xxterms, yxterms=yxterms, maxiter=maxiter,
+            reject=reject, order=order, max_order=max_order, grid=grid,
+            grid_smoothing=grid_smoothing, progress=progress)
+
+    if order is None:
+        max_order = 0
+    elif order != 'auto':
+        raise ValueError("order must be None or 'auto'")
+    elif max_order < 2:
+        raise ValueError("max_order must be at least 2")
+
+    if grid is None:
+        grid_x = grid_y = 0
+    else:
+        try:
+            grid_x, grid_y = [
+                operator.index(n) for n in np.broadcast_to(grid, (2,))]
+        except TypeError:
+            raise ValueError(
+                "grid must be a whole number of cells, not {0!r}".format(
+                    grid))
+        if grid_x < 1 or grid_y < 1:
+            raise ValueError(
+                "grid must have at least one cell in each direction")
+
     return _stimage.geomap(
         input,
         ref,
@@ -585,4 +844,133 @@ def geomap(input,
         xxterms,
         yxterms,
         maxiter,
-        reject)
+        reject,
+        max_order,
+        progress,
+        grid_x=grid_x,
+        grid_y=grid_y,
+        grid_smoothing=grid_smoothing)
+
+
+def geomap_joint(coords,
+                 groups,
+                 reference=0,
+                 fit_geometry="general",
+                 function="polynomial",
+                 maxiter=0,
+                 reject=0.0,
+                 progress=None):
+    """
+    `geomap_joint` computes the transformations of many overlapping
+    exposures at once, from sources matched across them.
+
+    Calling `geomap` on each exposure against a single reference
+    ignores the sources the other exposures have in common.
+    `geomap_joint` instead fits every transformation together with
+    the position of every matched source in a common frame,
+    minimizing the residuals of all of the observations at once.  The
+    common frame is that of the *reference* exposure, whose
+    transformation is the identity.
+
+    As with `geomap`, each transformation maps the common
+    (reference) frame to the coordinates of the exposure::
+
+        xin = f (xref, yref)
+        yin = g (xref, yref)
+
+    The sources need not be seen in every exposure, or in the
+    reference exposure, but every exposure must be connected to the
+    reference through sources it shares with others.
+
+    The source positions are eliminated from the normal equations,
+    leaving a sparse system in the transformation parameters alone
+    with a block for each pair of overlapping exposures, which is
+    solved by preconditioned conjugate gradients in C.  Each iteration
+    costs time linear in the number of observations, so hundreds of
+    exposures and hundreds of thousands of observations take about a
+    second.
+
+    **Parameters:**
+
+    - *coords*: A sequence of arrays of coordinates, one per exposure.
+      (Each must be an Nx2 array).
+
+    - *groups*: A sequence of integer arrays, one per exposure, the
+      same length as the corresponding array of *coords*.  Each gives
+      the source each coordinate is an observation of: observations
+      with the same value, in any exposures, are of the same source.
+      Negative values mark unmatched observations, which are ignored.
+
+    - *reference*: The index of the exposure that defines the common
+      frame.  Default: 0
+
+    - *fit_geometry*: The fitting geometry, as for `geomap`: "shift",
+      "xyscale", "rotate", "rscale", "rxyscale" or "general"
+      (default).  For "general", only the linear term is fit.
+
+    - *function*: The type of analytic surface the results are
+      expressed in, as for `geomap`.  Default: "polynomial"
+
+    - *maxiter* = 0: The maximum number of rejection iterations. The
+      default is no rejection.
+
+    - *reject* = 3.0: The rejection limit in units of sigma, computed
+      separately for each exposure and axis.
+
+    - *progress*: A callable polled before each iteration, as for
+      `xyxymatch`.  Default: `None`
+
+    **Returns:** A 2-tuple with the following parts:
+
+    - A list of `GeomapResults` objects, one per exposure, as returned
+      by `geomap`, mapping the common frame to that exposure.  Their
+      *mean_ref*, *mean_input* and *rms* are of the observations used
+      in the fit.
+
+    - A list of Numpy structured arrays, one per exposure, with the
+      same columns as that returned by `geomap`.  *ref_x* and *ref_y*
+      are the fit position of the source in the common frame.  Rows
+      that are unmatched, rejected, or of sources seen only once have
+      NaN *fit_x*, *fit_y*, *resid_x* and *resid_y*; unmatched rows
+      also have NaN *ref_x* and *ref_y*.
+    """
+    if len(coords) != len(groups):
+        raise ValueError("coords and groups must have the same length")
+    if len(coords) == 0:
+        raise ValueError("There must be at least one exposure")
+
+    coords = [np.asarray(c, dtype=np.float64).reshape(-1, 2)
+              for c in coords]
+    groups = [np.asarray(g).reshape(-1) for g in groups]
+    for c, g in zip(coords, groups):
+        if len(c) != len(g):
+            raise ValueError(
+                "Each array of groups must be the same length as its coords")
+        if g.dtype.kind not in 'iu':
+            raise TypeError("groups must be integer arrays")
+
+    nexposure = len(coords)
+    if not 0 <= reference < nexposure:
+        raise ValueError("reference is out of range")
+
+    counts = np.array([len(c) for c in coords])
+    exposure = np.repeat(np.arange(nexposure), counts)
+    coord = np.concatenate(coords)
+    group = np.concatenate([g.astype(np.int64) for g in groups])
+
+    matched = group >= 0
+    unique, group = np.unique(group[matched], return_inverse=True)
+
+    fits, output = _stimage.geomap_joint(
+        coord[matched], exposure[matched].astype(np.uintp),
+        group.astype(np.uintp), nexposure, len(unique),
+        reference, fit_geometry, function, maxiter, reject, progress)
+
+    full = np.empty(len(coord), dtype=output.dtype)
+    for name in output.dtype.names:
+        full[name] = np.nan
+    full['input_x'] = coord[:, 0]
+    full['input_y'] = coord[:, 1]
+    full[matched] = output
+
+    return fits, np.split(full, np.cumsum(counts)[:-1])
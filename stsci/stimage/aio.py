@@ -0,0 +1,121 @@
+# Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+#     1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+
+#     2. Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+
+#     3. The name of AURA and its representatives may not be used to
+#       endorse or promote products derived from this software without
+#       specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+# USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+
+"""
+Coroutine wrappers for running `xyxymatch` and `geomap` from asyncio.
+
+`xyxymatch` and `geomap` release the GIL while they run, so running
+them in an executor keeps the event loop responsive.  The wrappers
+here also cancel the work itself when the awaiting task is cancelled,
+such as by `asyncio.wait_for` on a timeout: the next time the C loops
+poll for progress, the call is abandoned, rather than running on in
+the executor to completion.
+
+The progress and cancellation hooks are shared with the call in
+memory, so the work has to run in a thread of this process, in a
+`concurrent.futures.ThreadPoolExecutor`.
+"""
+
+from __future__ import absolute_import
+
+import asyncio
+import concurrent.futures
+import functools
+import threading
+
+__all__ = ['xyxymatch_async', 'geomap_async']
+
+
+class _Cancelled(Exception):
+    """
+    Raised from the progress callback to stop a cancelled call.
+    """
+
+
+async def _run(function, args, kwargs, progress, executor):
+    if (executor is not None and
+            not isinstance(executor, concurrent.futures.ThreadPoolExecutor)):
+        raise TypeError(
+            "executor must be a concurrent.futures.ThreadPoolExecutor, "
+            "not {0}".format(type(executor).__name__))
+
+    loop = asyncio.get_running_loop()
+    cancelled = threading.Event()
+
+    def poll(stage, done, total):
+        if cancelled.is_set():
+            raise _Cancelled()
+        if progress is not None:
+            loop.call_soon_threadsafe(progress, stage, done, total)
+
+    future = loop.run_in_executor(
+        executor, functools.partial(function, *args, progress=poll, **kwargs))
+    try:
+        return await future
+    except asyncio.CancelledError:
+        cancelled.set()
+        raise
+
+
+async def xyxymatch_async(*args, executor=None, progress=None, **kwargs):
+    """
+    Run `xyxymatch` in *executor*, and return its result.
+
+    The arguments are those of `xyxymatch`, with the following
+    differences:
+
+    - *executor*: The `concurrent.futures.ThreadPoolExecutor` to run
+      in.  Other executors, such as a
+      `concurrent.futures.ProcessPoolExecutor`, raise `TypeError`,
+      since the progress and cancellation hooks cannot be sent to
+      another process.  Default: `None`, the event loop's default
+      executor
+
+    - *progress*: Called in the event loop's thread, rather than the
+      executor's, as ``progress(stage, done, total)``.  Default: `None`
+
+    Cancelling the awaiting task stops the match at its next progress
+    poll.
+    """
+    from . import xyxymatch
+    return await _run(xyxymatch, args, kwargs, progress, executor)
+
+
+async def geomap_async(*args, executor=None, progress=None, **kwargs):
+    """
+    Run `geomap` in *executor*, and return its result.
+
+    The arguments are those of `geomap`, with *executor* and
+    *progress* as for `xyxymatch_async`.
+
+    Cancelling the awaiting task stops the fit before its next
+    rejection iteration.
+    """
+    from . import geomap
+    return await _run(geomap, args, kwargs, progress, executor)
@@ -0,0 +1,300 @@
+# Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+#     1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+
+#     2. Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+
+#     3. The name of AURA and its representatives may not be used to
+#       endorse or promote products derived from this software without
+#       specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+# USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+
+"""
+Memoization of `xyxymatch` and `geomap` results.
+
+A `ResultCache` is keyed by a hash of the contents of the coordinate
+arrays and of every other argument, so a call with byte-identical
+inputs and parameters returns the stored result instead of
+recomputing it.  Results are kept in memory, least recently used
+first out once a byte limit is reached, and optionally in a directory
+on disk where they survive the process and can be shared between
+processes.
+
+The cache is opt-in: pass one as the *cache* argument of `xyxymatch`
+or `geomap`.
+"""
+
+from __future__ import absolute_import
+
+import collections
+import hashlib
+import os
+import tempfile
+import threading
+
+import numpy as np
+
+from . import _stimage
+from ._version import version as _stimage_version
+from .refindex import ReferenceIndex
+
+__all__ = ['ResultCache']
+
+
+def _hash_update(h, value):
+    if value is None:
+        h.update(b'N')
+    elif isinstance(value, str):
+        h.update(b'S')
+        h.update(value.encode('utf-8'))
+    elif isinstance(value, ReferenceIndex):
+        h.update(b'I')
+        h.update(value.buffer)
+    elif isinstance(value, _stimage.GeomapResults):
+        h.update(b'G')
+        h.update(value.tobytes())
+    elif isinstance(value, (type, np.dtype)):
+        h.update(b'D')
+        h.update(np.dtype(value).str.encode('ascii'))
+    else:
+        array = np.ascontiguousarray(value)
+        if array.dtype.hasobject:
+            raise TypeError(
+                "Can not compute a cache key for {0!r}".format(value))
+        h.update(b'A')
+        h.update(array.dtype.str.encode('ascii'))
+        h.update(repr(array.shape).encode('ascii'))
+        h.update(array.data if array.size else b'')
+    h.update(b'\0')
+
+
+def _copy_geomap_results(fit):
+    return _stimage.GeomapResults.frombuffer(bytearray(fit.tobytes()))
+
+
+def _copy(value):
+    if isinstance(value, np.ndarray):
+        return value.copy()
+    fit, output = value
+    return _copy_geomap_results(fit), output.copy()
+
+
+def _nbytes(value):
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    fit, output = value
+    return output.nbytes + len(fit.tobytes())
+
+
+def _pack(value):
+    if isinstance(value, np.ndarray):
+        return {'output': value}
+    fit, output = value
+    return {'output': output,
+            'fit': np.frombuffer(fit.tobytes(), dtype=np.uint8)}
+
+
+def _unpack(arrays):
+    output = arrays['output']
+    if 'fit' not in arrays:
+        return output
+    fit = _stimage.GeomapResults.frombuffer(bytearray(arrays['fit']))
+    return fit, output
+
+
+class ResultCache(object):
+    """
+    A cache of `xyxymatch` and `geomap` results.
+
+    **Parameters:**
+
+    - *max_bytes*: The most memory, in bytes, used by the results kept
+      in memory.  The least recently used results are dropped to stay
+      below it, and results larger than it are not kept in memory at
+      all.  Default: 256 MiB
+
+    - *directory*: A local directory to also store results in, one
+      file per result.  It is created if needed.  Files are written
+      atomically, so the directory may be shared by concurrent
+      processes.  Default: `None`, memory only
+
+    - *max_disk_bytes*: The most disk space, in bytes, used by the
+      files in *directory*.  The least recently used files are removed
+      to stay below it.  Default: `None`, unlimited
+
+    The *hits*, *disk_hits* and *misses* attributes count the lookups
+    found in the cache, the subset of those found on disk only, and
+    the lookups that had to be computed.  A hit returns a copy of the
+    stored result, identical to what a fresh computation would return.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024, directory=None,
+                 max_disk_bytes=None):
+        self.max_bytes = max_bytes
+        self.directory = None if directory is None else os.fspath(directory)
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.nbytes = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def __repr__(self):
+        return '<ResultCache: {0} results, {1} bytes, {2} hits, ' \
+            '{3} misses>'.format(
+                len(self), self.nbytes, self.hits, self.misses)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def key(self, func, **kwargs):
+        """
+        The cache key of calling *func* with *kwargs*, as a hex
+        string.
+        """
+        h = hashlib.blake2b(digest_size=20)
+        _hash_update(h, _stimage_version)
+        _hash_update(h, func.__name__)
+        for name in sorted(kwargs):
+            _hash_update(h, name)
+            _hash_update(h, kwargs[name])
+        return h.hexdigest()
+
+    def call(self, func, **kwargs):
+        """
+        Return ``func(**kwargs)``, from the cache if possible.  A
+        *progress* callback is passed on to *func*, but is not part of
+        the key.
+        """
+        progress = kwargs.pop('progress', None)
+        key = self.key(func, **kwargs)
+
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return _copy(value)
+
+        value = self._load(key)
+        if value is not None:
+            with self._lock:
+                self.hits += 1
+                self.disk_hits += 1
+                self._store(key, value)
+            return _copy(value)
+
+        if progress is not None:
+            kwargs['progress'] = progress
+        value = func(**kwargs)
+        with self._lock:
+            self.misses += 1
+            self._store(key, _copy(value))
+        self._save(key, value)
+        return value
+
+    def clear(self):
+        """
+        Remove every result from memory and from *directory*.  The
+        counters are left alone.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+        for path in self._files():
+            _unlink(path)
+
+    def _store(self, key, value):
+        nbytes = _nbytes(value)
+        if nbytes > self.max_bytes or key in self._entries:
+            return
+        self._entries[key] = value
+        self.nbytes += nbytes
+        while self.nbytes > self.max_bytes:
+            _, old = self._entries.popitem(last=False)
+            self.nbytes -= _nbytes(old)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.npz')
+
+    def _files(self):
+        if self.directory is None:
+            return []
+        return [os.path.join(self.directory, name)
+                for name in os.listdir(self.directory)
+                if name.endswith('.npz')]
+
+    def _load(self, key):
+        if self.directory is None:
+            return None
+        path = self._path(key)
+        try:
+            with np.load(path, allow_pickle=False) as npz:
+                arrays = dict((name, npz[name]) for name in npz.files)
+        except (IOError, OSError, ValueError):
+            return None
+        # Mark it as recently used for the disk eviction
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return _unpack(arrays)
+
+    def _save(self, key, value):
+        if self.directory is None:
+            return
+        fd, tmp_path = tempfile.mkstemp(
+            dir=self.directory, prefix='.' + key, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as fh:
+                np.savez(fh, **_pack(value))
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            _unlink(tmp_path)
+            raise
+        if self.max_disk_bytes is not None:
+            self._evict_files()
+
+    def _evict_files(self):
+        files = []
+        for path in self._files():
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, path))
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if total <= self.max_disk_bytes:
+                break
+            _unlink(path)
+            total -= size
+
+
+def _unlink(path):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
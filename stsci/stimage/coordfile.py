@@ -0,0 +1,151 @@
+# Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+#     1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+
+#     2. Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+
+#     3. The name of AURA and its representatives may not be used to
+#       endorse or promote products derived from this software without
+#       specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+# USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+
+"""
+Reading and writing IRAF-style coordinate list files.
+
+The IRAF tasks that `xyxymatch` and `geomap` are ported from exchange
+text coordinate and match files (``.coo``, ``.match``), with one object
+per line in whitespace-separated columns.  `read_coords` parses such
+files with the file memory-mapped and without holding the GIL, and
+`write_coords` writes the structured arrays returned by `xyxymatch`
+and `geomap` (or any 2-D array) in the same format.
+
+Blank lines, lines starting with ``#``, and anything after a ``#``
+are ignored.  IRAF's undefined value ``INDEF`` is read as NaN, and NaN
+is written as ``INDEF``.
+"""
+
+from __future__ import absolute_import
+
+import mmap
+import os
+
+import numpy as np
+
+from . import _stimage
+
+__all__ = ['read_coords', 'write_coords']
+
+
+def read_coords(path, columns=(0, 1)):
+    """
+    Read columns of numbers from a coordinate list file.
+
+    **Parameters:**
+
+    - *path*: The path of the file to read.
+
+    - *columns*: The 0-based indices of the columns to read, in the
+      order they are to be returned.  Default: ``(0, 1)``, the *x*
+      and *y* columns of a ``.coo`` file
+
+    **Returns:** A float64 array of shape ``(nrows, len(columns))``,
+    which with the default *columns* can be passed directly to
+    `xyxymatch` or `geomap`.
+
+    Raises `ValueError` if a line has too few columns or a column is
+    not a number.
+    """
+    with open(path, 'rb') as fd:
+        if os.fstat(fd.fileno()).st_size == 0:
+            return _stimage.read_coords(b'', columns)
+        buffer = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        return _stimage.read_coords(buffer, columns)
+    finally:
+        buffer.close()
+
+
+def _column_kind(dtype):
+    # The C writer handles native 8-byte floats and integers in place
+    if dtype.itemsize == 8 and dtype.isnative and dtype.kind in 'fui':
+        return dtype.kind
+    return None
+
+
+def write_coords(path, data, columns=None, precision=17, header=True):
+    """
+    Write an array as a coordinate list file.
+
+    **Parameters:**
+
+    - *path*: The path of the file to write.
+
+    - *data*: A structured array, such as those returned by
+      `xyxymatch` and `geomap`, or a 2-D array of numbers.
+
+    - *columns*: For a structured array, the names of the fields to
+      write, in order.  For a 2-D array, the names of its columns for
+      the header.  Default: `None`, all of the fields of a structured
+      array
+
+    - *precision*: The number of significant digits to write for
+      floating-point values.  The default of 17 reads back exactly.
+
+    - *header*: If true, the first line is a comment naming the
+      columns.  It may also be a string to use as the comment.
+      Default: `True`
+    """
+    data = np.asarray(data)
+
+    if data.dtype.names is not None:
+        if columns is None:
+            columns = data.dtype.names
+        columns = list(columns)
+        fields = [data.dtype.fields[name][:2] for name in columns]
+        kinds = [_column_kind(dtype) for dtype, offset in fields]
+        if None not in kinds:
+            # Written straight from the records, without a copy
+            data = np.ascontiguousarray(data.reshape(-1))
+            layout = [(offset, kind)
+                      for (dtype, offset), kind in zip(fields, kinds)]
+            stride = data.dtype.itemsize
+        else:
+            data = np.column_stack(
+                [data[name].reshape(-1).astype(np.float64)
+                 for name in columns] or [np.empty((len(data), 0))])
+    elif data.ndim != 2:
+        raise ValueError("data must be a structured array or a 2-D array")
+
+    if data.dtype.names is None:
+        kind = _column_kind(data.dtype)
+        if kind is None:
+            data, kind = data.astype(np.float64), 'f'
+        data = np.ascontiguousarray(data)
+        layout = [(i * 8, kind) for i in range(data.shape[1])]
+        stride = data.shape[1] * 8
+
+    if header is True:
+        header = ' '.join(columns) if columns else None
+    elif not header:
+        header = None
+
+    _stimage.write_coords(
+        os.fspath(path), data, len(data), stride, layout, precision, header)
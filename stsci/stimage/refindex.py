@@ -0,0 +1,176 @@
+# Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+#     1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+
+#     2. Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+
+#     3. The name of AURA and its representatives may not be used to
+#       endorse or promote products derived from this software without
+#       specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+# USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+
+"""
+On-disk reference indexes for `xyxymatch`.
+
+A reference index stores everything `xyxymatch` derives from the
+reference coordinates alone -- the sorted coordinates, the unique
+subset left after removing points closer together than *separation*,
+and the ratio-sorted table of reference triangles -- in a versioned
+binary file.  The file is opened with `mmap`, so any number of
+processes matching against the same reference list share a single
+page-cached copy and skip rebuilding it.
+"""
+
+from __future__ import absolute_import
+
+import mmap
+import os
+import tempfile
+
+import numpy as np
+
+from . import _stimage
+
+__all__ = ['build_reference_index', 'open_reference_index', 'ReferenceIndex']
+
+
+def build_reference_index(ref,
+                          path,
+                          separation = 9.0,
+                          nmatch = 30,
+                          tolerance = 1.0,
+                          maxratio = 10.0):
+    """
+    Build a reference index file for use with `xyxymatch`.
+
+    The file is written to a temporary file in the same directory and
+    then moved into place, so processes that already have *path* open
+    are not affected and never see a partially written index.
+
+    **Parameters:**
+
+    - *ref*: Array of reference coordinates. (Must be an Nx2 array).
+
+    - *path*: The path of the index file to write.
+
+    - *separation*: The minimum separation for objects in the
+      reference coordinate list.  `xyxymatch` must be called with the
+      same *separation* when using the index.  Default: 9.0
+
+    - *nmatch*, *tolerance*, *maxratio*: The parameters used to build
+      the triangle table.  The stored table is used by the
+      ``'triangles'`` algorithm when `xyxymatch` is called with the
+      same values, otherwise it is rebuilt from the stored unique
+      coordinates.  If *nmatch* is 0, no triangle table is stored.
+      Defaults: 30, 1.0, 10.0
+
+    **Returns:** A `ReferenceIndex` opened on the new file.
+    """
+    path = os.fspath(path)
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(
+        dir=directory, prefix='.' + os.path.basename(path), suffix='.tmp')
+    os.close(fd)
+    try:
+        _stimage.build_reference_index(
+            ref, tmp_path, separation, nmatch, tolerance, maxratio)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return ReferenceIndex(path)
+
+
+def open_reference_index(path):
+    """
+    Open a reference index file written by `build_reference_index`.
+
+    **Returns:** A `ReferenceIndex`.
+    """
+    return ReferenceIndex(path)
+
+
+class ReferenceIndex(object):
+    """
+    A read-only, memory-mapped reference index.
+
+    Pass it to `xyxymatch` as the *ref* argument.  The build
+    parameters are available as the *separation*, *nmatch*,
+    *tolerance* and *maxratio* attributes, and the sizes of the index
+    as *nref*, *nunique* and *ntriangles*.
+
+    The index can be used as a context manager, which closes it on
+    exit.  Arrays obtained from *ref* are views onto the mapping and
+    must be released before the index is closed.
+    """
+
+    def __init__(self, path):
+        self.path = os.fspath(path)
+        with open(self.path, 'rb') as fd:
+            self._mmap = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._info = _stimage.reference_index_info(self._mmap)
+        except BaseException:
+            self._mmap.close()
+            raise
+
+    def __getattr__(self, name):
+        info = self.__dict__.get('_info')
+        if info is not None and name in info:
+            return info[name]
+        raise AttributeError(name)
+
+    def __repr__(self):
+        return '<ReferenceIndex {0!r}: {1} coordinates, {2} unique, ' \
+            '{3} triangles>'.format(
+                self.path, self.nref, self.nunique, self.ntriangles)
+
+    def __len__(self):
+        return self.nref
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def closed(self):
+        return self._mmap.closed
+
+    @property
+    def buffer(self):
+        """The memory-mapped contents of the index file."""
+        return self._mmap
+
+    @property
+    def ref(self):
+        """
+        The reference coordinates, in their original order, as a
+        read-only Nx2 view onto the index.
+        """
+        return np.frombuffer(
+            self._mmap, dtype=np.float64, count=self.nref * 2,
+            offset=self.ref_offset).reshape((self.nref, 2))
+
+    def close(self):
+        """Unmap the index."""
+        self._mmap.close()
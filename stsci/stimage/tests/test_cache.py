@@ -0,0 +1,149 @@
+# Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+#     1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+
+#     2. Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+
+#     3. The name of AURA and its representatives may not be used to
+#       endorse or promote products derived from this software without
+#       specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+# USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+
+from __future__ import print_function
+import os
+
+import numpy as np
+
+import stsci.stimage as stimage
+
+
+def _coords():
+    np.random.seed(0)
+    ref = np.random.random((512, 2)) * 1024.0
+    input = ref * 1.001 + [2.0, -1.0] + np.random.normal(0.0, 0.01, ref.shape)
+    return input, ref
+
+
+def _assert_geomap_equal(a, b):
+    for name in ('fit_geometry', 'function', 'xxorder', 'xyorder',
+                 'xxterms', 'yxorder', 'yyorder', 'yxterms'):
+        assert getattr(a, name) == getattr(b, name)
+    for name in ('bbox', 'rms', 'mean_ref', 'mean_input', 'shift', 'mag',
+                 'rotation', 'xcoeff', 'ycoeff', 'x2coeff', 'y2coeff'):
+        np.testing.assert_array_equal(getattr(a, name), getattr(b, name))
+
+
+def test_memory():
+    input, ref = _coords()
+    cache = stimage.ResultCache()
+
+    expected = stimage.xyxymatch(input, ref, tolerance=5.0, separation=0.0)
+    first = stimage.xyxymatch(input, ref, tolerance=5.0, separation=0.0,
+                              cache=cache)
+    second = stimage.xyxymatch(input.copy(), ref.copy(), tolerance=5.0,
+                               separation=0.0, cache=cache)
+    assert (cache.hits, cache.misses) == (1, 1)
+    np.testing.assert_array_equal(first, expected)
+    np.testing.assert_array_equal(second, expected)
+
+    # Modifying a result doesn't modify the cache
+    second['ref_x'] = 0.0
+    third = stimage.xyxymatch(input, ref, tolerance=5.0, separation=0.0,
+                              cache=cache)
+    np.testing.assert_array_equal(third, expected)
+
+    # Any change to the arguments is a miss
+    stimage.xyxymatch(input, ref, tolerance=4.0, separation=0.0, cache=cache)
+    input[0, 0] += 1e-9
+    stimage.xyxymatch(input, ref, tolerance=5.0, separation=0.0, cache=cache)
+    assert (cache.hits, cache.misses) == (2, 3)
+    assert len(cache) == 3
+
+
+def test_geomap():
+    input, ref = _coords()
+    cache = stimage.ResultCache()
+
+    fit, output = stimage.geomap(input, ref, xxorder=3, cache=cache)
+    cached_fit, cached_output = stimage.geomap(input, ref, xxorder=3,
+                                               cache=cache)
+    assert (cache.hits, cache.misses) == (1, 1)
+    _assert_geomap_equal(cached_fit, fit)
+    np.testing.assert_array_equal(cached_output, output)
+
+
+def test_eviction():
+    input, ref = _coords()
+    nbytes = stimage.xyxymatch(input, ref, tolerance=5.0,
+                               separation=0.0).nbytes
+    cache = stimage.ResultCache(max_bytes=int(nbytes * 2.5))
+
+    for tolerance in (5.0, 6.0, 7.0):
+        stimage.xyxymatch(input, ref, tolerance=tolerance, separation=0.0,
+                          cache=cache)
+    assert len(cache) == 2
+    assert cache.nbytes <= cache.max_bytes
+
+    # The oldest one was dropped
+    stimage.xyxymatch(input, ref, tolerance=5.0, separation=0.0, cache=cache)
+    assert (cache.hits, cache.misses) == (0, 4)
+
+
+def test_disk(tmp_path):
+    input, ref = _coords()
+    directory = str(tmp_path / 'cache')
+
+    cache = stimage.ResultCache(directory=directory)
+    match = stimage.xyxymatch(input, ref, tolerance=5.0, separation=0.0,
+                              cache=cache)
+    fit, output = stimage.geomap(input, ref, cache=cache)
+    assert len(os.listdir(directory)) == 2
+
+    # A new cache, e.g. in another process, finds them on disk
+    cache = stimage.ResultCache(directory=directory)
+    np.testing.assert_array_equal(
+        stimage.xyxymatch(input, ref, tolerance=5.0, separation=0.0,
+                          cache=cache), match)
+    cached_fit, cached_output = stimage.geomap(input, ref, cache=cache)
+    _assert_geomap_equal(cached_fit, fit)
+    np.testing.assert_array_equal(cached_output, output)
+    assert (cache.hits, cache.disk_hits, cache.misses) == (2, 2, 0)
+
+    cache.clear()
+    assert len(cache) == 0
+    assert os.listdir(directory) == []
+
+
+def test_disk_eviction(tmp_path):
+    input, ref = _coords()
+    directory = tmp_path / 'cache'
+
+    cache = stimage.ResultCache(directory=str(directory))
+    stimage.xyxymatch(input, ref, tolerance=5.0, separation=0.0, cache=cache)
+    size, = [path.stat().st_size for path in directory.iterdir()]
+    cache.clear()
+
+    cache = stimage.ResultCache(directory=str(directory),
+                                max_disk_bytes=int(size * 1.5))
+    for tolerance in (5.0, 6.0):
+        stimage.xyxymatch(input, ref, tolerance=tolerance, separation=0.0,
+                          cache=cache)
+    assert len(list(directory.iterdir())) == 1
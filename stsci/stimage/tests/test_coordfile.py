@@ -0,0 +1,123 @@
+# Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+#     1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+
+#     2. Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+
+#     3. The name of AURA and its representatives may not be used to
+#       endorse or promote products derived from this software without
+#       specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+# USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+
+from __future__ import print_function
+
+import numpy as np
+import pytest
+
+import stsci.stimage as stimage
+
+
+def _write(tmp_path, text):
+    path = tmp_path / 'coords.coo'
+    path.write_bytes(text.encode('ascii'))
+    return str(path)
+
+
+def test_round_trip(tmp_path):
+    np.random.seed(0)
+    data = np.random.normal(0.0, 1e3, (1000, 3))
+    data[::7] *= 1e-300
+    path = str(tmp_path / 'coords.coo')
+
+    stimage.write_coords(path, data, columns=['x', 'y', 'mag'])
+
+    assert stimage.read_coords(path, (0, 1, 2)).tolist() == data.tolist()
+    np.testing.assert_array_equal(
+        stimage.read_coords(path, (2, 0)), data[:, [2, 0]])
+    np.testing.assert_array_equal(
+        stimage.read_coords(path, (0, 1, 2)), np.loadtxt(path))
+
+
+def test_format(tmp_path):
+    path = _write(
+        tmp_path,
+        "# x y\n"
+        "\n"
+        "  1.5   2   extra  # trailing comment\n"
+        "   # indented comment\n"
+        "-3e2\t+4.25e-1 1\n"
+        "INDEF 6\n"
+        "7 8")
+
+    result = stimage.read_coords(path)
+    assert result.shape == (4, 2)
+    np.testing.assert_array_equal(
+        result, [[1.5, 2.0], [-300.0, 0.425], [np.nan, 6.0], [7.0, 8.0]])
+
+
+def test_empty(tmp_path):
+    assert stimage.read_coords(_write(tmp_path, "")).shape == (0, 2)
+    assert stimage.read_coords(_write(tmp_path, "# x y\n\n")).shape == (0, 2)
+
+
+def test_errors(tmp_path):
+    with pytest.raises(ValueError, match="Line 2: expected at least 3"):
+        stimage.read_coords(_write(tmp_path, "1 2 3\n4 5\n"), (0, 2))
+
+    with pytest.raises(ValueError, match="Line 1: column 1 is not a number"):
+        stimage.read_coords(_write(tmp_path, "1 x\n"))
+
+
+def test_indef(tmp_path):
+    path = str(tmp_path / 'coords.coo')
+    data = np.array([[1.0, np.nan], [np.nan, 4.0]])
+
+    stimage.write_coords(path, data, header=False)
+
+    with open(path) as fd:
+        assert fd.read() == "1 INDEF\nINDEF 4\n"
+    np.testing.assert_array_equal(stimage.read_coords(path), data)
+
+
+def test_xyxymatch_and_geomap(tmp_path):
+    np.random.seed(0)
+    ref = np.random.random((64, 2)) * 1024.0
+    input = ref + [2.0, -1.0]
+    matches = stimage.xyxymatch(input, ref, tolerance=5.0, separation=0.0)
+    path = str(tmp_path / 'matches.match')
+
+    stimage.write_coords(path, matches)
+
+    with open(path) as fd:
+        assert fd.readline() == "# %s\n" % ' '.join(matches.dtype.names)
+    result = stimage.read_coords(path, (0, 1, 2, 3, 4, 5))
+    for i, name in enumerate(matches.dtype.names):
+        np.testing.assert_array_equal(result[:, i], matches[name])
+
+    fit, resids = stimage.geomap(input, ref)
+    stimage.write_coords(path, resids, columns=['input_x', 'fit_x'],
+                         header="input fit")
+
+    with open(path) as fd:
+        assert fd.readline() == "# input fit\n"
+    np.testing.assert_array_equal(
+        stimage.read_coords(path),
+        np.column_stack([resids['input_x'], resids['fit_x']]))
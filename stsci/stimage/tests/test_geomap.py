@@ -27,9 +27,36 @@
 # USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
 # DAMAGE.
 
+import asyncio
+import pickle
+
 import numpy as np
+import pytest
 import stsci.stimage as stimage
 
+
+def test_results():
+    np.random.seed(0)
+    ref = np.random.random((32, 2)) * 100.0
+    inp = ref + [1.5, -2.5]
+
+    result, output = stimage.geomap(inp, ref, fit_geometry='shift')
+
+    assert type(result).__name__ == 'GeomapResults'
+    assert result.fit_geometry == 'shift'
+    np.testing.assert_allclose(result.shift, [1.5, -2.5], atol=1e-8)
+    assert len(output) == 32
+
+
+def test_quiet(capfd):
+    np.random.seed(0)
+    ref = np.random.random((32, 2)) * 100.0
+
+    stimage.geomap(ref * 1.01 + [1.5, -2.5], ref, fit_geometry='general')
+
+    out, err = capfd.readouterr()
+    assert out == ''
+
 # def test_same():
 #     np.random.seed(0)
 #     x = np.random.random((512, 2))
@@ -42,5 +69,298 @@ import stsci.stimage as stimage
 
 #     assert False
 
+
+def _distorted(n=500):
+    np.random.seed(0)
+    ref = np.random.random((n, 2)) * [2048.0, 1024.0]
+    x, y = ref.T
+    input = np.empty_like(ref)
+    input[:, 0] = (3.0 + 1.01 * x + 0.02 * y + 1e-5 * x * x + 2e-5 * x * y +
+                   np.random.normal(0.0, 0.01, n))
+    input[:, 1] = (-2.0 - 0.01 * x + 0.99 * y + 1e-9 * y ** 3 +
+                   np.random.normal(0.0, 0.01, n))
+    return input, ref
+
+
+def test_linear():
+    np.random.seed(0)
+    ref = np.random.random((200, 2)) * 100.0
+    input = np.empty_like(ref)
+    input[:, 0] = 3.0 + 1.01 * ref[:, 0] + 0.02 * ref[:, 1]
+    input[:, 1] = -2.0 - 0.01 * ref[:, 0] + 0.99 * ref[:, 1]
+
+    fit, output = stimage.geomap(input, ref)
+
+    np.testing.assert_allclose(fit.xcoeff, [3.0, 1.01, 0.02], atol=1e-10)
+    np.testing.assert_allclose(fit.ycoeff, [-2.0, -0.01, 0.99], atol=1e-10)
+    assert np.all(fit.rms < 1e-10)
+    assert np.all(np.abs(output['resid_x']) < 1e-10)
+
+
+def test_auto_order():
+    input, ref = _distorted()
+
+    for function in ('polynomial', 'legendre', 'chebyshev'):
+        fit, output = stimage.geomap(
+            input, ref, function=function, order='auto', max_order=6)
+
+        assert (fit.xxorder, fit.xyorder, fit.xxterms) == (3, 3, 'half')
+        assert (fit.yxorder, fit.yyorder, fit.yxterms) == (4, 4, 'none')
+        np.testing.assert_allclose(fit.rms, 0.01, rtol=0.1)
+
+        explicit, _ = stimage.geomap(
+            input, ref, function=function,
+            xxorder=3, xyorder=3, xxterms='half',
+            yxorder=4, yyorder=4, yxterms='none')
+        np.testing.assert_allclose(fit.rms, explicit.rms)
+
+
+def test_auto_order_max_order():
+    input, ref = _distorted()
+
+    fit, output = stimage.geomap(input, ref, order='auto', max_order=3)
+
+    assert fit.yxorder == 3
+    assert fit.xxorder == 3
+
+
+def _assert_same_fit(a, b):
+    for name in ('fit_geometry', 'function', 'xxterms', 'yxterms',
+                 'xxorder', 'xyorder', 'yxorder', 'yyorder'):
+        assert getattr(a, name) == getattr(b, name)
+    for name in ('bbox', 'rms', 'mean_ref', 'mean_input', 'shift', 'mag',
+                 'rotation', 'xcoeff', 'ycoeff', 'x2coeff', 'y2coeff',
+                 'xgrid', 'ygrid'):
+        np.testing.assert_array_equal(getattr(a, name), getattr(b, name))
+
+
+def test_pickle():
+    input, ref = _distorted()
+    fit, output = stimage.geomap(
+        input, ref, function='legendre', xxorder=3, xyorder=3, yxorder=4,
+        yyorder=4)
+
+    for protocol in range(2, pickle.HIGHEST_PROTOCOL + 1):
+        _assert_same_fit(fit, pickle.loads(pickle.dumps(fit, protocol)))
+
+    if pickle.HIGHEST_PROTOCOL >= 5:
+        buffers = []
+        data = pickle.dumps(fit, 5, buffer_callback=buffers.append)
+        assert len(buffers) == 1
+        copy = pickle.loads(data, buffers=buffers)
+        _assert_same_fit(fit, copy)
+        assert np.shares_memory(copy.xcoeff, np.asarray(buffers[0]))
+
+
+def test_pickle_empty():
+    empty = stimage.GeomapResults()
+    assert empty.fit_geometry == 'general'
+    assert empty.function == 'polynomial'
+    assert empty.bbox.shape == (4,)
+
+    for protocol in range(2, pickle.HIGHEST_PROTOCOL + 1):
+        _assert_same_fit(empty, pickle.loads(pickle.dumps(empty, protocol)))
+    _assert_same_fit(
+        empty, stimage.GeomapResults.frombuffer(empty.tobytes()))
+
+
+def test_frombuffer():
+    input, ref = _distorted()
+    fit, output = stimage.geomap(input, ref, xxorder=3, xyorder=3)
+
+    data = fit.tobytes()
+    view = stimage.GeomapResults.frombuffer(data)
+    _assert_same_fit(fit, view)
+    assert not view.xcoeff.flags.writeable
+
+    buffer = bytearray(data)
+    view = stimage.GeomapResults.frombuffer(buffer)
+    view.xcoeff[0] += 1.0
+    assert stimage.GeomapResults.frombuffer(buffer).xcoeff[0] == view.xcoeff[0]
+
+    with pytest.raises(ValueError):
+        stimage.GeomapResults.frombuffer(data[:len(data) // 2])
+    with pytest.raises(ValueError):
+        stimage.GeomapResults.frombuffer(b'NOTGEOMA' + data[8:])
+
+
+def _wavy(n):
+    rng = np.random.RandomState(2)
+    ref = rng.random_sample((n, 2)) * 2048.0
+    x, y = ref.T
+    input = np.empty_like(ref)
+    input[:, 0] = (3.0 + 1.01 * x + 0.02 * y +
+                   0.3 * np.sin(x / 300.0) * np.cos(y / 250.0))
+    input[:, 1] = (-2.0 - 0.01 * x + 0.99 * y +
+                   0.2 * np.cos(x / 200.0 + y / 400.0))
+    return input, ref
+
+
+def test_grid():
+    input, ref = _wavy(5000)
+
+    linear, _ = stimage.geomap(input, ref, xxterms='none', yxterms='none')
+    fit, output = stimage.geomap(
+        input, ref, xxterms='none', yxterms='none', grid=(24, 16))
+
+    assert fit.xgrid.shape == fit.ygrid.shape == (19, 27)
+    assert np.all(fit.rms < linear.rms / 20.0)
+    np.testing.assert_allclose(
+        output['resid_x'], output['input_x'] - output['fit_x'])
+
+    # The grid is part of the solution wherever it is evaluated
+    test_input, test_ref = _wavy(1000)
+    np.testing.assert_allclose(fit.evaluate(test_ref), test_input, atol=0.02)
+    np.testing.assert_allclose(
+        fit.evaluate(ref), np.c_[output['fit_x'], output['fit_y']],
+        atol=1e-8)
+
+    # And survives packing
+    _assert_same_fit(fit, pickle.loads(pickle.dumps(fit)))
+    copy = stimage.GeomapResults.frombuffer(fit.tobytes())
+    _assert_same_fit(fit, copy)
+    np.testing.assert_array_equal(copy.evaluate(ref), fit.evaluate(ref))
+
+    # A smoother grid follows the distortion less closely
+    smooth, _ = stimage.geomap(
+        input, ref, xxterms='none', yxterms='none', grid=24,
+        grid_smoothing=100.0)
+    assert smooth.xgrid.shape == (27, 27)
+    assert np.all(smooth.rms > fit.rms)
+
+    assert linear.xgrid.size == 0
+    with pytest.raises(ValueError):
+        stimage.geomap(input, ref, grid=(0, 4))
+    with pytest.raises(ValueError, match='whole number'):
+        stimage.geomap(input, ref, grid=2.5)
+    with pytest.raises(ValueError, match='whole number'):
+        stimage.geomap(input, ref, grid=(4, 1.5))
+    with pytest.raises(RuntimeError, match='too large'):
+        stimage.geomap(input, ref, grid=(2 ** 31, 2 ** 31))
+    with pytest.raises(RuntimeError, match=r'\d{15,} bytes'):
+        stimage.geomap(input, ref, grid=(100000, 100000))
+    with pytest.raises(RuntimeError):
+        stimage.geomap(input, ref, grid=4, grid_smoothing=-1.0)
+
+
+def _exposures(nexposure=8, nsource=300, geometry='rscale', noise=0.0):
+    # Sources on a sky wider than any one exposure, each exposure
+    # seeing those within its footprint
+    rng = np.random.RandomState(1)
+    sky = rng.random_sample((nsource, 2)) * 3000.0
+    coords, groups, truth = [], [], []
+    for k in range(nexposure):
+        center = np.array([1000.0 + 150.0 * k, 1500.0 - 100.0 * k])
+        if k == 0:
+            matrix, shift = np.eye(2), np.zeros(2)
+        else:
+            angle = np.radians(0.5 * k)
+            c, s = np.cos(angle), np.sin(angle)
+            if geometry == 'rscale':
+                mag = 1.0 + 0.001 * k
+                matrix = mag * np.array([[c, s], [-s, c]])
+            else:
+                matrix = np.array([[1.0 + 0.002 * k, 0.01 * k, ],
+                                   [-0.005 * k, 0.99 + 0.001 * k]])
+            shift = np.array([20.0 * k, -10.0 * k])
+        seen = np.all(np.abs(sky - center) < 1000.0, axis=1)
+        coord = sky[seen].dot(matrix.T) + shift
+        coord += rng.normal(0.0, noise, coord.shape)
+        group = np.flatnonzero(seen)
+        # Matched source ids need not be contiguous, and some
+        # observations are unmatched
+        coords.append(np.vstack([coord, [[5.0, 5.0]]]))
+        groups.append(np.append(group * 3 + 7, -1))
+        truth.append((shift, matrix))
+    return coords, groups, truth
+
+
+def test_joint():
+    for geometry in ('rscale', 'general'):
+        coords, groups, truth = _exposures(geometry=geometry)
+
+        fits, outputs = stimage.geomap_joint(
+            coords, groups, fit_geometry=geometry)
+
+        assert len(fits) == len(outputs) == len(coords)
+        for fit, output, coord, (shift, matrix) in zip(
+                fits, outputs, coords, truth):
+            assert fit.fit_geometry == geometry
+            np.testing.assert_allclose(
+                fit.xcoeff, [shift[0], matrix[0, 0], matrix[0, 1]],
+                atol=1e-8)
+            np.testing.assert_allclose(
+                fit.ycoeff, [shift[1], matrix[1, 0], matrix[1, 1]],
+                atol=1e-8)
+            assert np.all(fit.rms < 1e-8)
+
+            assert len(output) == len(coord)
+            np.testing.assert_array_equal(output['input_x'], coord[:, 0])
+            # Sources seen in only this exposure have no residual
+            resid = output['resid_x'][:-1]
+            assert np.sum(np.isfinite(resid)) > len(resid) // 2
+            assert np.nanmax(np.abs(resid)) < 1e-8
+            assert np.isnan(output[-1]['ref_x'])
+            assert np.isnan(output[-1]['resid_y'])
+
+
+def test_joint_reject():
+    coords, groups, truth = _exposures(noise=0.01)
+    coords[3][10] += 5.0
+
+    fits, outputs = stimage.geomap_joint(
+        coords, groups, fit_geometry='rscale', maxiter=3, reject=3.0)
+
+    assert np.isnan(outputs[3]['resid_x'][10])
+    np.testing.assert_allclose(fits[3].rms, 0.01, rtol=0.2)
+    shift, matrix = truth[3]
+    np.testing.assert_allclose(fits[3].xcoeff[0], shift[0], atol=0.01)
+
+
+def test_joint_errors():
+    coords, groups, truth = _exposures()
+
+    with pytest.raises(ValueError):
+        stimage.geomap_joint(coords, groups[:-1])
+    with pytest.raises(ValueError):
+        stimage.geomap_joint(coords, groups, reference=len(coords))
+
+    # An exposure sharing no sources with the others
+    groups[2] = np.arange(len(groups[2])) + 100000
+    with pytest.raises(RuntimeError):
+        stimage.geomap_joint(coords, groups)
+
+
+def test_progress():
+    input, ref = _distorted()
+    input[:10] += 1.0
+    calls = []
+
+    expected, _ = stimage.geomap(input, ref, maxiter=3, reject=3.0)
+    fit, output = stimage.geomap(
+        input, ref, maxiter=3, reject=3.0,
+        progress=lambda *args: calls.append(args))
+    _assert_same_fit(fit, expected)
+    assert calls[0] == ('geo_fit_reject', 0, 3)
+
+    class Stop(Exception):
+        pass
+
+    def stop(stage, done, total):
+        raise Stop()
+
+    with pytest.raises(Stop):
+        stimage.geomap(input, ref, maxiter=3, reject=3.0, progress=stop)
+
+
+def test_geomap_async():
+    input, ref = _distorted()
+
+    expected, _ = stimage.geomap(input, ref, xxorder=3, xyorder=3)
+    fit, output = asyncio.run(
+        stimage.geomap_async(input, ref, xxorder=3, xyorder=3))
+    _assert_same_fit(fit, expected)
+
+
 if __name__ == '__main__':
     test_same()
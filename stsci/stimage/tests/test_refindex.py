@@ -0,0 +1,92 @@
+# Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+
+#     1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+
+#     2. Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+
+#     3. The name of AURA and its representatives may not be used to
+#       endorse or promote products derived from this software without
+#       specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+# USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+
+from __future__ import print_function
+import numpy as np
+import pytest
+
+import stsci.stimage as stimage
+
+
+def test_build_and_open(tmp_path):
+    np.random.seed(0)
+    ref = np.random.random((256, 2))
+    path = str(tmp_path / 'ref.idx')
+
+    with stimage.build_reference_index(ref, path, separation=0.0,
+                                       nmatch=20, tolerance=0.001) as index:
+        assert index.nref == 256
+        assert index.nunique == 256
+        assert index.ntriangles > 0
+        assert index.separation == 0.0
+        assert index.nmatch == 20
+        r = index.ref
+        np.testing.assert_array_equal(r, ref)
+        del r
+
+    with stimage.open_reference_index(path) as index:
+        assert len(index) == 256
+
+
+@pytest.mark.parametrize('algorithm', ['tolerance', 'triangles'])
+def test_xyxymatch_with_index(tmp_path, algorithm):
+    np.random.seed(0)
+    ref = np.random.random((512, 2))
+    input = ref + [0.0001, -0.0002]
+    path = str(tmp_path / 'ref.idx')
+    kwargs = dict(algorithm=algorithm, tolerance=0.001, separation=0.0,
+                  nmatch=20, maxratio=10.0, nreject=10)
+
+    stimage.build_reference_index(
+        ref, path, separation=0.0, nmatch=20, tolerance=0.001,
+        maxratio=10.0).close()
+
+    expected = stimage.xyxymatch(input, ref, **kwargs)
+    with stimage.open_reference_index(path) as index:
+        result = stimage.xyxymatch(input, index, **kwargs)
+
+    assert len(result) > 0
+    np.testing.assert_array_equal(result, expected)
+
+
+def test_separation_mismatch(tmp_path):
+    ref = np.random.random((64, 2))
+    path = str(tmp_path / 'ref.idx')
+
+    with stimage.build_reference_index(ref, path, separation=0.0) as index:
+        with pytest.raises(RuntimeError):
+            stimage.xyxymatch(ref, index, separation=1.0)
+
+
+def test_not_an_index(tmp_path):
+    path = tmp_path / 'bad.idx'
+    path.write_bytes(b'\0' * 4096)
+
+    with pytest.raises(ValueError):
+        stimage.open_reference_index(str(path))
@@ -29,7 +29,12 @@
 
 from __future__ import print_function
 
+import asyncio
+import concurrent.futures
+import time
+
 import numpy as np
+import pytest
 import stsci.stimage as stimage
 
 def test_same():
@@ -73,3 +78,251 @@ def test_different():
         assert r['ref_idx'][i] < 512
 
 
+
+def test_float32():
+    np.random.seed(0)
+    x = (np.random.random((512, 2)) * 512.0).astype(np.float32)
+    y = (np.random.random((512, 2)) * 512.0).astype(np.float32)
+
+    r64 = stimage.xyxymatch(x, y, algorithm='tolerance', tolerance=5.0,
+                            separation=0.0)
+    r32 = stimage.xyxymatch(x, y, algorithm='tolerance', tolerance=5.0,
+                            separation=0.0, dtype=np.float32)
+
+    assert r32.dtype == r64.dtype
+    assert len(r32) == len(r64) and len(r32) > 0
+    assert np.all(r32 == r64)
+
+def test_nthreads():
+    np.random.seed(0)
+    x = np.random.random((20000, 2)) * 1024.0
+    y = x + np.random.normal(0.0, 0.2, size=x.shape)
+
+    for dtype in (np.float64, np.float32):
+        expected = stimage.xyxymatch(x, y, algorithm='tolerance',
+                                     tolerance=0.5, separation=0.0,
+                                     dtype=dtype)
+        assert len(expected) > 0
+        for nthreads in (2, 3, 8):
+            r = stimage.xyxymatch(x, y, algorithm='tolerance',
+                                  tolerance=0.5, separation=0.0,
+                                  dtype=dtype, nthreads=nthreads)
+            assert np.all(r == expected)
+
+def test_transform():
+    np.random.seed(0)
+    ref = np.random.random((2000, 2)) * 2048.0
+    u, v = (ref / 1024.0 - 1.0).T
+    input = np.empty_like(ref)
+    input[:, 0] = 5.0 + 1.001 * ref[:, 0] + 3.0 * u * u + 1.5 * u * v
+    input[:, 1] = -3.0 + 0.999 * ref[:, 1] + 2.5 * v ** 3 + u * u
+    input += np.random.normal(0.0, 0.01, size=input.shape)
+
+    for function in ('polynomial', 'legendre', 'chebyshev'):
+        fit, _ = stimage.geomap(input, ref, function=function,
+                                xxorder=4, xyorder=4, yxorder=4, yyorder=4)
+
+        r = stimage.xyxymatch(input, ref, tolerance=0.1, separation=0.0,
+                              transform=fit)
+        assert len(r) == len(ref)
+        assert np.all(r['input_idx'] == r['ref_idx'])
+        assert np.all(r['input_x'] == input[r['input_idx'], 0])
+        assert np.all(r['input_y'] == input[r['input_idx'], 1])
+
+    # The linear part alone is not enough at this tolerance
+    r = stimage.xyxymatch(input, ref, tolerance=0.1, separation=0.0)
+    assert len(r) < len(ref) // 10
+
+def test_transform_unconverged():
+    np.random.seed(0)
+    ref = np.random.random((500, 2)) * 2048.0
+    u, v = (ref / 1024.0 - 1.0).T
+    input = np.empty_like(ref)
+    input[:, 0] = 5.0 + 1.001 * ref[:, 0] + 3.0 * u * u + 1.5 * u * v
+    input[:, 1] = -3.0 + 0.999 * ref[:, 1] + 2.5 * v ** 3 + u * u
+    fit, _ = stimage.geomap(input, ref, xxorder=4, xyorder=4, yxorder=4,
+                            yyorder=4)
+
+    # The distortion terms dominate far outside the fit
+    far = np.array([[1e5, -1e5], [2e5, -2e5]])
+    with pytest.warns(RuntimeWarning, match='2 of 502 input coordinates'):
+        r = stimage.xyxymatch(np.vstack([input, far]), ref, tolerance=0.1,
+                              separation=0.0, transform=fit)
+    assert len(r) == len(ref)
+
+def _rotated(n, seed):
+    np.random.seed(seed)
+    ref = np.random.random((n, 2)) * 2048.0
+    theta = 0.5
+    rotation = np.array([[np.cos(theta), -np.sin(theta)],
+                         [np.sin(theta), np.cos(theta)]])
+    input = (np.dot(ref, rotation.T) * 1.02 + [5.0, -7.0] +
+             np.random.normal(0.0, 0.05, size=ref.shape))
+    keep = np.nonzero(np.random.random(n) > 0.2)[0]
+    input = np.vstack([input[keep], np.random.random((n // 10, 2)) * 2048.0])
+    return input, ref, keep
+
+def test_triangles_subset():
+    # The second pass over the matched subset used to index the vote
+    # table past its end
+    input, ref, keep = _rotated(60, 5)
+
+    for nmatch in (10, 30, 60):
+        r = stimage.xyxymatch(input, ref, algorithm='triangles',
+                              tolerance=3.0, separation=0.0, nmatch=nmatch)
+        assert np.all(r['input_idx'] < len(keep))
+        assert np.all(keep[r['input_idx']] == r['ref_idx'])
+
+def test_estimate_cost():
+    small = stimage.estimate_xyxymatch_cost(
+        10000, 10000, algorithm='triangles', nmatch=30)
+    large = stimage.estimate_xyxymatch_cost(
+        10000, 10000, algorithm='triangles', nmatch=200)
+    assert small['nmatch'] == 30
+    assert small['peak_memory'] < large['peak_memory']
+    assert small['work'] < large['work']
+
+    tolerance = stimage.estimate_xyxymatch_cost(10000, 10000)
+    assert tolerance['peak_memory'] < small['peak_memory']
+
+    # Sizes often come from numpy, such as arr.shape[0] or np.sum
+    numpy_sizes = stimage.estimate_xyxymatch_cost(
+        np.int64(10000), np.sum(np.ones(10000, dtype=np.int32)),
+        algorithm='triangles', nmatch=30)
+    assert numpy_sizes == small
+
+    limited = stimage.estimate_xyxymatch_cost(
+        10000, 10000, algorithm='triangles', nmatch=200,
+        memory_limit=large['peak_memory'] // 4)
+    assert 30 < limited['nmatch'] < 200
+    assert limited['peak_memory'] <= large['peak_memory'] // 4
+    above = stimage.estimate_xyxymatch_cost(
+        10000, 10000, algorithm='triangles', nmatch=limited['nmatch'] + 1)
+    assert above['peak_memory'] > large['peak_memory'] // 4
+
+    with pytest.raises(MemoryError, match=r'memory_limit \(1000 bytes\)'):
+        stimage.estimate_xyxymatch_cost(
+            10000, 10000, algorithm='triangles', memory_limit=1000)
+
+def test_estimate_cost_growth():
+    # The merge compares each reference triangle with a fixed fraction
+    # of the input triangles, so the estimated work grows as about the
+    # sixth power of nmatch
+    input, ref, keep = _rotated(200, 1)
+
+    small = stimage.estimate_xyxymatch_cost(
+        input, ref, algorithm='triangles', nmatch=25)
+    large = stimage.estimate_xyxymatch_cost(
+        input, ref, algorithm='triangles', nmatch=45)
+    expected = (45.0 / 25.0) ** 6
+    assert abs(large['work'] / small['work'] / expected - 1.0) < 0.25
+
+def test_memory_limit():
+    input, ref, keep = _rotated(200, 1)
+
+    cost = stimage.estimate_xyxymatch_cost(
+        input, ref, algorithm='triangles', nmatch=40)
+    limit = stimage.estimate_xyxymatch_cost(
+        input, ref, algorithm='triangles', nmatch=200,
+        memory_limit=cost['peak_memory'])
+    assert limit['nmatch'] == 40
+
+    expected = stimage.xyxymatch(input, ref, algorithm='triangles',
+                                 tolerance=3.0, separation=0.0, nmatch=40)
+    r = stimage.xyxymatch(input, ref, algorithm='triangles', tolerance=3.0,
+                          separation=0.0, nmatch=200,
+                          memory_limit=cost['peak_memory'])
+    assert np.all(r == expected)
+
+def test_progress():
+    input, ref, keep = _rotated(200, 1)
+    calls = []
+
+    expected = stimage.xyxymatch(input, ref, algorithm='triangles',
+                                 tolerance=3.0, separation=0.0, nmatch=40)
+    r = stimage.xyxymatch(input, ref, algorithm='triangles', tolerance=3.0,
+                          separation=0.0, nmatch=40,
+                          progress=lambda *args: calls.append(args))
+    assert np.all(r == expected)
+
+    # The first poll always calls back
+    assert calls[0][0] == 'find_triangles'
+    for stage, done, total in calls:
+        assert stage in ('find_triangles', 'merge_triangles',
+                         'reject_triangles')
+        assert done < total
+
+def test_progress_cancel():
+    input, ref, keep = _rotated(200, 1)
+
+    class Stop(Exception):
+        pass
+
+    def stop(stage, done, total):
+        raise Stop('stopped in {0}'.format(stage))
+
+    with pytest.raises(Stop, match='stopped in find_triangles'):
+        stimage.xyxymatch(input, ref, algorithm='triangles', nmatch=40,
+                          progress=stop)
+
+    with pytest.raises(TypeError, match='progress must be callable'):
+        stimage.xyxymatch(input, ref, progress=1)
+
+def test_progress_cancel_merge():
+    # Each reference triangle searches a ratio window that grows with
+    # the lists, so the merge has to poll on the comparisons it makes,
+    # rather than once every 4096 reference triangles
+    input, ref, keep = _rotated(400, 1)
+    done = []
+
+    class Stop(Exception):
+        pass
+
+    def stop(stage, n, total):
+        if stage == 'merge_triangles':
+            done.append(n)
+            if len(done) == 4:
+                raise Stop()
+
+    with pytest.raises(Stop):
+        stimage.xyxymatch(input, ref, algorithm='triangles', nmatch=150,
+                          progress=stop)
+    assert np.all(np.diff(done) < 4096)
+
+def test_xyxymatch_async():
+    input, ref, keep = _rotated(200, 1)
+    calls = []
+
+    expected = stimage.xyxymatch(input, ref, algorithm='triangles',
+                                 tolerance=3.0, separation=0.0, nmatch=40)
+    r = asyncio.run(stimage.xyxymatch_async(
+        input, ref, algorithm='triangles', tolerance=3.0, separation=0.0,
+        nmatch=40, progress=lambda *args: calls.append(args)))
+    assert np.all(r == expected)
+    assert len(calls) > 0
+
+def test_xyxymatch_async_timeout():
+    # Runs for minutes unless cancelled
+    input, ref, keep = _rotated(400, 1)
+    executor = concurrent.futures.ThreadPoolExecutor(1)
+
+    async def match():
+        await asyncio.wait_for(
+            stimage.xyxymatch_async(input, ref, algorithm='triangles',
+                                    nmatch=200, executor=executor),
+            0.1)
+
+    start = time.time()
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(match())
+    executor.shutdown(wait=True)
+    assert time.time() - start < 10.0
+
+def test_xyxymatch_async_process_executor():
+    # The progress and cancellation hooks only work within the process
+    input, ref, keep = _rotated(50, 1)
+    executor = concurrent.futures.ProcessPoolExecutor(1)
+
+    with pytest.raises(TypeError, match='ThreadPoolExecutor'):
+        asyncio.run(stimage.xyxymatch_async(input, ref, executor=executor))
+    executor.shutdown(wait=True)
@@ -8,14 +8,24 @@ import pytest
 ROOT = os.path.relpath(os.path.join('build', 'test_c'))
 TESTS = [
     'test_cholesky',
-    # 'test_geomap',  # FIXME: died with Signals.SIGABRT 6
+    'test_geomap',
+    'test_geomap_grid',
+    'test_geomap_invert',
+    'test_geomap_joint',
+    'test_geomap_order',
+    'test_geomap_pack',
     'test_lintransform',
+    'test_radixsort',
+    'test_refindex',
     'test_surface',
+    'test_surface_basis',
     'test_triangles',
     'test_xycoincide',
+    'test_xysoa',
     'test_xysort',
     'test_xyxymatch',
-    'test_xyxymatch_triangles'
+    'test_xyxymatch_triangles',
+    'test_xyxymatchf'
 ]
 
 
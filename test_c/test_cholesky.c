@@ -1,9 +1,90 @@
 #include <assert.h>
+#include <math.h>
 #include <stdio.h>
 #include <stdlib.h>
 
 #include "surface/cholesky.h"
 
+#define NROWS 7
+#define NBANDS 3
+
+/* Factor and solve a symmetric positive definite banded system with a
+   known solution.  The band is stored as matrix[row * nbands + j] =
+   A[row][row + j]. */
+static int
+check(const size_t nrows, const size_t nbands) {
+    double              matrix[NROWS * NBANDS];
+    double              matfac[NROWS * NBANDS];
+    double              full[NROWS][NROWS];
+    double              x[NROWS];
+    double              b[NROWS];
+    double              coeff[NROWS];
+    surface_fit_error_e error_type = surface_fit_error_ok;
+    stimage_error_t     error;
+    size_t              i, j;
+
+    stimage_error_init(&error);
+
+    for (i = 0; i < nrows; ++i) {
+        for (j = 0; j < nrows; ++j) {
+            full[i][j] = 0.0;
+        }
+    }
+
+    for (i = 0; i < nrows; ++i) {
+        for (j = 0; j < nbands; ++j) {
+            if (i + j < nrows) {
+                matrix[i * nbands + j] = j == 0 ? 10.0 + i : 1.0 + i + j;
+                full[i][i + j] = full[i + j][i] = matrix[i * nbands + j];
+            } else {
+                matrix[i * nbands + j] = 0.0;
+            }
+        }
+        x[i] = 1.0 + 0.5 * i;
+    }
+
+    for (i = 0; i < nrows; ++i) {
+        b[i] = 0.0;
+        for (j = 0; j < nrows; ++j) {
+            b[i] += full[i][j] * x[j];
+        }
+    }
+
+    if (cholesky_factorization(
+                nbands, nrows, matrix, matfac, &error_type, &error) ||
+        cholesky_solve(nbands, nrows, matfac, b, coeff, &error)) {
+        printf("%s\n", stimage_error_get_message(&error));
+        return 1;
+    }
+
+    if (error_type != surface_fit_error_ok) {
+        printf("nrows %lu nbands %lu: reported singular\n",
+               (unsigned long)nrows, (unsigned long)nbands);
+        return 1;
+    }
+
+    for (i = 0; i < nrows; ++i) {
+        if (fabs(coeff[i] - x[i]) > 1e-10) {
+            printf("nrows %lu nbands %lu: coeff %lu is %g, expected %g\n",
+                   (unsigned long)nrows, (unsigned long)nbands,
+                   (unsigned long)i, coeff[i], x[i]);
+            return 1;
+        }
+    }
+
+    return 0;
+}
+
 int main(int argv, char** argc) {
+    size_t nrows, nbands;
+
+    for (nrows = 1; nrows <= NROWS; ++nrows) {
+        for (nbands = 1; nbands <= NBANDS; ++nbands) {
+            if (check(nrows, nbands)) {
+                return 1;
+            }
+        }
+    }
+
     return 0;
 }
@@ -1,99 +1,327 @@
 #include <assert.h>
+#define _USE_MATH_DEFINES       /* needed for MS Windows to define M_PI */
+#include <math.h>
 #include <stdio.h>
 #include <stdlib.h>
 
 #include "immatch/geomap.h"
 
-int
-main(int argc, char** argv) {
-    #define ncoords 64
-    coord_t ref[ncoords];
-    coord_t input[ncoords];
-    bbox_t bbox;
-    geomap_output_t output[ncoords];
-    size_t noutput = ncoords;
-    geomap_result_t result;
+#define NCOORDS 64
+
+/* Reference coordinates spread over a box away from the origin */
+static void
+make_ref(
+        coord_t* const ref) {
+
+    size_t i;
+
+    srand48(0);
+    for (i = 0; i < NCOORDS; ++i) {
+        ref[i].x = 100.0 + drand48() * 100.0;
+        ref[i].y = -50.0 + drand48() * 200.0;
+    }
+}
+
+/* Run geomap over the whole set of coordinates */
+static int
+fit(
+        const char* const name,
+        const coord_t* const input,
+        const coord_t* const ref,
+        const geomap_fit_e fit_geometry,
+        const surface_type_e function,
+        const size_t order,
+        const xterms_e xterms,
+        const size_t maxiter,
+        const double reject,
+        /* Output */
+        geomap_output_t* const output,
+        geomap_result_t* const result) {
+
+    bbox_t          bbox;
+    size_t          noutput = NCOORDS;
     stimage_error_t error;
-    size_t i = 0;
-    int status = 1;
 
     stimage_error_init(&error);
     bbox_init(&bbox);
-    geomap_result_init(&result);
 
-    /* TEST 1 */
+    if (geomap(
+                NCOORDS, input, NCOORDS, ref, &bbox, fit_geometry, function,
+                order, order, order, order, xterms, xterms, maxiter, reject,
+                &noutput, output, result, &error)) {
+        printf("%s: %s\n", name, stimage_error_get_message(&error));
+        return 1;
+    }
 
-    srand48(0);
+    if (noutput != NCOORDS) {
+        printf("%s: %lu outputs, expected %d\n",
+               name, (unsigned long)noutput, NCOORDS);
+        return 1;
+    }
+
+    return 0;
+}
+
+/* Fit data that the requested geometry describes exactly, and check
+   that the fit reproduces the input coordinates */
+static int
+check_exact(
+        const char* const name,
+        const coord_t* const input,
+        const coord_t* const ref,
+        const geomap_fit_e fit_geometry,
+        const surface_type_e function,
+        const size_t order,
+        const xterms_e xterms) {
+
+    geomap_output_t output[NCOORDS];
+    geomap_result_t result;
+    size_t          i;
+    int             status = 1;
+
+    geomap_result_init(&result);
+
+    if (fit(name, input, ref, fit_geometry, function, order, xterms, 0, 0.0,
+            output, &result)) {
+        goto exit;
+    }
 
-    for (i = 0; i < ncoords; ++i) {
-        ref[i].x = input[i].x = drand48();
-        ref[i].y = input[i].y = drand48();
+    for (i = 0; i < NCOORDS; ++i) {
+        if (!(fabs(output[i].fit.x - input[i].x) < 1e-6) ||
+            !(fabs(output[i].fit.y - input[i].y) < 1e-6)) {
+            printf("%s: point %lu fit to (%g, %g), expected (%g, %g)\n",
+                   name, (unsigned long)i, output[i].fit.x, output[i].fit.y,
+                   input[i].x, input[i].y);
+            goto exit;
+        }
     }
 
-    status = geomap(
-            ncoords, input,
-            ncoords, ref,
-            &bbox,
-            geomap_fit_general,
-            surface_type_polynomial,
-            2, 2, 2, 2,
-            xterms_half, xterms_half,
-            0, 0,
-            &noutput, output,
-            &result,
-            &error);
-    geomap_result_print(&result);
+    status = 0;
+
+ exit:
     geomap_result_free(&result);
 
-    /* TEST 2: SHIFT */
-    srand48(0);
+    return status;
+}
+
+/* A general fit of a distortion with cross terms and a different
+   shape in x and y */
+static int
+check_general(
+        const surface_type_e function) {
+
+    coord_t ref[NCOORDS];
+    coord_t input[NCOORDS];
+    size_t  i;
+
+    make_ref(ref);
+    for (i = 0; i < NCOORDS; ++i) {
+        input[i].x = 2.0 + 1.1 * ref[i].x + 0.2 * ref[i].y +
+            1e-3 * ref[i].x * ref[i].x;
+        input[i].y = -1.0 + 0.1 * ref[i].x + 0.9 * ref[i].y +
+            2e-4 * ref[i].x * ref[i].y;
+    }
+
+    return check_exact(
+            "general", input, ref, geomap_fit_general, function, 3,
+            xterms_half);
+}
+
+/* Transform the reference coordinates with a shift, a rotation of
+   theta degrees and separate x and y magnifications */
+static void
+make_linear(
+        const coord_t* const ref,
+        const double xmag,
+        const double ymag,
+        const double theta,
+        /* Output */
+        coord_t* const input) {
+
+    const double t = theta * M_PI / 180.0;
+    size_t       i;
 
-    for (i = 0; i < ncoords; ++i) {
-        ref[i].x = drand48();
-        ref[i].y = drand48();
-        input[i].x = ref[i].x + 1.5;
-        input[i].y = ref[i].y + 1.25;
+    for (i = 0; i < NCOORDS; ++i) {
+        input[i].x = 5.0 + xmag * cos(t) * ref[i].x + ymag * sin(t) * ref[i].y;
+        input[i].y = -3.0 - xmag * sin(t) * ref[i].x + ymag * cos(t) * ref[i].y;
     }
+}
+
+/* Fit each of the restricted geometries to data it describes exactly */
+static int
+check_linear(
+        const surface_type_e function) {
+
+    coord_t ref[NCOORDS];
+    coord_t input[NCOORDS];
+
+    make_ref(ref);
+
+    make_linear(ref, 1.0, 1.0, 0.0, input);
+    if (check_exact(
+                "shift", input, ref, geomap_fit_shift, function, 2,
+                xterms_none)) return 1;
+
+    make_linear(ref, 1.0, 1.0, 30.0, input);
+    if (check_exact(
+                "rotate", input, ref, geomap_fit_rotate, function, 2,
+                xterms_none)) return 1;
 
-    status = geomap(
-            ncoords, input,
-            ncoords, ref,
-            &bbox,
-            geomap_fit_shift,
-            surface_type_polynomial,
-            2, 2, 2, 2,
-            xterms_none, xterms_none,
-            0, 0,
-            &noutput, output,
-            &result,
-            &error);
-    geomap_result_print(&result);
+    make_linear(ref, 1.4, 1.4, 30.0, input);
+    if (check_exact(
+                "rscale", input, ref, geomap_fit_rscale, function, 2,
+                xterms_none)) return 1;
+
+    make_linear(ref, 1.5, 0.8, 30.0, input);
+    if (check_exact(
+                "rxyscale", input, ref, geomap_fit_rxyscale, function, 2,
+                xterms_none)) return 1;
+
+    return 0;
+}
+
+/* Check the shift, magnification and rotation derived from the
+   coefficients of a general linear fit */
+static int
+check_coeff(
+        const surface_type_e function) {
+
+    coord_t         ref[NCOORDS];
+    coord_t         input[NCOORDS];
+    geomap_output_t output[NCOORDS];
+    geomap_result_t result;
+    int             status = 1;
+
+    geomap_result_init(&result);
+    make_ref(ref);
+    make_linear(ref, 1.5, 0.8, 30.0, input);
+
+    if (fit("coeff", input, ref, geomap_fit_general, function, 2, xterms_none,
+            0, 0.0, output, &result)) {
+        goto exit;
+    }
+
+    if (!(fabs(result.shift.x - 5.0) < 1e-6) ||
+        !(fabs(result.shift.y + 3.0) < 1e-6) ||
+        !(fabs(result.mag.x - 1.5) < 1e-6) ||
+        !(fabs(result.mag.y - 0.8) < 1e-6) ||
+        !(fabs(result.rotation.x - 30.0) < 1e-6) ||
+        !(fabs(result.rotation.y - 30.0) < 1e-6)) {
+        printf("function %d: shift (%g, %g), mag (%g, %g), "
+               "rotation (%g, %g)\n",
+               function, result.shift.x, result.shift.y,
+               result.mag.x, result.mag.y,
+               result.rotation.x, result.rotation.y);
+        goto exit;
+    }
+
+    status = 0;
+
+ exit:
     geomap_result_free(&result);
 
-    /* /\* TEST 3: SCALE *\/ */
-    /* srand48(0); */
-
-    /* for (i = 0; i < ncoords; ++i) { */
-    /*     ref[i].x = drand48(); */
-    /*     ref[i].y = drand48(); */
-    /*     input[i].x = ref[i].x * 5.5; */
-    /*     input[i].y = ref[i].y * 1.25; */
-    /* } */
-
-    /* status = geomap( */
-    /*         ncoords, input, */
-    /*         ncoords, ref, */
-    /*         &bbox, */
-    /*         geomap_fit_xyscale, */
-    /*         surface_type_polynomial, */
-    /*         2, 2, 2, 2, */
-    /*         xterms_none, xterms_none, */
-    /*         0, 0, */
-    /*         &noutput, output, */
-    /*         &result, */
-    /*         &error); */
-    /* geomap_result_print(&result); */
-    /* geomap_result_free(&result); */
+    return status;
+}
+
+/* Reject a few outliers from an otherwise exact linear fit */
+static int
+check_reject(void) {
+
+    const size_t    outliers[3] = {3, 20, 41};
+    coord_t         ref[NCOORDS];
+    coord_t         input[NCOORDS];
+    geomap_output_t output[NCOORDS];
+    geomap_result_t result;
+    size_t          i, j;
+    int             is_outlier;
+    int             status = 1;
+
+    geomap_result_init(&result);
+    make_ref(ref);
+    make_linear(ref, 1.5, 0.8, 30.0, input);
+    for (j = 0; j < 3; ++j) {
+        input[outliers[j]].x += 0.9;
+        input[outliers[j]].y -= 0.9;
+    }
+
+    if (fit("reject", input, ref, geomap_fit_general,
+            surface_type_polynomial, 2, xterms_none, 5, 3.0, output,
+            &result)) {
+        goto exit;
+    }
+
+    for (i = 0; i < NCOORDS; ++i) {
+        is_outlier = 0;
+        for (j = 0; j < 3; ++j) {
+            if (i == outliers[j]) {
+                is_outlier = 1;
+            }
+        }
+
+        if (is_outlier != (isnan(output[i].fit.x) != 0)) {
+            printf("reject: point %lu %s rejected\n",
+                   (unsigned long)i, is_outlier ? "was not" : "was");
+            goto exit;
+        }
+    }
+
+    if (!(result.rms.x < 1e-6) || !(result.rms.y < 1e-6)) {
+        printf("reject: rms is (%g, %g)\n", result.rms.x, result.rms.y);
+        goto exit;
+    }
+
+    status = 0;
+
+ exit:
+    geomap_result_free(&result);
 
     return status;
 }
+
+/* Mismatched coordinate counts are reported as an error */
+static int
+check_mismatch(void) {
+
+    coord_t         ref[NCOORDS];
+    geomap_output_t output[NCOORDS];
+    geomap_result_t result;
+    bbox_t          bbox;
+    size_t          noutput = NCOORDS;
+    stimage_error_t error;
+
+    stimage_error_init(&error);
+    bbox_init(&bbox);
+    geomap_result_init(&result);
+    make_ref(ref);
+
+    if (geomap(
+                NCOORDS, ref, NCOORDS - 1, ref, &bbox, geomap_fit_general,
+                surface_type_polynomial, 2, 2, 2, 2, xterms_none, xterms_none,
+                0, 0.0, &noutput, output, &result, &error) == 0) {
+        printf("mismatch: no error\n");
+        return 1;
+    }
+
+    geomap_result_free(&result);
+
+    return 0;
+}
+
+int
+main(int argc, char** argv) {
+
+    if (check_general(surface_type_polynomial) ||
+        check_general(surface_type_legendre) ||
+        check_general(surface_type_chebyshev) ||
+        check_linear(surface_type_polynomial) ||
+        check_linear(surface_type_legendre) ||
+        check_coeff(surface_type_polynomial) ||
+        check_coeff(surface_type_legendre) ||
+        check_coeff(surface_type_chebyshev) ||
+        check_reject() ||
+        check_mismatch()) {
+        return 1;
+    }
+
+    return 0;
+}
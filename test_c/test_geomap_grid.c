@@ -0,0 +1,176 @@
+/*
+Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+    1. Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+
+    2. Redistributions in binary form must reproduce the above
+      copyright notice, this list of conditions and the following
+      disclaimer in the documentation and/or other materials provided
+      with the distribution.
+
+    3. The name of AURA and its representatives may not be used to
+      endorse or promote products derived from this software without
+      specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+DAMAGE.
+*/
+
+#include <math.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+
+#include "immatch/geomap.h"
+#include "immatch/geomap_grid.h"
+
+#define NCOORDS 2000
+
+/* A distortion no low order polynomial follows */
+static void
+distortion(const coord_t* const ref, coord_t* const d) {
+    d->x = 0.3 * sin(ref->x / 300.0) * cos(ref->y / 250.0);
+    d->y = 0.2 * cos(ref->x / 200.0 + ref->y / 400.0);
+}
+
+/* Fit a linear transformation and a residual grid to a distorted
+   one, then check that the grid follows the distortion, that
+   evaluating and inverting the result include it, and that it
+   survives packing */
+int main(int argv, char** argc) {
+    coord_t              input[NCOORDS];
+    coord_t              ref[NCOORDS];
+    coord_t              fit[NCOORDS];
+    coord_t              inverse[NCOORDS];
+    coord_t              d;
+    geomap_output_t      output[NCOORDS];
+    size_t               noutput = NCOORDS;
+    size_t               nunconverged = 0;
+    geomap_result_t      result;
+    geomap_result_t      copy;
+    geomap_result_view_t view;
+    stimage_error_t      error;
+    double*              buffer  = NULL;
+    size_t               size;
+    coord_t              linear_rms;
+    size_t               i;
+    int                  status  = 1;
+
+    stimage_error_init(&error);
+    geomap_result_init(&result);
+    geomap_result_init(&copy);
+
+    srand48(0);
+    for (i = 0; i < NCOORDS; ++i) {
+        ref[i].x = drand48() * 2048.0;
+        ref[i].y = drand48() * 2048.0;
+        distortion(&ref[i], &d);
+        input[i].x = 3.0 + 1.01 * ref[i].x + 0.02 * ref[i].y + d.x;
+        input[i].y = -2.0 - 0.01 * ref[i].x + 0.99 * ref[i].y + d.y;
+    }
+
+    if (geomap(NCOORDS, input, NCOORDS, ref, NULL, geomap_fit_general,
+               surface_type_polynomial, 2, 2, 2, 2, xterms_none, xterms_none,
+               0, 0.0, &noutput, output, &result, &error)) {
+        goto exit;
+    }
+    linear_rms = result.rms;
+
+    if (geomap_grid(16, 12, 0.01, noutput, output, &result, &error)) {
+        goto exit;
+    }
+
+    if (result.ngridx != 19 || result.ngridy != 15) {
+        printf("grid is %lu x %lu\n",
+               (unsigned long)result.ngridx, (unsigned long)result.ngridy);
+        goto exit;
+    }
+
+    if (!(result.rms.x < linear_rms.x / 20.0) ||
+        !(result.rms.y < linear_rms.y / 20.0)) {
+        printf("grid did not reduce the rms: (%g, %g) from (%g, %g)\n",
+               result.rms.x, result.rms.y, linear_rms.x, linear_rms.y);
+        goto exit;
+    }
+
+    if (geomap_result_eval(&result, NCOORDS, ref, fit, &error)) {
+        goto exit;
+    }
+
+    for (i = 0; i < NCOORDS; ++i) {
+        if (fabs(fit[i].x - output[i].fit.x) > 1e-8 ||
+            fabs(fit[i].y - output[i].fit.y) > 1e-8) {
+            printf("eval %lu differs from the output\n", (unsigned long)i);
+            goto exit;
+        }
+    }
+
+    if (geomap_result_invert(
+                &result, NCOORDS, fit, inverse, &nunconverged, &error)) {
+        goto exit;
+    }
+
+    if (nunconverged != 0) {
+        printf("%lu points did not converge\n", (unsigned long)nunconverged);
+        goto exit;
+    }
+
+    for (i = 0; i < NCOORDS; ++i) {
+        if (fabs(inverse[i].x - ref[i].x) > 1e-6 ||
+            fabs(inverse[i].y - ref[i].y) > 1e-6) {
+            printf("invert %lu differs\n", (unsigned long)i);
+            goto exit;
+        }
+    }
+
+    size = geomap_result_packed_size(&result);
+    buffer = malloc(size);
+    if (buffer == NULL) {
+        goto exit;
+    }
+    geomap_result_pack(&result, buffer);
+
+    if (geomap_result_view(size, buffer, &view, &error) ||
+        geomap_result_unpack(&view, &copy, &error) ||
+        geomap_result_eval(&copy, NCOORDS, ref, inverse, &error)) {
+        goto exit;
+    }
+
+    if (memcmp(fit, inverse, sizeof(fit)) != 0) {
+        printf("unpacked grid evaluates differently\n");
+        goto exit;
+    }
+
+    if (!geomap_grid(0, 12, 0.01, noutput, output, &result, &error) ||
+        !geomap_grid(16, 12, -1.0, noutput, output, &result, &error)) {
+        printf("bad grid parameters accepted\n");
+        goto exit;
+    }
+
+    stimage_error_init(&error);
+    status = 0;
+
+ exit:
+    free(buffer);
+    geomap_result_free(&result);
+    geomap_result_free(&copy);
+
+    if (error.message[0]) {
+        printf("%s\n", stimage_error_get_message(&error));
+    }
+
+    return status;
+}
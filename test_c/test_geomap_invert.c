@@ -0,0 +1,217 @@
+/*
+Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+    1. Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+
+    2. Redistributions in binary form must reproduce the above
+      copyright notice, this list of conditions and the following
+      disclaimer in the documentation and/or other materials provided
+      with the distribution.
+
+    3. The name of AURA and its representatives may not be used to
+      endorse or promote products derived from this software without
+      specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+DAMAGE.
+*/
+
+#include <math.h>
+#include <stdio.h>
+#include <stdlib.h>
+
+#include "immatch/geomap.h"
+
+#define NCOORDS 500
+
+/* Fit a distorted transformation, then check that evaluating the
+   result reproduces the fitted values and that inverting it recovers
+   the reference coordinates */
+static int
+check(const geomap_fit_e fit_geometry,
+      const surface_type_e function,
+      const xterms_e xterms,
+      const coord_t* const input,
+      const coord_t* const ref) {
+    geomap_output_t output[NCOORDS];
+    coord_t         fit[NCOORDS];
+    coord_t         inverse[NCOORDS];
+    size_t          noutput = NCOORDS;
+    size_t          nunconverged = 0;
+    geomap_result_t result;
+    stimage_error_t error;
+    size_t          i;
+    int             status = 1;
+
+    stimage_error_init(&error);
+    geomap_result_init(&result);
+
+    if (geomap(NCOORDS, input, NCOORDS, ref, NULL, fit_geometry, function,
+               4, 4, 4, 4, xterms, xterms, 0, 0.0, &noutput, output,
+               &result, &error)) {
+        goto exit;
+    }
+
+    if (geomap_result_eval(&result, NCOORDS, ref, fit, &error)) {
+        goto exit;
+    }
+
+    for (i = 0; i < NCOORDS; ++i) {
+        if (fabs(fit[i].x - output[i].fit.x) > 1e-8 ||
+            fabs(fit[i].y - output[i].fit.y) > 1e-8) {
+            printf("geometry %d function %d xterms %d: eval %lu differs\n",
+                   fit_geometry, function, xterms, (unsigned long)i);
+            goto exit;
+        }
+    }
+
+    if (geomap_result_invert(
+                &result, NCOORDS, fit, inverse, &nunconverged, &error)) {
+        goto exit;
+    }
+
+    if (nunconverged != 0) {
+        printf("%lu points did not converge\n", (unsigned long)nunconverged);
+        goto exit;
+    }
+
+    for (i = 0; i < NCOORDS; ++i) {
+        if (fabs(inverse[i].x - ref[i].x) > 1e-6 ||
+            fabs(inverse[i].y - ref[i].y) > 1e-6) {
+            printf("geometry %d function %d xterms %d: invert %lu differs\n",
+                   fit_geometry, function, xterms, (unsigned long)i);
+            goto exit;
+        }
+    }
+
+    status = 0;
+
+ exit:
+    geomap_result_free(&result);
+
+    if (error.message[0]) {
+        printf("%s\n", stimage_error_get_message(&error));
+    }
+
+    return status;
+}
+
+/* Points far outside the bbox, where the distortion terms dominate,
+   are counted as not converging, without spoiling the others */
+static int
+check_unconverged(
+        const coord_t* const input,
+        const coord_t* const ref) {
+    #define NFAR 3
+    geomap_output_t output[NCOORDS];
+    coord_t         points[NCOORDS + NFAR];
+    coord_t         inverse[NCOORDS + NFAR];
+    size_t          noutput = NCOORDS;
+    size_t          nunconverged = 0;
+    geomap_result_t result;
+    stimage_error_t error;
+    size_t          i;
+    int             status = 1;
+
+    stimage_error_init(&error);
+    geomap_result_init(&result);
+
+    if (geomap(NCOORDS, input, NCOORDS, ref, NULL, geomap_fit_general,
+               surface_type_polynomial, 4, 4, 4, 4, xterms_full,
+               xterms_full, 0, 0.0, &noutput, output, &result, &error)) {
+        goto exit;
+    }
+
+    for (i = 0; i < NCOORDS; ++i) {
+        points[i] = output[i].fit;
+    }
+    for (i = 0; i < NFAR; ++i) {
+        points[NCOORDS + i].x = 1e5 * (double)(i + 1);
+        points[NCOORDS + i].y = -1e5 * (double)(i + 1);
+    }
+
+    if (geomap_result_invert(
+                &result, NCOORDS + NFAR, points, inverse, &nunconverged,
+                &error)) {
+        goto exit;
+    }
+
+    if (nunconverged != NFAR) {
+        printf("%lu points did not converge, expected %d\n",
+               (unsigned long)nunconverged, NFAR);
+        goto exit;
+    }
+
+    for (i = 0; i < NCOORDS; ++i) {
+        if (fabs(inverse[i].x - ref[i].x) > 1e-6 ||
+            fabs(inverse[i].y - ref[i].y) > 1e-6) {
+            printf("invert %lu differs next to unconverged points\n",
+                   (unsigned long)i);
+            goto exit;
+        }
+    }
+
+    status = 0;
+
+ exit:
+    geomap_result_free(&result);
+
+    if (error.message[0]) {
+        printf("%s\n", stimage_error_get_message(&error));
+    }
+
+    return status;
+}
+
+int main(int argv, char** argc) {
+    coord_t        input[NCOORDS];
+    coord_t        ref[NCOORDS];
+    double         u, v;
+    geomap_fit_e   fit_geometry;
+    surface_type_e function;
+    xterms_e       xterms;
+    size_t         i;
+
+    srand48(0);
+    for (i = 0; i < NCOORDS; ++i) {
+        ref[i].x = drand48() * 2048.0;
+        ref[i].y = drand48() * 2048.0;
+        u = ref[i].x / 1024.0 - 1.0;
+        v = ref[i].y / 1024.0 - 1.0;
+        input[i].x = 5.0 + 1.001 * ref[i].x + 0.002 * ref[i].y +
+            3.0 * u * u + 1.5 * u * v;
+        input[i].y = -3.0 - 0.001 * ref[i].x + 0.999 * ref[i].y +
+            2.5 * v * v * v + u * u;
+    }
+
+    for (fit_geometry = geomap_fit_shift; fit_geometry < geomap_fit_LAST;
+         ++fit_geometry) {
+        for (function = surface_type_polynomial;
+             function < surface_type_LAST; ++function) {
+            for (xterms = xterms_none; xterms < xterms_LAST; ++xterms) {
+                if (check(fit_geometry, function, xterms, input, ref)) {
+                    return 1;
+                }
+            }
+        }
+    }
+
+    if (check_unconverged(input, ref)) {
+        return 1;
+    }
+
+    return 0;
+}
@@ -0,0 +1,396 @@
+/*
+Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+    1. Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+
+    2. Redistributions in binary form must reproduce the above
+      copyright notice, this list of conditions and the following
+      disclaimer in the documentation and/or other materials provided
+      with the distribution.
+
+    3. The name of AURA and its representatives may not be used to
+      endorse or promote products derived from this software without
+      specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+DAMAGE.
+*/
+
+#include <math.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+
+#include "immatch/geomap_joint.h"
+
+#define NSTARS 400
+#define NEXPOSURES 12
+#define MAXOBS (NSTARS * NEXPOSURES)
+
+typedef struct {
+    double t[2];
+    double m[4];
+} transform_t;
+
+static void
+make_transform(
+        const geomap_fit_e fit_geometry,
+        const int flip,
+        transform_t* const tr) {
+
+    double theta = (drand48() - 0.5) * 0.6;
+    double xmag  = 0.9 + 0.2 * drand48();
+    double ymag  = 0.9 + 0.2 * drand48();
+    double f     = flip ? -1.0 : 1.0;
+
+    tr->t[0] = 512.0 + (drand48() - 0.5) * 400.0;
+    tr->t[1] = 512.0 + (drand48() - 0.5) * 400.0;
+
+    switch (fit_geometry) {
+    case geomap_fit_shift:
+        xmag = ymag = 1.0;
+        theta = 0.0;
+        f = 1.0;
+        break;
+    case geomap_fit_xyscale:
+        theta = 0.0;
+        f = 1.0;
+        break;
+    case geomap_fit_rotate:
+        xmag = ymag = 1.0;
+        break;
+    case geomap_fit_rscale:
+        ymag = xmag;
+        break;
+    default:
+        break;
+    }
+
+    tr->m[0] = f * xmag * cos(theta);
+    tr->m[1] = ymag * sin(theta);
+    tr->m[2] = -f * xmag * sin(theta);
+    tr->m[3] = ymag * cos(theta);
+
+    if (fit_geometry == geomap_fit_general) {
+        tr->m[1] += 0.01;
+        tr->m[2] -= 0.02;
+    }
+}
+
+static void
+apply_transform(
+        const transform_t* const tr,
+        const coord_t* const a,
+        coord_t* const b) {
+
+    double dx = a->x - 512.0;
+    double dy = a->y - 512.0;
+
+    b->x = tr->t[0] + tr->m[0] * dx + tr->m[1] * dy;
+    b->y = tr->t[1] + tr->m[2] * dx + tr->m[3] * dy;
+}
+
+/* Simulate a dithered stack: each exposure sees the stars in its own
+   window of the field, overlapping its neighbours */
+static size_t
+simulate(
+        const geomap_fit_e fit_geometry,
+        const coord_t* const stars,
+        transform_t* const truth,
+        coord_t* const coord,
+        size_t* const exposure,
+        size_t* const group) {
+
+    size_t nobs = 0;
+    size_t k, s;
+    double lo;
+
+    for (k = 0; k < NEXPOSURES; ++k) {
+        if (k == 0) {
+            truth[k].t[0] = truth[k].t[1] = 512.0;
+            truth[k].m[0] = truth[k].m[3] = 1.0;
+            truth[k].m[1] = truth[k].m[2] = 0.0;
+        } else {
+            make_transform(fit_geometry, k == 3, &truth[k]);
+        }
+
+        lo = 512.0 * (double)k / (double)NEXPOSURES;
+        for (s = 0; s < NSTARS; ++s) {
+            if (stars[s].x < lo || stars[s].x > lo + 512.0) continue;
+            if (drand48() < 0.1) continue;
+            apply_transform(&truth[k], &stars[s], &coord[nobs]);
+            exposure[nobs] = k;
+            group[nobs] = s;
+            ++nobs;
+        }
+    }
+
+    return nobs;
+}
+
+static int
+check_geometry(
+        const geomap_fit_e fit_geometry,
+        const surface_type_e function,
+        const coord_t* const stars) {
+
+    transform_t     truth[NEXPOSURES];
+    coord_t*        coord    = malloc(MAXOBS * sizeof(coord_t));
+    size_t*         exposure = malloc(MAXOBS * sizeof(size_t));
+    size_t*         group    = malloc(MAXOBS * sizeof(size_t));
+    geomap_output_t* output  = malloc(MAXOBS * sizeof(geomap_output_t));
+    geomap_result_t results[NEXPOSURES];
+    coord_t         fit[NSTARS];
+    coord_t         expected;
+    stimage_error_t error;
+    size_t          nobs, k, s;
+    double          maxdiff  = 0.0;
+    int             status   = 1;
+
+    stimage_error_init(&error);
+    for (k = 0; k < NEXPOSURES; ++k) {
+        geomap_result_init(&results[k]);
+    }
+
+    nobs = simulate(fit_geometry, stars, truth, coord, exposure, group);
+
+    if (geomap_joint(
+                NEXPOSURES, 0, nobs, coord, exposure, group, NSTARS,
+                fit_geometry, function, 0, 0.0, output, results, &error)) {
+        printf("%s\n", stimage_error_get_message(&error));
+        goto exit;
+    }
+
+    for (k = 0; k < NEXPOSURES; ++k) {
+        if (results[k].fit_geometry != fit_geometry) {
+            printf("wrong fit geometry\n");
+            goto exit;
+        }
+        if (geomap_result_eval(&results[k], NSTARS, stars, fit, &error)) {
+            printf("%s\n", stimage_error_get_message(&error));
+            goto exit;
+        }
+        for (s = 0; s < NSTARS; ++s) {
+            apply_transform(&truth[k], &stars[s], &expected);
+            maxdiff = MAX(maxdiff, fabs(fit[s].x - expected.x));
+            maxdiff = MAX(maxdiff, fabs(fit[s].y - expected.y));
+        }
+    }
+
+    for (k = 0; k < nobs; ++k) {
+        maxdiff = MAX(maxdiff, fabs(output[k].ref.x - stars[group[k]].x));
+        maxdiff = MAX(maxdiff, fabs(output[k].ref.y - stars[group[k]].y));
+    }
+
+    if (!(maxdiff < 1e-6)) {
+        printf("geometry %d: transformations differ by %g\n",
+               (int)fit_geometry, maxdiff);
+        goto exit;
+    }
+
+    status = 0;
+
+ exit:
+    for (k = 0; k < NEXPOSURES; ++k) {
+        geomap_result_free(&results[k]);
+    }
+    free(coord);
+    free(exposure);
+    free(group);
+    free(output);
+
+    return status;
+}
+
+/* A grossly wrong match is rejected, and the rest of the fit is
+   unaffected by it */
+static int
+check_reject(
+        const coord_t* const stars) {
+
+    transform_t     truth[NEXPOSURES];
+    coord_t*        coord    = malloc(MAXOBS * sizeof(coord_t));
+    size_t*         exposure = malloc(MAXOBS * sizeof(size_t));
+    size_t*         group    = malloc(MAXOBS * sizeof(size_t));
+    geomap_output_t* output  = malloc(MAXOBS * sizeof(geomap_output_t));
+    geomap_result_t results[NEXPOSURES];
+    stimage_error_t error;
+    size_t          nobs, k, bad;
+    int             status   = 1;
+
+    stimage_error_init(&error);
+    for (k = 0; k < NEXPOSURES; ++k) {
+        geomap_result_init(&results[k]);
+    }
+
+    nobs = simulate(geomap_fit_rscale, stars, truth, coord, exposure, group);
+    for (k = 0; k < nobs; ++k) {
+        coord[k].x += (drand48() - 0.5) * 0.01;
+        coord[k].y += (drand48() - 0.5) * 0.01;
+    }
+    bad = nobs / 2;
+    coord[bad].x += 5.0;
+
+    if (geomap_joint(
+                NEXPOSURES, 0, nobs, coord, exposure, group, NSTARS,
+                geomap_fit_rscale, surface_type_polynomial, 3, 3.0, output,
+                results, &error)) {
+        printf("%s\n", stimage_error_get_message(&error));
+        goto exit;
+    }
+
+    if (!isnan(output[bad].fit.x)) {
+        printf("outlier was not rejected\n");
+        goto exit;
+    }
+
+    for (k = 0; k < NEXPOSURES; ++k) {
+        if (!(results[k].rms.x < 0.01 && results[k].rms.y < 0.01)) {
+            printf("exposure %lu has rms %g, %g\n",
+                   (unsigned long)k, results[k].rms.x, results[k].rms.y);
+            goto exit;
+        }
+    }
+
+    /* An exposure that overlaps nothing cannot be fit */
+    for (k = 0; k < nobs; ++k) {
+        if (exposure[k] == NEXPOSURES - 1) {
+            group[k] = NSTARS + k;
+        }
+    }
+    for (k = 0; k < NEXPOSURES; ++k) {
+        geomap_result_free(&results[k]);
+    }
+    if (!geomap_joint(
+                NEXPOSURES, 0, nobs, coord, exposure, group, NSTARS + nobs,
+                geomap_fit_rscale, surface_type_polynomial, 0, 0.0, output,
+                results, &error)) {
+        printf("disconnected exposure was fit\n");
+        goto exit;
+    }
+
+    stimage_error_init(&error);
+    status = 0;
+
+ exit:
+    for (k = 0; k < NEXPOSURES; ++k) {
+        geomap_result_free(&results[k]);
+    }
+    free(coord);
+    free(exposure);
+    free(group);
+    free(output);
+
+    return status;
+}
+
+/* A deep stack, where every exposure sees every source, is solved
+   without forming the reduced system */
+#define NDEEP 80
+#define NDEEPSTARS 50
+
+static int
+check_deep(
+        const coord_t* const stars) {
+
+    transform_t     truth[NDEEP];
+    coord_t         coord[NDEEP * NDEEPSTARS];
+    size_t          exposure[NDEEP * NDEEPSTARS];
+    size_t          group[NDEEP * NDEEPSTARS];
+    geomap_output_t output[NDEEP * NDEEPSTARS];
+    geomap_result_t results[NDEEP];
+    coord_t         fit[NDEEPSTARS];
+    coord_t         expected;
+    stimage_error_t error;
+    size_t          nobs = 0;
+    size_t          k, s;
+    double          maxdiff = 0.0;
+    int             status = 1;
+
+    stimage_error_init(&error);
+    for (k = 0; k < NDEEP; ++k) {
+        geomap_result_init(&results[k]);
+        make_transform(geomap_fit_general, 0, &truth[k]);
+        for (s = 0; s < NDEEPSTARS; ++s) {
+            apply_transform(&truth[k], &stars[s], &coord[nobs]);
+            exposure[nobs] = k;
+            group[nobs] = s;
+            ++nobs;
+        }
+    }
+
+    /* The reference exposure need not be the first, nor the identity
+       in pixel terms: the common frame is its own coordinates */
+    if (geomap_joint(
+                NDEEP, 5, nobs, coord, exposure, group, NDEEPSTARS,
+                geomap_fit_general, surface_type_polynomial, 0, 0.0, output,
+                results, &error)) {
+        printf("%s\n", stimage_error_get_message(&error));
+        goto exit;
+    }
+
+    for (k = 0; k < NDEEP; ++k) {
+        if (geomap_result_eval(
+                    &results[k], NDEEPSTARS, coord + 5 * NDEEPSTARS, fit,
+                    &error)) {
+            printf("%s\n", stimage_error_get_message(&error));
+            goto exit;
+        }
+        for (s = 0; s < NDEEPSTARS; ++s) {
+            expected = coord[k * NDEEPSTARS + s];
+            maxdiff = MAX(maxdiff, fabs(fit[s].x - expected.x));
+            maxdiff = MAX(maxdiff, fabs(fit[s].y - expected.y));
+        }
+    }
+
+    if (!(maxdiff < 1e-6)) {
+        printf("deep stack: transformations differ by %g\n", maxdiff);
+        goto exit;
+    }
+
+    status = 0;
+
+ exit:
+    for (k = 0; k < NDEEP; ++k) {
+        geomap_result_free(&results[k]);
+    }
+
+    return status;
+}
+
+int main(int argv, char** argc) {
+    coord_t stars[NSTARS];
+    size_t  i;
+
+    srand48(0);
+    for (i = 0; i < NSTARS; ++i) {
+        stars[i].x = drand48() * 1024.0;
+        stars[i].y = drand48() * 1024.0;
+    }
+
+    if (check_geometry(geomap_fit_shift, surface_type_polynomial, stars) ||
+        check_geometry(geomap_fit_xyscale, surface_type_legendre, stars) ||
+        check_geometry(geomap_fit_rotate, surface_type_polynomial, stars) ||
+        check_geometry(geomap_fit_rscale, surface_type_chebyshev, stars) ||
+        check_geometry(geomap_fit_rxyscale, surface_type_polynomial, stars) ||
+        check_geometry(geomap_fit_general, surface_type_legendre, stars) ||
+        check_deep(stars) ||
+        check_reject(stars)) {
+        return 1;
+    }
+
+    return 0;
+}
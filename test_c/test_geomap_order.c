@@ -0,0 +1,166 @@
+/*
+Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+    1. Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+
+    2. Redistributions in binary form must reproduce the above
+      copyright notice, this list of conditions and the following
+      disclaimer in the documentation and/or other materials provided
+      with the distribution.
+
+    3. The name of AURA and its representatives may not be used to
+      endorse or promote products derived from this software without
+      specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+DAMAGE.
+*/
+
+#include <math.h>
+#include <stdio.h>
+#include <stdlib.h>
+
+#include "immatch/geomap.h"
+
+#define NCOORDS 500
+
+static double
+noise(void) {
+    /* Roughly normal with a sigma of 0.01 */
+    return (drand48() + drand48() + drand48() - 1.5) * 0.02;
+}
+
+static int
+check(const char* const name,
+      const coord_t* const input,
+      const coord_t* const ref,
+      const size_t max_order,
+      const size_t expected_xorder,
+      const xterms_e expected_xxterms,
+      const size_t expected_yorder,
+      const xterms_e expected_yxterms) {
+    size_t xorder = 0;
+    size_t yorder = 0;
+    xterms_e xxterms = xterms_LAST;
+    xterms_e yxterms = xterms_LAST;
+    stimage_error_t error;
+
+    stimage_error_init(&error);
+
+    if (geomap_select_order(
+                NCOORDS, input, NCOORDS, ref, NULL, max_order,
+                &xorder, &xxterms, &yorder, &yxterms, &error)) {
+        printf("%s: %s\n", name, stimage_error_get_message(&error));
+        return 1;
+    }
+
+    if (xorder != expected_xorder || xxterms != expected_xxterms ||
+        yorder != expected_yorder || yxterms != expected_yxterms) {
+        printf("%s: expected (%lu, %d) (%lu, %d), got (%lu, %d) (%lu, %d)\n",
+               name,
+               (unsigned long)expected_xorder, expected_xxterms,
+               (unsigned long)expected_yorder, expected_yxterms,
+               (unsigned long)xorder, xxterms,
+               (unsigned long)yorder, yxterms);
+        return 1;
+    }
+
+    return 0;
+}
+
+int
+main(int argc, char** argv) {
+    static coord_t ref[NCOORDS];
+    static coord_t input[NCOORDS];
+    size_t xorder = 0;
+    size_t yorder = 0;
+    xterms_e xxterms, yxterms;
+    stimage_error_t error;
+    double x, y;
+    size_t i = 0;
+    int status = 0;
+
+    stimage_error_init(&error);
+    srand48(0);
+
+    for (i = 0; i < NCOORDS; ++i) {
+        ref[i].x = drand48() * 2048.0;
+        ref[i].y = drand48() * 1024.0 + 100.0;
+    }
+
+    /* A linear transformation needs nothing more than order 2 */
+    for (i = 0; i < NCOORDS; ++i) {
+        x = ref[i].x;
+        y = ref[i].y;
+        input[i].x = 3.0 + 1.01 * x + 0.02 * y + noise();
+        input[i].y = -2.0 - 0.01 * x + 0.99 * y + noise();
+    }
+    status |= check("linear", input, ref, 6,
+                    2, xterms_none, 2, xterms_none);
+
+    /* Pure powers of x or y only need the "none" cross terms */
+    for (i = 0; i < NCOORDS; ++i) {
+        x = ref[i].x;
+        y = ref[i].y;
+        input[i].x = 3.0 + 1.01 * x + 0.02 * y +
+            2e-5 * x * x + 1e-9 * x * x * x + noise();
+        input[i].y = -2.0 - 0.01 * x + 0.99 * y + 3e-5 * y * y + noise();
+    }
+    status |= check("none", input, ref, 6,
+                    4, xterms_none, 3, xterms_none);
+
+    /* A cross term in a quadratic needs "half" */
+    for (i = 0; i < NCOORDS; ++i) {
+        x = ref[i].x;
+        y = ref[i].y;
+        input[i].x = 3.0 + 1.01 * x + 0.02 * y +
+            1e-5 * x * x + 2e-5 * x * y + noise();
+        input[i].y = -2.0 - 0.01 * x + 0.99 * y +
+            1e-5 * x * x - 1e-5 * x * y + 2e-5 * y * y + noise();
+    }
+    status |= check("half", input, ref, 6,
+                    3, xterms_half, 3, xterms_half);
+
+    /* An x * y term alone is the full order 2 surface */
+    for (i = 0; i < NCOORDS; ++i) {
+        x = ref[i].x;
+        y = ref[i].y;
+        input[i].x = 3.0 + 1.01 * x + 0.02 * y + 2e-5 * x * y + noise();
+        input[i].y = -2.0 - 0.01 * x + 0.99 * y + noise();
+    }
+    status |= check("full", input, ref, 6,
+                    2, xterms_full, 2, xterms_none);
+
+    /* max_order caps the search */
+    for (i = 0; i < NCOORDS; ++i) {
+        x = ref[i].x;
+        y = ref[i].y;
+        input[i].x = 3.0 + 1.01 * x + 1e-9 * x * x * x + noise();
+        input[i].y = y + noise();
+    }
+    status |= check("max_order", input, ref, 3,
+                    3, xterms_none, 2, xterms_none);
+
+    /* An order below 2 is an error */
+    if (!geomap_select_order(
+                NCOORDS, input, NCOORDS, ref, NULL, 1,
+                &xorder, &xxterms, &yorder, &yxterms, &error)) {
+        printf("max_order of 1 should fail\n");
+        status = 1;
+    }
+
+    return status;
+}
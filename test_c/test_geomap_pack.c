@@ -0,0 +1,154 @@
+/*
+Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+    1. Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+
+    2. Redistributions in binary form must reproduce the above
+      copyright notice, this list of conditions and the following
+      disclaimer in the documentation and/or other materials provided
+      with the distribution.
+
+    3. The name of AURA and its representatives may not be used to
+      endorse or promote products derived from this software without
+      specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+DAMAGE.
+*/
+
+#include <math.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+
+#include "immatch/geomap.h"
+
+#define NCOORDS 200
+
+/* Pack a fitted result, check that the view and the unpacked copy
+   evaluate exactly as the original, and that damaged buffers are
+   rejected */
+int main(int argv, char** argc) {
+    coord_t                 input[NCOORDS];
+    coord_t                 ref[NCOORDS];
+    coord_t                 fit[NCOORDS];
+    coord_t                 fit2[NCOORDS];
+    geomap_output_t         output[NCOORDS];
+    size_t                  noutput = NCOORDS;
+    geomap_result_t         result;
+    geomap_result_t         copy;
+    geomap_result_view_t    view;
+    geomap_result_header_t* header;
+    stimage_error_t         error;
+    double*                 buffer = NULL;
+    size_t                  size;
+    size_t                  i;
+    int                     status = 1;
+
+    stimage_error_init(&error);
+    geomap_result_init(&result);
+    geomap_result_init(&copy);
+
+    srand48(0);
+    for (i = 0; i < NCOORDS; ++i) {
+        ref[i].x = drand48() * 1024.0;
+        ref[i].y = drand48() * 1024.0;
+        input[i].x = 2.0 + 1.01 * ref[i].x + 1e-5 * ref[i].x * ref[i].y;
+        input[i].y = -1.0 + 0.99 * ref[i].y + 1e-5 * ref[i].y * ref[i].y;
+    }
+
+    if (geomap(NCOORDS, input, NCOORDS, ref, NULL, geomap_fit_general,
+               surface_type_legendre, 3, 3, 3, 3, xterms_half, xterms_full,
+               0, 0.0, &noutput, output, &result, &error)) {
+        goto exit;
+    }
+
+    size = geomap_result_packed_size(&result);
+    buffer = malloc(size);
+    if (buffer == NULL) {
+        goto exit;
+    }
+    geomap_result_pack(&result, buffer);
+
+    if (geomap_result_view(size, buffer, &view, &error)) {
+        goto exit;
+    }
+
+    if (view.header->nxcoeff != result.nxcoeff ||
+        view.header->nx2coeff != result.nx2coeff ||
+        view.xcoeff[1] != result.xcoeff[1] ||
+        view.y2coeff[0] != result.y2coeff[0]) {
+        printf("view differs from the packed result\n");
+        goto exit;
+    }
+
+    if (geomap_result_unpack(&view, &copy, &error) ||
+        geomap_result_eval(&result, NCOORDS, ref, fit, &error) ||
+        geomap_result_eval(&copy, NCOORDS, ref, fit2, &error)) {
+        goto exit;
+    }
+
+    if (memcmp(fit, fit2, sizeof(fit)) != 0) {
+        printf("unpacked result evaluates differently\n");
+        goto exit;
+    }
+
+    if (!geomap_result_view(size - 8, buffer, &view, &error)) {
+        printf("truncated buffer accepted\n");
+        goto exit;
+    }
+
+    /* A version 1 buffer has no grid fields in its header, and no
+       grids */
+    header = (geomap_result_header_t*)buffer;
+    header->version = 1;
+    header->header_size = GEOMAP_RESULT_HEADER_SIZE_V1;
+    header->size = size - (sizeof(geomap_result_header_t) -
+                           GEOMAP_RESULT_HEADER_SIZE_V1);
+    memmove((char*)buffer + GEOMAP_RESULT_HEADER_SIZE_V1, header + 1,
+            size - sizeof(geomap_result_header_t));
+    geomap_result_free(&copy);
+    if (geomap_result_view(header->size, buffer, &view, &error) ||
+        geomap_result_unpack(&view, &copy, &error) ||
+        geomap_result_eval(&copy, NCOORDS, ref, fit2, &error)) {
+        goto exit;
+    }
+
+    if (view.ngridx != 0 || memcmp(fit, fit2, sizeof(fit)) != 0) {
+        printf("version 1 result evaluates differently\n");
+        goto exit;
+    }
+
+    ((char*)buffer)[0] = 'X';
+    if (!geomap_result_view(size, buffer, &view, &error)) {
+        printf("bad magic accepted\n");
+        goto exit;
+    }
+
+    stimage_error_init(&error);
+    status = 0;
+
+ exit:
+    free(buffer);
+    geomap_result_free(&result);
+    geomap_result_free(&copy);
+
+    if (error.message[0]) {
+        printf("%s\n", stimage_error_get_message(&error));
+    }
+
+    return status;
+}
@@ -0,0 +1,113 @@
+#include <assert.h>
+#include <stdio.h>
+#include <stdlib.h>
+
+#include "lib/radixsort.h"
+#include "lib/xysort.h"
+
+static int
+double_compare(const void* ap, const void* bp) {
+    const double a = *(const double*)ap;
+    const double b = *(const double*)bp;
+
+    if (a < b) {
+        return -1;
+    } else if (a > b) {
+        return 1;
+    }
+    return 0;
+}
+
+int main(int argv, char** argc) {
+    #define ncoords 10000
+    double a[ncoords];
+    double b[ncoords];
+    size_t perm[ncoords];
+    coord_t data[ncoords];
+    const coord_t* ptr[ncoords];
+    stimage_error_t error;
+    size_t i = 0;
+    size_t sizes[] = {0, 1, 2, 63, 64, 65, ncoords};
+    size_t s = 0;
+    size_t n = 0;
+
+    stimage_error_init(&error);
+
+    srand48(0);
+
+    /* Sorting doubles must give the same result as qsort, for both
+       the insertion sort and radix sort paths */
+    for (s = 0; s < sizeof(sizes) / sizeof(size_t); ++s) {
+        n = sizes[s];
+        for (i = 0; i < n; ++i) {
+            a[i] = b[i] = (drand48() - 0.5) * 1e6;
+        }
+        if (n > 4) {
+            a[0] = b[0] = 0.0;
+            a[1] = b[1] = -0.0;
+            a[2] = b[2] = a[3] = b[3] = 42.0;
+        }
+
+        if (radix_sort_doubles(n, a, &error)) {
+            printf("%s\n", stimage_error_get_message(&error));
+            return 1;
+        }
+        qsort(b, n, sizeof(double), &double_compare);
+
+        for (i = 0; i < n; ++i) {
+            if (a[i] != b[i]) {
+                printf("radix_sort_doubles mismatch at %lu\n", (unsigned long)i);
+                return 1;
+            }
+        }
+    }
+
+    /* The argsort must be stable */
+    for (i = 0; i < ncoords; ++i) {
+        a[i] = (double)(lrand48() % 100) - 50.0;
+    }
+    a[10] = -0.0;
+    if (radix_argsort(ncoords, a, sizeof(double), perm, &error)) {
+        printf("%s\n", stimage_error_get_message(&error));
+        return 1;
+    }
+    for (i = 1; i < ncoords; ++i) {
+        if (a[perm[i-1]] > a[perm[i]] ||
+            (a[perm[i-1]] == a[perm[i]] && perm[i-1] > perm[i])) {
+            printf("radix_argsort is not stable at %lu\n", (unsigned long)i);
+            return 1;
+        }
+    }
+
+    /* Applying the permutation must sort the array */
+    if (apply_permutation(ncoords, a, sizeof(double), perm, &error)) {
+        printf("%s\n", stimage_error_get_message(&error));
+        return 1;
+    }
+    for (i = 1; i < ncoords; ++i) {
+        if (a[i-1] > a[i]) {
+            printf("apply_permutation did not sort at %lu\n", (unsigned long)i);
+            return 1;
+        }
+        if (perm[i] != i) {
+            printf("apply_permutation did not reset perm\n");
+            return 1;
+        }
+    }
+
+    /* xysort with many ties in y, including a long run of equal y */
+    for (i = 0; i < ncoords; ++i) {
+        data[i].x = drand48();
+        data[i].y = (i < ncoords / 2) ? 1.0 : (double)(lrand48() % 1000);
+    }
+    xysort(ncoords, data, ptr);
+    for (i = 1; i < ncoords; ++i) {
+        if (ptr[i-1]->y > ptr[i]->y ||
+            (ptr[i-1]->y == ptr[i]->y && ptr[i-1]->x > ptr[i]->x)) {
+            printf("xysort out of order at %lu\n", (unsigned long)i);
+            return 1;
+        }
+    }
+
+    return 0;
+}
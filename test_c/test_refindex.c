@@ -0,0 +1,186 @@
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+
+#include "immatch/refindex.h"
+#include "immatch/xyxymatch.h"
+
+static void*
+read_file(const char* path, size_t* size) {
+    FILE* fd;
+    long len;
+    void* buffer;
+
+    fd = fopen(path, "rb");
+    if (fd == NULL) {
+        return NULL;
+    }
+    fseek(fd, 0, SEEK_END);
+    len = ftell(fd);
+    fseek(fd, 0, SEEK_SET);
+    /* malloc'd memory is suitably aligned, like an mmap'd file */
+    buffer = malloc(len);
+    if (buffer == NULL || fread(buffer, 1, len, fd) != (size_t)len) {
+        free(buffer);
+        fclose(fd);
+        return NULL;
+    }
+    fclose(fd);
+    *size = (size_t)len;
+    return buffer;
+}
+
+static int
+compare_outputs(
+        const size_t na, const xyxymatch_output_t* a,
+        const size_t nb, const xyxymatch_output_t* b) {
+    size_t i;
+
+    if (na != nb) {
+        printf("Expected %lu pairs, got %lu\n",
+               (unsigned long)na, (unsigned long)nb);
+        return 1;
+    }
+
+    for (i = 0; i < na; ++i) {
+        if (a[i].coord_idx != b[i].coord_idx ||
+            a[i].ref_idx != b[i].ref_idx ||
+            a[i].ref.x != b[i].ref.x ||
+            a[i].ref.y != b[i].ref.y) {
+            printf("Output mismatch at %lu\n", (unsigned long)i);
+            return 1;
+        }
+    }
+
+    return 0;
+}
+
+int main(int argc, char** argv) {
+    #define ncoords 2048
+    const char* path = "test_refindex.idx";
+    coord_t ref[ncoords];
+    coord_t input[ncoords];
+    xyxymatch_output_t output_a[ncoords];
+    xyxymatch_output_t output_b[ncoords];
+    size_t noutput_a;
+    size_t noutput_b;
+    const double separation = 0.0001;
+    const double tolerance = 0.0001;
+    const double maxratio = 10.0;
+    const size_t nmatch = 30;
+    const size_t nreject = 10;
+    char* buffer = NULL;
+    size_t size = 0;
+    refindex_t index;
+    stimage_error_t error;
+    size_t i = 0;
+    int algo;
+
+    stimage_error_init(&error);
+
+    srand48(0);
+
+    for (i = 0; i < ncoords; ++i) {
+        ref[i].x = drand48() - 0.5;
+        ref[i].y = drand48() - 0.5;
+        input[i].x = ref[i].x + 24;
+        input[i].y = ref[i].y + 42;
+    }
+    if (refindex_build(ncoords, ref, separation, nmatch, tolerance, maxratio,
+                       path, &error)) {
+        printf("%s\n", stimage_error_get_message(&error));
+        return 1;
+    }
+
+    buffer = read_file(path, &size);
+    remove(path);
+    if (buffer == NULL) {
+        printf("Could not read back the index\n");
+        return 1;
+    }
+
+    if (refindex_view(size, buffer, &index, &error)) {
+        printf("%s\n", stimage_error_get_message(&error));
+        return 1;
+    }
+
+    if (index.header->nref != ncoords ||
+        index.header->nunique != ncoords ||
+        index.header->ntriangles == 0) {
+        printf("Unexpected header contents\n");
+        return 1;
+    }
+
+    for (i = 0; i < ncoords; ++i) {
+        if (index.ref[i].x != ref[i].x || index.ref[i].y != ref[i].y) {
+            printf("Reference coordinates not stored in original order\n");
+            return 1;
+        }
+    }
+
+    for (i = 1; i < ncoords; ++i) {
+        if (index.ref[index.sorted[i]].y < index.ref[index.sorted[i-1]].y) {
+            printf("Sorted section is not sorted\n");
+            return 1;
+        }
+    }
+
+    /* Matching against the index must give the same result as
+       matching against the array, both with the stored triangles and
+       with a different nmatch that forces them to be rebuilt */
+    for (algo = 0; algo < 3; ++algo) {
+        xyxymatch_algo_e algorithm =
+            algo == 0 ? xyxymatch_algo_tolerance : xyxymatch_algo_triangles;
+        size_t n = algo == 2 ? nmatch - 5 : nmatch;
+        double tol = algorithm == xyxymatch_algo_tolerance ? 30.0 : tolerance;
+        coord_t origin = {24.0, 42.0};
+        coord_t* originp = algorithm == xyxymatch_algo_tolerance ? &origin : NULL;
+
+        noutput_a = noutput_b = ncoords;
+        if (xyxymatch(ncoords, input, ncoords, ref, &noutput_a, output_a,
+                      originp, NULL, NULL, NULL, algorithm, tol,
+                      separation, n, maxratio, nreject, 1, &error) ||
+            xyxymatch_refindex(ncoords, input, &index, &noutput_b, output_b,
+                               originp, NULL, NULL, NULL, algorithm, tol,
+                               separation, n, maxratio, nreject, 1,
+                               &error)) {
+            printf("%s\n", stimage_error_get_message(&error));
+            return 1;
+        }
+
+        if (noutput_a == 0) {
+            printf("No matches found\n");
+            return 1;
+        }
+
+        if (compare_outputs(noutput_a, output_a, noutput_b, output_b)) {
+            return 1;
+        }
+    }
+
+    /* A different separation is an error */
+    noutput_b = ncoords;
+    if (!xyxymatch_refindex(ncoords, input, &index, &noutput_b, output_b,
+                            NULL, NULL, NULL, NULL, xyxymatch_algo_triangles,
+                            tolerance, separation * 2.0, nmatch, maxratio,
+                            nreject, 1, &error)) {
+        printf("Expected an error for mismatched separation\n");
+        return 1;
+    }
+
+    /* Truncated and corrupt buffers are rejected */
+    if (!refindex_view(size - 8, buffer, &index, &error)) {
+        printf("Expected an error for a truncated index\n");
+        return 1;
+    }
+
+    buffer[0] = 'X';
+    if (!refindex_view(size, buffer, &index, &error)) {
+        printf("Expected an error for a bad magic number\n");
+        return 1;
+    }
+
+    free(buffer);
+
+    return 0;
+}
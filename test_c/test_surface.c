@@ -1,8 +1,212 @@
 #include <assert.h>
+#include <math.h>
 #include <stdio.h>
 #include <stdlib.h>
 
+#include "surface/fit.h"
 #include "surface/surface.h"
+#include "surface/vector.h"
+
+#define NCOORDS 100
+
+/* The number of x terms in row l (the power of y) of a surface */
+static size_t
+row_length(
+        const size_t xorder,
+        const size_t yorder,
+        const xterms_e xterms,
+        const size_t l) {
+
+    size_t maxorder = (xorder > yorder ? xorder : yorder) + 1;
+
+    switch (xterms) {
+    case xterms_none:
+        return l == 0 ? xorder : 1;
+    case xterms_half:
+        return xorder < maxorder - 1 - l ? xorder : maxorder - 1 - l;
+    default:
+        return xorder;
+    }
+}
+
+/* Evaluate a fitted surface at the points it was fit to, and check
+   that it reproduces the data */
+static int
+check_vector(
+        const surface_t* const s,
+        const coord_t* const coord,
+        const double* const z,
+        stimage_error_t* const error) {
+
+    double zfit[NCOORDS];
+    size_t i;
+
+    for (i = 0; i < NCOORDS; ++i) {
+        zfit[i] = -1.0;
+    }
+
+    if (surface_vector(s, NCOORDS, coord, zfit, error)) {
+        return 1;
+    }
+
+    for (i = 0; i < NCOORDS; ++i) {
+        if (fabs(zfit[i] - z[i]) > 1e-8) {
+            printf("function %d order (%d, %d) xterms %d: point %lu "
+                   "is %g, expected %g\n",
+                   s->type, (int)s->xorder, (int)s->yorder, s->xterms,
+                   (unsigned long)i, zfit[i], z[i]);
+            return 1;
+        }
+    }
+
+    return 0;
+}
+
+/* Fit a power series surface to data it describes exactly, and check
+   that the coefficients are recovered */
+static int
+check_fit(
+        const size_t xorder,
+        const size_t yorder,
+        const xterms_e xterms) {
+
+    surface_t           s;
+    bbox_t              bbox;
+    coord_t             coord[NCOORDS];
+    double              z[NCOORDS];
+    double              w[NCOORDS];
+    double              expected[64];
+    surface_fit_error_e fit_error = surface_fit_error_ok;
+    stimage_error_t     error;
+    size_t              i, k, l, c;
+    int                 status    = 1;
+
+    stimage_error_init(&error);
+    surface_new(&s);
+    bbox.min.x = bbox.min.y = 0.0;
+    bbox.max.x = bbox.max.y = 2.0;
+
+    srand48(0);
+    for (i = 0; i < NCOORDS; ++i) {
+        coord[i].x = drand48() * 2.0;
+        coord[i].y = drand48() * 2.0;
+        z[i] = 0.0;
+        c = 0;
+        for (l = 0; l < yorder; ++l) {
+            for (k = 0; k < row_length(xorder, yorder, xterms, l); ++k) {
+                expected[c] = 1.0 + 0.5 * (double)c;
+                z[i] += expected[c] * pow(coord[i].x, (double)k) *
+                    pow(coord[i].y, (double)l);
+                ++c;
+            }
+        }
+        w[i] = 1.0;
+    }
+
+    if (surface_init(
+                &s, surface_type_polynomial, (int)xorder, (int)yorder,
+                xterms, &bbox, &error) ||
+        surface_fit(
+                &s, NCOORDS, coord, z, w, surface_fit_weight_user,
+                &fit_error, &error)) {
+        goto exit;
+    }
+
+    if (s.ncoeff != c) {
+        printf("order (%lu, %lu) xterms %d: %lu coefficients, expected %lu\n",
+               (unsigned long)xorder, (unsigned long)yorder, xterms,
+               (unsigned long)s.ncoeff, (unsigned long)c);
+        goto exit;
+    }
+
+    for (i = 0; i < c; ++i) {
+        if (fabs(s.coeff[i] - expected[i]) > 1e-8) {
+            printf("order (%lu, %lu) xterms %d: coeff %lu is %g, "
+                   "expected %g\n",
+                   (unsigned long)xorder, (unsigned long)yorder, xterms,
+                   (unsigned long)i, s.coeff[i], expected[i]);
+            goto exit;
+        }
+    }
+
+    if (check_vector(&s, coord, z, &error)) {
+        goto exit;
+    }
+
+    status = 0;
+
+ exit:
+    surface_free(&s);
+
+    if (error.message[0]) {
+        printf("%s\n", stimage_error_get_message(&error));
+    }
+
+    return status;
+}
+
+/* Fit a plane with an orthogonal surface, whose coordinates are
+   normalized to [-1, 1] over the bbox */
+static int
+check_normalized(const surface_type_e function) {
+
+    surface_t           s;
+    bbox_t              bbox;
+    coord_t             coord[NCOORDS];
+    double              z[NCOORDS];
+    double              w[NCOORDS];
+    /* z = x + 3 y, with x = 150 + 50 xn and y = 50 + 100 yn */
+    double              expected[3] = {300.0, 50.0, 300.0};
+    surface_fit_error_e fit_error   = surface_fit_error_ok;
+    stimage_error_t     error;
+    size_t              i;
+    int                 status      = 1;
+
+    stimage_error_init(&error);
+    surface_new(&s);
+    bbox.min.x = 100.0;
+    bbox.max.x = 200.0;
+    bbox.min.y = -50.0;
+    bbox.max.y = 150.0;
+
+    srand48(0);
+    for (i = 0; i < NCOORDS; ++i) {
+        coord[i].x = 100.0 + drand48() * 100.0;
+        coord[i].y = -50.0 + drand48() * 200.0;
+        z[i] = coord[i].x + 3.0 * coord[i].y;
+        w[i] = 1.0;
+    }
+
+    if (surface_init(&s, function, 2, 2, xterms_none, &bbox, &error) ||
+        surface_fit(
+                &s, NCOORDS, coord, z, w, surface_fit_weight_user,
+                &fit_error, &error)) {
+        goto exit;
+    }
+
+    for (i = 0; i < 3; ++i) {
+        if (fabs(s.coeff[i] - expected[i]) > 1e-8) {
+            printf("function %d: coeff %lu is %g, expected %g\n",
+                   function, (unsigned long)i, s.coeff[i], expected[i]);
+            goto exit;
+        }
+    }
+
+    if (check_vector(&s, coord, z, &error)) {
+        goto exit;
+    }
+
+    status = 0;
+
+ exit:
+    surface_free(&s);
+
+    if (error.message[0]) {
+        printf("%s\n", stimage_error_get_message(&error));
+    }
+
+    return status;
+}
 
 int main(int argv, char** argc) {
     surface_t surface;
@@ -33,6 +237,20 @@ int main(int argv, char** argc) {
     if (copy.matrix == NULL) goto exit;
     if (copy.matrix == surface.matrix) goto exit;
 
+    if (check_fit(2, 2, xterms_none) ||
+        check_fit(3, 3, xterms_none) ||
+        check_fit(3, 3, xterms_half) ||
+        check_fit(3, 3, xterms_full) ||
+        check_fit(4, 2, xterms_none) ||
+        check_fit(4, 2, xterms_half) ||
+        check_fit(2, 4, xterms_half) ||
+        check_fit(2, 4, xterms_full) ||
+        check_normalized(surface_type_legendre) ||
+        check_normalized(surface_type_chebyshev)) {
+        status = 1;
+        goto exit;
+    }
+
     status = 0;
 
  exit:
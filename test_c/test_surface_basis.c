@@ -0,0 +1,177 @@
+/*
+Copyright (C) 2008-2010 Association of Universities for Research in Astronomy (AURA)
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+    1. Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+
+    2. Redistributions in binary form must reproduce the above
+      copyright notice, this list of conditions and the following
+      disclaimer in the documentation and/or other materials provided
+      with the distribution.
+
+    3. The name of AURA and its representatives may not be used to
+      endorse or promote products derived from this software without
+      specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY AURA ``AS IS'' AND ANY EXPRESS OR IMPLIED
+WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL AURA BE LIABLE FOR ANY DIRECT, INDIRECT,
+INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+DAMAGE.
+*/
+
+#include <math.h>
+#include <stdio.h>
+#include <stdlib.h>
+
+#include "surface/basis.h"
+#include "surface/fit.h"
+#include "surface/vector.h"
+
+/* More than two blocks of the evaluation kernel, ending in a partial
+   one */
+#define NCOORDS 300
+
+/* Fit and evaluate a surface both with and without the basis cache,
+   and make sure the results agree */
+static int
+check(const surface_type_e type,
+      const int xorder,
+      const int yorder,
+      const xterms_e xterms,
+      surface_basis_cache_t* const cache,
+      const coord_t* const ref,
+      const double* const z,
+      const bbox_t* const bbox) {
+    surface_t           plain;
+    surface_t           cached;
+    surface_fit_error_e fit_error = surface_fit_error_ok;
+    double              w[NCOORDS];
+    double              zplain[NCOORDS];
+    double              zcached[NCOORDS];
+    stimage_error_t     error;
+    size_t              i;
+    int                 status = 1;
+
+    stimage_error_init(&error);
+    surface_new(&plain);
+    surface_new(&cached);
+
+    for (i = 0; i < NCOORDS; ++i) {
+        w[i] = 1.0;
+    }
+
+    if (surface_init(
+                &plain, type, xorder, yorder, xterms, bbox, &error) ||
+        surface_init(
+                &cached, type, xorder, yorder, xterms, bbox, &error)) {
+        goto exit;
+    }
+
+    if (surface_fit(
+                &plain, NCOORDS, ref, z, w, surface_fit_weight_user,
+                &fit_error, &error) ||
+        surface_fit_cached(
+                &cached, cache, z, w, surface_fit_weight_user,
+                &fit_error, &error)) {
+        goto exit;
+    }
+
+    if (surface_vector(&plain, NCOORDS, ref, zplain, &error) ||
+        surface_vector_cached(&cached, cache, zcached, &error)) {
+        goto exit;
+    }
+
+    for (i = 0; i < plain.ncoeff; ++i) {
+        if (plain.coeff[i] != cached.coeff[i]) {
+            printf("type %d order %d %d xterms %d: coeff %lu differs\n",
+                   type, xorder, yorder, xterms, (unsigned long)i);
+            goto exit;
+        }
+    }
+
+    for (i = 0; i < NCOORDS; ++i) {
+        /* The plain evaluation sums in a different order */
+        if (fabs(zplain[i] - zcached[i]) >
+            1e-12 * (1.0 + fabs(zplain[i]))) {
+            printf("type %d order %d %d xterms %d: zfit %lu differs\n",
+                   type, xorder, yorder, xterms, (unsigned long)i);
+            goto exit;
+        }
+    }
+
+    status = 0;
+
+ exit:
+    surface_free(&plain);
+    surface_free(&cached);
+
+    if (error.message[0]) {
+        printf("%s\n", stimage_error_get_message(&error));
+    }
+
+    return status;
+}
+
+int main(int argv, char** argc) {
+    coord_t               ref[NCOORDS];
+    double                z[NCOORDS];
+    bbox_t                bbox;
+    surface_basis_cache_t cache;
+    surface_type_e        type;
+    xterms_e              xterms;
+    int                   order;
+    size_t                i;
+    int                   status = 1;
+
+    srand48(0);
+    for (i = 0; i < NCOORDS; ++i) {
+        ref[i].x = drand48() * 2048.0;
+        ref[i].y = drand48() * 2048.0;
+        z[i] = 3.0 + 1e-3 * ref[i].x - 2e-3 * ref[i].y +
+            1e-7 * ref[i].x * ref[i].y + 1e-9 * ref[i].y * ref[i].y * ref[i].y;
+    }
+
+    bbox_init(&bbox);
+    determine_bbox(NCOORDS, ref, &bbox);
+
+    surface_basis_cache_init(&cache, NCOORDS, ref);
+
+    /* Alternate increasing orders and types, so the cache must both
+       grow entries and evict them */
+    for (order = 2; order <= 5; ++order) {
+        for (type = surface_type_polynomial; type < surface_type_LAST;
+             ++type) {
+            for (xterms = xterms_none; xterms < xterms_LAST; ++xterms) {
+                if (check(type, order, order, xterms, &cache, ref, z,
+                          &bbox) ||
+                    check(type, order, 2, xterms, &cache, ref, z, &bbox) ||
+                    check(type, 2, order, xterms, &cache, ref, z, &bbox) ||
+                    check(type, order + 2, order, xterms, &cache, ref, z,
+                          &bbox) ||
+                    check(type, order, order + 2, xterms, &cache, ref, z,
+                          &bbox) ||
+                    check(type, 1, order, xterms, &cache, ref, z, &bbox) ||
+                    check(type, order, 1, xterms, &cache, ref, z, &bbox)) {
+                    goto exit;
+                }
+            }
+        }
+    }
+
+    status = 0;
+
+ exit:
+    surface_basis_cache_free(&cache);
+
+    return status;
+}
@@ -0,0 +1,284 @@
+#include <assert.h>
+#include <stdio.h>
+#include <stdlib.h>
+
+#include "lib/lintransform.h"
+#include "lib/xycoincide.h"
+#include "lib/xysoa.h"
+#include "lib/xysort.h"
+#include "immatch/lib/tolerance.h"
+
+/* The original pointer-based implementations, to check that the
+   structure-of-arrays kernels give identical results */
+static size_t
+reference_xycoincide(
+    const size_t ncoords,
+    const coord_t** const output,
+    const double tolerance) {
+
+    double tolerance2 = tolerance * tolerance;
+    size_t nunique = ncoords;
+    double distance, r2;
+    size_t iprev, i;
+
+    for (iprev = 0; iprev < ncoords; ++iprev) {
+        if (output[iprev] == NULL) {
+            continue;
+        }
+        for (i = iprev + 1; i < ncoords; ++i) {
+            if (output[i] == NULL) {
+                continue;
+            }
+            distance = output[i]->y - output[iprev]->y;
+            r2 = distance * distance;
+            if (r2 > tolerance2) {
+                break;
+            }
+            distance = output[i]->x - output[iprev]->x;
+            r2 += distance * distance;
+            if (r2 <= tolerance2) {
+                output[i] = NULL;
+                --nunique;
+            }
+        }
+    }
+
+    iprev = 0;
+    for (i = 0; i < ncoords; ++i) {
+        if (output[i] != NULL) {
+            output[iprev++] = output[i];
+        }
+    }
+
+    return nunique;
+}
+
+static void
+reference_match_tolerance(
+        const size_t nref,
+        const coord_t* const ref,
+        const coord_t* const * const ref_sorted,
+        const size_t ninput,
+        const coord_t* const input,
+        const coord_t* const * const input_sorted,
+        const double tolerance,
+        size_t* nmatches,
+        size_t* matches /* [nref * 2] */) {
+
+    const double tolerance2 = tolerance*tolerance;
+    size_t rp, blp = 0, lp;
+    double dx, dy = 0.0, rmax2, r2;
+    const coord_t* lmatch;
+
+    *nmatches = 0;
+    for (rp = 0; rp < nref; ++rp) {
+        for (; blp < ninput; ++blp) {
+            dy = ref_sorted[rp]->y - input_sorted[blp]->y;
+            if (dy < tolerance) {
+                break;
+            }
+        }
+        if (blp >= ninput) {
+            break;
+        }
+        if (dy < -tolerance) {
+            continue;
+        }
+        rmax2 = tolerance2;
+        lmatch = NULL;
+        for (lp = blp; lp < ninput; ++lp) {
+            dy = ref_sorted[rp]->y - input_sorted[lp]->y;
+            if (dy < -tolerance) {
+                break;
+            }
+            dx = ref_sorted[rp]->x - input_sorted[lp]->x;
+            r2 = dx*dx + dy*dy;
+            if (r2 <= rmax2) {
+                rmax2 = r2;
+                lmatch = input_sorted[lp];
+            }
+        }
+        if (lmatch != NULL) {
+            matches[(*nmatches) * 2] = ref_sorted[rp] - ref;
+            matches[(*nmatches) * 2 + 1] = lmatch - input;
+            ++(*nmatches);
+        }
+    }
+}
+
+typedef struct {
+    size_t  n;
+    size_t* matches;
+} collect_t;
+
+static int
+collect(void* data, size_t ref_index, size_t input_index, stimage_error_t* error) {
+    collect_t* c = (collect_t*)data;
+    c->matches[c->n * 2] = ref_index;
+    c->matches[c->n * 2 + 1] = input_index;
+    ++c->n;
+    return 0;
+}
+
+int main(int argv, char** argc) {
+    #define ncoords 4000
+    static coord_t ref[ncoords];
+    static coord_t input[ncoords];
+    static coord_t trans[ncoords];
+    static const coord_t* ref_ptr[ncoords];
+    static const coord_t* input_ptr[ncoords];
+    static const coord_t* expected_ptr[ncoords];
+    static size_t expected_matches[ncoords * 2];
+    static size_t matches[ncoords * 2];
+    const double tolerances[] = {0.0, 0.001, 0.01, 0.05};
+    lintransform_t lintransform;
+    coord_t origin = {0.5, 0.5};
+    coord_t mag = {1.001, 0.999};
+    coord_t rot = {0.1, 0.1};
+    coord_t ref_origin = {0.5, 0.5};
+    xysoa_t ref_soa;
+    xysoa_t input_soa;
+    collect_t c;
+    size_t nexpected, nunique, nref_unique, ninput_unique;
+    size_t i, t, nthreads;
+    stimage_error_t error;
+
+    stimage_error_init(&error);
+
+    srand48(0);
+
+    /* Coordinates on a coarse grid, so that there are many exact ties
+       in y */
+    for (i = 0; i < ncoords; ++i) {
+        ref[i].x = (double)(lrand48() % 400) / 400.0;
+        ref[i].y = (double)(lrand48() % 400) / 400.0;
+        input[i].x = ref[i].x + (drand48() - 0.5) * 0.002;
+        input[i].y = ref[i].y + (drand48() - 0.5) * 0.002;
+    }
+
+    /* apply_lintransform, in place and out of place */
+    compute_lintransform(origin, mag, rot, ref_origin, &lintransform);
+    apply_lintransform(&lintransform, ncoords, input, trans);
+    for (i = 0; i < ncoords; ++i) {
+        coord_t c = input[i];
+        apply_lintransform(&lintransform, 1, &c, &c);
+        if (c.x != trans[i].x || c.y != trans[i].y) {
+            printf("apply_lintransform mismatch at %lu\n", (unsigned long)i);
+            return 1;
+        }
+    }
+
+    for (t = 0; t < sizeof(tolerances) / sizeof(double); ++t) {
+        /* xycoincide */
+        xysort(ncoords, ref, ref_ptr);
+        xysort(ncoords, ref, expected_ptr);
+        nexpected = reference_xycoincide(ncoords, expected_ptr, tolerances[t]);
+        nunique = xycoincide(ncoords, ref_ptr, ref_ptr, tolerances[t]);
+        if (nunique != nexpected) {
+            printf("xycoincide: expected %lu, got %lu\n",
+                   (unsigned long)nexpected, (unsigned long)nunique);
+            return 1;
+        }
+        for (i = 0; i < nunique; ++i) {
+            if (ref_ptr[i] != expected_ptr[i]) {
+                printf("xycoincide mismatch at %lu\n", (unsigned long)i);
+                return 1;
+            }
+        }
+
+        /* xycoincide_soa */
+        if (xysoa_init(&ref_soa, ncoords, &error)) {
+            printf("%s\n", stimage_error_get_message(&error));
+            return 1;
+        }
+        xysort(ncoords, ref, ref_ptr);
+        xysoa_gather(ncoords, ref, ref_ptr, &ref_soa);
+        if (xycoincide_soa(&ref_soa, tolerances[t], &error)) {
+            printf("%s\n", stimage_error_get_message(&error));
+            return 1;
+        }
+        if (ref_soa.n != nexpected) {
+            printf("xycoincide_soa: expected %lu, got %lu\n",
+                   (unsigned long)nexpected, (unsigned long)ref_soa.n);
+            return 1;
+        }
+        for (i = 0; i < ref_soa.n; ++i) {
+            if (ref + ref_soa.index[i] != expected_ptr[i] ||
+                ref_soa.x[i] != expected_ptr[i]->x ||
+                ref_soa.y[i] != expected_ptr[i]->y) {
+                printf("xycoincide_soa mismatch at %lu\n", (unsigned long)i);
+                return 1;
+            }
+        }
+        nref_unique = ref_soa.n;
+        xysoa_pointers(&ref_soa, ref, ref_ptr);
+
+        /* match_tolerance */
+        if (xysoa_init(&input_soa, ncoords, &error)) {
+            printf("%s\n", stimage_error_get_message(&error));
+            return 1;
+        }
+        xysort(ncoords, input, input_ptr);
+        xysoa_gather(ncoords, input, input_ptr, &input_soa);
+        if (xycoincide_soa(&input_soa, tolerances[t], &error)) {
+            printf("%s\n", stimage_error_get_message(&error));
+            return 1;
+        }
+        ninput_unique = input_soa.n;
+        xysoa_pointers(&input_soa, input, input_ptr);
+
+        reference_match_tolerance(
+                nref_unique, ref, ref_ptr, ninput_unique, input, input_ptr,
+                0.003, &nexpected, expected_matches);
+
+        /* The threaded match must give the same matches in the same
+           order, even when strip boundaries fall inside a run of
+           equal y */
+        for (nthreads = 1; nthreads <= 4; ++nthreads) {
+            c.n = 0;
+            c.matches = matches;
+            if (match_tolerance_soa(&ref_soa, &input_soa, 0.003, nthreads,
+                                    &collect, &c, &error)) {
+                printf("%s\n", stimage_error_get_message(&error));
+                return 1;
+            }
+            if (c.n != nexpected || nexpected == 0) {
+                printf("match_tolerance_soa (%lu threads): expected %lu, "
+                       "got %lu\n", (unsigned long)nthreads,
+                       (unsigned long)nexpected, (unsigned long)c.n);
+                return 1;
+            }
+            for (i = 0; i < nexpected * 2; ++i) {
+                if (matches[i] != expected_matches[i]) {
+                    printf("match_tolerance_soa (%lu threads) mismatch at "
+                           "%lu\n", (unsigned long)nthreads,
+                           (unsigned long)i);
+                    return 1;
+                }
+            }
+        }
+
+        c.n = 0;
+        if (match_tolerance(nref_unique, ref, ref_ptr, ninput_unique, input,
+                            input_ptr, 0.003, &collect, &c, &error)) {
+            printf("%s\n", stimage_error_get_message(&error));
+            return 1;
+        }
+        if (c.n != nexpected) {
+            printf("match_tolerance: expected %lu, got %lu\n",
+                   (unsigned long)nexpected, (unsigned long)c.n);
+            return 1;
+        }
+        for (i = 0; i < nexpected * 2; ++i) {
+            if (matches[i] != expected_matches[i]) {
+                printf("match_tolerance mismatch at %lu\n", (unsigned long)i);
+                return 1;
+            }
+        }
+
+        xysoa_free(&ref_soa);
+        xysoa_free(&input_soa);
+    }
+
+    return 0;
+}
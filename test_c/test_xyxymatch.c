@@ -36,7 +36,7 @@ int main(int argc, char** argv) {
                        &noutput, output,
                        &origin, &mag, &rot, &ref_origin,
                        xyxymatch_algo_tolerance,
-                       tolerance, 0.0, 0, 0.0, 0,
+                       tolerance, 0.0, 0, 0.0, 0, 1,
                        &error);
 
     if (status) {
@@ -81,7 +81,7 @@ int main(int argc, char** argv) {
                        &noutput, output,
                        &origin, &mag, &rot, &ref_origin,
                        xyxymatch_algo_tolerance,
-                       tolerance, 0.0, 0, 0.0, 0,
+                       tolerance, 0.0, 0, 0.0, 0, 1,
                        &error);
 
     if (status) {
@@ -1,5 +1,6 @@
 #include <stdio.h>
 #include <stdlib.h>
+#include <string.h>
 
 #include "immatch/xyxymatch.h"
 #include "lib/lintransform.h"
@@ -29,7 +30,7 @@ int compare(const size_t ncoords,
             &noutput, output,
             &origin, &mag, &rot, &ref_origin,
             xyxymatch_algo_triangles,
-            tolerance, 0.0, max_points, max_ratio, nreject,
+            tolerance, 0.0, max_points, max_ratio, nreject, 1,
             &error);
 
     if (status) {
@@ -52,6 +53,55 @@ int compare(const size_t ncoords,
     return 0;
 }
 
+/* Cancels the call after a given number of polls */
+int cancel_after(void* data, const char* stage, size_t done, size_t total) {
+    size_t* npoll = (size_t*)data;
+
+    if (done > total) {
+        printf("Progress past the end of %s\n", stage);
+    }
+
+    if (*npoll == 0) {
+        return 1;
+    }
+    --(*npoll);
+    return 0;
+}
+
+int cancel(const size_t ncoords,
+           const coord_t* const ref,
+           const coord_t* const input,
+           xyxymatch_output_t* output) {
+    const coord_t origin = {0.0, 0.0};
+    const coord_t mag = {1.0, 1.0};
+    const coord_t rot = {0.0, 0.0};
+    size_t noutput = ncoords;
+    size_t npoll = 3;
+    stimage_error_t error;
+
+    stimage_error_init(&error);
+    stimage_error_set_progress(&error, &cancel_after, &npoll);
+
+    if (!xyxymatch(
+                ncoords, input,
+                ncoords, ref,
+                &noutput, output,
+                &origin, &mag, &rot, &origin,
+                xyxymatch_algo_triangles,
+                0.0001, 0.0, 40, 10.0, 10, 1,
+                &error)) {
+        printf("Expected the match to be cancelled\n");
+        return 1;
+    }
+
+    if (strcmp(stimage_error_get_message(&error), "Cancelled") != 0) {
+        printf("Unexpected message: %s\n", stimage_error_get_message(&error));
+        return 1;
+    }
+
+    return 0;
+}
+
 int main(int argc, char** argv) {
     #define ncoords 4098
     coord_t ref[ncoords];
@@ -118,5 +168,12 @@ int main(int argc, char** argv) {
         return 1;
     }
 
+    /* Cancellation from the progress callback */
+    printf("Cancel\n");
+
+    if (cancel(ncoords, ref, input, output)) {
+        return 1;
+    }
+
     return 0;
 }
@@ -0,0 +1,147 @@
+#include <stdio.h>
+#include <stdlib.h>
+
+#include "immatch/xyxymatch.h"
+#include "lib/xysoa.h"
+#include "lib/xysort.h"
+
+static int
+compare(const size_t ncoords,
+        const coordf_t* const ref,
+        const coordf_t* const input,
+        const xyxymatch_algo_e algorithm,
+        const double tolerance,
+        const double separation) {
+    static xyxymatch_output_t output[2][10000];
+    static coord_t ref_double[10000];
+    static coord_t input_double[10000];
+    size_t noutput[2];
+    stimage_error_t error;
+    size_t i = 0;
+
+    stimage_error_init(&error);
+
+    for (i = 0; i < ncoords; ++i) {
+        ref_double[i].x = ref[i].x;
+        ref_double[i].y = ref[i].y;
+        input_double[i].x = input[i].x;
+        input_double[i].y = input[i].y;
+    }
+
+    noutput[0] = noutput[1] = ncoords;
+    if (xyxymatch(ncoords, input_double, ncoords, ref_double,
+                  &noutput[0], output[0], NULL, NULL, NULL, NULL,
+                  algorithm, tolerance, separation, 30, 10.0, 10, 1,
+                  &error) ||
+        xyxymatchf(ncoords, input, ncoords, ref,
+                   &noutput[1], output[1], NULL, NULL, NULL, NULL,
+                   algorithm, tolerance, separation, 30, 10.0, 10, 1,
+                   &error)) {
+        printf("%s\n", stimage_error_get_message(&error));
+        return 1;
+    }
+
+    if (noutput[0] == 0) {
+        printf("No matches found\n");
+        return 1;
+    }
+
+    if (noutput[0] != noutput[1]) {
+        printf("Expected %lu pairs, got %lu\n",
+               (unsigned long)noutput[0], (unsigned long)noutput[1]);
+        return 1;
+    }
+
+    for (i = 0; i < noutput[0]; ++i) {
+        if (output[0][i].coord_idx != output[1][i].coord_idx ||
+            output[0][i].ref_idx != output[1][i].ref_idx ||
+            output[0][i].coord.x != output[1][i].coord.x ||
+            output[0][i].coord.y != output[1][i].coord.y ||
+            output[0][i].ref.x != output[1][i].ref.x ||
+            output[0][i].ref.y != output[1][i].ref.y) {
+            printf("Mismatch at %lu\n", (unsigned long)i);
+            return 1;
+        }
+    }
+
+    return 0;
+}
+
+int main(int argc, char** argv) {
+    #define ncoords 10000
+    static coordf_t ref[ncoords];
+    static coordf_t input[ncoords];
+    static coord_t ref_double[ncoords];
+    static const coord_t* ref_ptr[ncoords];
+    xysoaf_t soa;
+    stimage_error_t error;
+    size_t i = 0;
+
+    stimage_error_init(&error);
+
+    srand48(0);
+
+    /* Some of the points are on a coarse grid, so that there are exact
+       ties in y, and some are offset by exactly the tolerance, so
+       that there are pairs right on the boundary */
+    for (i = 0; i < ncoords; ++i) {
+        if (i % 3 == 0) {
+            ref[i].x = (float)(lrand48() % 2048);
+            ref[i].y = (float)(lrand48() % 64);
+        } else {
+            ref[i].x = (float)(drand48() * 2048.0);
+            ref[i].y = (float)(drand48() * 2048.0);
+        }
+        if (i % 5 == 0) {
+            input[i].x = ref[i].x + 0.5f;
+            input[i].y = ref[i].y;
+        } else {
+            input[i].x = ref[i].x + (float)((drand48() - 0.5) * 0.6);
+            input[i].y = ref[i].y + (float)((drand48() - 0.5) * 0.6);
+        }
+    }
+
+    /* xysoaf_sort must give the same order as xysort */
+    for (i = 0; i < ncoords; ++i) {
+        ref_double[i].x = ref[i].x;
+        ref_double[i].y = ref[i].y;
+    }
+    xysort(ncoords, ref_double, ref_ptr);
+    if (xysoaf_init(&soa, ncoords, &error) ||
+        xysoaf_sort(ncoords, ref, &soa, &error)) {
+        printf("%s\n", stimage_error_get_message(&error));
+        return 1;
+    }
+    for (i = 0; i < ncoords; ++i) {
+        if (ref_ptr[i] - ref_double != soa.index[i] ||
+            soa.x[i] != ref[soa.index[i]].x ||
+            soa.y[i] != ref[soa.index[i]].y) {
+            printf("xysoaf_sort mismatch at %lu\n", (unsigned long)i);
+            return 1;
+        }
+    }
+    xysoaf_free(&soa);
+
+    printf("Tolerance\n");
+    if (compare(ncoords, ref, input, xyxymatch_algo_tolerance, 0.5, 0.0)) {
+        return 1;
+    }
+
+    printf("Tolerance with separation\n");
+    if (compare(ncoords, ref, input, xyxymatch_algo_tolerance, 0.5, 3.0)) {
+        return 1;
+    }
+
+    printf("Triangles\n");
+    for (i = 0; i < ncoords; ++i) {
+        ref[i].x = (float)(drand48() * 2048.0);
+        ref[i].y = (float)(drand48() * 2048.0);
+        input[i].x = ref[i].x;
+        input[i].y = ref[i].y;
+    }
+    if (compare(ncoords, ref, input, xyxymatch_algo_triangles, 0.0001, 0.0)) {
+        return 1;
+    }
+
+    return 0;
+}